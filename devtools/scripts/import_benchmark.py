@@ -0,0 +1,69 @@
+"""
+Measures the time to import optking in fresh interpreters, and checks it against
+a budget.  Neither psi4 nor qcelemental may be imported by ``import optking``;
+they are loaded on first use.
+
+usage: python import_benchmark.py [budget_seconds [repeats]]
+
+Exits with status 1 if the median import time is over the budget (default
+0.5 s) or if psi4 or qcelemental were imported.  The modules that take the
+longest to import are listed from ``python -X importtime``.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+budget = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+timed_import = """
+import json, sys, time
+t = time.perf_counter()
+import optking
+t = time.perf_counter() - t
+print(json.dumps({'time': t, 'psi4': 'psi4' in sys.modules,
+                  'qcelemental': 'qcelemental' in sys.modules}))
+"""
+
+# optking writes its log to the working directory when imported
+workdir = tempfile.mkdtemp()
+
+
+def run(*args):
+    return subprocess.run([sys.executable] + list(args), cwd=workdir, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+results = [json.loads(run('-c', timed_import).stdout.strip().splitlines()[-1])
+           for _ in range(repeats)]
+times = sorted(r['time'] for r in results)
+median = times[len(times) // 2]
+
+# cumulative import times, in microseconds, of the slowest modules
+profile = []
+for line in run('-X', 'importtime', '-c', 'import optking').stderr.splitlines():
+    fields = line.split('|')
+    if len(fields) == 3 and fields[1].strip().isdigit():
+        profile.append((int(fields[1]), fields[2].rstrip()))
+profile.sort(reverse=True)
+
+print("import optking: median %.3f s, min %.3f s, max %.3f s over %d runs (budget %.3f s)"
+      % (median, times[0], times[-1], repeats, budget))
+print("\nslowest imports (cumulative):")
+for cumulative, name in profile[1:11]:
+    print("  %8.1f ms  %s" % (cumulative / 1000.0, name.strip()))
+
+eager = [name for name in ('psi4', 'qcelemental') if any(r[name] for r in results)]
+failed = False
+if eager:
+    print("\nFAIL: imported by 'import optking': %s" % ', '.join(eager))
+    failed = True
+if median > budget:
+    print("\nFAIL: import time over the budget of %.3f s" % budget)
+    failed = True
+os.remove(os.path.join(workdir, 'opt_log.out'))
+os.rmdir(workdir)
+sys.exit(1 if failed else 0)
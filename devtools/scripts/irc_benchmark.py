@@ -0,0 +1,65 @@
+"""
+Compares the number of gradients per IRC point for the IRC algorithms
+(irc_algorithm GS and HPC) on the HOOH IRC from the cis transition state.
+
+usage: python irc_benchmark.py [step_size ...]
+"""
+import sys
+
+import psi4
+import optking
+from optking import psi4methods
+
+psi4.set_memory('2 GB')
+psi4.core.be_quiet()
+
+hooh_ts = """
+  H     0.0000000000   0.9803530335  -0.8498671785
+  O     0.0000000000   0.6988545188   0.0536419016
+  O     0.0000000000  -0.6988545188   0.0536419016
+  H     0.0000000000  -0.9803530335  -0.8498671785
+  noreorient
+"""
+psi4_options = {'basis': 'dzp', 'scf_type': 'pk'}
+
+calls = {'gradient': 0, 'hessian': 0}
+psi4_calculation = psi4methods.psi4_calculation
+
+
+def counted_calculation(new_geom, o_json, driver='gradient'):
+    calls[driver] = calls.get(driver, 0) + 1
+    return psi4_calculation(new_geom, o_json, driver)
+
+
+psi4methods.psi4_calculation = counted_calculation
+
+
+def run_irc(algorithm, step_size):
+    psi4.core.clean_options()
+    h2o2 = psi4.geometry(hooh_ts)
+    h2o2.reset_point_group('c2')
+    psi4.set_options(psi4_options)
+    psi4.set_module_options("OPTKING", {
+        'opt_type': 'irc',
+        'irc_algorithm': algorithm,
+        'irc_step_size': step_size,
+        'irc_points': 40,
+        'geom_maxiter': 200})
+    calls.update(gradient=0, hessian=0)
+
+    json_output = optking.Psi4Opt('hf', psi4_options)
+    return json_output['properties']['IRC'], calls['gradient']
+
+
+if __name__ == '__main__':
+    step_sizes = [float(s) for s in sys.argv[1:]] or [0.1, 0.2, 0.3]
+
+    print("%6s%8s%8s%11s%12s%20s" % ('Alg', 'Step', 'Points', 'Gradients', 'Grad/Point',
+                                    'Final Energy'))
+    for step_size in step_sizes:
+        for algorithm in ['GS', 'HPC']:
+            IRC, nGradients = run_irc(algorithm, step_size)
+            nPoints = len(IRC) - 1
+            print("%6s%8.2f%8d%11d%12.2f%20.10f" % (algorithm, step_size, nPoints, nGradients,
+                                                   nGradients / max(nPoints, 1),
+                                                   IRC[-1]['Energy']))
@@ -1,81 +1,49 @@
 ### Class to store points on the IRC
 import logging
-import os
 
 from .printTools import printGeomString, printMatString
 import numpy as np
 from .exceptions import OptError
 
-class IRCpoint(object):
-    """Holds data for one step on the IRC.
-    Parameters
-    ----------
-    step_number : int
-        step number
-    q_pivot :    ndarray
-        pivot point for next step 
-    x_pivot :    ndarray
-        pivot point for next step; save so that q_pivot can be recomputed if desired
-    q       :    ndarray
-        internal coordinate values
-    x       :    ndarray
-        cartesian coordinate values
-    f_q     :    ndarray
-        internal coordinate forces
-    f_x     :    ndarray
-        cartesian coordinate forces
-    energy  :    float
-        total energy
-    step_dist :  float
-    arc_dist  :  float
-    line_dist :  float
-    """
-
-    def __init__(self, step_number, q, x, f_q, f_x, energy, q_pivot, x_pivot, step_dist, arc_dist, line_dist):
-        self.step_number = step_number
-        self.q = q
-        self.x = x
-        self.f_q = f_q
-        self.f_x = f_x
-        self.energy = energy
-        self.q_pivot = q_pivot
-        self.x_pivot = x_pivot
-        self.step_dist = step_dist
-        self.arc_dist = arc_dist
-        self.line_dist = line_dist
-
-    def add_pivot(self, q_p, x_p):
-        self.q_pivot = q_p
-        self.x_pivot = x_p
-
-    def dictOutput(self):
-        s = {}
-        s['Step Number']      = self.step_number
-        s['Intco Values']     = self.q
-        s['Geometry']         = self.x
-        s['Internal Forces']  = self.f_q
-        s['Cartesian Forces'] = self.f_x
-        s['Energy']           = self.energy
-        s['Pivot Intco Values'] = self.q_pivot
-        s['Pivot Geometry']   = self.x_pivot
-        s['Step Distance']    = self.step_dist
-        s['Arc Distance' ]    = self.arc_dist
-        s['Line Distance']    = self.line_dist
-        return s
-
 class IRCdata(object):
     """ Stores obtained points along the IRC as well as information about
-        the status of the IRC computation"""
+        the status of the IRC computation.
+
+    Each quantity is kept in a growable array with one row per point.
+
+    step_number : int
+    q           : internal coordinate values
+    x           : cartesian coordinate values
+    f_q         : internal coordinate forces
+    f_x         : cartesian coordinate forces
+    energy      : total energy
+    q_pivot     : pivot point for next step
+    x_pivot     : pivot point for next step; save so that q_pivot can be recomputed if desired
+    step_dist   : sum of all steps to and from pivot points, a multiple of the step_size
+    arc_dist    : distance along a circular arc connecting rxnpath points
+    line_dist   : sum of all steps directly between rxnpath points, ignoring pivot points
+
+    When a path file is set, each point is appended to it as it is added.
+    """
     __step_size = 0.0
     __direction = None
     __running_step_dist = 0.0
     __running_arc_dist  = 0.0
     __running_line_dist = 0.0
 
+    _point_fields = ('step_number', 'q', 'x', 'f_q', 'f_x', 'energy', 'step_dist', 'arc_dist',
+                     'line_dist')
+
     def __init__(self):
         self.go = True
-        self.irc_points = []
         self.atom_symbols = None
+        self.path_file = None
+        self._n = 0
+        self._data = {}
+        self._has_pivot = np.zeros(0, bool)
+
+    def __len__(self):
+        return self._n
 
     def set_atom_symbols(self, atom_symbols): # just for printing
         self.atom_symbols = atom_symbols.copy()# just for printing
@@ -84,8 +52,47 @@ class IRCdata(object):
         self.__step_size = step_size
         self.__direction = direction
 
+    def set_path_file(self, filename):
+        """ Write points to filename, one line each, as they are added.  Points
+        already on the path are written first. """
+        self.path_file = filename
+        with open(filename, 'w') as path_file:
+            for i in range(self._n):
+                path_file.write(self._path_line(i))
+
+    def _path_line(self, i):
+        out = ''
+        if i == 0:
+            out += "@IRC  Step              Energy    Change in Energy      Step       Arc      Line"
+            out += "".join("    Coord %3d" % k for k in range(len(self.q(0)))) + "\n"
+        DE = self.energy(i) if i == 0 else self.energy(i) - self.energy(i - 1)
+        out += "@IRC  %4d %19.12f %19.12f %9.2f %9.5f %9.5f " % (self.step_number(i),
+               self.energy(i), DE, self.step_dist(i), self.arc_dist(i), self.line_dist(i))
+        out += "".join("%13.8f" % value for value in self.q(i)) + "\n"
+        return out
+
+    def _grow(self):
+        capacity = max(8, 2 * len(self._has_pivot))
+        for name, A in self._data.items():
+            B = np.zeros((capacity,) + A.shape[1:], A.dtype)
+            B[:self._n] = A[:self._n]
+            self._data[name] = B
+        has_pivot = np.zeros(capacity, bool)
+        has_pivot[:self._n] = self._has_pivot[:self._n]
+        self._has_pivot = has_pivot
+
+    def _store(self, name, value):
+        value = np.asarray(value)
+        if name not in self._data:
+            self._data[name] = np.zeros((len(self._has_pivot),) + value.shape, value.dtype)
+        A = self._data[name]
+        if A.shape[1:] != value.shape:
+            raise OptError("IRC %s of shape %s does not match the path, %s" %
+                           (name, value.shape, A.shape[1:]))
+        A[self._n] = value
+
     def add_irc_point(self, step_number, q_in, x_in, f_q, f_x, E, lineDistStep=0, arcDistStep=0):
-        if len(self.irc_points) != 0:
+        if self._n != 0:
             if self.__direction == 'FORWARD':
                 sign = 1
             elif self.__direction == 'BACKWARD':
@@ -102,75 +109,129 @@ class IRCdata(object):
             # distance along a circular arc connecting rxnpath points
             self.__running_arc_dist  += sign * arcDistStep
 
-        onepoint = IRCpoint(step_number, q_in, x_in, f_q, f_x, E, None, None,
-            self.__running_step_dist, self.__running_arc_dist, self.__running_line_dist)
-        self.irc_points.append(onepoint)
+        if self._n == len(self._has_pivot):
+            self._grow()
+        values = (step_number, q_in, x_in, f_q, f_x, E, self.__running_step_dist,
+                  self.__running_arc_dist, self.__running_line_dist)
+        for name, value in zip(self._point_fields, values):
+            self._store(name, value)
+        self._has_pivot[self._n] = False
+        self._n += 1
 
         logger = logging.getLogger(__name__)
-        pindex = (len(self.irc_points)-1)
+        pindex = self._n - 1
         outstr = "\nAdding IRC point %d\n" % pindex
         outstr += printGeomString(self.atom_symbols, x_in, "Angstroms")
         logger.info(outstr)
 
+        if self.path_file is not None:
+            with open(self.path_file, 'a') as path_file:
+                path_file.write(self._path_line(pindex))
 
     def add_pivot_point(self, q_p, x_p, step=None):
-        index = -1 if step is None else step
+        index = self._index(step)
         logger = logging.getLogger(__name__)
-        pindex = (len(self.irc_points)-1) if step is None else step
-        logger.debug("Adding pivot point (index %d) for finding rxnpath point %d" % (pindex,pindex+1))
-        self.irc_points[index].add_pivot(q_p, x_p)
+        logger.debug("Adding pivot point (index %d) for finding rxnpath point %d" % (index, index+1))
+        if 'q_pivot' not in self._data:
+            self._data['q_pivot'] = np.zeros_like(self._data['q'])
+            self._data['x_pivot'] = np.zeros_like(self._data['x'])
+        self._data['q_pivot'][index] = q_p
+        self._data['x_pivot'][index] = x_p
+        self._has_pivot[index] = True
+
+    def _index(self, step):
+        # Most recent point unless otherwise specified; negative steps count from the end.
+        index = -1 if step is None else step
+        if not -self._n <= index < self._n:
+            raise IndexError("IRC point %d is not on the path of %d points" % (index, self._n))
+        return index % self._n
+
+    def _value(self, name, step):
+        value = self._data[name][self._index(step)]
+        return value.copy() if value.ndim else value.item()
 
     # Return most recent IRC step data unless otherwise specified
     def step_number(self, step=None):
-        index = -1 if step is None else step
-        return self.irc_points[index].step_number
+        return self._value('step_number', step)
 
     @property
     def step_size(self):
         return self.__step_size
 
     def current_step_number(self):
-        return len(self.irc_points)
+        return self._n
 
     def q_pivot(self, step=None):
-        index = -1 if step is None else step
-        return self.irc_points[index].q_pivot
+        index = self._index(step)
+        return self._data['q_pivot'][index].copy() if self._has_pivot[index] else None
 
     def x_pivot(self, step=None):
-        index = -1 if step is None else step
-        return self.irc_points[index].x_pivot
+        index = self._index(step)
+        return self._data['x_pivot'][index].copy() if self._has_pivot[index] else None
 
     def q(self, step=None):
-        index = -1 if step is None else step
-        return self.irc_points[index].q
+        return self._value('q', step)
 
     def x(self, step=None):
-        index = -1 if step is None else step
-        return self.irc_points[index].x
+        return self._value('x', step)
 
     def f_q(self, step=None):
-        index = -1 if step is None else step
-        return self.irc_points[index].f_q
+        return self._value('f_q', step)
 
     def f_x(self, step=None):
-        index = -1 if step is None else step
-        return self.irc_points[index].f_x
+        return self._value('f_x', step)
 
     def energy(self, step=None):
-        index = -1 if step is None else step
-        return self.irc_points[index].energy
+        return self._value('energy', step)
 
     def line_dist(self, step=None):
-        index = -1 if step is None else step
-        return self.irc_points[index].line_dist
+        return self._value('line_dist', step)
 
     def arc_dist(self, step=None):
-        index = -1 if step is None else step
-        return self.irc_points[index].arc_dist
+        return self._value('arc_dist', step)
 
     def step_dist(self, step=None):
-        index = -1 if step is None else step
-        return self.irc_points[index].step_dist
+        return self._value('step_dist', step)
+
+    def interpolate(self, arc_dist):
+        """ Geometry and energy at any arc distance along the path, by piecewise
+        cubic Hermite interpolation between the points.
+
+        Parameters
+        ----------
+        arc_dist : float or ndarray
+            arc distance(s) from the transition state; negative along the backward branch
+
+        Returns
+        -------
+        ndarray, float
+            (nat, 3) geometry and energy; for an array of arc distances, arrays with
+            one more leading dimension
+        """
+        if self._n < 2:
+            raise OptError("At least two IRC points are needed to interpolate.")
+        order = np.argsort(self._data['arc_dist'][:self._n], kind='stable')
+        s = self._data['arc_dist'][order]
+        a = np.atleast_1d(np.asarray(arc_dist, float))
+        if a.min() < s[0] or a.max() > s[-1]:
+            raise OptError("Arc distance is outside the path, [%.5f, %.5f]." % (s[0], s[-1]))
+
+        i = np.clip(np.searchsorted(s, a, side='right') - 1, 0, self._n - 2)
+        h = s[i + 1] - s[i]
+        t = (a - s[i]) / h
+        basis = ((1 + 2 * t) * (1 - t)**2, h * t * (1 - t)**2, t**2 * (3 - 2 * t), h * t**2 * (t - 1))
+
+        def hermite(Y):
+            # slopes by finite differences over the neighbouring points
+            dY = np.gradient(Y, s, axis=0)
+            c00, c10, c01, c11 = (c.reshape((-1,) + (1,) * (Y.ndim - 1)) for c in basis)
+            return c00 * Y[i] + c10 * dY[i] + c01 * Y[i + 1] + c11 * dY[i + 1]
+
+        x = hermite(self._data['x'][order])
+        E = hermite(self._data['energy'][order])
+        if np.ndim(arc_dist) == 0:
+            return x[0], E[0]
+        return x, E
 
     # Given current forces, checks if we are at/near a minimum
     # For now, checks if forces are opposite those are previous pivot point
@@ -182,14 +243,16 @@ class IRCdata(object):
 
         logger = logging.getLogger(__name__)
         logger.info("Overlap of forces with previous rxnpath point %8.4f" % overlap)
-    
+
         if overlap < -0.7:
             return True
 
-        # TODO  Look at line distance criterion when distances are working.
-        #elif:
-        #    g_line_dist(p_irc_data->size()-1) - g_line_dist(p_irc_data->size()-2)) < s*10e-03)
-        #    return True
+        # The last rxnpath point did not move away from the one before it.
+        if self._n > 2:
+            line_step = abs(self.line_dist(-1) - self.line_dist(-2))
+            logger.info("Line distance of last rxnpath step %10.5f" % line_step)
+            if line_step < self.__step_size * 1.0e-3:
+                return True
 
         return False
 
@@ -197,44 +260,35 @@ class IRCdata(object):
         """ For clarity, display geometry and internal coordinates for the final IRC step
             IRC algorithm will display an additional IRC step and constrained optimization
             after this step has been reached """
-        
+
         s = "Final Geometry: [Ang] \n"
         s += printMatString(self.x())
-        s += "\n\n\tInternal Coordinates: [Ang/Deg] \n"   
+        s += "\n\n\tInternal Coordinates: [Ang/Deg] \n"
         itr = 0
         s += "\t - Coordinate -           - BOHR/RAD -       - ANG/DEG -\n"
-        
+
         for x in intcos:
             s += ("\t%-18s=%17.6f%19.6f\n" % (x, self.q()[itr], self.q()[itr] * x.qShowFactor))
             #s += ("\t%-18s=%17.6f\n" % (x, IRCdata.history.q()[itr] * x.qShowFactor))
             itr += 1
-        
+
         return s
-        
+
 
     def progress_report(self):
+        """ Log the table of all points.  Each point is written to the path file as
+        it is added, so the table is needed only at the end. """
         blocks = 4 # TODO: make dynamic
         sign = 1
         Ncoord = len(self.q())
 
-        #logging.basicConfig(filename='ircprogress.log',level=logging.DEBUG)
-
-        irc_report = os.path.join(os.getcwd(), 'ircprogress.log') #prepare progress report
-        with open(irc_report, 'w') as irc_prog:
-            irc_prog.truncate(0)
-
-        irc_log = logging.getLogger('ircprogress')
-        irc_handle = logging.FileHandler(os.path.join(os.getcwd(), 'ircprogress.log'), 'w')  
-        irc_handle.setLevel(logging.DEBUG)
-        irc_log.addHandler(irc_handle)
-
         out = '\n'
         out += "@IRC ----------------------------------------------\n"
         out += "@IRC            ****      IRC Report      ****\n"
         out += "@IRC ----------------------------------------------\n"
         out += "@IRC  Step    Energy              Change in Energy \n"
         out += "@IRC ----------------------------------------------\n"
-        for i in range(len(self.irc_points)):
+        for i in range(self._n):
             if i == 0:
                 DE = self.energy(i)
             else:
@@ -256,13 +310,13 @@ class IRCdata(object):
             for i in range(j*blocks, (j+1)* blocks):
                 out += "-------------"
             out += "\n"
-            for i in range(len(self.irc_points)):
+            for i in range(self._n):
                 out += "@IRC  %3d %9.2lf %9.5lf  %9.5lf   " % (i, sign*self.step_dist(i),
                     sign*self.arc_dist(i), sign*self.line_dist(i))
                 for k in range(j*blocks, (j+1)*blocks):
                     out += "%13.8f" % self.q(i)[k]
                 out += "\n"
-          
+
             out += "@IRC --------------------------------------"
             for i in range(j*blocks, (j+1)* blocks):
                 out += "-------------"
@@ -279,7 +333,7 @@ class IRCdata(object):
                 out += "-------------"
             out += "\n"
 
-            for i in range(len(self.irc_points)):
+            for i in range(self._n):
                 out += "@IRC  %3d %9.2lf %9.5lf  %9.5lf   " % (i,
                     sign*self.step_dist(i), sign*self.arc_dist(i), sign*self.line_dist(i))
                 for k in range(Ncoord - (Ncoord % blocks), Ncoord):
@@ -290,16 +344,66 @@ class IRCdata(object):
 
             for i in range(Ncoord - (Ncoord % blocks), Ncoord):
                 out += "-------------"
-        
+
         out += "\n"
         out += "\n"
-        irc_log.info(out)
+        logger = logging.getLogger(__name__)
+        logger.info(out)
 
         #out += mol.print_coords(psi_outfile, qc_outfile)
         #out += mol.print_simples(psi_outfile, qc_outfile)
 
+    def dictOutput(self, step):
+        s = {}
+        s['Step Number']      = self.step_number(step)
+        s['Intco Values']     = self.q(step)
+        s['Geometry']         = self.x(step)
+        s['Internal Forces']  = self.f_q(step)
+        s['Cartesian Forces'] = self.f_x(step)
+        s['Energy']           = self.energy(step)
+        s['Pivot Intco Values'] = self.q_pivot(step)
+        s['Pivot Geometry']   = self.x_pivot(step)
+        s['Step Distance']    = self.step_dist(step)
+        s['Arc Distance' ]    = self.arc_dist(step)
+        s['Line Distance']    = self.line_dist(step)
+        return s
+
     def rxnpathDict(self):
-        rp = [ self.irc_points[i].dictOutput() for i in range(len(self.irc_points)) ]
+        rp = [ self.dictOutput(i) for i in range(self._n) ]
         return rp
 
+
+def joinBranches(backward, forward):
+    """ Join the backward and forward branches of an IRC, which both start at
+    the transition state, into one path ordered from the end of the backward
+    branch to the end of the forward branch.
+
+    Parameters
+    ----------
+    backward : IRCdata
+    forward : IRCdata
+
+    Returns
+    -------
+    IRCdata
+    """
+    path = IRCdata()
+    path.set_atom_symbols(forward.atom_symbols)
+    path.set_step_size_and_direction(forward.step_size, 'BOTH')
+
+    rows = [(backward, i) for i in range(len(backward) - 1, 0, -1)] + \
+           [(forward, i) for i in range(len(forward))]
+    branches = [branch for branch in (backward, forward) if any(b is branch for b, i in rows)]
+    if not rows:
+        return path
+
+    for name in set.intersection(*(set(branch._data) for branch in branches)):
+        path._data[name] = np.array([branch._data[name][i] for branch, i in rows])
+    path._has_pivot = np.array([branch._has_pivot[i] for branch, i in rows], bool)
+    if 'q_pivot' not in path._data:
+        path._has_pivot[:] = False
+    path._n = len(rows)
+    return path
+
+
 history = 0
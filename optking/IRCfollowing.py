@@ -6,9 +6,9 @@ from . import optparams as op
 from . import intcosMisc
 from . import stepAlgorithms
 from . import IRCdata
-from .displace import displace
+from .displace import displaceMolsys
 from .history import oHistory
-from .linearAlgebra import symmMatEig, symmMatInv, symmMatRoot
+from .linearAlgebra import symmMatEig
 from .printTools import printArrayString, printMatString
 from .exceptions import AlgError
 
@@ -39,21 +39,21 @@ def computePivotAndGuessPoints(oMolsys, v, IRCstepSize):
     logger = logging.getLogger(__name__)
 
     # Compute and save pivot point
-    G = intcosMisc.Gmat(oMolsys.intcos, oMolsys.geom, oMolsys.masses)
+    G = oMolsys.Gmat(massWeight=True)
     N = step_N_factor(G, v)
     dq_pivot = 0.5 * N * IRCstepSize * np.dot(G, v)
     logger.debug("\n Dq to Pivot Point:" + printArrayString(dq_pivot))
 
     x_pivot = oMolsys.geom # starting geom but becomes pivot point on next line
-    displace(oMolsys.intcos, x_pivot, dq_pivot, ensure_convergence=True)
-    q_pivot = intcosMisc.qValues(oMolsys.intcos, x_pivot)
+    displaceMolsys(oMolsys, dq_pivot, geom=x_pivot, ensure_convergence=True)
+    q_pivot = oMolsys.qValues(x_pivot)
     IRCdata.history.add_pivot_point(q_pivot, x_pivot)
 
     # Step again to get initial guess for next step.  Leave geometry in oMolsys.
     logger.info("Computing Dq to First Guess Point")
     logger.debug(printArrayString(dq_pivot))
     x_guess = x_pivot.copy()
-    displace(oMolsys.intcos, x_guess, dq_pivot, ensure_convergence=True)
+    displaceMolsys(oMolsys, dq_pivot, geom=x_guess, ensure_convergence=True)
     oMolsys.geom = x_guess
 
 
@@ -65,15 +65,13 @@ def Dq_IRC(oMolsys, E, f_q, H_q, s, dqGuess):
     logger = logging.getLogger(__name__)
     logger.debug("Starting IRC constrained optimization\n")
 
-    G_prime = intcosMisc.Gmat(oMolsys.intcos, oMolsys.geom, oMolsys.masses)
+    G_prime = oMolsys.Gmat(massWeight=True)
     logger.debug("Mass-weighted Gmatrix at hypersphere point: \n" + printMatString(G_prime))
-    G_prime_root = symmMatRoot(G_prime)
-    G_prime_inv = symmMatInv(G_prime)
-    G_prime_root_inv = symmMatRoot(G_prime_inv)
+    G_prime_root = oMolsys.Groot(massWeight=True)
+    G_prime_root_inv = oMolsys.Groot(massWeight=True, Inverse=True)
 
     logger.debug("G prime root matrix: \n" + printMatString(G_prime_root))
 
-    deltaQM = 0
     g_M = np.dot(G_prime_root, - f_q) 
     logger.debug("g_M: \n" + printArrayString(g_M))
 
@@ -81,8 +79,7 @@ def Dq_IRC(oMolsys, E, f_q, H_q, s, dqGuess):
     logger.debug("H_M: \n" + printMatString(H_M))
 
     #p_prime = dqGuess
-    p_prime = intcosMisc.qValues(oMolsys.intcos, oMolsys.geom) -  \
-              intcosMisc.qValues(oMolsys.intcos, IRCdata.history.x_pivot())
+    p_prime = oMolsys.qValues() - IRCdata.history.q_pivot()
     p_M = np.dot(G_prime_root_inv, p_prime)
     logger.debug("p_M: \n" + printArrayString(p_M))
 
@@ -90,114 +87,26 @@ def Dq_IRC(oMolsys, E, f_q, H_q, s, dqGuess):
     logger.debug("HMEigValues: \n" + printArrayString(HMEigValues))
     logger.debug("HMEigVects: \n" + printMatString(HMEigVects))
 
-    # Variables for solving lagrangian function
-    lb_lagrangian = -100
-    up_lagrangian = 100
-    lb_lambda = 0
-    if HMEigValues[0] < 0: # Make lower than the lowest eval
-        Lambda = 1.1 * HMEigValues[0]
-    else:
-        Lambda = 0.9 * HMEigValues[0]
-    up_lambda = Lambda
-
     # Solve Eqn. 26 in Gonzalez & Schlegel (1990) for lambda.
     # Sum_j { [(b_j p_bar_j - g_bar_j)/(b_j - lambda)]^2} - (s/2)^2 = 0.
     # For each j (dimension of H_M):
     #  b is an eigenvalues of H_M
     #  p_bar is projection p_M onto an eigenvector of H_M
     #  g_bar is projection g_M onto an eigenvector of H_M
-
-    lagrangian = calcLagrangian(Lambda, HMEigValues, HMEigVects, g_M, p_M, s)
-    prev_lagrangian = lagrangian
-
-    logger.debug("Starting coarse-grain multiplier search.")
-    logger.debug("lambda        Lagrangian value:\n")
-    #print("lambda        Lagrangian value:")
-
-    lagIter = 0
-    while lagIter < 1000:
-        lagrangian = calcLagrangian(Lambda, HMEigValues, HMEigVects, g_M, p_M, s)
-        logger.debug("%15.10e  %8.3e" % (Lambda, lagrangian) )
-        #print("%15.10e  %8.3e" % (Lambda, lagrangian) )
-
-        if lagrangian < 0 and abs(lagrangian) < abs(lb_lagrangian):
-            lb_lagrangian = lagrangian
-            lb_lambda = Lambda
-        elif lagrangian > 0 and abs(lagrangian) < abs(up_lagrangian):
-            up_lagrangian = lagrangian
-            up_lambda = Lambda
-
-        if prev_lagrangian * lagrangian < 0:
-            break;
-        prev_lagrangian = lagrangian
-
-        lagIter += 1
-        Lambda -= 0.001
-
-    logger.debug("Coarse graining results:")
-    logger.debug("Lambda between %10.5f and %10.5f" % (lb_lambda,up_lambda))
-    logger.debug("for Lagrangian %10.5f to  %10.5f" % (lb_lagrangian,up_lagrangian))
-
-    # Calulate lambda using Householder method
-    prev_lambda = -999
-    lagIter = 0
-    Lambda = (lb_lambda + up_lambda)/2 # start in middle of coarse range
-
-    logger.debug("lambda        Lagrangian:")
-    while abs(Lambda - prev_lambda) > 10**-15:
-        prev_lagrangian = lagrangian
-        L_derivs = calcLagrangianDerivs(Lambda, HMEigValues, HMEigVects, g_M, p_M, s)
-        lagrangian = L_derivs[0]
-        logger.debug("%15.5e%15.5e" % (Lambda, lagrangian) )
-        
-        h_f = -1 * L_derivs[0] / L_derivs[1]
-
-        # Keep track of lowest and highest results thus far
-        if lagrangian < 0 and (abs(lagrangian) < abs(lb_lagrangian)):
-            lb_lagrangian = lagrangian
-            lb_lambda = Lambda
-        elif lagrangian > 0 and abs(lagrangian) < abs(up_lagrangian):
-            up_lagrangian = lagrangian
-            up_lambda = Lambda
-
-        # Bisect if lagrangian has changed signs.
-        if lagrangian * prev_lagrangian < 0:
-            current_lambda = Lambda
-            Lambda = (prev_lambda + Lambda ) / 2
-            prev_lambda = current_lambda
-        else:
-            prev_lambda = Lambda
-            Lambda += h_f * (
-            24 * L_derivs[1] + 24 * L_derivs[2] * h_f + 4 * L_derivs[3] * h_f**2) / (
-            24 * L_derivs[1] + 36 * h_f * L_derivs[2] +
-             6 * L_derivs[2]**2 * h_f**2 / L_derivs[1] +
-             8 * L_derivs[3] * h_f**2 + L_derivs[4] * h_f**3)
-
-        lagIter += 1
-        if lagIter > 50:
-            prev_lambda = Lambda
-            Lambda = (lb_lambda + up_lambda) / 2 #Try a bisection after 50 attempts
-
-        if lagIter > 200:
-            err_msg = "Could not converge Lagrangian multiplier for constrained rxnpath search."
-            logger.warning(err_msg)
-            raise AlgError(err_msg)
-
+    p_bar = np.dot(HMEigVects, p_M)
+    g_bar = np.dot(HMEigVects, g_M)
+    Lambda = solveSecularEquation(HMEigValues, HMEigValues * p_bar - g_bar, s)
     logger.info("Lambda converged at %15.5e" % Lambda)
 
     # Find dq_M from Eqn. 24 in Gonzalez & Schlegel (1990).
-    # dq_M = (H_M - lambda I)^(-1) [lambda * p_M - g_M]
-    LambdaI = np.identity(len(oMolsys.intcos))
-    LambdaI = np.multiply(Lambda, LambdaI)
-    deltaQM = symmMatInv(np.subtract(H_M, LambdaI))
-    deltaQM = np.dot(deltaQM, np.subtract(np.multiply(Lambda, p_M), g_M))
+    # dq_M = (H_M - lambda I)^(-1) [lambda * p_M - g_M], in the eigenbasis of H_M
+    deltaQM = np.dot(HMEigVects.T, (Lambda * p_bar - g_bar) / (HMEigValues - Lambda))
     logger.debug("dq_M to next geometry\n" + printArrayString(deltaQM))
 
     # Find dq = G^(1/2) dq_M and do displacements.
     dq = np.dot(G_prime_root, deltaQM)
     logger.info("dq to next geometry\n" + printArrayString(dq))
-    # TODO write geometry for multiple fragments
-    displace(oMolsys.intcos, oMolsys._fragments[0].geom, dq)
+    displaceMolsys(oMolsys, dq)
 
     # Complete history entry of step.
     # Compute gradient and hessian in step direction
@@ -219,41 +128,96 @@ def Dq_IRC(oMolsys, E, f_q, H_q, s, dqGuess):
     return dq
 
 
-# Calculates and returns value of Lagrangian function given multiplier Lambda.
-def calcLagrangian(Lambda, HMEigValues, HMEigVects, g_M, p_M, s):
-    lagrangian = 0
-    for i in range(len(HMEigValues)):
-        numerator = HMEigValues[i] * np.dot(HMEigVects[i], p_M) - np.dot(HMEigVects[i], g_M)
-        denom = HMEigValues[i] - Lambda
-        lagrangian += (numerator / denom) ** 2
+def calcLagrangian(Lambda, HMEigValues, numerators, s):
+    """ Value of the secular function
+    L(lambda) = Sum_j [numerators_j / (b_j - lambda)]^2 - (s/2)^2
+
+    Parameters
+    ----------
+    Lambda : float
+    HMEigValues : ndarray
+        eigenvalues b_j of the mass-weighted Hessian
+    numerators : ndarray
+        b_j p_bar_j - g_bar_j for each eigenvector
+    s : float
+        IRC step size
+    """
+    return np.sum((numerators / (HMEigValues - Lambda))**2) - (0.5 * s)**2
+
+
+def solveSecularEquation(HMEigValues, numerators, s, conv=1.0e-14, max_iter=200):
+    """ Finds the root of the secular function below the lowest eigenvalue b_0.
+
+    On (-inf, b_0) the function rises monotonically from -(s/2)^2, so the root
+    is bracketed by [b_0 - 2|numerators|/s, b_0].  Newton steps are taken on
+    1/sqrt(L + (s/2)^2) - 2/s, which is nearly linear in lambda, and any
+    step leaving the bracket is replaced by bisection.
+
+    Parameters
+    ----------
+    HMEigValues : ndarray
+        eigenvalues b_j of the mass-weighted Hessian, in ascending order
+    numerators : ndarray
+        b_j p_bar_j - g_bar_j for each eigenvector
+    s : float
+        IRC step size
 
-    lagrangian -= (0.5 * s)**2
-    return lagrangian
+    Returns
+    -------
+    float
+        Lagrange multiplier lambda
+    """
+    logger = logging.getLogger(__name__)
+    target = 0.5 * s
+    b_0 = HMEigValues[0]
+    lower = b_0 - np.linalg.norm(numerators) / target
+    upper = b_0
+    scale = max(1.0, abs(lower), abs(upper))
+
+    # start from a point in the middle of the bracket
+    Lambda = 0.5 * (lower + upper)
+    logger.debug("Lambda bracketed by %15.10e and %15.10e" % (lower, upper))
+    logger.debug("     lambda        Lagrangian")
+    for lagIter in range(max_iter):
+        D = HMEigValues - Lambda
+        terms = (numerators / D)**2
+        norm = sqrt(np.sum(terms))
+        logger.debug("%15.10e  %10.3e" % (Lambda, norm**2 - target**2))
+
+        if norm > target:
+            upper = Lambda
+        else:
+            lower = Lambda
+        if norm == 0.0 or upper - lower < conv * scale:
+            break
+
+        # d/dlambda of 1/norm is -(Sum_j terms_j / D_j) / norm^3
+        slope = -np.sum(terms / D) / norm**3
+        step = -(1.0 / norm - 1.0 / target) / slope if slope != 0.0 else 0.0
+        if lower < Lambda + step < upper and abs(step) > 0.5 * conv * scale:
+            Lambda += step
+        elif abs(step) <= 0.5 * conv * scale:
+            break
+        else:
+            Lambda = 0.5 * (lower + upper)
+    else:
+        err_msg = "Could not converge Lagrangian multiplier for constrained rxnpath search."
+        logger.warning(err_msg)
+        raise AlgError(err_msg)
 
-# Calculates and returns value of derivative of Lagrangian function given multiplier Lambda.
-def calcLagrangianDerivs(Lambda, HMEigValues, HMEigVects, g_M, p_M, s):
-    deriv = np.array( [0.0, 0.0, 0.0, 0.0, 0.0], float)
-    for i in range(len(HMEigValues)):
-        numerator = HMEigValues[i] * np.dot(HMEigVects[i], p_M) - np.dot(HMEigVects[i], g_M)
-        D = HMEigValues[i] - Lambda
-        deriv[0] +=     (numerator / D) ** 2
-        deriv[1] += 2  *(numerator / D) ** 2 / (D) 
-        deriv[2] += 6  *(numerator / D) ** 2 / (D*D)
-        deriv[3] += 24 *(numerator / D) ** 2 / (D*D*D)
-        deriv[4] += 120*(numerator / D) ** 2 / (D*D*D*D)
+    if Lambda >= b_0:
+        err_msg = "Lagrangian multiplier for constrained rxnpath search is not below lowest eigenvalue."
+        logger.warning(err_msg)
+        raise AlgError(err_msg)
 
-    deriv[0] -= (0.5 * s)**2
+    return Lambda
 
-    return deriv
 
 # mass-weighted distance from previous rxnpath point to new one
 def calcLineDistStep(oMolsys):
-    G      = intcosMisc.Gmat(oMolsys.intcos, oMolsys.geom, oMolsys.masses)
-    G_root = symmMatRoot(G)
-    G_inv  = symmMatInv(G_root)
-    G_root_inv  = symmMatRoot(G_inv)
+    G_root_inv = oMolsys.Groot(massWeight=True, Inverse=True)
 
-    rxn_Dq  = np.subtract(intcosMisc.qValues(oMolsys.intcos, oMolsys.geom), IRCdata.history.q())
+    rxn_Dq  = np.subtract(oMolsys.qValues(), IRCdata.history.q())
     # mass weight (not done in old C++ code)
     rxn_Dq_M = np.dot(G_root_inv, rxn_Dq)
     return np.linalg.norm ( rxn_Dq_M )
@@ -266,16 +230,11 @@ def calcLineDistStep(oMolsys):
 def calcArcDistStep(oMolsys):
     qp = IRCdata.history.q_pivot(-1) # pivot point is stored in previous step
     q0 = IRCdata.history.q(-1)
-    q1 = intcosMisc.qValues(oMolsys.intcos, oMolsys.geom)
+    q1 = oMolsys.qValues()
 
     p    = np.subtract(q1, qp)  # Dq from pivot point to latest rxnpath pt.
     line = np.subtract(q1, q0)  # Dq from rxnpath pt. to rxnpath pt.
 
-    # mass-weight
-    G      = intcosMisc.Gmat(oMolsys.intcos, oMolsys.geom, oMolsys.masses)
-    G_root = symmMatRoot(G)
-    G_inv  = symmMatInv(G_root)
-    G_root_inv  = symmMatRoot(G_inv)
     p[:]    = np.multiply( 1.0/np.linalg.norm(p),    p )
     line[:] = np.multiply( 1.0/np.linalg.norm(line), line )
 
@@ -283,3 +242,199 @@ def calcArcDistStep(oMolsys):
     arcDistStep = IRCdata.history.step_size * alpha / tan(alpha)
     return arcDistStep
 
+
+
+# Hessian-based predictor-corrector integration of the IRC.  See
+# Hratchian & Schlegel, J. Chem. Phys. 120, 9918 (2004).  All quantities are in
+# mass-weighted internal coordinates, g_M = G^(1/2) g_q and H_M = G^(1/2) H_q G^(1/2).
+def lqaStep(g_M, H_M, s, n_grid=1000):
+    """ Follows the steepest-descent path of the local quadratic model for an
+    arc length s (Page & McIver, 1988).
+
+    In the eigenbasis of H_M, the path is dq_j(t) = g_j (exp(-b_j t) - 1) / b_j;
+    its arc length is the integral of |g(t)| = sqrt(Sum_j g_j^2 exp(-2 b_j t)),
+    evaluated on a grid of the parameter t.
+
+    Parameters
+    ----------
+    g_M : ndarray
+        mass-weighted gradient
+    H_M : ndarray
+        mass-weighted Hessian
+    s : float
+        arc length of the step
+    n_grid : int, optional
+        number of intervals on which the arc length is integrated
+
+    Returns
+    -------
+    ndarray, float
+        mass-weighted step, and its arc length; the arc length is less than s
+        when the path reaches the minimum of the model first
+    """
+    logger = logging.getLogger(__name__)
+    b, V = symmMatEig(H_M)
+    g_bar = np.dot(V, g_M)
+    g_norm = np.linalg.norm(g_bar)
+    if g_norm == 0.0:
+        raise AlgError("Gradient is zero; the LQA step is undefined.")
+
+    def path(t):
+        bt = np.multiply.outer(t, b)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f = np.where(np.abs(bt) > 1.0e-12, np.expm1(-bt) / b, -t[..., None])
+        return f * g_bar
+
+    def arc(T):
+        # stiff modes change on a much shorter scale than the whole path
+        t = np.union1d(np.linspace(0.0, T, n_grid + 1), np.geomspace(1.0e-8 * T, T, n_grid))
+        speed = np.sqrt(np.sum(g_bar**2 * np.exp(-2.0 * np.multiply.outer(t, b)), axis=-1))
+        lengths = np.concatenate(([0.0], np.cumsum(0.5 * (speed[1:] + speed[:-1]) * np.diff(t))))
+        return t, lengths
+
+    # Increase the range of t until it contains the arc length s.  When all the
+    # eigenvalues are positive, the path has a finite length.
+    T = s / g_norm
+    t, lengths = arc(T)
+    for i in range(100):
+        if lengths[-1] >= s:
+            break
+        prev_length = lengths[-1]
+        T *= 2.0
+        t, lengths = arc(T)
+        if lengths[-1] - prev_length < 1.0e-10 * s:
+            logger.info("\tLQA path reaches the minimum of the model after %10.5f" % lengths[-1])
+            break
+
+    t_s = np.interp(min(s, lengths[-1]), lengths, t)
+    dq_M = np.dot(V.T, path(np.array([t_s]))[0])
+    return dq_M, min(s, lengths[-1])
+
+
+def dwiGradient(y, points):
+    """ Gradient of the distance-weighted interpolant of quadratic models.
+
+    E(y) = Sum_i w_i(y) T_i(y), where T_i is the second-order Taylor expansion
+    about point i, and w_i is proportional to 1/|y - y_i|^2.
+
+    Parameters
+    ----------
+    y : ndarray
+        position at which to evaluate the gradient
+    points : list of tuple
+        (y_i, E_i, g_i, H_i) at each point
+
+    Returns
+    -------
+    ndarray
+    """
+    Y = np.array([p[0] for p in points])
+    E = np.array([p[1] for p in points])
+    g = np.array([p[2] for p in points])
+    H = np.array([p[3] for p in points])
+
+    d = y - Y
+    HD = np.einsum('inm,im->in', H, d)
+    T = E + np.einsum('in,in->i', g, d) + 0.5 * np.einsum('in,in->i', d, HD)
+    gradT = g + HD
+
+    dist2 = np.einsum('in,in->i', d, d)
+    if np.min(dist2) < 1.0e-20:  # at one of the points, the weights are flat
+        return gradT[np.argmin(dist2)]
+
+    v = 1.0 / dist2
+    V = np.sum(v)
+    grad_v = -2.0 * d * (v**2)[:, None]
+    grad_w = grad_v / V - np.outer(v, np.sum(grad_v, axis=0)) / V**2
+    return np.dot(v / V, gradT) + np.dot(T, grad_w)
+
+
+def dwiHessian(y, points):
+    """ Hessian of the distance-weighted interpolant.
+
+    With v_i = 1/|d_i|^2, V = Sum_i v_i and w_i = v_i / V,
+    Hess E = Sum_i [w_i H_i + grad w_i grad T_i^T + grad T_i grad w_i^T + T_i Hess w_i],
+    where grad v_i = -2 v_i^2 d_i and Hess v_i = -2 v_i^2 I + 8 v_i^3 d_i d_i^T.
+
+    Parameters
+    ----------
+    y : ndarray
+        position at which to evaluate the Hessian
+    points : list of tuple
+        (y_i, E_i, g_i, H_i); see dwiGradient()
+
+    Returns
+    -------
+    ndarray
+    """
+    Y = np.array([p[0] for p in points])
+    E = np.array([p[1] for p in points])
+    g = np.array([p[2] for p in points])
+    H = np.array([p[3] for p in points])
+
+    d = y - Y
+    HD = np.einsum('inm,im->in', H, d)
+    T = E + np.einsum('in,in->i', g, d) + 0.5 * np.einsum('in,in->i', d, HD)
+    gradT = g + HD
+
+    dist2 = np.einsum('in,in->i', d, d)
+    if np.min(dist2) < 1.0e-20:  # at one of the points, the weights are flat
+        return H[np.argmin(dist2)].copy()
+
+    n = len(y)
+    v = 1.0 / dist2
+    V = np.sum(v)
+    grad_v = -2.0 * d * (v**2)[:, None]
+    S = np.sum(grad_v, axis=0)
+    grad_w = grad_v / V - np.outer(v, S) / V**2
+
+    def weightedHessV(c):
+        # Sum_i c_i Hess v_i
+        return -2.0 * np.dot(c, v**2) * np.identity(n) + 8.0 * np.dot(d.T * (c * v**3), d)
+
+    TgradV = np.dot(T, grad_v)
+    Tv = np.dot(T, v)
+    THessW = weightedHessV(T) / V - (np.outer(TgradV, S) + np.outer(S, TgradV)) / V**2 \
+        - Tv * weightedHessV(np.ones(len(v))) / V**2 + 2.0 * Tv * np.outer(S, S) / V**3
+    cross = np.dot(grad_w.T, gradT)
+    return np.einsum('i,inm->nm', v / V, H) + cross + cross.T + THessW
+
+
+def dwiStep(points, s, n_steps=10, v_start=None):
+    """ Follows the steepest-descent path on the distance-weighted interpolant
+    from the first point for an arc length s.
+
+    Each sub-step is an LQA step on the local quadratic model of the interpolant.
+    Near the transition state the gradient is small compared with the stiff
+    curvatures, and explicit integrators zig-zag across the valley.
+
+    Parameters
+    ----------
+    points : list of tuple
+        (y_i, E_i, g_i, H_i); see dwiGradient()
+    s : float
+        arc length of the step
+    n_steps : int, optional
+    v_start : ndarray, optional
+        unit direction to leave the first point by when its gradient is zero,
+        i.e., the transition vector at a transition state
+
+    Returns
+    -------
+    ndarray
+        end point of the path
+    """
+    y = np.array(points[0][0], float)
+    h = s / n_steps
+    for i in range(n_steps):
+        g = dwiGradient(y, points)
+        if np.linalg.norm(g) <= 1.0e-12:
+            if v_start is None:
+                break
+            y = y + h * v_start
+            continue
+        dy, arc = lqaStep(g, dwiHessian(y, points), h)
+        y = y + dy
+        if arc < h:  # reached the minimum of the interpolant
+            break
+    return y
@@ -2,16 +2,20 @@ from itertools import combinations, permutations
 import logging
 
 import numpy as np
-import qcelemental as qcel
 
 from . import bend
 from . import cart
+from . import delocalized
 from .exceptions import AlgError, OptError
 from . import optparams as op
 from . import stre
 from . import tors
 from . import v3d
 from .intcosMisc import qValues
+from .misc import covalentRadiiFromZ
+
+# rows of the distance matrix computed at once in connectivityFromDistances()
+_CONNECT_BLOCK = 512
 
 
 def connectivityFromDistances(geom, Z):
@@ -32,15 +36,16 @@ def connectivityFromDistances(geom, Z):
 
     """
     nat = geom.shape[0]
-    C = np.zeros((len(geom), len(geom)), bool)
-    # logger = logging.getLogger(__name__)
-    for i, j in combinations(range(nat), 2):
-        R = v3d.dist(geom[i], geom[j])
-        Rcov = qcel.covalentradii.get(Z[i], missing=4.0) + qcel.covalentradii.get(Z[j], missing=4.0)
-        # logger.debug("Trying to connect atoms " + str(i) + ' and ' + str(j) + " distance is: " +
-        #            str(qcel.covalentradii.get(Z[i], missing=4.0) + qcel.covalentradii.get(Z[j], missing=4.0)))
-        if R < op.Params.covalent_connect * Rcov:
-            C[i, j] = C[j, i] = True
+    C = np.zeros((nat, nat), bool)
+    Rcov = covalentRadiiFromZ(Z)
+
+    # Work on blocks of rows so the distance matrix of a large cluster never
+    # has to be held in memory at once.
+    for start in range(0, nat, _CONNECT_BLOCK):
+        rows = slice(start, min(start + _CONNECT_BLOCK, nat))
+        R = np.linalg.norm(geom[rows, None, :] - geom[None, :, :], axis=2)
+        C[rows] = R < op.Params.covalent_connect * (Rcov[rows, None] + Rcov[None, :])
+    np.fill_diagonal(C, False)
 
     return C
 
@@ -280,8 +285,10 @@ def linearBendCheck(intcos, geom, dq):
     logger = logging.getLogger(__name__)
     linearBends = []
 
-    # TODO This will need generalized later for combination coordinates.
-    # q = qValues(intcos, geom)
+    if delocalized.combinationSets(intcos):
+        # Check the bends among the primitives of combination coordinates.
+        primitives, dq_prim = delocalized.primitiveDisplacements(intcos, geom, dq)
+        return linearBendCheck(primitives, geom, dq_prim)
 
     for i, intco in enumerate(intcos):
         if isinstance(intco, bend.Bend):
@@ -332,8 +339,8 @@ def freezeStretchesFromInputAtomList(frozenStreList, oMolsys):
             "Number of atoms in frozen stretch list not divisible by 2.")
 
     for i in range(0, len(frozenStreList), 2):
-        stretch = stre.Stre(frozenStreList[i] - 1, frozenStreList[i + 1] - 1, frozen=True)
-        f = checkFragment(stretch.atoms, oMolsys)
+        f, atoms = fragmentLocalAtoms([frozenStreList[i] - 1, frozenStreList[i + 1] - 1], oMolsys)
+        stretch = stre.Stre(*atoms, frozen=True)
         try:
             frozen_stretch = oMolsys._fragments[f]._intcos.index(stretch)
             oMolsys._fragments[f]._intcos[frozen_stretch].frozen = True
@@ -358,12 +365,8 @@ def freezeBendsFromInputAtomList(frozenBendList, oMolsys):
             "Number of atoms in frozen bend list not divisible by 3.")
 
     for i in range(0, len(frozenBendList), 3):
-        bendFroz = bend.Bend(
-            frozenBendList[i] - 1,
-            frozenBendList[i + 1] - 1,
-            frozenBendList[i + 2] - 1,
-            frozen=True)
-        f = checkFragment(bendFroz.atoms, oMolsys)
+        f, atoms = fragmentLocalAtoms([a - 1 for a in frozenBendList[i:i + 3]], oMolsys)
+        bendFroz = bend.Bend(*atoms, frozen=True)
         try:
             freezing_bend = oMolsys._fragments[f]._intcos.index(bendFroz)
             oMolsys._fragments[f]._intcos[freezing_bend].frozen = True
@@ -387,13 +390,8 @@ def freezeTorsionsFromInputAtomList(frozenTorsList, oMolsys):
             "Number of atoms in frozen torsion list not divisible by 4.")
 
     for i in range(0, len(frozenTorsList), 4):
-        torsAngle = tors.Tors(
-            frozenTorsList[i] - 1,
-            frozenTorsList[i + 1] - 1,
-            frozenTorsList[i + 2] - 1,
-            frozenTorsList[i + 3] - 1,
-            frozen=True)
-        f = checkFragment(torsAngle.atoms, oMolsys)
+        f, atoms = fragmentLocalAtoms([a - 1 for a in frozenTorsList[i:i + 4]], oMolsys)
+        torsAngle = tors.Tors(*atoms, frozen=True)
         try:
             freezing_tors = oMolsys._fragments[f]._intcos.index(torsAngle)
             oMolsys._fragments[f]._intcos[freezing_tors].frozen = True
@@ -414,8 +412,7 @@ def freeze_cartesians_from_input_list(frozen_cart_list, oMolsys):
     """
     logger = logging.getLogger(__name__)
     for i in range(0, len(frozen_cart_list), 2):
-        at = frozen_cart_list[i] - 1
-        f = oMolsys.atom2frag_index(at)  # get frag
+        f, (at, ) = fragmentLocalAtoms([frozen_cart_list[i] - 1], oMolsys)
         for xyz in frozen_cart_list[i+1]:
             newCart = cart.Cart(at, xyz, frozen=True)
             try:
@@ -441,14 +438,23 @@ def checkFragment(atomList, oMolsys):
     return fragList[0]
 
 
+def fragmentLocalAtoms(atomList, oMolsys):
+    """Returns the fragment containing a group of atoms and the atoms' indices
+    within that fragment.  Coordinates are stored with fragment atom indices.
+    """
+    f = checkFragment(atomList, oMolsys)
+    first = oMolsys.frag_1st_atom(f)
+    return f, [a - first for a in atomList]
+
+
 # TODO Length mod 3 should be checked in OptParams
 def fixStretchesFromInputList(fixedStreList, oMolsys):
     logger = logging.getLogger(__name__)
     for i in range(0, len(fixedStreList), 3):  # loop over fixed stretches
-        stretch = stre.Stre(fixedStreList[i] - 1, fixedStreList[i + 1] - 1)
+        f, atoms = fragmentLocalAtoms([fixedStreList[i] - 1, fixedStreList[i + 1] - 1], oMolsys)
+        stretch = stre.Stre(*atoms)
         val = fixedStreList[i + 2] / stretch.qShowFactor
         stretch.fixedEqVal = val
-        f = checkFragment(stretch.atoms, oMolsys)
         try:
             fixing_stretch = oMolsys._fragments[f]._intcos.index(stretch)
             oMolsys._fragments[f]._intcos[fixing_stretch].fixedEqVal = val
@@ -460,11 +466,10 @@ def fixStretchesFromInputList(fixedStreList, oMolsys):
 def fixBendsFromInputList(fixedBendList, oMolsys):
     logger = logging.getLogger(__name__)
     for i in range(0, len(fixedBendList), 4):  # loop over fixed bends
-        one_bend = bend.Bend(fixedBendList[i] - 1, fixedBendList[i + 1] - 1,
-                             fixedBendList[i + 2] - 1)
+        f, atoms = fragmentLocalAtoms([a - 1 for a in fixedBendList[i:i + 3]], oMolsys)
+        one_bend = bend.Bend(*atoms)
         val = fixedBendList[i + 3] / one_bend.qShowFactor
         one_bend.fixedEqVal = val
-        f = checkFragment(one_bend.atoms, oMolsys)
         try:
             fixing_bend = oMolsys._fragments[f]._intcos.index(one_bend)
             oMolsys._fragments[f]._intcos[fixing_bend].fixedEqVal = val
@@ -476,11 +481,10 @@ def fixBendsFromInputList(fixedBendList, oMolsys):
 def fixTorsionsFromInputList(fixedTorsList, oMolsys):
     logger = logging.getLogger(__name__)
     for i in range(0, len(fixedTorsList), 5):  # loop over fixed dihedrals
-        one_tors = tors.Tors(fixedTorsList[i] - 1, fixedTorsList[i + 1] - 1,
-                             fixedTorsList[i + 2] - 1, fixedTorsList[i + 3] - 1)
+        f, atoms = fragmentLocalAtoms([a - 1 for a in fixedTorsList[i:i + 4]], oMolsys)
+        one_tors = tors.Tors(*atoms)
         val = fixedTorsList[i + 4] / one_tors.qShowFactor
         one_tors.fixedEqVal = val
-        f = checkFragment(one_tors.atoms, oMolsys)
         try:
             fixing_tors = oMolsys._fragments[f]._intcos.index(one_tors)
             oMolsys._fragments[f]._intcos[fixing_tors].fixedEqVal = val
@@ -498,6 +502,13 @@ def addFrozenAndFixedIntcos(oMolsys):
         freezeTorsionsFromInputAtomList(op.Params.frozen_dihedral, oMolsys)
     if op.Params.frozen_cartesian:
         freeze_cartesians_from_input_list(op.Params.frozen_cartesian, oMolsys)
+    if op.Params.core_atoms:
+        # the environment of a layered optimization moves only in microiterations
+        environment = []
+        for atom in range(1, oMolsys.Natom + 1):
+            if atom not in op.Params.core_atoms:
+                environment += [atom, ['X', 'Y', 'Z']]
+        freeze_cartesians_from_input_list(environment, oMolsys)
 
     if op.Params.fixed_distance:
         fixStretchesFromInputList(op.Params.fixed_distance, oMolsys)
@@ -505,3 +516,4 @@ def addFrozenAndFixedIntcos(oMolsys):
         fixBendsFromInputList(op.Params.fixed_bend, oMolsys)
     if op.Params.fixed_dihedral:
         fixTorsionsFromInputList(op.Params.fixed_dihedral, oMolsys)
+    oMolsys.clearCache(newCoordinates=True)
@@ -2,12 +2,12 @@ import math
 import logging
 
 import numpy as np
-import qcelemental as qcel
 
+from .lazyModule import qcel
 from .exceptions import AlgError, OptError
 from . import v3d
 from .simple import Simple
-from .misc import delta, HguessLindhRho
+from .misc import delta, HguessLindhRho, covalentRadiiFromZ
 
 
 class Bend(Simple):
@@ -283,8 +283,8 @@ class Bend(Simple):
             b = 0.11
             c = 0.44
             d = -0.42
-            Rcov_AB = qcel.covalentradii.get(Z[self.A], missing=4.0) + qcel.covalentradii.get(Z[self.B], missing=4.0)
-            Rcov_BC = qcel.covalentradii.get(Z[self.C], missing=4.0) + qcel.covalentradii.get(Z[self.B], missing=4.0)
+            Rcov_AB = covalentRadiiFromZ(Z[self.A]) + covalentRadiiFromZ(Z[self.B])
+            Rcov_BC = covalentRadiiFromZ(Z[self.C]) + covalentRadiiFromZ(Z[self.B])
             R_AB = v3d.dist(geom[self.A], geom[self.B])
             R_BC = v3d.dist(geom[self.B], geom[self.C])
             return a + b / (np.power(Rcov_AB * Rcov_BC, d)) * np.exp(
@@ -1,5 +1,4 @@
-import qcelemental as qcel
-
+from .lazyModule import qcel
 from .exceptions import AlgError, OptError
 from .simple import Simple
 
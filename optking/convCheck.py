@@ -44,9 +44,8 @@ def convCheck(iterNum, oMolsys, dq, f, energies, q_pivot=None):
                 f[i] = 0
 
     if op.Params.opt_type == 'IRC':
-        G_m = Gmat(oMolsys.intcos, oMolsys.geom, oMolsys.masses)
-        G_m_inv = np.linalg.inv(G_m)
-        q = qValues(oMolsys.intcos, oMolsys.geom)
+        G_m_inv = oMolsys.Ginv(massWeight=True)
+        q = oMolsys.qValues()
         logger.info("Projecting out forces parallel to reaction path.")
 
         p = np.subtract(q, q_pivot)
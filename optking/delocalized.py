@@ -0,0 +1,366 @@
+""" Non-redundant linear combinations of primitive internal coordinates.
+
+DELOCALIZED coordinates (Baker, Kessi and Delley, J. Chem. Phys. 105, 192 (1996))
+are the eigenvectors of G = B B^T of the full primitive set with non-zero
+eigenvalues.  NATURAL coordinates (Pulay, Fogarasi, Pang and Boggs, J. Am. Chem.
+Soc. 101, 2550 (1979)) are formed locally: bends about a common central atom and
+torsions about a common bond are combined among themselves, and the local
+combinations are kept only if they add a new direction to the coordinate space.
+
+Each Combination behaves like any other coordinate: q, B-matrix rows and second
+derivatives are linear combinations of those of the primitives.  All combinations
+from one fragment share a CombinationSet which evaluates the primitive values and
+B matrix once per geometry.
+"""
+import logging
+
+import numpy as np
+
+from . import bend
+from . import oofp
+from . import tors
+from .exceptions import AlgError
+from .linearAlgebra import symmMatInv
+from .simple import Simple
+
+
+class CombinationSet(object):
+    """ A set of primitive coordinates and the coefficients of their combinations.
+
+    Parameters
+    ----------
+    primitives : list(Simple)
+    U : ndarray
+        (Nprim, Ncombo) coefficients; column k defines combination k
+    label : str
+        printed name of the combinations, e.g., DLC or NIC
+    """
+    def __init__(self, primitives, U, label):
+        self.primitives = primitives
+        self.U = U
+        self.label = label
+        self._geom = None
+        self._q = None
+        self._B = None
+
+    def clearCache(self):
+        self._geom = None
+        self._q = None
+        self._B = None
+
+    def _checkGeom(self, geom):
+        if self._geom is None or self._geom.shape != geom.shape or \
+                not np.array_equal(self._geom, geom):
+            self._geom = np.array(geom, dtype=float)
+            self._q = None
+            self._B = None
+
+    def q(self, geom):
+        """ Values of all combinations. """
+        self._checkGeom(geom)
+        if self._q is None:
+            q_prim = np.array([p.q(geom) for p in self.primitives])
+            self._q = np.dot(self.U.T, q_prim)
+        return self._q
+
+    def B(self, geom):
+        """ B matrix rows of all combinations. """
+        self._checkGeom(geom)
+        if self._B is None:
+            self._B = np.dot(self.U.T, _Bmat(self.primitives, geom))
+        return self._B
+
+
+class Combination(Simple):
+    """ One coordinate of a CombinationSet.
+
+    Parameters
+    ----------
+    combinationSet : CombinationSet
+    index : int
+        column of combinationSet.U
+    """
+    def __init__(self, combinationSet, index):
+        self._set = combinationSet
+        self._index = index
+        coeffs = combinationSet.U[:, index]
+        atoms = set()
+        for p, c in zip(combinationSet.primitives, coeffs):
+            if c != 0.0:
+                atoms.update(p.atoms)
+        Simple.__init__(self, sorted(atoms))
+
+    def __str__(self):
+        return ' %s(%d)' % (self._set.label, self._index + 1)
+
+    def __eq__(self, other):
+        if not isinstance(other, Combination):
+            return False
+        return self._set is other._set and self._index == other._index
+
+    @property
+    def combinationSet(self):
+        return self._set
+
+    @property
+    def coefficients(self):
+        return self._set.U[:, self._index]
+
+    def q(self, geom):
+        return self._set.q(geom)[self._index]
+
+    def qShow(self, geom):
+        return self.q(geom)
+
+    # Combinations mix lengths and angles, so they are shown in a.u.
+    @property
+    def qShowFactor(self):
+        return 1.0
+
+    @property
+    def fShowFactor(self):
+        return 1.0
+
+    def DqDx(self, geom, dqdx, mini=False):
+        if mini:
+            raise AlgError("Combination coordinates do not provide mini B-matrix rows.")
+        dqdx[:] = self._set.B(geom)[self._index]
+
+    def Dq2Dx2(self, geom, dq2dx2):
+        tmp = np.zeros(dq2dx2.shape)
+        for p, c in zip(self._set.primitives, self.coefficients):
+            if c != 0.0:
+                tmp[:] = 0.0
+                p.Dq2Dx2(geom, tmp)
+                dq2dx2 += c * tmp
+
+    def diagonalHessianGuess(self, geom, Z, connectivity, guessType="SIMPLE"):
+        return sum(c * c * p.diagonalHessianGuess(geom, Z, connectivity, guessType)
+                   for p, c in zip(self._set.primitives, self.coefficients) if c != 0.0)
+
+    def description(self, tol=0.1):
+        """ Principal primitives of this combination, for printing. """
+        s = '%s:' % str(self)
+        for p, c in zip(self._set.primitives, self.coefficients):
+            if abs(c) > tol:
+                s += ' %+.3f*%s' % (c, str(p).strip())
+        return s
+
+
+def combinationSets(intcos):
+    """ Unique CombinationSets used by a list of coordinates. """
+    sets = []
+    for intco in intcos:
+        if isinstance(intco, Combination) and \
+                not any(intco.combinationSet is s for s in sets):
+            sets.append(intco.combinationSet)
+    return sets
+
+
+def primitiveIntcos(intcos):
+    """ Unique primitives underlying a list of coordinates. """
+    primitives = []
+    for S in combinationSets(intcos):
+        primitives.extend(S.primitives)
+    for intco in intcos:
+        if not isinstance(intco, Combination) and not any(intco is p for p in primitives):
+            primitives.append(intco)
+    return primitives
+
+
+def expand(intcos):
+    """ Writes a coordinate list in terms of primitives.
+
+    Returns
+    -------
+    list(Simple), ndarray
+        primitives and the (Nintco, Nprim) matrix T with q = T q_prim
+    """
+    primitives = []
+    offsets = {}
+    columns = []
+    for intco in intcos:
+        if isinstance(intco, Combination):
+            S = intco.combinationSet
+            if id(S) not in offsets:
+                offsets[id(S)] = len(primitives)
+                primitives.extend(S.primitives)
+            columns.append(offsets[id(S)])
+        else:
+            columns.append(len(primitives))
+            primitives.append(intco)
+
+    T = np.zeros((len(intcos), len(primitives)))
+    for i, (intco, start) in enumerate(zip(intcos, columns)):
+        if isinstance(intco, Combination):
+            T[i, start:start + len(intco.combinationSet.primitives)] = intco.coefficients
+        else:
+            T[i, start] = 1.0
+    return primitives, T
+
+
+def _Bmat(intcos, geom):
+    B = np.zeros((len(intcos), geom.size))
+    for i, intco in enumerate(intcos):
+        intco.DqDx(geom, B[i])
+    return B
+
+
+def primitiveDisplacements(intcos, geom, dq):
+    """ First-order change in the primitives produced by a step dq.
+
+    Returns
+    -------
+    list(Simple), ndarray
+        primitives and dq_prim = B_prim B^T G^-1 dq
+    """
+    primitives, T = expand(intcos)
+    B = _Bmat(intcos, geom)
+    Ginv = symmMatInv(np.dot(B, B.T), redundant=True)
+    dx = np.dot(B.T, np.dot(Ginv, dq))
+    return primitives, np.dot(_Bmat(primitives, geom), dx)
+
+
+def formCombinations(intcos, geom, natural=False, eval_tol=1.0e-8):
+    """ Replaces a primitive coordinate list by a non-redundant set.
+
+    Frozen and fixed primitives are kept as they are, so that constraints
+    continue to act on the primitive itself; the combinations span the
+    remaining, unconstrained directions.
+
+    Parameters
+    ----------
+    intcos : list(Simple)
+        primitive coordinates
+    geom : ndarray
+        (nat, 3) cartesian geometry
+    natural : bool
+        form natural instead of delocalized coordinates
+    eval_tol : float
+        eigenvalues of G below this are taken to be redundancies
+
+    Returns
+    -------
+    list(Simple)
+        constrained primitives followed by the combinations
+    """
+    logger = logging.getLogger(__name__)
+    if not intcos:
+        return []
+
+    constrained = [i for i, intco in enumerate(intcos) if intco.frozen or intco.fixed]
+
+    B_prim = _Bmat(intcos, geom)
+
+    if natural:
+        U = _naturalCoefficients(intcos, B_prim, constrained, eval_tol)
+        label = 'NIC'
+    else:
+        U = _delocalizedCoefficients(B_prim, constrained, eval_tol)
+        label = 'DLC'
+
+    combinationSet = CombinationSet(list(intcos), U, label)
+    combos = [Combination(combinationSet, k) for k in range(U.shape[1])]
+
+    s = "\tFormed %d %s coordinates from %d primitives (%d constrained).\n" % (
+        len(combos), 'natural' if natural else 'delocalized', len(intcos), len(constrained))
+    for c in combos:
+        s += '\t' + c.description() + '\n'
+    logger.info(s)
+
+    return [intcos[i] for i in constrained] + combos
+
+
+def _delocalizedCoefficients(B_prim, constrained, eval_tol):
+    G = np.dot(B_prim, B_prim.T)
+    evals, evects = np.linalg.eigh(G)
+    U = evects[:, evals > eval_tol]
+
+    if constrained:
+        # Remove the constrained primitives from the space spanned by U.
+        E = np.zeros((U.shape[0], len(constrained)))
+        E[constrained, range(len(constrained))] = 1.0
+        Q, R = np.linalg.qr(np.dot(U, np.dot(U.T, E)))
+        Q = Q[:, np.abs(np.diag(R)) > 1.0e-8]
+        Uc = U - np.dot(Q, np.dot(Q.T, U))
+        left, s, _ = np.linalg.svd(Uc, full_matrices=False)
+        U = left[:, s > 1.0e-6]
+
+    return U
+
+
+def _naturalGroups(intcos, skip):
+    """ Groups primitives into local sets: one per stretch/cartesian, bends and
+    out-of-plane angles by central atom, torsions by central bond.  Returns the
+    groups and whether each contributes all or only its leading combination. """
+    streGroups, bendGroups, torsGroups = [], {}, {}
+    for i, intco in enumerate(intcos):
+        if i in skip:
+            continue
+        if isinstance(intco, bend.Bend):
+            bendGroups.setdefault(intco.B, []).append(i)
+        elif isinstance(intco, oofp.Oofp):
+            torsGroups.setdefault(('O', intco.A), []).append(i)
+        elif isinstance(intco, tors.Tors):
+            torsGroups.setdefault(tuple(sorted((intco.B, intco.C))), []).append(i)
+        else:
+            streGroups.append([i])
+    return [(g, False) for g in streGroups + list(bendGroups.values())] + \
+           [(g, True) for g in torsGroups.values()]
+
+
+def _naturalCoefficients(intcos, B_prim, constrained, eval_tol, accept_tol=0.2):
+    Nprim, Ncart = B_prim.shape
+
+    # orthonormal basis of the cartesian directions already described
+    accepted = np.zeros((Ncart, 0))
+    for i in constrained:
+        accepted = _extendBasis(accepted, B_prim[i])
+    Nconstrained = accepted.shape[1]
+
+    columns = []
+    for group, leadingOnly in _naturalGroups(intcos, set(constrained)):
+        Bg = B_prim[group]
+        evals, evects = np.linalg.eigh(np.dot(Bg, Bg.T))
+        # Local redundancies, e.g., the six angles about a tetrahedral center.
+        keep = [k for k in reversed(range(len(group))) if evals[k] > max(eval_tol, 1.0e-6 * evals[-1])]
+        if leadingOnly:
+            keep = keep[:1]  # one overall torsion about each bond
+        for k in keep:
+            extended = _extendBasis(accepted, np.dot(evects[:, k], Bg), accept_tol)
+            if extended.shape[1] > accepted.shape[1]:
+                accepted = extended
+                u = np.zeros(Nprim)
+                u[group] = evects[:, k]
+                columns.append(u)
+
+    # Directions still missing are added as delocalized combinations.
+    evals, evects = np.linalg.eigh(np.dot(B_prim, B_prim.T))
+    skip = np.zeros(Nprim, dtype=bool)
+    skip[constrained] = True
+    U = evects[:, evals > eval_tol]
+    U = U[:, np.abs(U[skip]).max(axis=0) < 1.0e-8] if np.any(skip) else U
+    R = np.dot(U.T, B_prim)
+    R -= np.dot(np.dot(R, accepted), accepted.T)
+    W, S, _ = np.linalg.svd(R, full_matrices=False)
+    rank = np.linalg.matrix_rank(B_prim[~skip], tol=1.0e-6) if np.any(~skip) else 0
+    nMissing = max(0, rank - (accepted.shape[1] - Nconstrained))
+    for k in range(min(nMissing, len(S))):
+        if S[k] < 1.0e-6:
+            break
+        u = np.dot(U, W[:, k])
+        columns.append(u / np.linalg.norm(u))
+
+    return np.array(columns).T.reshape(Nprim, len(columns))
+
+
+def _extendBasis(basis, v, tol=1.0e-4):
+    """ Adds v to the orthonormal column basis if it has a new component. """
+    norm = np.linalg.norm(v)
+    if norm == 0.0:
+        return basis
+    r = v - np.dot(basis, np.dot(basis.T, v))
+    rnorm = np.linalg.norm(r)
+    if rnorm / norm < tol:
+        return basis
+    return np.column_stack((basis, r / rnorm))
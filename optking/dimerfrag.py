@@ -0,0 +1,292 @@
+import numpy as np
+
+from . import optparams as op
+from . import orient
+from . import v3d
+from .bend import Bend
+from .exceptions import OptError
+from .misc import covalentRadiiFromZ
+from .stre import Stre
+from .tors import Tors
+
+# Interfragment coordinates are defined between up to three reference points on
+# each fragment.  Each reference point is a fixed linear combination of the atoms
+# of its fragment.  The coordinates are ordinary simple coordinates of a "pseudo"
+# geometry of six points, A1, A2, A3, B1, B2, B3:
+#
+#   ndA   ndB
+#  ------------
+#    1     1     R_AB
+#    2     1     + theta_A (not B)
+#    1     2     + theta_B (not A)
+#    2     2     + theta_A + theta_B + tau (1-2-3-4)
+#    3     2     + phi_A
+#    2     3     + phi_A + phi_B
+#  ------------
+_A1, _A2, _A3, _B1, _B2, _B3 = range(6)
+_LABELS = ('R_AB', 'theta_A', 'theta_B', 'tau', 'phi_A', 'phi_B')
+
+
+class DimerFrag(object):
+    """ Interfragment coordinates between two fragments
+
+    Parameters
+    ----------
+    A_idx : int
+        index of fragment A in the molecular system
+    A_weights : ndarray
+        (ndA, natomA) weights of the atoms of A in each of its reference points
+    B_idx : int
+        index of fragment B; B is the fragment moved when the coordinates change
+    B_weights : ndarray
+        (ndB, natomB) weights of the atoms of B in each of its reference points
+    """
+    def __init__(self, A_idx, A_weights, B_idx, B_weights):
+        self._A_idx = A_idx
+        self._B_idx = B_idx
+        self._A_weights = np.asarray(A_weights, float)
+        self._B_weights = np.asarray(B_weights, float)
+
+        ndA, ndB = self.ndA, self.ndB
+        if not 1 <= ndA <= 3 or not 1 <= ndB <= 3:
+            raise OptError("Fragments need 1 to 3 reference points.")
+
+        self._D_on = [True, ndA > 1, ndB > 1, ndA > 1 and ndB > 1,
+                      ndA > 2, ndB > 2]
+        inverse = op.Params.interfrag_dist_inv
+        pseudo = [Stre(_A1, _B1, inverse=inverse),
+                  Bend(_A2, _A1, _B1),
+                  Bend(_A1, _B1, _B2),
+                  Tors(_A2, _A1, _B1, _B2),
+                  Tors(_A3, _A2, _A1, _B1),
+                  Tors(_A1, _B1, _B2, _B3)]
+        self._intcos = [c for c, on in zip(pseudo, self._D_on) if on]
+        self._labels = [('1/R_AB' if inverse and lbl == 'R_AB' else lbl)
+                        for lbl, on in zip(_LABELS, self._D_on) if on]
+
+    def __str__(self):
+        s = "\tInterfragment coordinates between fragments %d and %d\n" % (
+            self._A_idx + 1, self._B_idx + 1)
+        for label, w in (('A', self._A_weights), ('B', self._B_weights)):
+            for i, row in enumerate(w):
+                atoms = ', '.join("%d(%.3f)" % (a + 1, row[a]) for a in np.nonzero(row)[0])
+                s += "\t  %s%d : %s\n" % (label, i + 1, atoms)
+        return s
+
+    @property
+    def A_idx(self):
+        return self._A_idx
+
+    @property
+    def B_idx(self):
+        return self._B_idx
+
+    @property
+    def A_weights(self):
+        return self._A_weights
+
+    @property
+    def B_weights(self):
+        return self._B_weights
+
+    @property
+    def ndA(self):
+        return len(self._A_weights)
+
+    @property
+    def ndB(self):
+        return len(self._B_weights)
+
+    @property
+    def intcos(self):
+        """ The interfragment coordinates, as coordinates of the reference points. """
+        return self._intcos
+
+    @property
+    def labels(self):
+        return self._labels
+
+    def refPoints(self, geomA, geomB):
+        """ (6, 3) pseudo geometry A1, A2, A3, B1, B2, B3; undefined points are zero. """
+        pts = np.zeros((6, 3), float)
+        pts[_A1:_A1 + self.ndA] = np.dot(self._A_weights, geomA)
+        pts[_B1:_B1 + self.ndB] = np.dot(self._B_weights, geomB)
+        return pts
+
+    def q(self, geomA, geomB):
+        pts = self.refPoints(geomA, geomB)
+        return np.array([intco.q(pts) for intco in self._intcos])
+
+    def qShow(self, geomA, geomB):
+        pts = self.refPoints(geomA, geomB)
+        return np.array([intco.qShow(pts) for intco in self._intcos])
+
+    def updateOrientation(self, geomA, geomB):
+        pts = self.refPoints(geomA, geomB)
+        for intco in self._intcos:
+            if isinstance(intco, Tors):
+                intco.updateOrientation(pts)
+
+    def Bmat(self, geomA, geomB):
+        """ Returns the (Nintco, 3 natomA + 3 natomB) B matrix block.
+
+        The derivatives with respect to the reference points are transformed to
+        the atoms with the chain rule, dq/dx_i = sum_p w_pi dq/dr_p.
+        """
+        pts = self.refPoints(geomA, geomB)
+        B_ref = np.zeros((len(self._intcos), 18), float)
+        for i, intco in enumerate(self._intcos):
+            intco.DqDx(pts, B_ref[i])
+        B_ref = B_ref.reshape(-1, 6, 3)
+
+        BA = np.einsum('kpx,pi->kix', B_ref[:, _A1:_A1 + self.ndA], self._A_weights)
+        BB = np.einsum('kpx,pi->kix', B_ref[:, _B1:_B1 + self.ndB], self._B_weights)
+        return np.hstack((BA.reshape(len(self._intcos), -1), BB.reshape(len(self._intcos), -1)))
+
+    def gradientBDerivativeTerm(self, geomA, geomB, g_q):
+        """ K_xy = sum_I g_q[I] d^2(q_I)/(dx dy) over the atoms of A and B. """
+        pts = self.refPoints(geomA, geomB)
+        K_ref = np.zeros((18, 18), float)
+        dq2dx2 = np.zeros((18, 18), float)
+        for I, intco in enumerate(self._intcos):
+            dq2dx2[:] = 0
+            intco.Dq2Dx2(pts, dq2dx2)
+            K_ref += g_q[I] * dq2dx2
+
+        W = np.zeros((6, len(geomA) + len(geomB)), float)
+        W[_A1:_A1 + self.ndA, :len(geomA)] = self._A_weights
+        W[_B1:_B1 + self.ndB, len(geomA):] = self._B_weights
+        K_ref = K_ref.reshape(6, 3, 6, 3)
+        K = np.einsum('pi,pxqy,qj->ixjy', W, K_ref, W)
+        return K.reshape(3 * W.shape[1], 3 * W.shape[1])
+
+    def hessianGuess(self, geomA, geomB, ZA, ZB, guessType="DEFAULT"):
+        """ Diagonal guess force constants for the interfragment coordinates.
+
+        DEFAULT uses small, fixed force constants.  FISCHER_LIKE takes the
+        stretch from the Fischer formula for the closest pair of atoms.
+        """
+        h = np.array([0.007, 0.003, 0.003, 0.001, 0.001, 0.001])[self._D_on]
+        if guessType == "FISCHER_LIKE":
+            D = np.linalg.norm(geomA[:, None, :] - geomB[None, :, :], axis=2)
+            a, b = np.unravel_index(np.argmin(D), D.shape)
+            Rcov = covalentRadiiFromZ(ZA[a]) + covalentRadiiFromZ(ZB[b])
+            h[0] = 0.3601 * np.exp(-1.944 * (D[a, b] - Rcov))
+        if op.Params.interfrag_dist_inv:  # d2E/d(1/R)2 = R^4 d2E/dR2 near a minimum
+            R = v3d.dist(*self.refPoints(geomA, geomB)[[_A1, _B1]])
+            h[0] *= R**4
+        return h
+
+    def _dummyPoints(self, pts):
+        """ Fills in undefined reference points of A with points that keep
+        zmatPoint() well-defined; they stay fixed while B is moved. """
+        pts = pts.copy()
+        if self.ndA < 2:
+            pts[_A2] = pts[_A1] + _perpendicular(pts[_B1] - pts[_A1])
+        if self.ndA < 3:
+            pts[_A3] = pts[_A2] + _perpendicular(pts[_A1] - pts[_A2])
+        return pts
+
+    def orient(self, geomA, geomB, q_target):
+        """ Moves fragment B rigidly so that the coordinates take the values q_target.
+
+        Coordinates that are not defined for these reference points keep their
+        current values, measured from dummy points on A.
+
+        Returns
+        -------
+        float
+            distance of the reference points of B from their targets
+        """
+        pts = self._dummyPoints(self.refPoints(geomA, geomB))
+        values = [v3d.dist(pts[_A1], pts[_B1]),
+                  v3d.angle(pts[_A2], pts[_A1], pts[_B1]),
+                  v3d.angle(pts[_A1], pts[_B1], pts[_B2]) if self.ndB > 1 else 0.0,
+                  v3d.tors(pts[_A2], pts[_A1], pts[_B1], pts[_B2]) if self.ndB > 1 else 0.0,
+                  v3d.tors(pts[_A3], pts[_A2], pts[_A1], pts[_B1]),
+                  v3d.tors(pts[_A1], pts[_B1], pts[_B2], pts[_B3]) if self.ndB > 2 else 0.0]
+
+        cnt = 0
+        for i, on in enumerate(self._D_on):
+            if on:
+                values[i] = q_target[cnt]
+                cnt += 1
+        if op.Params.interfrag_dist_inv:
+            values[0] = 1.0 / values[0]
+
+        return orient.orientFragment(pts[_A1:_A3 + 1], self._B_weights, geomB, *values)
+
+
+def _perpendicular(v):
+    """ A unit vector perpendicular to v. """
+    axis = np.eye(3)[np.argmin(np.abs(v))]
+    perp = v3d.cross(v, axis)
+    v3d.normalize(perp)
+    return perp
+
+
+def referenceWeights(geom, ref_atoms=None, partner=None):
+    """ Chooses (up to three) reference points for a fragment
+
+    Parameters
+    ----------
+    geom : ndarray
+        (natom, 3) geometry of the fragment
+    ref_atoms : list(list(int)), optional
+        user-specified reference points, each the (0-based, fragment) atoms
+        whose average is the point
+    partner : ndarray, optional
+        first reference point of the other fragment of the dimer
+
+    Returns
+    -------
+    ndarray
+        (nref, natom) weights of the atoms in each reference point
+
+    Notes
+    -----
+    By default, the first point is the centroid of the fragment.  The second is
+    the atom farthest from the line joining the centroid to the partner point, so
+    that the interfragment bend stays away from 0 and pi; without a partner it is
+    the atom farthest from the centroid.  The third is the atom farthest from the
+    line through the first two.  Collinear choices are avoided, so linear
+    fragments may get two points and atoms get one.
+    """
+    natom = len(geom)
+    if ref_atoms:
+        W = np.zeros((len(ref_atoms), natom), float)
+        for p, atoms in enumerate(ref_atoms):
+            W[p, atoms] = 1.0 / len(atoms)
+        return W
+
+    W = [np.full(natom, 1.0 / natom)]
+    if natom == 1:
+        return np.array(W)
+
+    center = np.dot(W[0], geom)
+    offsets = geom - center
+    second = None
+    if partner is not None:
+        dist, sin = _offAxis(offsets, partner - center)
+        if np.max(sin) > np.sin(op.Params.interfrag_collinear_tol * np.pi):
+            second = int(np.argmax(dist * (sin > np.sin(op.Params.interfrag_collinear_tol * np.pi))))
+    if second is None:
+        second = int(np.argmax(np.linalg.norm(offsets, axis=1)))
+    W.append(np.eye(natom)[second])
+
+    dist, sin = _offAxis(offsets, offsets[second])
+    third = int(np.argmax(dist))
+    if sin[third] > np.sin(op.Params.interfrag_collinear_tol * np.pi):
+        W.append(np.eye(natom)[third])
+
+    return np.array(W)
+
+
+def _offAxis(offsets, axis):
+    """ Distance of each point from the line through the origin along axis, and
+    the sine of its angle with that line. """
+    axis = v3d.eAB(np.zeros(3), axis)
+    r = np.linalg.norm(offsets, axis=1)
+    dist = np.linalg.norm(offsets - np.outer(np.dot(offsets, axis), axis), axis=1)
+    sin = np.divide(dist, r, out=np.zeros(len(r)), where=r > 1.0e-8)
+    return dist, sin
@@ -14,7 +14,7 @@ from .linearAlgebra import absMax, rms, symmMatInv
 #   Reduce step size as necessary until back-transformation converges.
 
 
-def displace(intcos, geom, dq, fq=None, atom_offset=0, ensure_convergence=False):
+def displace(intcos, geom, dq, fq=None, atom_offset=0, ensure_convergence=False, A=None):
     """ Converts internal coordinate step into the new cartesian geometry
 
     Parameters
@@ -28,6 +28,8 @@ def displace(intcos, geom, dq, fq=None, atom_offset=0, ensure_convergence=False)
         overriden to actual displacements performed
     fq : ndarray
         forces in internal coordinates
+    A : ndarray, optional
+        G^-1 B at the starting geometry, for the first back-transformation step
 
 
     """
@@ -49,7 +51,11 @@ def displace(intcos, geom, dq, fq=None, atom_offset=0, ensure_convergence=False)
     # Do your best to backtransform all internal coordinate displacments.
     logger.info("\tBeginnning displacement in cartesian coordinates...")
 
-    if ensure_convergence:
+    if intcosMisc.isCartesian(intcos, len(geom)):
+        # the step is the cartesian displacement
+        geom += np.reshape(dq, geom.shape)
+
+    elif ensure_convergence:
         conv = False
         cnt = -1
 
@@ -60,7 +66,7 @@ def displace(intcos, geom, dq, fq=None, atom_offset=0, ensure_convergence=False)
                 dq[:] = dq_orig / (2.0 * cnt)
 
             intcosMisc.fixBendAxes(intcos, geom)
-            conv = stepIter(intcos, geom, dq)
+            conv = stepIter(intcos, geom, dq, A=A)
             intcosMisc.unfixBendAxes(intcos)
 
             if not conv:
@@ -94,38 +100,28 @@ def displace(intcos, geom, dq, fq=None, atom_offset=0, ensure_convergence=False)
 
     else:  # try to back-transform, but continue even if desired dq is not achieved
         intcosMisc.fixBendAxes(intcos, geom)
-        stepIter(intcos, geom, dq)
+        stepIter(intcos, geom, dq, A=A)
         intcosMisc.unfixBendAxes(intcos)
 
-    # Fix drift/error in any frozen coordinates
-    if any(intco.frozen for intco in intcos):
-
-        # Set dq for unfrozen intcos to zero.
-        dq_adjust_frozen = q_orig - intcosMisc.qValues(intcos, geom)
-
-        for i, intco in enumerate(intcos):
-            if not intco.frozen:
-                dq_adjust_frozen[i] = 0
-
-        success_of_back_trans = (
-                "\n\tBack-transformation to cartesian coordinates to adjust frozen coordinates: \n")
-
+    # Fix drift/error in any frozen coordinates, and move fixed ones to their targets
+    constrained = intcosMisc.constrainedMask(intcos)
+    if np.any(constrained):
+        q_target = q_orig + intcosMisc.fixedErrors(intcos, geom_orig, limit=op.Params.intrafrag_trust)
         intcosMisc.fixBendAxes(intcos, geom)
-        check = stepIter(
-            intcos,
-            geom,
-            dq_adjust_frozen,
-            bt_dx_conv=1.0e-12,
-            bt_dx_rms_change_conv=1.0e-12,
-            bt_max_iter=100)
+        for i in range(op.Params.bt_max_iter):
+            dq_adjust = intcosMisc.fixedErrors(intcos, geom, q_target)
+            if absMax(dq_adjust) < 1.0e-10:
+                break
+            B = intcosMisc.Bmat(intcos, geom)
+            geom += intcosMisc.constraintDisplacement(B, constrained, dq_adjust).reshape(geom.shape)
         intcosMisc.unfixBendAxes(intcos)
 
-        if check:
-            success_of_back_trans += ("\tsuccessful.\n")
-            logger.info(success_of_back_trans)
+        error = absMax(intcosMisc.fixedErrors(intcos, geom, q_target))
+        if error < 1.0e-10:
+            logger.info("\tFrozen and fixed coordinates are at their targets.")
         else:
-            success_of_back_trans += ("\tunsuccessful, but continuing.\n")
-            logger.warning(success_of_back_trans)
+            logger.warning("\tFrozen and fixed coordinates are within %.1e of their targets;"
+                           " continuing." % error)
 
     # Make sure final Dq is actual change
     q_final = intcosMisc.qValues(intcos, geom)
@@ -170,8 +166,88 @@ def displace(intcos, geom, dq, fq=None, atom_offset=0, ensure_convergence=False)
     logger.info(coordinate_change_report)
 
 
+def displaceMolsys(oMolsys, dq, fq=None, geom=None, ensure_convergence=False):
+    """ Displaces every fragment of the molecular system by its block of dq
+
+    Parameters
+    ----------
+    oMolsys : Molsys
+    dq : ndarray
+        step in internal coordinates of the whole system
+        overriden to actual displacements performed
+    fq : ndarray, optional
+        forces in internal coordinates (used for printing)
+    geom : ndarray, optional
+        (nat, 3) geometry to displace in place; the fragment geometries by default
+    ensure_convergence : bool
+        reduce step size as necessary until back-transformation converges
+    """
+    if oMolsys.dimers:
+        q_orig = oMolsys.qValues(geom)
+
+    # G^-1 B at the starting geometry is usually known already
+    A = oMolsys.fragAmats(geom)
+    for iF, F in enumerate(oMolsys._fragments):
+        intcoSlice = oMolsys.frag_intco_slice(iF)
+        first = oMolsys.frag_1st_atom(iF)
+        fragGeom = F.geom if geom is None else geom[first:first + F.Natom]
+        displace(F.intcos, fragGeom, dq[intcoSlice], None if fq is None else fq[intcoSlice],
+                 atom_offset=first, ensure_convergence=ensure_convergence, A=A[iF])
+
+    if oMolsys.dimers:
+        displaceDimers(oMolsys, dq, q_orig, geom)
+    # the geometry or the torsion orientations may have changed in place
+    oMolsys.clearCache()
+    # remove the symmetry breaking from the back-transformation
+    oMolsys.symmetrizeGeom(geom)
+
+
+def displaceDimers(oMolsys, dq, q_orig, geom=None):
+    """ Moves the fragments rigidly to take the interfragment steps in dq
+
+    The interfragment steps are scaled down together so that none is larger than
+    op.Params.interfrag_trust.  The dimers are ordered so that each fragment B is
+    oriented relative to a fragment A already in its final position.
+
+    Parameters
+    ----------
+    oMolsys : Molsys
+    dq : ndarray
+        step in internal coordinates of the whole system; the interfragment
+        entries are overwritten with the displacements achieved
+    q_orig : ndarray
+        internal coordinate values before the step
+    geom : ndarray, optional
+        (nat, 3) geometry to displace in place; the fragment geometries by default
+    """
+    logger = logging.getLogger(__name__)
+    slices = [oMolsys.dimer_intco_slice(iD) for iD in range(len(oMolsys.dimers))]
+    dq_inter = np.concatenate([dq[s] for s in slices])
+    scale = 1.0
+    if absMax(dq_inter) > op.Params.interfrag_trust:
+        scale = op.Params.interfrag_trust / absMax(dq_inter)
+        logger.info("\tScaling interfragment step by %.3f to interfrag_trust = %.3f"
+                    % (scale, op.Params.interfrag_trust))
+
+    geoms = oMolsys._fragGeoms(geom)
+    report = "\n\t---Interfragment Coordinate Step---\n"
+    report += "\t%12s%14s%14s%14s\n" % ("Coordinate", "Previous", "Change", "New")
+    for D, s in zip(oMolsys.dimers, slices):
+        q_target = q_orig[s] + scale * dq[s]
+        err = D.orient(geoms[D.A_idx], geoms[D.B_idx], q_target)
+        if err > 1.0e-8:
+            logger.warning("\tReference points of fragment %d missed by %.2e" % (D.B_idx + 1, err))
+
+        q_new = D.q(geoms[D.A_idx], geoms[D.B_idx])
+        dq[s] = q_new - q_orig[s]
+        for label, intco, q0, d, q1 in zip(D.labels, D.intcos, q_orig[s], dq[s], q_new):
+            f = intco.qShowFactor
+            report += "\t%12s%14.5f%14.5f%14.5f\n" % (label, q0 * f, d * f, q1 * f)
+    logger.info(report)
+
+
 def stepIter(intcos, geom, dq,
-             bt_dx_conv=None, bt_dx_rms_change_conv=None, bt_max_iter=None):
+             bt_dx_conv=None, bt_dx_rms_change_conv=None, bt_max_iter=None, A=None):
     logger = logging.getLogger(__name__)
     dx_rms_last = -1
     if bt_dx_conv is None:
@@ -201,7 +277,8 @@ def stepIter(intcos, geom, dq,
     while bt_iter_continue:
 
         dq_rms = rms(dq)
-        dx_rms, dx_max = oneStep(intcos, geom, dq, print_lvl > 2)
+        dx_rms, dx_max = oneStep(intcos, geom, dq, print_lvl > 2,
+                                 A if bt_iter_cnt == 0 else None)
 
         # Met convergence thresholds
         if dx_rms < bt_dx_conv and dx_max < bt_dx_conv:
@@ -256,7 +333,7 @@ def stepIter(intcos, geom, dq,
 # B (dx) = B * [Bt (B Bt)^-1 dq]
 #   dx = Bt (B Bt)^-1 dq
 #   dx = Bt G^-1 dq, where G = B B^t.
-def oneStep(intcos, geom, dq, printDetails=False):
+def oneStep(intcos, geom, dq, printDetails=False, A=None):
     """ Convert dq to dx.  Geometry is updated
 
     Parameters
@@ -265,6 +342,8 @@ def oneStep(intcos, geom, dq, printDetails=False):
     geom : ndarray
         cartesian geometry updated to new geometry
     dq : displacement in internal coordinates
+    A : ndarray, optional
+        G^-1 B at geom, if already known
 
     Returns
     -------
@@ -273,13 +352,14 @@ def oneStep(intcos, geom, dq, printDetails=False):
     float :
         absolute maximum of cartesian displacement
     """
-    B = intcosMisc.Bmat(intcos, geom)
-    G = np.dot(B, B.T)
-    Ginv = symmMatInv(G, redundant=True)
-    tmp_v_Nint = np.dot(Ginv, dq)
+    if A is None:
+        B = intcosMisc.Bmat(intcos, geom)
+        G = np.dot(B, B.T)
+        Ginv = symmMatInv(G, redundant=True)
+        A = np.dot(Ginv, B)
     # dx = np.zeros(geom.shape[0] * geom.shape[1], float)  # dx is 1D here
 
-    dx = np.dot(B.T, tmp_v_Nint)
+    dx = np.dot(A.T, dq)
     if printDetails:
         qOld = intcosMisc.qValues(intcos, geom)
     geom += dx.reshape(geom.shape)
@@ -295,5 +375,5 @@ def oneStep(intcos, geom, dq, printDetails=False):
                                  % (i + 1, dq_achieved[i], dq_achieved[i] - dq[i]))
     dx_rms = rms(dx)
     dx_max = absMax(dx)
-    del B, G, Ginv, tmp_v_Nint, dx
+    del A, dx
     return dx_rms, dx_max
@@ -0,0 +1,388 @@
+""" Optimization of an ensemble of conformers that share one set of coordinates.
+
+The K geometries are stacked in (K, nat, 3) arrays, and each operation of an
+RFO minimization step is done for all conformers in one call: the values and B
+matrices of the coordinates, the generalized inverse of G and the projection
+of redundancies, the RFO eigenproblems, the BFGS updates and the iterative
+back-transformation.  Converged conformers are masked out of later steps.
+Stretches, regular bends, torsions and cartesians are evaluated as arrays;
+other coordinates, such as linear bends and out-of-plane angles, are evaluated
+one conformer at a time.
+
+The gradients are computed by a function that takes a (k, nat, 3) stack of
+geometries and returns the (k,) energies and the (k, nat, 3) or (k, 3nat)
+cartesian gradients, so that a backend may batch them as well.
+"""
+import logging
+
+import numpy as np
+
+from . import bend, cart, convCheck, stre, tors
+from . import caseInsensitiveDict
+from . import optparams as op
+from .exceptions import OptError
+
+
+class BatchedIntcos(object):
+    """ The internal coordinates of a molecular system, for a stack of geometries.
+
+    Parameters
+    ----------
+    oMolsys : Molsys
+        molecular system; the atom indices of the coordinates of each fragment
+        are shifted to the numbering of the whole system
+    """
+    def __init__(self, oMolsys):
+        if oMolsys.dimers:
+            raise OptError("Interfragment coordinates are not supported in ensemble optimizations.")
+        self.Natom = oMolsys.Natom
+        self.Nintco = len(oMolsys.intcos)
+        groups = {'stre': ([], []), 'bend': ([], []), 'tors': ([], []), 'cart': ([], [])}
+        self._inverse = []
+        self._other = []
+        row = 0
+        for iF, F in enumerate(oMolsys._fragments):
+            first = oMolsys.frag_1st_atom(iF)
+            for intco in F.intcos:
+                atoms = [first + a for a in intco.atoms]
+                if isinstance(intco, stre.Stre):
+                    group = 'stre'
+                    self._inverse.append(intco.inverse)
+                elif isinstance(intco, bend.Bend) and intco.bendType == 'REGULAR':
+                    group = 'bend'
+                elif isinstance(intco, tors.Tors):
+                    group = 'tors'
+                elif isinstance(intco, cart.Cart):
+                    group, atoms = 'cart', [3 * atoms[0] + intco.xyz]
+                else:
+                    self._other.append((row, oMolsys.frag_atom_range(iF), intco))
+                    row += 1
+                    continue
+                groups[group][0].append(row)
+                groups[group][1].append(atoms)
+                row += 1
+        widths = {'stre': 2, 'bend': 3, 'tors': 4, 'cart': 1}
+        self._groups = dict((name, (np.array(rows, int),
+                                    np.array(atoms, int).reshape(len(rows), widths[name])))
+                            for name, (rows, atoms) in groups.items())
+        self._inverse = np.array(self._inverse, bool)
+        # differences of torsions are taken on the circle
+        self.periodic = np.zeros(self.Nintco, bool)
+        self.periodic[self._groups['tors'][0]] = True
+
+    def difference(self, q1, q0):
+        """ q1 - q0, with torsions in (-pi, pi]. """
+        dq = q1 - q0
+        dq[..., self.periodic] -= 2.0 * np.pi * np.round(dq[..., self.periodic] / (2.0 * np.pi))
+        return dq
+
+    def qAndB(self, X):
+        """ Values and B matrices of the coordinates.
+
+        Parameters
+        ----------
+        X : ndarray
+            (K, nat, 3) geometries
+
+        Returns
+        -------
+        ndarray, ndarray
+            (K, nintco) values and (K, nintco, 3nat) B matrices
+        """
+        K = len(X)
+        q = np.zeros((K, self.Nintco), float)
+        B = np.zeros((K, self.Nintco, self.Natom, 3), float)
+
+        rows, atoms = self._groups['stre']
+        if len(rows):
+            u = X[:, atoms[:, 0]] - X[:, atoms[:, 1]]
+            r = np.linalg.norm(u, axis=2)
+            e = u / r[..., None]
+            inv = self._inverse
+            q[:, rows] = np.where(inv, 1.0 / r, r)
+            e = e * np.where(inv, -1.0 / r ** 2, 1.0)[..., None]
+            self._scatter(B, rows, atoms, [e, -e])
+
+        rows, atoms = self._groups['bend']
+        if len(rows):
+            u = X[:, atoms[:, 0]] - X[:, atoms[:, 1]]
+            v = X[:, atoms[:, 2]] - X[:, atoms[:, 1]]
+            Lu, Lv = np.linalg.norm(u, axis=2)[..., None], np.linalg.norm(v, axis=2)[..., None]
+            u, v = u / Lu, v / Lv
+            cos = np.clip(np.sum(u * v, axis=2), -1.0, 1.0)
+            sin = np.sqrt(np.maximum(1.0 - cos ** 2, 1.0e-20))[..., None]
+            q[:, rows] = np.arccos(cos)
+            da = (cos[..., None] * u - v) / (Lu * sin)
+            dc = (cos[..., None] * v - u) / (Lv * sin)
+            self._scatter(B, rows, atoms, [da, -da - dc, dc])
+
+        rows, atoms = self._groups['tors']
+        if len(rows):
+            b1 = X[:, atoms[:, 1]] - X[:, atoms[:, 0]]
+            b2 = X[:, atoms[:, 2]] - X[:, atoms[:, 1]]
+            b3 = X[:, atoms[:, 3]] - X[:, atoms[:, 2]]
+            n1, n2 = np.cross(b1, b2), np.cross(b2, b3)
+            L2 = np.linalg.norm(b2, axis=2)[..., None]
+            n1n1 = np.maximum(np.sum(n1 * n1, axis=2), 1.0e-20)[..., None]
+            n2n2 = np.maximum(np.sum(n2 * n2, axis=2), 1.0e-20)[..., None]
+            q[:, rows] = np.arctan2(L2[..., 0] * np.sum(b1 * n2, axis=2), np.sum(n1 * n2, axis=2))
+            da = -L2 * n1 / n1n1
+            dd = L2 * n2 / n2n2
+            s1 = -np.sum(b1 * b2, axis=2)[..., None] / L2 ** 2
+            s3 = -np.sum(b3 * b2, axis=2)[..., None] / L2 ** 2
+            db = (s1 - 1.0) * da - s3 * dd
+            dc = (s3 - 1.0) * dd - s1 * da
+            self._scatter(B, rows, atoms, [da, db, dc, dd])
+
+        B = B.reshape(K, self.Nintco, 3 * self.Natom)
+        rows, atoms = self._groups['cart']
+        if len(rows):
+            q[:, rows] = X.reshape(K, -1)[:, atoms[:, 0]]
+            B[:, rows, atoms[:, 0]] = 1.0
+
+        for row, atoms, intco in self._other:
+            cols = slice(3 * atoms.start, 3 * atoms.stop)
+            for k in range(K):
+                q[k, row] = intco.q(X[k, atoms.start:atoms.stop])
+                intco.DqDx(X[k, atoms.start:atoms.stop], B[k, row, cols])
+        return q, B
+
+    @staticmethod
+    def _scatter(B, rows, atoms, derivatives):
+        for a, d in enumerate(derivatives):
+            np.add.at(B, (slice(None), rows, atoms[:, a]), d)
+
+
+def _generalizedInverses(B):
+    """ G^-1 and the projector G G^-1 for a stack of B matrices; eigenvalues of G
+    below 1.0e-10 are redundant, as in symmMatInv(). """
+    G = B @ B.transpose(0, 2, 1)
+    w, V = np.linalg.eigh(G)
+    keep = w > 1.0e-10
+    w_inv = np.where(keep, 1.0 / np.where(keep, w, 1.0), 0.0)
+    G_inv = (V * w_inv[:, None, :]) @ V.transpose(0, 2, 1)
+    P = (V * keep[:, None, :]) @ V.transpose(0, 2, 1)
+    return G_inv, P
+
+
+def _rfoSteps(H, fq, trust):
+    """ RFO steps for a stack of Hessians and forces, scaled to the trust radii.
+    The lowest root of each augmented Hessian is taken whose intermediate
+    normalization is below op.Params.rfo_normalization_max; without one, the
+    step is along the forces.
+
+    Returns
+    -------
+    ndarray, ndarray
+        (K, nintco) steps and (K,) projected energy changes
+    """
+    K, n = fq.shape
+    A = np.zeros((K, n + 1, n + 1), float)
+    A[:, :n, :n] = H
+    A[:, :n, n] = A[:, n, :n] = -fq
+    evals, evects = np.linalg.eigh(A)
+    last = evects[:, n, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scaled = np.max(np.abs(evects / last[:, None, :]), axis=1)
+    ok = (np.abs(last) > 1.0e-10) & (scaled < op.Params.rfo_normalization_max)
+    root = np.argmax(ok, axis=1)
+    v = evects[np.arange(K), :, root]
+    dq = np.where(ok[np.arange(K), root][:, None], v[:, :n] / v[:, n:], fq)
+
+    norm = np.linalg.norm(dq, axis=1)
+    dq *= np.minimum(1.0, trust / np.maximum(norm, 1.0e-14))[:, None]
+    norm = np.linalg.norm(dq, axis=1)
+
+    # projected energy change along the step, as DE_projected('RFO', ...)
+    u = dq / np.maximum(norm, 1.0e-14)[:, None]
+    g = -np.sum(fq * u, axis=1)
+    h = np.sum(u * np.einsum('kij,kj->ki', H, u), axis=1)
+    DE = (norm * g + 0.5 * norm ** 2 * h) / (1.0 + norm ** 2)
+    return dq, DE
+
+
+def _bfgsUpdate(H, dq, dg):
+    """ BFGS update of a stack of Hessians, skipping members with small
+    denominators or large steps, with the changes limited as in
+    History.hessianUpdate().
+
+    Returns
+    -------
+    ndarray
+        updated Hessians
+    """
+    H = H.copy()
+    gq = np.sum(dq * dg, axis=1)
+    qq = np.sum(dq * dq, axis=1)
+    use = (np.abs(gq) >= op.Params.hess_update_den_tol) & (qq >= op.Params.hess_update_den_tol)
+    use &= np.max(np.abs(dq), axis=1, initial=0.0) <= op.Params.hess_update_dq_tol
+    if not np.any(use):
+        return H
+    H_use, dq, dg, gq = H[use], dq[use], dg[use], gq[use]
+    Hdq = np.einsum('kij,kj->ki', H_use, dq)
+    dqHdq = np.sum(dq * Hdq, axis=1)
+    dH = (np.einsum('ki,kj->kij', dg, dg) / gq[:, None, None]
+          - np.einsum('ki,kj->kij', Hdq, Hdq) / dqHdq[:, None, None])
+    if op.Params.hess_update_limit:
+        limit = np.maximum(np.abs(op.Params.hess_update_limit_scale * H_use),
+                           op.Params.hess_update_limit_max)
+        dH = np.clip(dH, -limit, limit)
+    H[use] = H_use + dH
+    return H
+
+
+def optimizeEnsemble(oMolsys, geoms, gradients, options_in=None):
+    """ Minimizes a stack of conformers with the coordinates of oMolsys.
+
+    Parameters
+    ----------
+    oMolsys : Molsys
+        molecular system; its coordinates are generated from its own
+        connectivity if it has none.  Its geometry is not changed.
+    geoms : ndarray
+        (K, nat, 3) starting geometries, with the atoms in the order of oMolsys
+    gradients : function
+        gradients(X) of a (k, nat, 3) stack of geometries returns the (k,)
+        energies and the cartesian gradients
+    options_in : dict, optional
+        optking options; only minimizations with RFO steps and BFGS updates,
+        without constraints, are done
+
+    Returns
+    -------
+    ndarray, ndarray, ndarray
+        (K, nat, 3) final geometries, (K,) energies and (K,) booleans for
+        convergence
+    """
+    logger = logging.getLogger(__name__)
+    saved_params = getattr(op, 'Params', None)
+    if options_in is not None:
+        op.Params = op.OptParams(caseInsensitiveDict.CaseInsensitiveDict(options_in))
+    try:
+        if op.Params.opt_type != 'MIN':
+            raise OptError("Ensemble optimizations are minimizations.")
+        x_saved = oMolsys.geom
+        if not oMolsys.intcos:
+            oMolsys.addIntcosFromConnectivity()
+        if any(intco.frozen or intco.fixed for intco in oMolsys.intcos):
+            raise OptError("Constraints are not supported in ensemble optimizations.")
+        coordinates = BatchedIntcos(oMolsys)
+
+        X = np.array(geoms, float).reshape(-1, oMolsys.Natom, 3)
+        K = len(X)
+        H = np.zeros((K, coordinates.Nintco, coordinates.Nintco), float)
+        for k in range(K):
+            oMolsys.geom = X[k]
+            H[k] = oMolsys.hessianGuess(op.Params.intrafrag_hess)
+        oMolsys.geom = x_saved
+
+        E = np.zeros(K, float)
+        E_last = np.zeros(K, float)
+        DE_projected = np.full(K, np.nan)
+        q_last, fq_last = None, None
+        trust = np.full(K, op.Params.intrafrag_trust)
+        converged = np.zeros(K, bool)
+        for stepNumber in range(op.Params.geom_maxiter):
+            active = np.flatnonzero(~converged)
+            if not len(active):
+                break
+            logger.info("\tEnsemble step %d: %d of %d conformers active."
+                        % (stepNumber + 1, len(active), K))
+            E_a, g = gradients(X[active])
+            E[active] = E_a
+            g = np.reshape(g, (len(active), -1))
+
+            q, B = coordinates.qAndB(X[active])
+            G_inv, P = _generalizedInverses(B)
+            fq = -np.einsum('kij,kj->ki', G_inv, np.einsum('kix,kx->ki', B, g))
+
+            if stepNumber > 0:
+                # trust radii from the ratio of actual to projected energy changes
+                DE = E[active] - E_last[active]
+                ratio = DE / DE_projected[active]
+                bad = DE > 0.0
+                down = bad | ((DE_projected[active] < 0.0) & (ratio < 0.25))
+                up = ~bad & (DE_projected[active] < 0.0) & (ratio > 0.75)
+                trust[active] = np.where(down, np.maximum(trust[active] / 4.0,
+                                                          op.Params.intrafrag_trust_min),
+                                         np.where(up, np.minimum(trust[active] * 3.0,
+                                                                 op.Params.intrafrag_trust_max),
+                                                  trust[active]))
+                if op.Params.hess_update != 'NONE':
+                    H[active] = _bfgsUpdate(H[active], coordinates.difference(q, q_last[active]),
+                                            fq_last[active] - fq)
+
+            # project redundancies out of the forces and Hessians
+            fq_p = np.einsum('kij,kj->ki', P, fq)
+            H_a = P @ H[active] @ P
+            H[active] = H_a
+            dq, DE_projected[active] = _rfoSteps(H_a, fq_p, trust[active])
+
+            for i, k in enumerate(active):
+                converged[k] = convCheck.test_for_convergence(
+                    E[k] - E_last[k], np.max(np.abs(fq_p[i])), np.sqrt(np.mean(fq_p[i] ** 2)),
+                    np.max(np.abs(dq[i])), np.sqrt(np.mean(dq[i] ** 2)))
+            E_last[active] = E[active]
+            if q_last is None:
+                q_last = np.zeros((K, coordinates.Nintco), float)
+                fq_last = np.zeros((K, coordinates.Nintco), float)
+            q_last[active], fq_last[active] = q, fq
+
+            moving = active[~converged[active]]
+            X[moving] = backTransform(coordinates, X[moving], dq[~converged[active]])
+
+        if not np.all(converged):
+            logger.warning("\t%d of %d conformers did not converge in %d steps."
+                           % (np.count_nonzero(~converged), K, op.Params.geom_maxiter))
+        return X, E, converged
+    finally:
+        if options_in is not None:
+            op.Params = saved_params
+
+
+def backTransform(coordinates, X, dq):
+    """ Displaces a stack of geometries by the internal coordinate steps dq,
+    iterating x += B^T G^-1 (q_target - q(x)) for all members at once.  Members
+    that do not converge within op.Params.bt_max_iter iterations take the
+    geometry of the first iteration.
+
+    Parameters
+    ----------
+    coordinates : BatchedIntcos
+    X : ndarray
+        (K, nat, 3) geometries
+    dq : ndarray
+        (K, nintco) steps
+
+    Returns
+    -------
+    ndarray
+        (K, nat, 3) displaced geometries
+    """
+    logger = logging.getLogger(__name__)
+    X = X.copy()
+    K = len(X)
+    q, B = coordinates.qAndB(X)
+    q_target = q + dq
+    X_first = None
+    active = np.ones(K, bool)
+    for i in range(op.Params.bt_max_iter):
+        idx = np.flatnonzero(active)
+        if not len(idx):
+            break
+        if i > 0:
+            q, B = coordinates.qAndB(X[idx])
+        error = coordinates.difference(q_target[idx], q)
+        G_inv, _ = _generalizedInverses(B)
+        dx = np.einsum('kix,ki->kx', B, np.einsum('kij,kj->ki', G_inv, error))
+        X[idx] += dx.reshape(len(idx), -1, 3)
+        if X_first is None:
+            X_first = X.copy()
+        done = (np.sqrt(np.mean(dx ** 2, axis=1)) < op.Params.bt_dx_conv) & \
+               (np.max(np.abs(dx), axis=1) < op.Params.bt_dx_conv)
+        active[idx[done]] = False
+    if np.any(active):
+        logger.warning("\tBack-transformation did not converge for %d conformers; using the"
+                       " first iteration." % np.count_nonzero(active))
+        X[active] = X_first[active]
+    return X
@@ -1,9 +1,10 @@
 import logging
 
 # import numpy as np
-import qcelemental as qcel
 
+from .lazyModule import qcel
 from . import addIntcos
+from . import delocalized
 from .printTools import printArrayString, printMatString
 
 class Frag:
@@ -121,6 +122,13 @@ class Frag:
     def addCartesianIntcos(self):
         addIntcos.addCartesianIntcos(self._intcos, self._geom)
 
+    def formCombinationIntcos(self, natural=False):
+        self._intcos[:] = delocalized.formCombinations(self._intcos, self._geom, natural)
+
+    def primitiveIntcos(self):
+        """ The primitive coordinates underlying the current coordinate set. """
+        return delocalized.primitiveIntcos(self._intcos)
+
 #    def printGeom(self):
 #        for i in range(self._geom.shape[0]):
 #            print_opt("\t%5s%15.10f%15.10f%15.10f\n" % \
@@ -1,8 +1,12 @@
 import logging
 
 import numpy as np
-import qcelemental as qcel
 
+from .lazyModule import qcel
+from . import bend, cart, delocalized, stre, tors
+from .addIntcos import connectivityFromDistances
+from .intcosMisc import convertHessianToInternals
+from .misc import HguessLindhRho, covalentRadiiFromZ, periodsFromZ
 from .printTools import printMatString
 # from bend import *
 
@@ -19,7 +23,7 @@ def show(H, intcos):
 
 
 def guess(intcos, geom, Z, connectivity=None, guessType="SIMPLE"):
-    """ Generates diagonal empirical Hessian in a.u.
+    """ Generates empirical Hessian in a.u.
 
     Parameters
     ----------
@@ -29,17 +33,349 @@ def guess(intcos, geom, Z, connectivity=None, guessType="SIMPLE"):
     connectivity : ndarray, optional
         connectivity matrix
     guessType: str, optional
-        the default is SIMPLE. other options: FISCHER, LINDH_SIMPLE, SCHLEGEL
+        the default is SIMPLE. other options: FISCHER, LINDH_SIMPLE, SCHLEGEL, LINDH
 
     Notes
     -----
-    such as
+    All types but LINDH are diagonal, such as
       Schlegel, Theor. Chim. Acta, 66, 333 (1984) and
       Fischer and Almlof, J. Phys. Chem., 96, 9770 (1992).
+    Coordinates of the same type are evaluated together; types without a
+    vectorized formula fall back to their own diagonalHessianGuess().
+    For delocalized or natural coordinates the guess is formed for the
+    primitives and transformed to their combinations.
+    LINDH is the full model Hessian of
+      Lindh et al., Chem. Phys. Lett. 241, 423 (1995)
+    built in Cartesians and transformed to the internal coordinates.
     """
+    if guessType == "LINDH":
+        return lindhGuess(intcos, geom, Z)
+
+    if delocalized.combinationSets(intcos):
+        # Guess for the primitives, then transform to the combinations.
+        primitives, T = delocalized.expand(intcos)
+        H_prim = guess(primitives, geom, Z, connectivity, guessType)
+        return np.dot(T, np.dot(H_prim, T.T))
+
+    geom = np.asarray(geom)
+    Z = np.asarray(Z, dtype=int)
+
+    groups = {}
+    for i, intco in enumerate(intcos):
+        groups.setdefault(type(intco), []).append(i)
+
+    diag_hess = np.zeros(len(intcos))
+    for coordType, index in groups.items():
+        atoms = np.array([intcos[i].atoms for i in index], dtype=int)
+        if coordType is stre.Stre:
+            diag_hess[index] = _streGuess(atoms, geom, Z, guessType)
+        elif coordType is bend.Bend:
+            diag_hess[index] = _bendGuess(atoms, geom, Z, guessType)
+        elif coordType is tors.Tors:
+            if guessType == "FISCHER" and connectivity is None:
+                connectivity = connectivityFromDistances(geom, Z)
+            diag_hess[index] = _torsGuess(atoms, geom, Z, connectivity, guessType)
+        elif coordType is cart.Cart:
+            diag_hess[index] = 0.1
+        else:
+            diag_hess[index] = [intcos[i].diagonalHessianGuess(geom, Z, connectivity, guessType)
+                                for i in index]
 
-    diag_hess = np.asarray([intco.diagonalHessianGuess(geom, Z, connectivity, guessType)
-                            for intco in intcos])
     H = np.diagflat(diag_hess)
 
     return H
+
+
+def _distances(geom, atoms, i, j):
+    return np.linalg.norm(geom[atoms[:, i]] - geom[atoms[:, j]], axis=1)
+
+
+def _streGuess(atoms, geom, Z, guessType):
+    logger = logging.getLogger(__name__)
+    A, B = atoms[:, 0], atoms[:, 1]
+
+    if guessType == "SIMPLE":
+        return 0.5
+
+    elif guessType == "SCHLEGEL":
+        R = _distances(geom, atoms, 0, 1)
+        BB_table = np.array([[-0.244, 0.352, 0.660],
+                             [0.352, 1.085, 1.522],
+                             [0.660, 1.522, 2.068]])
+        PerA = np.minimum(periodsFromZ(Z[A]), 3) - 1
+        PerB = np.minimum(periodsFromZ(Z[B]), 3) - 1
+        AA = 1.734
+        BB = BB_table[PerA, PerB]
+        return AA / ((R - BB) * (R - BB) * (R - BB))
+
+    elif guessType == "FISCHER":
+        Rcov = covalentRadiiFromZ(Z[A]) + covalentRadiiFromZ(Z[B])
+        R = _distances(geom, atoms, 0, 1)
+        AA = 0.3601
+        BB = 1.944
+        return AA * (np.exp(-BB * (R - Rcov)))
+
+    elif guessType == "LINDH_SIMPLE":
+        R = _distances(geom, atoms, 0, 1)
+        k_r = 0.45
+        return k_r * HguessLindhRho(Z[A], Z[B], R)
+
+    else:
+        logger.warning("Hessian guess encountered unknown coordinate type.\n")
+        return 1.0
+
+
+def _bendGuess(atoms, geom, Z, guessType):
+    A, B, C = atoms[:, 0], atoms[:, 1], atoms[:, 2]
+
+    if guessType == "SIMPLE":
+        return 0.2
+
+    elif guessType == "SCHLEGEL":
+        return np.where((Z[A] == 1) | (Z[C] == 1), 0.160, 0.250)
+
+    elif guessType == "FISCHER":
+        a = 0.089
+        b = 0.11
+        c = 0.44
+        d = -0.42
+        Rcov_AB = covalentRadiiFromZ(Z[A]) + covalentRadiiFromZ(Z[B])
+        Rcov_BC = covalentRadiiFromZ(Z[C]) + covalentRadiiFromZ(Z[B])
+        R_AB = _distances(geom, atoms, 0, 1)
+        R_BC = _distances(geom, atoms, 1, 2)
+        return a + b / (np.power(Rcov_AB * Rcov_BC, d)) * np.exp(
+            -c * (R_AB + R_BC - Rcov_AB - Rcov_BC))
+
+    elif guessType == "LINDH_SIMPLE":
+        R_AB = _distances(geom, atoms, 0, 1)
+        R_BC = _distances(geom, atoms, 1, 2)
+        k_phi = 0.15
+        return k_phi * HguessLindhRho(Z[A], Z[B], R_AB) * HguessLindhRho(Z[B], Z[C], R_BC)
+
+    else:
+        return 1.0
+
+
+def _torsGuess(atoms, geom, Z, connectivity, guessType):
+    logger = logging.getLogger(__name__)
+    A, B, C, D = atoms[:, 0], atoms[:, 1], atoms[:, 2], atoms[:, 3]
+
+    if guessType == "SIMPLE":
+        return 0.1
+
+    elif guessType == "SCHLEGEL":
+        R_BC = _distances(geom, atoms, 1, 2)
+        Rcov = covalentRadiiFromZ(Z[B]) + covalentRadiiFromZ(Z[C])
+        a = 0.0023
+        b = np.where(R_BC > (Rcov + a / 0.07), 0.0, 0.07)
+        return a - (b * (R_BC - Rcov))
+
+    elif guessType == "FISCHER":
+        R = _distances(geom, atoms, 1, 2)
+        Rcov = covalentRadiiFromZ(Z[B]) + covalentRadiiFromZ(Z[C])
+        a = 0.0015
+        b = 14.0
+        c = 2.85
+        d = 0.57
+        e = 4.00
+
+        # Connectivity of central 2 torsional atoms - 2 = L
+        nbonds = np.asarray(connectivity).sum(axis=1)
+        L = nbonds[B] + nbonds[C] - 2
+        return a + b * (np.power(L, d)) / (np.power(R * Rcov, e)) * (
+            np.exp(-c * (R - Rcov)))
+
+    elif guessType == "LINDH_SIMPLE":
+        R_AB = _distances(geom, atoms, 0, 1)
+        R_BC = _distances(geom, atoms, 1, 2)
+        R_CD = _distances(geom, atoms, 2, 3)
+        k_tau = 0.005
+        return k_tau * HguessLindhRho(Z[A], Z[B], R_AB) * HguessLindhRho(Z[B], Z[C], R_BC) \
+            * HguessLindhRho(Z[C], Z[D], R_CD)
+
+    else:
+        logger.warning("""Hessian guess encountered unknown coordinate type.\n
+            As default, identity matrix is used""")
+        return 1.0
+
+
+def lindhGuess(intcos, geom, Z):
+    """ Lindh model Hessian expressed in the internal coordinates.
+
+    Parameters
+    ----------
+    intcos : list of Stre, Bend, Tors, etc.
+    geom : ndarray
+        cartesian geometry
+    Z : list or ndarray
+        atomic numbers
+
+    Returns
+    -------
+    ndarray
+        (Nintco, Nintco) Hessian
+    """
+    H_cart = lindhCartesianHessian(geom, Z)
+
+    # The model has no curvature for overall translation and rotation.  Give these
+    # the force constant of the simple cartesian guess so that steps in cartesian
+    # coordinates remain bounded; internal coordinates are unaffected.
+    rigid = rigidBodyVectors(geom)
+    H_cart += 0.1 * np.dot(rigid, rigid.T)
+
+    return convertHessianToInternals(H_cart, intcos, geom)
+
+
+def rigidBodyVectors(geom):
+    """ Orthonormal (3 Natom, <=6) basis of overall translations and rotations. """
+    geom = np.asarray(geom, dtype=float)
+    Natom = len(geom)
+    com = geom - geom.mean(axis=0)
+    vectors = [np.tile(axis, Natom) for axis in np.eye(3)]
+    vectors += [np.cross(axis, com).ravel() for axis in np.eye(3)]
+    u, s, _ = np.linalg.svd(np.array(vectors).T, full_matrices=False)
+    return u[:, s > 1.0e-6 * s[0]]
+
+
+def lindhCartesianHessian(geom, Z, rho_cutoff=1.0e-4):
+    """ Builds the model Hessian of Lindh et al., Chem. Phys. Lett. 241, 423 (1995).
+
+    The Hessian is a sum of k * b b^T over all atom pairs, triples and
+    quadruples, where b is the Cartesian gradient of the corresponding
+    distance, angle or dihedral, and k is k_r*rho_ij, k_phi*rho_ij*rho_jk
+    or k_tau*rho_ij*rho_jk*rho_kl.  Every pair is included; triples and
+    quadruples are formed only from pairs with rho_ij above rho_cutoff.
+
+    Parameters
+    ----------
+    geom : ndarray
+        (Natom, 3) cartesian geometry
+    Z : list or ndarray
+        atomic numbers
+    rho_cutoff : float, optional
+        screening threshold on rho_ij for angle and dihedral terms
+
+    Returns
+    -------
+    ndarray
+        (3 Natom, 3 Natom) Cartesian Hessian in a.u.
+    """
+    k_r = 0.45
+    k_phi = 0.15
+    k_tau = 0.005
+
+    geom = np.asarray(geom, dtype=float)
+    Z = np.asarray(Z, dtype=int)
+    Natom = len(geom)
+    H = np.zeros((Natom, Natom, 3, 3))
+    if Natom < 2:
+        return H.reshape(3 * Natom, 3 * Natom)
+
+    R = np.linalg.norm(geom[:, None, :] - geom[None, :, :], axis=2)
+    rho = HguessLindhRho(Z[:, None], Z[None, :], R)
+    np.fill_diagonal(rho, 0.0)
+
+    # stretches over all pairs
+    I, J = np.triu_indices(Natom, 1)
+    atoms = np.column_stack((I, J))
+    _addTerms(H, atoms, _streDerivatives(geom, atoms), k_r * rho[I, J])
+
+    # neighbors through pairs which survive the screening
+    neighbors = [np.flatnonzero(rho[i] > rho_cutoff) for i in range(Natom)]
+
+    # bends i-j-k with j central
+    bends = []
+    for j in range(Natom):
+        nb = neighbors[j]
+        if len(nb) < 2:
+            continue
+        a, c = np.triu_indices(len(nb), 1)
+        bends.append(np.column_stack((nb[a], np.full(len(a), j), nb[c])))
+    if bends:
+        atoms = np.concatenate(bends)
+        dqdx, ok = _bendDerivatives(geom, atoms)
+        k = k_phi * rho[atoms[:, 0], atoms[:, 1]] * rho[atoms[:, 1], atoms[:, 2]]
+        _addTerms(H, atoms[ok], dqdx[ok], k[ok])
+
+    # dihedrals i-j-k-l about each screened j-k pair
+    torsions = []
+    for j in range(Natom):
+        for k in neighbors[j]:
+            if k <= j:
+                continue
+            nb_j = neighbors[j][neighbors[j] != k]
+            nb_k = neighbors[k][neighbors[k] != j]
+            if len(nb_j) == 0 or len(nb_k) == 0:
+                continue
+            i, l = np.meshgrid(nb_j, nb_k, indexing='ij')
+            i, l = i.ravel(), l.ravel()
+            keep = i != l
+            n = np.count_nonzero(keep)
+            torsions.append(np.column_stack((i[keep], np.full(n, j), np.full(n, k), l[keep])))
+    if torsions:
+        atoms = np.concatenate(torsions)
+        dqdx, ok = _torsDerivatives(geom, atoms)
+        k = k_tau * rho[atoms[:, 0], atoms[:, 1]] * rho[atoms[:, 1], atoms[:, 2]] \
+            * rho[atoms[:, 2], atoms[:, 3]]
+        _addTerms(H, atoms[ok], dqdx[ok], k[ok])
+
+    return H.transpose(0, 2, 1, 3).reshape(3 * Natom, 3 * Natom)
+
+
+def _addTerms(H, atoms, dqdx, k):
+    """ Accumulate k * b b^T into the (Natom, Natom, 3, 3) array H. """
+    nAtomsPerTerm = atoms.shape[1]
+    for a in range(nAtomsPerTerm):
+        kb = k[:, None] * dqdx[:, a, :]
+        for b in range(nAtomsPerTerm):
+            np.add.at(H, (atoms[:, a], atoms[:, b]), kb[:, :, None] * dqdx[:, b, None, :])
+
+
+def _streDerivatives(geom, atoms):
+    u = geom[atoms[:, 1]] - geom[atoms[:, 0]]
+    u /= np.linalg.norm(u, axis=1)[:, None]
+    return np.stack((-u, u), axis=1)
+
+
+def _bendDerivatives(geom, atoms, sin_tol=1.0e-3):
+    """ Wilson B vectors of the angles A-B-C; near-linear angles are flagged. """
+    u = geom[atoms[:, 0]] - geom[atoms[:, 1]]
+    v = geom[atoms[:, 2]] - geom[atoms[:, 1]]
+    Lu = np.linalg.norm(u, axis=1)
+    Lv = np.linalg.norm(v, axis=1)
+    eu = u / Lu[:, None]
+    ev = v / Lv[:, None]
+    cos = np.clip(np.einsum('ij,ij->i', eu, ev), -1.0, 1.0)
+    sin = np.sqrt(1.0 - cos * cos)
+    ok = sin > sin_tol
+    sin = np.where(ok, sin, 1.0)
+
+    dA = (cos[:, None] * eu - ev) / (Lu * sin)[:, None]
+    dC = (cos[:, None] * ev - eu) / (Lv * sin)[:, None]
+    return np.stack((dA, -dA - dC, dC), axis=1), ok
+
+
+def _torsDerivatives(geom, atoms, cross_tol=1.0e-6):
+    """ Derivatives of the dihedral angles A-B-C-D (Blondel and Karplus, J. Comp.
+    Chem. 17, 1132 (1996)); dihedrals with a collinear triple are flagged. """
+    F = geom[atoms[:, 0]] - geom[atoms[:, 1]]
+    G = geom[atoms[:, 1]] - geom[atoms[:, 2]]
+    Hv = geom[atoms[:, 3]] - geom[atoms[:, 2]]
+    A = np.cross(F, G)
+    B = np.cross(Hv, G)
+    A2 = np.einsum('ij,ij->i', A, A)
+    B2 = np.einsum('ij,ij->i', B, B)
+    LG = np.linalg.norm(G, axis=1)
+    ok = (A2 > cross_tol * LG) & (B2 > cross_tol * LG)
+    A2 = np.where(ok, A2, 1.0)
+    B2 = np.where(ok, B2, 1.0)
+
+    FG = np.einsum('ij,ij->i', F, G)
+    HG = np.einsum('ij,ij->i', Hv, G)
+    dA = -(LG / A2)[:, None] * A
+    dD = (LG / B2)[:, None] * B
+    cA = (FG / (A2 * LG))[:, None] * A
+    cB = (HG / (B2 * LG))[:, None] * B
+    dB = -dA + cA - cB
+    dC = -dD - cA + cB
+    return np.stack((dA, dB, dC, dD), axis=1), ok
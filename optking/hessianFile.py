@@ -0,0 +1,70 @@
+""" Reading and writing of cartesian Hessians.
+
+Two formats are supported, chosen by the extension of the file name:
+
+.npy
+    numpy binary; read memory-mapped, so that only the rows needed by the
+    transformation to internal coordinates are paged in.
+other
+    text, as written by psi4 for a frequency job: a line with the number of
+    atoms and 6 * natom, then the (3nat, 3nat) elements in row order, three per
+    line.
+"""
+import logging
+
+import numpy as np
+
+from .exceptions import OptError
+
+
+def isBinary(filename):
+    return str(filename).lower().endswith('.npy')
+
+
+def readCartesianHessian(filename, Natom):
+    """ Reads a cartesian Hessian.
+
+    Parameters
+    ----------
+    filename : str
+    Natom : int
+        number of atoms of the molecular system, to check the file against
+
+    Returns
+    -------
+    ndarray
+        (3nat, 3nat) Hessian; a read-only memory map for a binary file
+    """
+    logger = logging.getLogger(__name__)
+    logger.info("\tReading cartesian Hessian from %s.\n" % filename)
+    try:
+        if isBinary(filename):
+            H = np.load(filename, mmap_mode='r')
+        else:
+            with open(filename, 'r') as f:
+                header = f.readline().split()
+                H = np.array(f.read().split(), float)
+            if not header or int(header[0]) != Natom:
+                raise OptError("Hessian file %s is not for %d atoms." % (filename, Natom))
+            H = H.reshape(3 * Natom, -1)
+    except (IOError, ValueError) as error:
+        raise OptError("Cannot read a cartesian Hessian from %s: %s" % (filename, error))
+
+    if H.shape != (3 * Natom, 3 * Natom):
+        raise OptError("Hessian in %s has shape %s, expected %s."
+                       % (filename, H.shape, (3 * Natom, 3 * Natom)))
+    return H
+
+
+def writeCartesianHessian(filename, H):
+    """ Writes a (3nat, 3nat) cartesian Hessian in the format of the file name. """
+    logger = logging.getLogger(__name__)
+    logger.info("\tWriting cartesian Hessian to %s.\n" % filename)
+    H = np.asarray(H, float)
+    if isBinary(filename):
+        np.save(filename, H)
+        return
+    Natom = len(H) // 3
+    with open(filename, 'w') as f:
+        f.write("%5d%5d\n" % (Natom, 6 * Natom))
+        np.savetxt(f, H.reshape(-1, 3), fmt='%20.10f', delimiter='')
@@ -0,0 +1,173 @@
+""" An on-disk library of converged internal coordinate Hessians, to warm-start
+related optimizations.
+
+Each simple internal coordinate is identified by a key of its type and of the
+index and atomic number of its atoms, e.g. 'R(1:8,2:1)'.  An entry of the
+library holds the final Hessian of an optimization over the keys of its
+coordinates, in a file named by a fingerprint of the optimization type and the
+sorted keys, so that the bonding topology and coordinate set of an identical
+system find it directly.  Otherwise, the entry of the same optimization type
+sharing the largest fraction of coordinates is used.
+
+A new optimization takes the stored force constants between the coordinates
+it shares with the entry, and keeps the model guess for all other
+coordinates.  Entries are files of op.Params.hessian_library; the least
+recently used are evicted beyond op.Params.hessian_library_max_entries
+entries or op.Params.hessian_library_max_size megabytes.  Files are replaced
+atomically, so that concurrent optimizations may share a library.
+"""
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from . import optparams as op
+from .delocalized import Combination
+from .intcosMisc import constrainedMask
+from .simple import Simple
+
+
+def coordinateKeys(oMolsys):
+    """ A key for each internal coordinate of oMolsys; None for coordinates that
+    are not simple, such as delocalized combinations and interfragment coordinates.
+
+    Returns
+    -------
+    list
+    """
+    Z = oMolsys.Z
+    keys = []
+    for iF, F in enumerate(oMolsys._fragments):
+        first = oMolsys.frag_1st_atom(iF)
+        for intco in F.intcos:
+            if not isinstance(intco, Simple) or isinstance(intco, Combination):
+                keys.append(None)
+                continue
+            label = str(intco).lstrip('* ').split('(')[0]
+            atoms = ','.join('%d:%d' % (first + a + 1, Z[first + a]) for a in intco.atoms)
+            keys.append('%s(%s)' % (label, atoms))
+    keys += [None] * sum(len(D.intcos) for D in oMolsys.dimers)
+    return keys
+
+
+def fingerprint(keys):
+    """ Name of the library entry for a set of coordinate keys. """
+    text = '\n'.join([op.Params.opt_type] + sorted(k for k in keys if k is not None))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _entries():
+    return glob.glob(os.path.join(op.Params.hessian_library, '*.npz'))
+
+
+def _entryPath(keys):
+    return os.path.join(op.Params.hessian_library, fingerprint(keys) + '.npz')
+
+
+def _bestEntry(keys):
+    """ Path and keys of the library entry sharing the largest fraction of keys,
+    if at least op.Params.hessian_library_min_overlap; else (None, None). """
+    wanted = set(k for k in keys if k is not None)
+    if not wanted:
+        return None, None
+    best, best_keys, best_overlap = None, None, op.Params.hessian_library_min_overlap
+    path = _entryPath(keys)
+    candidates = [path] if os.path.exists(path) else _entries()
+    for candidate in candidates:
+        try:
+            with np.load(candidate) as entry:
+                if str(entry['opt_type']) != op.Params.opt_type:
+                    continue
+                entry_keys = [str(k) for k in entry['keys']]
+        except (IOError, OSError, ValueError, KeyError):
+            continue  # removed or being replaced by another optimization
+        overlap = len(wanted.intersection(entry_keys)) / float(len(wanted))
+        if overlap >= best_overlap:
+            best, best_keys, best_overlap = candidate, entry_keys, overlap
+    return best, best_keys
+
+
+def warmStart(oMolsys, H):
+    """ Replaces the force constants of H between coordinates found in the
+    library by the stored ones.
+
+    Parameters
+    ----------
+    oMolsys : Molsys
+    H : ndarray
+        internal coordinate Hessian, usually the model guess; modified in place
+
+    Returns
+    -------
+    int
+        number of coordinates taken from the library
+    """
+    logger = logging.getLogger(__name__)
+    keys = coordinateKeys(oMolsys)
+    path, entry_keys = _bestEntry(keys)
+    if path is None:
+        logger.info("\tNo matching Hessian in the library %s.\n" % op.Params.hessian_library)
+        return 0
+    try:
+        with np.load(path) as entry:
+            H_entry = entry['H']
+        os.utime(path, None)  # most recently used
+    except (IOError, OSError, ValueError, KeyError):
+        return 0
+
+    index = dict((k, i) for i, k in enumerate(entry_keys))
+    mine = [i for i, k in enumerate(keys) if k in index]
+    theirs = [index[keys[i]] for i in mine]
+    H[np.ix_(mine, mine)] = H_entry[np.ix_(theirs, theirs)]
+    logger.info("\tTook the Hessian of %d of %d coordinates from the library entry %s.\n"
+                % (len(mine), len(keys), os.path.basename(path)))
+    return len(mine)
+
+
+def store(oMolsys, H):
+    """ Saves the Hessian of the simple, unconstrained coordinates of oMolsys
+    to the library, replacing an entry of the same fingerprint, and evicts the
+    least recently used entries beyond the size limits. """
+    logger = logging.getLogger(__name__)
+    keys = coordinateKeys(oMolsys)
+    constrained = constrainedMask(oMolsys.intcos)
+    keep = [i for i, k in enumerate(keys) if k is not None and not constrained[i]]
+    if not keep:
+        return
+
+    if not os.path.isdir(op.Params.hessian_library):
+        os.makedirs(op.Params.hessian_library)
+    path = _entryPath(keys)
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=op.Params.hessian_library)
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, opt_type=op.Params.opt_type, keys=np.array([keys[i] for i in keep]),
+                 H=np.asarray(H, float)[np.ix_(keep, keep)])
+    os.replace(tmp, path)
+    logger.info("\tSaved the Hessian of %d coordinates to the library entry %s.\n"
+                % (len(keep), os.path.basename(path)))
+    evict()
+
+
+def evict():
+    """ Removes the least recently used entries of the library until it holds at
+    most op.Params.hessian_library_max_entries entries and
+    op.Params.hessian_library_max_size megabytes. """
+    entries = []
+    for path in _entries():
+        try:
+            entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+        except OSError:
+            continue
+    entries.sort(reverse=True)
+    total = 0
+    max_size = op.Params.hessian_library_max_size * 1024 ** 2
+    for n, (_, size, path) in enumerate(entries):
+        total += size
+        if n >= op.Params.hessian_library_max_entries or total > max_size:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -2,8 +2,8 @@ import math
 import logging
 
 import numpy as np
-import qcelemental as qcel
 
+from .lazyModule import qcel
 from . import intcosMisc
 from . import optparams as op
 from .linearAlgebra import absMax, rms, signOfDouble
@@ -11,16 +11,30 @@ from .printTools import printMatString, printArrayString
 
 
 class Step(object):
-    def __init__(self, geom, E, forces, qcout=None):
+    def __init__(self, geom, E, forces, qcout=None, gradient=None):
         self.geom = geom.copy()  # Store as 2D object
         self.E = E
         self.forces = forces.copy()
         self.qcout = qcout
+        # cartesian gradient, to express the forces in other coordinates
+        self.gradient = None if gradient is None else np.array(gradient, float).ravel()
         self.projectedDE = None
         self.Dq = None
         self.followedUnitVector = None
         self.oneDgradient = None
         self.oneDhessian = None
+        # internal coordinate values, and the coordinates they were computed for
+        self._q = None
+        self._qKey = None
+
+    def qValues(self, oMolsys):
+        """ Internal coordinate values at this step's geometry.  They are computed
+        once for each set of coordinates and orientation of the dihedrals. """
+        key = (oMolsys.coordinateVersion, oMolsys.dihedralOrientations())
+        if self._q is None or self._qKey != key:
+            self._q = oMolsys.qValues(self.geom)
+            self._qKey = key
+        return self._q
 
     def record(self, projectedDE, Dq, followedUnitVector, oneDgradient, oneDhessian):
         self.projectedDE = projectedDE
@@ -75,11 +89,35 @@ class History(object):
         del self.steps[index]
 
     # Add new step.  We will store geometry as 1D in history.
-    def append(self, geom, E, forces, qcout):
-        s = Step(geom, E, forces, qcout)
+    def append(self, geom, E, forces, qcout, gradient=None):
+        s = Step(geom, E, forces, qcout, gradient)
         self.steps.append(s)
         History.stepsSinceLastHessian += 1
 
+    def reexpress(self, oMolsys):
+        """ Expresses the steps in the current coordinates of oMolsys, after the
+        coordinates were changed, so that Hessian updates can go on.  The forces
+        are transformed from the cartesian gradients, and the displacement of
+        each step becomes the change of the coordinates to the next geometry
+        (the current one, for the last step).
+
+        Returns
+        -------
+        bool
+            False, without changes, if a step has no cartesian gradient
+        """
+        if any(step.gradient is None for step in self.steps):
+            return False
+        oMolsys.updateDihedralOrientations()
+        q = [step.qValues(oMolsys) for step in self.steps] + [oMolsys.qValues()]
+        for i, step in enumerate(self.steps):
+            step.forces = oMolsys.qForces(step.gradient, step.geom)
+            if step.Dq is not None:
+                step.Dq = q[i + 1] - q[i]
+                norm = np.linalg.norm(step.Dq)
+                step.followedUnitVector = step.Dq / norm if norm > 0.0 else step.Dq.copy()
+        return True
+
     # Fill in details of new step.
     def appendRecord(self, projectedDE, Dq, followedUnitVector, oneDgradient,
                      oneDhessian):
@@ -190,13 +228,13 @@ class History(object):
         return
 
     # Use History to update Hessian
-    def hessianUpdate(self, H, intcos):
+    def hessianUpdate(self, H, oMolsys):
         logger = logging.getLogger(__name__)
         if op.Params.hess_update == 'NONE' or len(self.steps) < 2:
             return
 
         logger.info("\tPerforming %s update." % op.Params.hess_update)
-        Nintco = len(intcos)  # working dimension
+        Nintco = len(oMolsys.intcos)  # working dimension
 
         f = np.zeros(Nintco, float)
         # x = np.zeros(self.steps[-1].geom.shape,float)
@@ -206,11 +244,11 @@ class History(object):
         f[:] = currentStep.forces
         # x[:] = currentStep.geom
         x = currentStep.geom
-        q[:] = intcosMisc.qValues(intcos, x)
 
         # Fix configuration of torsions and out-of-plane angles,
         # so that Dq's are reasonable
-        intcosMisc.updateDihedralOrientations(intcos, x)
+        oMolsys.updateDihedralOrientations(x)
+        q[:] = currentStep.qValues(oMolsys)
 
         dq = np.zeros(Nintco, float)
         dg = np.zeros(Nintco, float)
@@ -228,8 +266,7 @@ class History(object):
         while iStep > -1 and len(use_steps) < numToUse:
             oldStep = self.steps[iStep]
             f_old = oldStep.forces
-            x_old = oldStep.geom
-            q_old[:] = intcosMisc.qValues(intcos, x_old)
+            q_old[:] = oldStep.qValues(oMolsys)
             dq[:] = q - q_old
             dg[:] = f_old - f  # gradients -- not forces!
             gq = np.dot(dq, dg)
@@ -265,8 +302,7 @@ class History(object):
             oldStep = self.steps[i_step]
 
             f_old = oldStep.forces
-            x_old = oldStep.geom
-            q_old[:] = intcosMisc.qValues(intcos, x_old)
+            q_old[:] = oldStep.qValues(oMolsys)
             dq[:] = q - q_old
             dg[:] = f_old - f  # gradients -- not forces!
             gq = np.dot(dq, dg)
@@ -367,3 +403,10 @@ def summaryString():
 
 
 oHistory = History()
+
+
+def resetHistory():
+    """ Clears the history left by a previous optimization in the same process. """
+    vars(oHistory).clear()
+    History.consecutiveBacksteps = 0
+    oHistory.__init__()
@@ -5,7 +5,9 @@ import logging
 from . import oofp
 from . import optparams as op
 from . import bend
+from . import cart
 from . import tors
+from . import delocalized
 
 from .linearAlgebra import symmMatInv, symmMatRoot
 from .printTools import printMatString, printArrayString
@@ -32,10 +34,38 @@ def qValues(intcos, geom):
         internal coordinate values
     """
 
-    q = np.array([i.q(geom) for i in intcos])
+    rows, cols = cartesianIndices(intcos)
+    q = np.zeros(len(intcos), float)
+    q[rows] = np.asarray(geom).ravel()[cols]
+    for i, intco in enumerate(intcos):
+        if not isinstance(intco, cart.Cart):
+            q[i] = intco.q(geom)
     return q
 
 
+def cartesianIndices(intcos):
+    """ Positions of the cartesian coordinates in intcos, and the indices
+    3 * atom + xyz of the cartesians they are.  The values and B matrix rows of
+    cartesians are filled from these at once.
+
+    Returns
+    -------
+    (ndarray, ndarray)
+    """
+    rows = [i for i, intco in enumerate(intcos) if isinstance(intco, cart.Cart)]
+    cols = [3 * intcos[i].A + intcos[i].xyz for i in rows]
+    return np.array(rows, int), np.array(cols, int)
+
+
+def isCartesian(intcos, Natom):
+    """ Whether intcos are the 3 Natom cartesians in order x1, y1, z1, x2, ...
+    Then B is the unit matrix, and the internal coordinate machinery is not needed. """
+    if len(intcos) != 3 * Natom:
+        return False
+    rows, cols = cartesianIndices(intcos)
+    return len(rows) == len(intcos) and np.array_equal(cols, np.arange(3 * Natom))
+
+
 def qShowValues(intcos, geom):
     """Scales internal coordiante values by coordinate factor.
 
@@ -62,18 +92,36 @@ def updateDihedralOrientations(intcos, geom):
     for intco in intcos:
         if isinstance(intco, tors.Tors) or isinstance(intco, oofp.Oofp):
             intco.updateOrientation(geom)
+    for S in delocalized.combinationSets(intcos):
+        updateDihedralOrientations(S.primitives, geom)
+        S.clearCache()
+
+
+def dihedralOrientations(intcos):
+    """ orientations (near180) of each tors and oofp coordinate, as a tuple """
+    orientations = [intco.near180 for intco in intcos
+                    if isinstance(intco, tors.Tors) or isinstance(intco, oofp.Oofp)]
+    for S in delocalized.combinationSets(intcos):
+        orientations.append(dihedralOrientations(S.primitives))
+    return tuple(orientations)
 
 
 def fixBendAxes(intcos, geom):
     for intco in intcos:
         if isinstance(intco, bend.Bend):
             intco.fixBendAxes(geom)
+    for S in delocalized.combinationSets(intcos):
+        fixBendAxes(S.primitives, geom)
+        S.clearCache()
 
 
 def unfixBendAxes(intcos):
     for intco in intcos:
         if isinstance(intco, bend.Bend):
             intco.unfixBendAxes()
+    for S in delocalized.combinationSets(intcos):
+        unfixBendAxes(S.primitives)
+        S.clearCache()
 
 
 # Returns mass-weighted Bmatrix if masses are supplied.
@@ -83,8 +131,11 @@ def Bmat(intcos, geom, masses=None):
     Ncart = geom.size
 
     B = np.zeros((Nint, Ncart), float)
+    rows, cols = cartesianIndices(intcos)
+    B[rows, cols] = 1.0
     for i, intco in enumerate(intcos):
-        intco.DqDx(geom, B[i])
+        if not isinstance(intco, cart.Cart):
+            intco.DqDx(geom, B[i])
 
     if type(masses) is np.ndarray:
         sqrtm = np.array([np.repeat(np.sqrt(masses), 3)]*len(intcos))
@@ -157,43 +208,96 @@ def qShowForces(intcos, forces):
     return qaJ
 
 
-def constraint_matrix(intcos):
-    if not any([coord.frozen for coord in intcos]):
-        return None
-    C = np.zeros((len(intcos), len(intcos)), float)
-    for i, coord in enumerate(intcos):
-        if coord.frozen:
-            C[i, i] = 1.0
-    return C
-    # frozen_coords = np.asarray([int(coord.frozen) for coord in intcos])
-    # if np.any(frozen_coords):
-    #    return np.diagflat(frozen_coords)
-    # else:
-    #    return None
+def constrainedMask(intcos):
+    """ Boolean mask of the frozen and fixed coordinates. """
+    return np.array([intco.frozen or intco.fixed for intco in intcos], bool)
 
 
-def projectRedundanciesAndConstraints(intcos, geom, fq, H):
-    """Project redundancies and constraints out of forces and Hessian"""
+def fixedErrors(intcos, geom, q_target=None, limit=None):
+    """ Displacements that take the constrained coordinates to their targets.
+
+    Parameters
+    ----------
+    intcos : list
+        internal coordinates
+    geom : ndarray
+        (nat, 3) cartesian geometry
+    q_target : ndarray, optional
+        targets of the constrained coordinates; by default, fixedEqVal for the
+        fixed coordinates and the present values for the frozen ones
+    limit : float, optional
+        largest displacement of a fixed coordinate toward its fixedEqVal
+
+    Returns
+    -------
+    ndarray
+        q_target - q for the constrained coordinates and zero for the others;
+        torsions take the shorter way around
+    """
+    dq = np.zeros(len(intcos), float)
+    for i, intco in enumerate(intcos):
+        if q_target is not None and (intco.frozen or intco.fixed):
+            dq[i] = q_target[i] - intco.q(geom)
+        elif intco.fixed:
+            dq[i] = intco.fixedEqVal - intco.q(geom)
+        if isinstance(intco, tors.Tors) or isinstance(intco, oofp.Oofp):
+            dq[i] = (dq[i] + np.pi) % (2.0 * np.pi) - np.pi
+        if limit is not None and intco.fixed:
+            dq[i] = np.clip(dq[i], -limit, limit)
+    return dq
+
+
+def constraintDisplacement(B, mask, dq):
+    """ Smallest cartesian displacement that changes the coordinates in mask by
+    dq[mask], to first order: dx = B_c^T (B_c B_c^T)^-1 dq_c. """
+    Bc = B[mask]
+    return np.dot(Bc.T, np.dot(symmMatInv(np.dot(Bc, Bc.T), redundant=True), dq[mask]))
+
+
+def projectionMatrix(intcos, geom, G=None, G_inv=None):
+    """ Projector onto the non-redundant, unconstrained internal coordinate space.
+
+    Parameters
+    ----------
+    intcos : list
+        internal coordinates
+    geom : ndarray
+        (nat, 3) cartesian geometry
+    G, G_inv : ndarray, optional
+        G matrix and its generalized inverse at geom, if already known
+
+    Returns
+    -------
+    ndarray
+        P = G G^-1, with frozen coordinates projected out
+    """
     logger = logging.getLogger(__name__)
-    # dim = len(intcos)
     # compute projection matrix = G G^-1
-    G = Gmat(intcos, geom)
-    G_inv = symmMatInv(G, redundant=True)
+    if G is None:
+        G = Gmat(intcos, geom)
+    if G_inv is None:
+        G_inv = symmMatInv(G, redundant=True)
     Pprime = np.dot(G, G_inv)
     # logger.debug("\tProjection matrix for redundancies.\n\n" + printMatString(Pprime))
-    # Add constraints to projection matrix
-    C = constraint_matrix(intcos)
-
-    if np.any(C):
-        logger.debug("Adding constraints for projection.\n" + printMatString(C))
-        # print_opt(np.dot(C, np.dot(Pprime, C)))
-        CPC = np.zeros((len(intcos), len(intcos)), float)
-        CPC[:, :] = np.dot(C, np.dot(Pprime, C))
-        CPCInv = symmMatInv(CPC, redundant=True)
-        P = np.zeros((len(intcos), len(intcos)), float)
-        P[:, :] = Pprime - np.dot(Pprime, np.dot(C, np.dot(CPCInv, np.dot(C, Pprime))))
+    # Add constraints to projection matrix: P = P' - P'_c (P'_cc)^-1 P'_c^T for
+    # the frozen and fixed coordinates c
+    c = constrainedMask(intcos)
+
+    if np.any(c):
+        logger.debug("Adding constraints for projection: coordinates %s."
+                     % (np.flatnonzero(c) + 1))
+        CPCInv = symmMatInv(Pprime[np.ix_(c, c)], redundant=True)
+        P = Pprime - np.dot(Pprime[:, c], np.dot(CPCInv, Pprime[c, :]))
     else:
         P = Pprime
+    return P
+
+
+def projectRedundanciesAndConstraints(intcos, geom, fq, H, P=None):
+    """Project redundancies and constraints out of forces and Hessian"""
+    logger = logging.getLogger(__name__)
+    if P is None:
+        P = projectionMatrix(intcos, geom)
 
     # Project redundancies out of forces.
     # fq~ = P fq
@@ -216,37 +320,45 @@ def projectRedundanciesAndConstraints(intcos, geom, fq, H):
         logger.debug("Projected (PHP) Hessian matrix\n" + printMatString(H))
 
 
-def applyFixedForces(oMolsys, fq, H, stepNumber):
+def applyFixedForces(oMolsys, fq, H):
+    """ Prepares the forces for a step that reaches the targets of the fixed
+    coordinates exactly.
+
+    The fixed coordinates are constraints, projected out like the frozen ones,
+    and the displacement moves them onto their targets (see displace), by at
+    most intrafrag_trust in one step.  That move dq_c changes the forces on the
+    other coordinates by -H dq_c, which is added here, so that the step minimizes
+    the quadratic model on the constraint surface: the projected equivalent of
+    solving for the Lagrange multipliers.
+
+    Parameters
+    ----------
+    oMolsys : Molsys
+    fq : ndarray
+        forces in internal coordinates; modified in place
+    H : ndarray
+        Hessian in internal coordinates
+    """
     logger = logging.getLogger(__name__)
-    x = oMolsys.geom
+    intcos = oMolsys.intcos
+    fixed = np.array([intco.fixed for intco in intcos], bool)
+    if not np.any(fixed):
+        return
+
+    dq_c = np.zeros(len(intcos), float)
+    report = "\n\tFixed coordinates:\n\t%19s%14s%14s\n" % ("Coordinate", "Value", "Target")
     for iF, F in enumerate(oMolsys._fragments):
-        for i, intco in enumerate(F.intcos):
+        dq_c[oMolsys.frag_intco_slice(iF)] = fixedErrors(F.intcos, F.geom,
+                                                         limit=op.Params.intrafrag_trust)
+        for intco in F.intcos:
             if intco.fixed:
-                # TODO we may need to add iF to the location to get unique locations
-                # for each fragment
-                location = oMolsys.frag_1st_intco(iF) + i
-                val = intco.q(x)
-                eqVal = intco.fixedEqVal
-
-                # Increase force constant by 5% of initial value per iteration
-                k = (1 + 0.05 * stepNumber) * op.Params.fixed_coord_force_constant
-                force = k * (eqVal - val)
-                H[location][location] = k
-                fq[location] = force
-                fix_forces_report = ("\n\tAdding user-defined constraint:"
-                                     + "Fragment %d; Coordinate %d:\n" % (iF + 1, i + 1))
-                fix_forces_report += ("\t\tValue = %12.6f; Fixed value    = %12.6f"
-                                      % (val, eqVal))
-                fix_forces_report += ("\t\tForce = %12.6f; Force constant = %12.6f"
-                                      % (force, k))
-                logger.info(fix_forces_report)
-
-                # Delete coupling between this coordinate and others.
-                logger.info("\t\tRemoving off-diagonal coupling between coordinate"
-                            + "%d and others." % (location + 1))
-                for j in range(len(H)):  # gives first dimension length
-                    if j != location:
-                        H[j][location] = H[location][j] = 0.0
+                report += "\t%19s%14.5f%14.5f\n" % (
+                    intco, intco.qShow(F.geom), intco.fixedEqVal * intco.qShowFactor)
+    logger.info(report)
+
+    B = oMolsys.Bmat()
+    dq = np.dot(B, constraintDisplacement(B, constrainedMask(intcos), dq_c))
+    fq -= np.dot(H, dq)
 
 
 # """
@@ -262,6 +374,18 @@ def applyFixedForces(oMolsys, fq, H, stepNumber):
 # """
 
 
+def gradientBDerivativeTerm(intcos, geom, g_q):
+    """ Returns K_xy = sum_I g_q[I] d^2(q_I)/(dx dy), the gradient term in Hessian transformations. """
+    Ncart = geom.size
+    K = np.zeros((Ncart, Ncart), float)
+    dq2dx2 = np.zeros((Ncart, Ncart), float)
+    for I, q in enumerate(intcos):
+        dq2dx2[:] = 0
+        q.Dq2Dx2(geom, dq2dx2)  # d^2(q_I)/ dx_i dx_j
+        K += g_q[I] * dq2dx2
+    return K
+
+
 def convertHessianToInternals(H, intcos, geom, g_x=None):
     """ converts the hessian from cartesian coordinates into internal coordinates 
     
@@ -296,20 +420,8 @@ def convertHessianToInternals(H, intcos, geom, g_x=None):
         logger.info("Including force/B-matrix derivative term.\n")
 
         g_q = np.dot(Atranspose, g_x)
-        Ncart = 3 * len(geom)
-        dq2dx2 = np.zeros((Ncart, Ncart), float)  # should be cart x cart for fragment ?
-
-        for I, q in enumerate(intcos):
-            dq2dx2[:] = 0
-            q.Dq2Dx2(geom, dq2dx2)  # d^2(q_I)/ dx_i dx_j
-
-            for a in range(Ncart):
-                for b in range(Ncart):
-                    # adjust indices for multiple fragments
-                    Hworking[a, b] -= g_q[I] * dq2dx2[a, b] 
-
+        Hworking -= gradientBDerivativeTerm(intcos, geom, g_q)
 
-    
     Hq = np.dot(Atranspose, np.dot(Hworking, Atranspose.T))
     return Hq
 
@@ -358,16 +470,7 @@ def convertHessianToCartesians(Hint, intcos, geom, masses=None, g_q=None):
                     + "stationary points.\n")
     else:  # Hxy += dE/dq_I d2(q_I)/dxdy
         logger.info("Including force/B-matrix derivative term.\n")
-        Ncart = 3 * len(geom)
-
-        dq2dx2 = np.zeros((Ncart, Ncart), float)  # should be cart x cart for fragment ?
-        for I, q in enumerate(intcos):
-            dq2dx2[:] = 0
-            q.Dq2Dx2(geom, dq2dx2)
-
-            for a in range(Ncart):
-                for b in range(Ncart):
-                    Hxy[a, b] += g_q[I] * dq2dx2[a, b]
+        Hxy += gradientBDerivativeTerm(intcos, geom, g_q)
 
     return Hxy
 
@@ -9,7 +9,7 @@ from .molsys import Molsys
 from . import qcdbjson
 
 
-def run_json_file(json_file):
+def run_json_file(json_file, json_out_file=None):
     """ wrapper for run_json_dict to read json input file and create json output file 
     formattted according to the MolSSI QCSchema
 
@@ -17,6 +17,8 @@ def run_json_file(json_file):
     ----------
     json_file : file
         json input file: qc_schema_input
+    json_out_file : file, optional
+        json output file: qc_schema_output. By default, json_file is overwritten.
 
     Notes
     -----
@@ -29,10 +31,8 @@ def run_json_file(json_file):
     
     json_out = run_qcschema(json_dict)
     
-    with open(json_file, "r+") as input_file:
-        input_file.seek(0)
-        input_file.truncate()
-        json.dump(json_out, input_file, indent=2)
+    with open(json_file if json_out_file is None else json_out_file, "w") as output_file:
+        json.dump(json_out, output_file, indent=2)
 
 
 def run_qcschema(json_dict):
@@ -49,6 +49,7 @@ def run_qcschema(json_dict):
     dict
     
     """
+    logger = logging.getLogger(__name__)
 
     if json_dict['driver'] != "optimize":
         logger.error('optking is not meant to run this input please use your favorite QC program')
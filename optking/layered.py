@@ -0,0 +1,217 @@
+""" Layered optimization: microiterations of the environment on a cheap backend.
+
+The atoms of op.Params.core_atoms are optimized on the expensive gradient, with
+the cartesians of all other atoms (the environment) frozen.  Before each
+expensive gradient, the environment is relaxed with the core fixed, on the
+cheap energy corrected to first order by the last expensive gradient:
+
+    E_env(x) = E_cheap(x) + (g_expensive(x_ref) - g_cheap(x_ref)) . (x - x_ref)
+
+so that the environment forces vanish on the expensive surface at convergence.
+The optimization is converged only when the expensive forces on the environment
+also meet the force criterion.  Since the correction holds only near x_ref, no
+atom of the environment moves more than op.Params.micro_trust, or the trust
+radius of the core steps, in one relaxation.  The change of the corrected cheap
+energy is added to the projected energy change of the core step, so that a
+relaxation that the expensive energy does not follow shrinks the trust radius.
+
+The bundled Lennard-Jones backend suits environments of atoms or rigid
+molecules held by nonbonded forces; the environment of a covalent molecule
+needs a force field in environment_calculation.
+"""
+import logging
+
+import numpy as np
+
+from . import lj_functions
+from . import optparams as op
+from .exceptions import OptError
+from .linearAlgebra import absMax
+from .misc import connectedComponents
+
+
+def environment_calculation(geom, Z):
+    """ Energy and (nat, 3) cartesian gradient on the cheap backend.  The bundled
+    Lennard-Jones potential is the default; replace this function to use another
+    backend, as for psi4methods.psi4_calculation.  Terms within the core are
+    constant in the microiterations and may be left out. """
+    return lj_functions.calc_energy_and_gradient(geom, op.Params.lj_sigma, op.Params.lj_epsilon,
+                                                 atoms=environmentAtoms(len(geom)), squared=False)
+
+
+def environmentAtoms(Natom):
+    """ Indices of the atoms not in op.Params.core_atoms. """
+    core = np.array(op.Params.core_atoms, int) - 1
+    if np.any(core < 0) or np.any(core >= Natom):
+        raise OptError("Core atoms must be in the range 1 to %d." % Natom)
+    return np.setdiff1d(np.arange(Natom), core)
+
+
+def environmentConverged(gX):
+    """ Whether the expensive forces on the environment meet the force criterion
+    of the convergence check, which sees only the forces on the core.
+
+    Parameters
+    ----------
+    gX : ndarray
+        expensive cartesian gradient
+
+    Returns
+    -------
+    bool
+    """
+    logger = logging.getLogger(__name__)
+    f = np.reshape(gX, (-1, 3))[environmentAtoms(len(gX) // 3)].ravel()
+    if len(f) == 0:
+        return True
+    max_force, rms_force = absMax(f), np.sqrt(np.mean(f**2))
+    if op.Params.i_max_force:
+        converged = max_force < op.Params.conv_max_force
+    elif op.Params.i_rms_force:
+        converged = rms_force < op.Params.conv_rms_force
+    else:
+        converged = True
+    logger.info("\tForces on the environment: max %10.2e, rms %10.2e; %s."
+                % (max_force, rms_force, "converged" if converged else "not converged"))
+    return converged
+
+
+def coreConnectivity(C, geom):
+    """ Removes the bonds of the environment atoms from the connectivity matrix,
+    so that the environment is described only by its frozen cartesians and the
+    internal coordinates of the core do not depend on it.  Pieces of the core
+    joined only through the environment are reconnected at their closest atoms.
+
+    Parameters
+    ----------
+    C : ndarray
+        (nat, nat) boolean connectivity matrix; modified in place
+    geom : ndarray
+        (nat, 3) cartesian geometry
+    """
+    env = environmentAtoms(len(C))
+    C[env, :] = False
+    C[:, env] = False
+
+    core = np.setdiff1d(np.arange(len(C)), env)
+    bonds = np.argwhere(np.triu(C[np.ix_(core, core)], 1))
+    pieces = [core[c] for c in connectedComponents(len(core), bonds)]
+    while len(pieces) > 1:
+        D = np.linalg.norm(geom[pieces[0]][:, None, :] - geom[None, np.concatenate(pieces[1:]), :], axis=2)
+        i, j = np.unravel_index(np.argmin(D), D.shape)
+        a, b = pieces[0][i], np.concatenate(pieces[1:])[j]
+        C[a, b] = C[b, a] = True
+        other = next(k for k in range(1, len(pieces)) if b in pieces[k])
+        pieces[0] = np.concatenate([pieces[0], pieces.pop(other)])
+    return C
+
+
+def relaxEnvironment(oMolsys, x_ref=None, g_ref=None):
+    """ Minimizes the corrected cheap energy with respect to the environment
+    cartesians by L-BFGS, with the core fixed; updates the geometry of oMolsys.
+
+    Parameters
+    ----------
+    oMolsys : Molsys
+    x_ref : ndarray, optional
+        (nat, 3) geometry of the last expensive gradient
+    g_ref : ndarray, optional
+        expensive cartesian gradient at x_ref; without it, there is no correction
+
+    Returns
+    -------
+    int, float
+        number of microiterations; change of the corrected cheap energy, the
+        projected change of the expensive energy
+    """
+    logger = logging.getLogger(__name__)
+    env = environmentAtoms(oMolsys.Natom)
+    Z = oMolsys.Z
+    x_start = oMolsys.geom
+    if len(env) == 0:
+        return 0, 0.0
+
+    trust = min(op.Params.micro_trust, op.Params.intrafrag_trust)
+    correction = np.zeros(x_start.shape, float)
+    if g_ref is not None:
+        correction[env] = (np.reshape(g_ref, x_start.shape)
+                           - environment_calculation(x_ref, Z)[1])[env]
+        x_ref = np.array(x_ref, float).reshape(x_start.shape)
+    else:
+        x_ref = x_start
+
+    def model(y):
+        x = x_start.copy()
+        x[env] = y.reshape(-1, 3)
+        E, g = environment_calculation(x, Z)
+        E += np.sum(correction * (x - x_ref))
+        return E, (np.asarray(g) + correction)[env].ravel()
+
+    def bound(y):
+        # no atom moves more than trust from its starting position
+        d = y.reshape(-1, 3) - x_start[env]
+        r = np.linalg.norm(d, axis=1)
+        scale = np.minimum(1.0, trust / np.maximum(r, 1.0e-12))
+        return (x_start[env] + d * scale[:, None]).ravel()
+
+    def projector(y, g):
+        # atoms at the bound that are pushed outward stay on it
+        d = y.reshape(-1, 3) - x_start[env]
+        r = np.linalg.norm(d, axis=1)
+        u = d / np.maximum(r, 1.0e-12)[:, None]
+        held = r > (1.0 - 1.0e-8) * trust
+        held &= np.einsum('ij,ij->i', g.reshape(-1, 3), u) < 0.0
+        u = u * held[:, None]
+
+        def project(v):
+            v = v.reshape(-1, 3)
+            return (v - np.einsum('ij,ij->i', v, u)[:, None] * u).ravel()
+        return project
+
+    y = x_start[env].ravel()
+    E, g = model(y)
+    E_start = E
+    project = projector(y, g)
+    p = project(g)
+    S, Y = [], []
+    nIterations = 0
+    while nIterations < op.Params.micro_maxiter and absMax(p) >= op.Params.micro_g_convergence:
+        nIterations += 1
+        # L-BFGS direction by the two-loop recursion
+        d = -p
+        alphas = []
+        for s, dp in reversed(list(zip(S, Y))):
+            alphas.append(np.dot(s, d) / np.dot(dp, s))
+            d = d - alphas[-1] * dp
+        if S:
+            d = d * np.dot(S[-1], Y[-1]) / np.dot(Y[-1], Y[-1])
+        for s, dp, a in zip(S, Y, reversed(alphas)):
+            d = d + (a - np.dot(dp, d) / np.dot(dp, s)) * s
+        d = project(d)
+        if np.dot(d, p) >= 0.0:
+            d, S, Y = -p, [], []
+
+        # backtracking line search, at most trust along d
+        t = min(1.0, trust / absMax(d))
+        while t >= 1.0e-8:
+            y_new = bound(y + t * d)
+            E_new, g_new = model(y_new)
+            if E_new <= E + 1.0e-4 * np.dot(g, y_new - y):
+                break
+            t *= 0.5
+        else:
+            break  # no descent within numerical precision
+
+        project = projector(y_new, g_new)
+        p_new = project(g_new)
+        s, dp = y_new - y, p_new - p
+        y, E, g, p = y_new, E_new, g_new, p_new
+        if np.dot(s, dp) > 1.0e-12:
+            S, Y = (S + [s])[-op.Params.micro_history:], (Y + [dp])[-op.Params.micro_history:]
+
+    x = x_start.copy()
+    x[env] = y.reshape(-1, 3)
+    oMolsys.geom = x
+    logger.info("\tRelaxed %d environment atoms in %d microiterations; largest force %.2e."
+                % (len(env), nIterations, absMax(p)))
+    return nIterations, E - E_start
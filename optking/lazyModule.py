@@ -0,0 +1,28 @@
+""" Modules that are imported on first use, to keep the import of optking fast.
+
+qcelemental builds its data tables and pydantic models when imported, which
+costs more than the rest of optking together, and psi4 is only needed to run
+psi4 calculations.  Modules of optking take the proxy below in place of the
+module, e.g. ``from .lazyModule import qcel``.
+"""
+import importlib
+
+
+class LazyModule(object):
+    """ Stands in for the module name, which is imported on the first access of
+    one of its attributes. """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = 'imported' if self._module is not None else 'not imported'
+        return "<lazy module '%s' (%s)>" % (self._name, state)
+
+
+qcel = LazyModule('qcelemental')
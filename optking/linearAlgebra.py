@@ -44,15 +44,132 @@ def symmMatEig(mat):
     return evals, evects
 
 # Returns eigenvector with lowest eigenvalues; makes the largest
-# magnitude element positive.
-def lowestEigenvectorSymmMat(mat):
+# magnitude element positive.  guess is an approximate eigenvector,
+# e.g. the one of the previous step.
+def lowestEigenvectorSymmMat(mat, guess=None):
+    evals, evects = lowestEigenpairsSymmMat(mat, 1, guess)
+    return evects[:, 0]
+
+
+# Matrices smaller than this are diagonalized in full by lowestEigenpairsSymmMat().
+davidson_min_dim = 100
+
+
+def lowestEigenpairsSymmMat(mat, k=1, guess=None, exclude=None, tol=1.0e-8, max_iter=100):
+    """Compute the k lowest eigenpairs of a real, symmetric matrix with the
+    Davidson method, which costs O(N^2 k) per iteration instead of the O(N^3)
+    of a full diagonalization.  Matrices smaller than davidson_min_dim, and
+    those for which the iterations fail, are diagonalized in full.
+
+    Parameters
+    ----------
+    mat : ndarray
+        (n, n) symmetric matrix
+    k : int
+        number of eigenpairs
+    guess : ndarray, optional
+        (n, ) or (n, m) approximate eigenvectors, such as those of the
+        previous step, to start the iterations from
+    exclude : ndarray, optional
+        (n, ) or (n, m) orthonormal eigenvectors of mat to be left out of
+        the solutions
+    tol : float
+        largest norm of the residuals of the converged eigenvectors
+    max_iter : int
+        largest number of iterations
+
+    Returns
+    -------
+    ndarray, ndarray
+        (k, ), (n, k) lowest eigenvalues in ascending order, and eigenvectors
+        in columns with their largest magnitude element positive
+
+    """
+    dim = mat.shape[0]
+    X = np.zeros((dim, 0)) if exclude is None else np.reshape(exclude, (dim, -1))
+    k = min(k, dim - X.shape[1])
+    if dim < davidson_min_dim:
+        evals, evects = _lowestEigenpairsDense(mat, k, X)
+    else:
+        evals, evects = _davidson(mat, k, guess, X, tol, max_iter)
+        if evals is None:
+            evals, evects = _lowestEigenpairsDense(mat, k, X)
+
+    for i in range(k):
+        if abs(min(evects[:, i])) > abs(max(evects[:, i])):
+            evects[:, i] *= -1.0
+    return evals, evects
+
+
+def _lowestEigenpairsDense(mat, k, X):
+    # Excluded vectors are moved above the rest of the spectrum.
+    if X.shape[1]:
+        shift = 2.0 * np.max(np.sum(np.abs(mat), axis=1)) + 1.0
+        mat = mat + shift * np.dot(X, X.T)
     try:
         evals, evects = np.linalg.eigh(mat)
-        if abs(min(evects[:,0])) > abs(max(evects[:,0])):
-            evects[:,0] *= -1.0
-    except:
-        raise OptError("symmMatEig: could not compute eigenvectors")
-    return evects[:,0]
+    except np.linalg.LinAlgError as e:
+        raise OptError("lowestEigenpairsSymmMat: could not compute eigenvectors") from e
+    return evals[:k], evects[:, :k]
+
+
+def orthonormalize(V, X, thresh=1.0e-8):
+    """Columns of V orthonormalized against the columns of X and each other;
+    those with nothing left are dropped. """
+    basis = []
+    for v in V.T:
+        for _ in range(2):
+            if X.shape[1]:
+                v = v - np.dot(X, np.dot(X.T, v))
+            for b in basis:
+                v = v - np.dot(b, v) * b
+        n = np.linalg.norm(v)
+        if n > thresh:
+            basis.append(v / n)
+    return np.array(basis).T.reshape(len(V), len(basis))
+
+
+def _davidson(mat, k, guess, X, tol, max_iter):
+    """Davidson iterations with the diagonal preconditioner.  Returns None,
+    None if the eigenpairs did not converge. """
+    dim = mat.shape[0]
+    diag = np.diag(mat)
+    max_sub = min(dim, max(24, 6 * k))
+
+    # start from the guesses, and the unit vectors of the lowest diagonal elements
+    start = [] if guess is None else [np.reshape(guess, (dim, -1))]
+    start.append(np.eye(dim)[:, np.argsort(diag)[:k + 2]])
+    V = orthonormalize(np.hstack(start), X)
+    AV = np.dot(mat, V)
+
+    for _ in range(max_iter):
+        T = np.dot(V.T, AV)
+        theta_all, s_all = np.linalg.eigh(0.5 * (T + T.T))
+        theta, s = theta_all[:k], s_all[:, :k]
+        U = np.dot(V, s)
+        R = np.dot(AV, s) - U * theta
+        if X.shape[1]:
+            R -= np.dot(X, np.dot(X.T, R))
+        res = np.linalg.norm(R, axis=0)
+        if np.all(res < tol):
+            return theta, U
+        if V.shape[1] >= dim:
+            return None, None
+
+        # corrections of the unconverged vectors
+        denom = theta[res >= tol] - diag[:, None]
+        denom[np.abs(denom) < 1.0e-8] = 1.0e-8
+        T = R[:, res >= tol] / denom
+        if V.shape[1] + T.shape[1] > max_sub:  # restart from the lowest Ritz vectors
+            keep = s_all[:, :max(k, max_sub // 2)]
+            V, AV = np.dot(V, keep), np.dot(AV, keep)
+        T = orthonormalize(T, np.hstack((X, V)))
+        if T.shape[1] == 0:
+            return None, None
+        V = np.hstack((V, T))
+        AV = np.hstack((AV, np.dot(mat, T)))
+
+    return None, None
 
 def asymmMatEig(mat):
     """Compute the eigenvalues and right eigenvectors of a square array.
@@ -76,7 +193,7 @@ def asymmMatEig(mat):
     """
     try:
         evals, evects = np.linalg.eig(mat)
-    except np.LinAlgError as e:
+    except np.linalg.LinAlgError as e:
         raise OptError("asymmMatEig: could not compute eigenvectors") from e
 
     idx = np.argsort(evals)
@@ -96,7 +213,7 @@ def symmMatInv(A, redundant=False, redundant_eval_tol=1.0e-10):
 
     try:
         evals, evects = symmMatEig(A)
-    except LinAlgError:
+    except np.linalg.LinAlgError:
         raise OptError("symmMatrixInv: could not compute eigenvectors")
         # could be LinAlgError?
 
@@ -124,22 +241,27 @@ def symmMatInv(A, redundant=False, redundant_eval_tol=1.0e-10):
     return AInv
 
 
-# Compute A^(1/2) for a positive-definite matrix.  A^(-1/2) if Inverse == True
-def symmMatRoot(A, Inverse=None):
+# Compute A^(1/2) for a positive-definite matrix.  A^(-1/2) if Inverse == True;
+# for a semi-definite matrix, the inverse is generalized over the nonzero eigenvalues.
+def symmMatRoot(A, Inverse=None, redundant_eval_tol=1.0e-10):
     try:
         evals, evects = np.linalg.eigh(A)
         # Eigenvectors of A are in columns of evects
         # Evals in ascending order
-    except LinAlgError:
+    except np.linalg.LinAlgError:
         raise OptError("symmMatRoot: could not compute eigenvectors")
 
     evals[ np.abs(evals) < 5*np.finfo(np.float).resolution ] = 0.0
     evects[ np.abs(evects) < 5*np.finfo(np.float).resolution ] = 0.0
 
+    # zero (redundant) eigenvalues may come out slightly negative
+    evals[ np.abs(evals) < redundant_eval_tol ] = 0.0
+
     rootMatrix = np.zeros((len(evals), len(evals)), float)
     if Inverse:
         for i in range(0, len(evals)):
-            evals[i] = 1 / evals[i]
+            if evals[i] != 0.0:
+                evals[i] = 1 / evals[i]
 
     for i in range(0, len(evals)):
         rootMatrix[i][i] = sqrt(evals[i])
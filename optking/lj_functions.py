@@ -5,10 +5,12 @@ A simple set of functions to compute LJ energies and gradients.
 import numpy as np
 
 
-def calc_energy_and_gradient(positions, sigma, epsilon, do_gradient=True):
+def calc_energy_and_gradient(positions, sigma, epsilon, do_gradient=True, atoms=None, squared=True):
     r"""
     Computes the energy and gradient of a expression in the form
     V_{ij} = 4 \epsilon [ (sigma / r) ^ 12 - (sigma / r)^6]
+    where r is the squared distance, or the distance if squared is False.
+    If atoms is given, only the pairs with at least one of these atoms are included.
     """
 
     # Holds the energy and the energy gradient
@@ -19,22 +21,32 @@ def calc_energy_and_gradient(positions, sigma, epsilon, do_gradient=True):
     sigma6 = sigma**6
     sigma12 = sigma6**2
 
+    included = np.ones(positions.shape[0], bool)
+    if atoms is not None:
+        included[:] = False
+        included[atoms] = True
+
     # Double loop over all particles
     for i in range(0, positions.shape[0] - 1):
         jvals = positions[(i + 1):]
+        pairs = included[i] | included[(i + 1):]
 
         dr = jvals - positions[i]
 
         r = np.einsum("ij,ij->i", dr, dr)
+        if not squared:
+            r = np.sqrt(r)
         r6 = np.power(r, 6)
         r12 = np.power(r6, 2)
 
-        E += np.sum((sigma12 / r12) - (sigma6 / r6))
+        E += np.sum(((sigma12 / r12) - (sigma6 / r6))[pairs])
         if do_gradient:
-            g = 12 * r12 - 6 * r6
-            g *= dr
-            gradient[i] += -np.sum(g)
-            gradient[i:] += g
+            # dV/dr = (-12 sigma12 / r12 + 6 sigma6 / r6) / r, and d(r)/d(x_j) is
+            # 2 dr for the squared distance, dr / r for the distance
+            dr_dx = 2.0 * dr / r[:, None] if squared else dr / (r * r)[:, None]
+            g = (pairs * (-12 * sigma12 / r12 + 6 * sigma6 / r6))[:, None] * dr_dx
+            gradient[i] -= np.sum(g, axis=0)
+            gradient[(i + 1):] += g
 
     E *= 4.0 * epsilon
 
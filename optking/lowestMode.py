@@ -0,0 +1,135 @@
+""" Hessian-free estimate of the lowest curvature mode, for transition state
+searches and the start of an IRC.
+
+The lowest eigenvector of the internal coordinate Hessian is found with the
+block Davidson method, preconditioned by the model Hessian.  Each product of the
+Hessian with a trial vector u is a forward difference of the internal forces,
+
+    H u = -(f_q(x + h dx) - f_q(x)) / h,    dx = B^T G^-1 u,
+
+which includes the B-matrix derivative term, so that one gradient gives each
+product.  The gradients of a block of op.Params.mode_block trial vectors are
+computed concurrently.  The model Hessian is then corrected in the space of the
+trial vectors, so that it reproduces the measured products; P-RFO and the IRC
+proceed with this Hessian as with a computed one.  A few gradients replace the
+6N gradients of a finite-difference Hessian.
+"""
+import logging
+
+import numpy as np
+
+from . import optparams as op
+from .exceptions import AlgError
+from .linearAlgebra import lowestEigenpairsSymmMat, orthonormalize
+from .printTools import printArrayString
+
+
+def lowestMode(oMolsys, gX, H, gradients, guess=None):
+    """ Finds the lowest mode of the Hessian at the current geometry from
+    gradient differences, and corrects H along the trial vectors.
+
+    Parameters
+    ----------
+    oMolsys : Molsys
+        molecular system, at the current geometry
+    gX : ndarray
+        cartesian gradient at the current geometry
+    H : ndarray
+        model Hessian in internal coordinates; the preconditioner, and the
+        Hessian outside of the space of the trial vectors
+    gradients : function
+        takes a list of (nat, 3) geometries, and returns the list of their
+        cartesian gradients
+    guess : ndarray, optional
+        approximate lowest mode, e.g. the followed vector of the previous step
+
+    Returns
+    -------
+    ndarray, ndarray, float, int
+        corrected Hessian; lowest mode, normalized, and its curvature; number
+        of gradients computed
+    """
+    logger = logging.getLogger(__name__)
+    h = op.Params.mode_fd_step
+    block = op.Params.mode_block
+    dim = len(H)
+    geom = oMolsys.geom
+    f_q = oMolsys.qForces(gX)
+    B = oMolsys.Bmat()
+    BtGinv = np.dot(B.T, oMolsys.Ginv())
+    diag = np.diag(H)
+
+    # start from the guess and the lowest modes of the model Hessian
+    trial = [] if guess is None or len(guess) != dim else [np.reshape(guess, (dim, 1))]
+    trial.append(lowestEigenpairsSymmMat(H, min(block, dim))[1])
+    trial = np.hstack(trial)
+
+    V = np.zeros((dim, 0))
+    W = np.zeros((dim, 0))
+    nGradients = 0
+    for iteration in range(op.Params.mode_max_iter):
+        # trial vectors are made realizable, i.e. in the range of B
+        trial = orthonormalize(np.dot(B, np.dot(BtGinv, trial)), V)[:, :block]
+        if trial.shape[1] == 0:
+            break
+        dx = np.dot(BtGinv, trial)
+        geoms = [geom + h * dx[:, i].reshape(-1, 3) for i in range(trial.shape[1])]
+        products = [-(oMolsys.qForces(g, x) - f_q) / h
+                    for g, x in zip(gradients(geoms), geoms)]
+        nGradients += len(geoms)
+        V = np.hstack((V, trial))
+        W = np.hstack((W, np.array(products).T))
+
+        T = np.dot(V.T, W)
+        theta, s = np.linalg.eigh(0.5 * (T + T.T))
+        U = np.dot(V, s)
+        R = np.dot(W, s) - U * theta
+        residual = np.linalg.norm(R[:, 0])
+        logger.info("\tLowest mode iteration %d: %d gradients, curvature %12.8f, residual %10.3e"
+                    % (iteration + 1, nGradients, theta[0], residual))
+        if residual < op.Params.mode_tol:
+            break
+
+        # diagonally preconditioned corrections of the lowest Ritz vectors
+        k = min(block, len(theta))
+        denom = theta[:k] - diag[:, None]
+        denom[np.abs(denom) < 1.0e-4] = 1.0e-4
+        trial = R[:, :k] / denom
+    else:
+        logger.warning("\tLowest mode not converged in %d iterations; residual %10.3e"
+                       % (op.Params.mode_max_iter, residual))
+
+    if V.shape[1] == 0:
+        raise AlgError("No displacements are possible to find the lowest mode.")
+    logger.info("\tLowest mode, curvature %12.8f\n\n\t" % theta[0] + printArrayString(U[:, 0]))
+    return updateHessianInSubspace(H, V, W), U[:, 0], theta[0], nGradients
+
+
+def updateHessianInSubspace(H, V, W):
+    """ Corrects H so that H V = W, for orthonormal columns V, and keeps H in
+    the complement of V.  The products W are symmetrized first within V:
+
+        H' = (1 - V V^T) H (1 - V V^T) + W' V^T + V W'^T - V (V^T W') V^T
+
+    with W' = W + V (T - V^T W), T = (V^T W + W^T V) / 2.
+
+    Parameters
+    ----------
+    H : ndarray
+        (n, n) symmetric matrix
+    V : ndarray
+        (n, m) orthonormal vectors
+    W : ndarray
+        (n, m) products of the Hessian with V
+
+    Returns
+    -------
+    ndarray
+        (n, n) corrected Hessian
+    """
+    VtW = np.dot(V.T, W)
+    T = 0.5 * (VtW + VtW.T)
+    W = W + np.dot(V, T - VtW)
+    Q = np.identity(len(H)) - np.dot(V, V.T)
+    return np.dot(Q, np.dot(H, Q)) + np.dot(W, V.T) + np.dot(V, W.T) \
+        - np.dot(V, np.dot(T, V.T))
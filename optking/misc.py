@@ -1,8 +1,6 @@
 import numpy as np
-import logging
-
-import qcelemental as qcel
 
+from .lazyModule import qcel
 from .exceptions import AlgError, OptError
 
 
@@ -13,66 +11,170 @@ def delta(i, j):
         return 0
 
 
-def isDqSymmetric(intcos, geom, Dq):
-    logger = logging.getLogger(__name__)
-    # TODO add symmetry check
-    logger.debug('\tTODO add isDqSymmetric\n')
-    return True
+class DisjointSets(object):
+    """ Union-find over the integers 0, ..., n-1, with path halving. """
+    def __init__(self, n):
+        self._parent = list(range(n))
+
+    def find(self, i):
+        parent = self._parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        """ Merges the sets of i and j; returns False if they were already one set.
+        The smallest member of a set is always its representative. """
+        ri, rj = self.find(i), self.find(j)
+        if ri == rj:
+            return False
+        if ri < rj:
+            self._parent[rj] = ri
+        else:
+            self._parent[ri] = rj
+        return True
+
+
+def connectedComponents(n, edges):
+    """ Connected components of a graph on nodes 0, ..., n-1.
+
+    Parameters
+    ----------
+    n : int
+        number of nodes
+    edges : iterable of (int, int)
+        pairs of connected nodes, e.g. np.argwhere(np.triu(C, 1)) for a
+        connectivity matrix C
+
+    Returns
+    -------
+    list of ndarray
+        sorted nodes of each component, ordered by their first node
+    """
+    sets = DisjointSets(n)
+    for i, j in edges:
+        sets.union(i, j)
+    roots = np.array([sets.find(i) for i in range(n)], dtype=int)
+    order = np.argsort(roots, kind='stable')
+    splits = np.flatnonzero(np.diff(roots[order])) + 1
+    return np.split(order, splits)
+
+
+def minimumSpanningTree(D):
+    """ Minimum spanning tree of a complete graph (Prim's algorithm).
+
+    Parameters
+    ----------
+    D : ndarray
+        (n, n) symmetric edge weights
+
+    Returns
+    -------
+    list of (int, int)
+        the n-1 edges (parent, child) of the tree rooted at node 0, in the order
+        they were added, so every parent is added before its children
+    """
+    n = len(D)
+    in_tree = np.zeros(n, bool)
+    in_tree[0] = True
+    best = np.array(D[0], float)
+    parent = np.zeros(n, int)
+    edges = []
+    for _ in range(n - 1):
+        child = int(np.argmin(np.where(in_tree, np.inf, best)))
+        edges.append((int(parent[child]), child))
+        in_tree[child] = True
+        closer = D[child] < best
+        best[closer] = D[child][closer]
+        parent[closer] = child
+    return edges
+
+
+# Element property tables indexed by atomic number.  These are built once on
+# first use so that Hessian guesses and connectivity tests do not repeat the
+# qcelemental lookups for every coordinate.
+_MAX_Z = 118
+_periods = None
+_covalent_radii = None
+
+
+def _buildElementTables():
+    global _periods, _covalent_radii
+    periods = np.ones(_MAX_Z + 1, dtype=int)
+    radii = np.full(_MAX_Z + 1, 4.0)
+    for Z in range(1, _MAX_Z + 1):
+        try:
+            periods[Z] = qcel.periodictable.to_period(Z)
+            radii[Z] = qcel.covalentradii.get(Z, missing=4.0)
+        except qcel.NotAnElementError:
+            periods[Z:] = periods[Z - 1]
+            break
+    _periods = periods
+    _covalent_radii = radii
+
+
+def periodsFromZ(Z):
+    """ Returns the row of the periodic table for each atomic number.
+
+    Parameters
+    ----------
+    Z : int or array_like of int
+
+    Returns
+    -------
+    ndarray of int (or int for scalar input)
+    """
+    if _periods is None:
+        _buildElementTables()
+    return _periods[np.asarray(Z, dtype=int)]
+
+
+def covalentRadiiFromZ(Z):
+    """ Returns the covalent radius (bohr) for each atomic number; 4.0 if unknown.
 
+    Parameters
+    ----------
+    Z : int or array_like of int
 
-def symmetrizeXYZ(XYZ):
-    logger = logging.getLogger(__name__)
-    # TODO add symmetrize function
-    logger.debug('\tTODO add symmetrize XYZ\n')
-    return XYZ
+    Returns
+    -------
+    ndarray of float (or float for scalar input)
+    """
+    if _covalent_radii is None:
+        _buildElementTables()
+    return _covalent_radii[np.asarray(Z, dtype=int)]
 
 
 # "Average" bond length given two periods
 # Values below are from Lindh et al.
 # Based on DZP RHF computations, I suggest: 1.38 1.9 2.53, and 1.9 2.87 3.40
+_LINDH_R_REF = np.array([[1.35, 2.10, 2.53],
+                         [2.10, 2.87, 3.40],
+                         [2.53, 3.40, 3.40]])
+
+_LINDH_ALPHA = np.array([[1.0000, 0.3949, 0.3949],
+                         [0.3949, 0.2800, 0.2800],
+                         [0.3949, 0.2800, 0.2800]])
+
+
 def AverageRFromPeriods(perA, perB):
-    if perA == 1:
-        if perB == 1:
-            return 1.35
-        elif perB == 2:
-            return 2.1
-        else:
-            return 2.53
-    elif perA == 2:
-        if perB == 1:
-            return 2.1
-        elif perB == 2:
-            return 2.87
-        else:
-            return 3.40
-    else:
-        if perB == 1:
-            return 2.53
-        else:
-            return 3.40
+    return _LINDH_R_REF[min(perA, 3) - 1, min(perB, 3) - 1]
 
 
 # Return Lindh alpha value from two periods
 def HguessLindhAlpha(perA, perB):
-    if perA == 1:
-        if perB == 1:
-            return 1.000
-        else:
-            return 0.3949
-    else:
-        if perB == 1:
-            return 0.3949
-        else:
-            return 0.2800
+    return _LINDH_ALPHA[min(perA, 3) - 1, min(perB, 3) - 1]
 
 
 # rho_ij = e^(alpha (r^2,ref - r^2))
 def HguessLindhRho(ZA, ZB, RAB):
-    perA = qcel.periodictable.to_period(ZA)
-    perB = qcel.periodictable.to_period(ZB)
+    """ Lindh rho for atom pair(s); arguments may be scalars or arrays. """
+    iA = np.minimum(periodsFromZ(ZA), 3) - 1
+    iB = np.minimum(periodsFromZ(ZB), 3) - 1
 
-    alpha = HguessLindhAlpha(perA, perB)
-    r_ref = AverageRFromPeriods(perA, perB)
+    alpha = _LINDH_ALPHA[iA, iB]
+    r_ref = _LINDH_R_REF[iA, iB]
 
     return np.exp(-alpha * (RAB * RAB - r_ref * r_ref))
 
@@ -1,13 +1,25 @@
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
-import qcelemental as qcel
 
+from .lazyModule import qcel
+from . import bend
+from . import cart
+from . import dimerfrag
 from . import frag
+from . import hessian
+from . import intcosMisc
+from . import oofp
+from . import optparams as op
+from . import symmetry
+from . import tors
 from .exceptions import AlgError, OptError
-from . import v3d
-from .addIntcos import connectivityFromDistances, addCartesianIntcos
+from .addIntcos import connectivityFromDistances, addCartesianIntcos, linearBendCheck
+from .linearAlgebra import symmMatInv, symmMatRoot
+from .misc import DisjointSets, connectedComponents, covalentRadiiFromZ, minimumSpanningTree
+from .printTools import printArrayString, printMatString
 
 
 class Molsys(object):
@@ -32,6 +44,15 @@ class Molsys(object):
         if fb_fragments:
             self._fb_fragments = fb_fragments
         self._multiplicity = multiplicity
+        # interfragment coordinates between pairs of fragments (MULTI mode)
+        self._dimers = []
+        # point group used to symmetrize the optimization; see detectPointGroup()
+        self.pointGroup = None
+        # derived quantities (q, B, G, ...) at the current geometry; see _cached()
+        self._version = 0
+        self._coordinateVersion = 0
+        self._cacheKey = None
+        self._cache = {}
 
     def __str__(self):
         s = ''
@@ -139,6 +160,10 @@ class Molsys(object):
     def Nfragments(self):
         return len(self._fragments) + len(self._fb_fragments)
 
+    def _fragStarts(self):
+        """ Overall index of the first atom of each fragment, then the number of atoms. """
+        return np.cumsum([0] + [F.Natom for F in self._fragments])
+
     # Return overall index of first atom in fragment, beginning 0,1,...
     def frag_1st_atom(self, iF):
         if iF >= len(self._fragments):
@@ -172,31 +197,68 @@ class Molsys(object):
     def geom(self):
         """cartesian geometry [a0]"""
         geom = np.zeros((self.Natom, 3), float)
-        for iF, F in enumerate(self._fragments):
-            row = self.frag_1st_atom(iF)
+        for F, row in zip(self._fragments, self._fragStarts()):
             geom[row:(row + F.Natom), :] = F.geom
         return geom
 
     @geom.setter
     def geom(self, newgeom):
         """ setter for geometry"""
-        for iF, F in enumerate(self._fragments):
-            row = self.frag_1st_atom(iF)
+        for F, row in zip(self._fragments, self._fragStarts()):
             F.geom[:] = newgeom[row:(row + F.Natom), :]
+        self.clearCache()
+
+    @property
+    def version(self):
+        """ Counter of changes to the geometry or to the coordinates. """
+        return self._version
+
+    @property
+    def coordinateVersion(self):
+        """ Counter of changes to the set of coordinates only. """
+        return self._coordinateVersion
+
+    def clearCache(self, newCoordinates=False):
+        """ Discards the quantities cached for the current geometry and starts a
+        new version.  Code that edits the coordinates of the fragments directly
+        must call this with newCoordinates=True. """
+        self._version += 1
+        if newCoordinates:
+            self._coordinateVersion += 1
+        self._cacheKey = None
+        self._cache = {}
+
+    def _cached(self, name, geom, compute):
+        """ Returns compute(), evaluated once per version of the geometry.
+
+        Only quantities at the current geometry are cached.  The fragment
+        geometries may be displaced in place, so the cache also keeps a copy of
+        the geometry it was computed at.  Cached arrays are shared; the public
+        methods return copies.
+        """
+        current = self.geom
+        if geom is not None and (geom.shape != current.shape or not np.array_equal(geom, current)):
+            return compute()
+        key = (self._version, len(self.intcos))
+        if self._cacheKey is None or self._cacheKey[0] != key or \
+                not np.array_equal(self._cacheKey[1], current):
+            self._cacheKey = (key, current)
+            self._cache = {}
+        if name not in self._cache:
+            self._cache[name] = compute()
+        return self._cache[name]
 
     @property
     def masses(self):
         m = np.zeros(self.Natom, float)
-        for iF, F in enumerate(self._fragments):
-            start = self.frag_1st_atom(iF)
+        for F, start in zip(self._fragments, self._fragStarts()):
             m[start:(start + F.Natom)] = F.masses
         return m
 
     @property
     def Z(self):
         z = [0 for i in range(self.Natom)]
-        for iF, F in enumerate(self._fragments):
-            first = self.frag_1st_atom(iF)
+        for F, first in zip(self._fragments, self._fragStarts()):
             z[first:(first + F.Natom)] = F.Z
         return z
 
@@ -205,8 +267,14 @@ class Molsys(object):
         _intcos = []
         for F in self._fragments:
             _intcos += F.intcos
+        for D in self._dimers:
+            _intcos += D.intcos
         return _intcos
 
+    @property
+    def dimers(self):
+        return self._dimers
+
     def frag_1st_intco(self, iF):
         if iF >= len(self._fragments):
             return ValueError()
@@ -215,21 +283,596 @@ class Molsys(object):
             start += len(self._fragments[i]._intcos)
         return start
 
+    def frag_intco_slice(self, iF):
+        start = self.frag_1st_intco(iF)
+        return slice(start, start + len(self._fragments[iF]._intcos))
+
+    def dimer_intco_slice(self, iD):
+        start = sum(len(F._intcos) for F in self._fragments)
+        start += sum(len(D.intcos) for D in self._dimers[:iD])
+        return slice(start, start + len(self._dimers[iD].intcos))
+
+    def frag_cart_slice(self, iF):
+        start = 3 * self.frag_1st_atom(iF)
+        return slice(start, start + 3 * self._fragments[iF].Natom)
+
+    def _fragGeoms(self, geom=None):
+        """ Views of a (nat, 3) geometry for each fragment; fragment geometries by default. """
+        if geom is None:
+            return [F.geom for F in self._fragments]
+        return [geom[start:start + F.Natom] for start, F in zip(self._fragStarts(), self._fragments)]
+
+    def _fragmentMap(self, func, geom=None):
+        """ Evaluates func(iF, F, fragment geometry) for every fragment.
+
+        Intrafragment coordinates do not couple across fragments, so the
+        fragments are independent and can be done in a thread pool of
+        op.Params.frag_threads workers.
+        """
+        geoms = self._fragGeoms(geom)
+        nThreads = min(op.Params.frag_threads, len(self._fragments))
+        if nThreads > 1:
+            with ThreadPoolExecutor(max_workers=nThreads) as pool:
+                return list(pool.map(func, range(len(geoms)), self._fragments, geoms))
+        return [func(iF, F, x) for iF, (F, x) in enumerate(zip(self._fragments, geoms))]
+
+    @staticmethod
+    def _blockDiagonal(blocks):
+        """ Assembles per-fragment blocks into one block diagonal matrix. """
+        Nrow = sum(b.shape[0] for b in blocks)
+        Ncol = sum(b.shape[1] for b in blocks)
+        M = np.zeros((Nrow, Ncol), float)
+        row = col = 0
+        for b in blocks:
+            M[row:row + b.shape[0], col:col + b.shape[1]] = b
+            row += b.shape[0]
+            col += b.shape[1]
+        return M
+
+    def qValues(self, geom=None):
+        """ Internal coordinate values of all fragments.
+
+        Parameters
+        ----------
+        geom : ndarray, optional
+            (nat, 3) geometry of the system; defaults to the current geometry
+        """
+        def compute():
+            q = self._fragmentMap(lambda iF, F, x: intcosMisc.qValues(F.intcos, x), geom)
+            geoms = self._fragGeoms(geom)
+            q += [D.q(geoms[D.A_idx], geoms[D.B_idx]) for D in self._dimers]
+            return np.concatenate(q) if q else np.zeros(0, float)
+
+        return self._cached('q', geom, compute).copy()
+
+    def qShowValues(self, geom=None):
+        q = self._fragmentMap(lambda iF, F, x: intcosMisc.qShowValues(F.intcos, x), geom)
+        geoms = self._fragGeoms(geom)
+        q += [D.qShow(geoms[D.A_idx], geoms[D.B_idx]) for D in self._dimers]
+        return np.concatenate(q) if q else np.zeros(0, float)
+
+    def _dimerBmat(self, geom=None):
+        """ Rows of the B matrix for the interfragment coordinates. """
+        geoms = self._fragGeoms(geom)
+        B = np.zeros((sum(len(D.intcos) for D in self._dimers), 3 * self.Natom), float)
+        row = 0
+        for D in self._dimers:
+            BAB = D.Bmat(geoms[D.A_idx], geoms[D.B_idx])
+            nA = 3 * len(geoms[D.A_idx])
+            B[row:row + len(BAB), self.frag_cart_slice(D.A_idx)] = BAB[:, :nA]
+            B[row:row + len(BAB), self.frag_cart_slice(D.B_idx)] = BAB[:, nA:]
+            row += len(BAB)
+        return B
+
+    def _fragBmats(self, geom=None, massWeight=False):
+        def fragB(iF, F, x):
+            masses = np.asarray(F.masses, float) if massWeight else None
+            return intcosMisc.Bmat(F.intcos, x, masses)
+
+        return self._cached(('fragB', massWeight), geom,
+                            lambda: self._fragmentMap(fragB, geom))
+
+    def _fragGmats(self, geom=None, massWeight=False):
+        return self._cached(('fragG', massWeight), geom, lambda: [
+            np.dot(B, B.T) for B in self._fragBmats(geom, massWeight)])
+
+    def _fragGinvs(self, geom=None, massWeight=False):
+        G = self._fragGmats(geom, massWeight)
+
+        def fragGinv(iF, F, x):
+            if intcosMisc.isCartesian(F.intcos, F.Natom):
+                return np.diag(1.0 / np.diag(G[iF]))  # G is diagonal
+            return symmMatInv(G[iF], redundant=True)
+
+        return self._cached(('fragGinv', massWeight), geom,
+                            lambda: self._fragmentMap(fragGinv, geom))
+
+    def _Bmat(self, geom=None, massWeight=False):
+        def compute():
+            B = self._blockDiagonal(self._fragBmats(geom, massWeight))
+            if self._dimers:
+                Bd = self._dimerBmat(geom)
+                if massWeight:
+                    Bd /= np.repeat(np.sqrt(self.masses), 3)
+                B = np.vstack((B, Bd))
+            return B
+
+        return self._cached(('B', massWeight), geom, compute)
+
+    def _Gmat(self, geom=None, massWeight=False):
+        def compute():
+            if self._dimers:
+                B = self._Bmat(geom, massWeight)
+                return np.dot(B, B.T)
+            return self._blockDiagonal(self._fragGmats(geom, massWeight))
+
+        return self._cached(('G', massWeight), geom, compute)
+
+    def _Ginv(self, geom=None, massWeight=False):
+        def compute():
+            Gff_inv = self._blockDiagonal(self._fragGinvs(geom, massWeight))
+            if not self._dimers:
+                return Gff_inv
+
+            G = self._Gmat(geom, massWeight)
+            nf = len(G) - sum(len(D.intcos) for D in self._dimers)
+            Gfd = G[:nf, nf:]
+            X = np.dot(Gff_inv, Gfd)
+            S = G[nf:, nf:] - np.dot(Gfd.T, X)
+            if np.linalg.eigvalsh(S)[0] < 1.0e-10:
+                self.logger.debug("Interfragment coordinates are redundant; inverting full G.")
+                return symmMatInv(G, redundant=True)
+
+            S_inv = symmMatInv(S, redundant=True)
+            G_inv = np.zeros(G.shape, float)
+            G_inv[:nf, :nf] = Gff_inv + np.dot(X, np.dot(S_inv, X.T))
+            G_inv[:nf, nf:] = -np.dot(X, S_inv)
+            G_inv[nf:, :nf] = G_inv[:nf, nf:].T
+            G_inv[nf:, nf:] = S_inv
+
+            P = np.dot(G[:nf, :nf], Gff_inv)
+            G_inv[:nf, :] = np.dot(P, G_inv[:nf, :])
+            G_inv[:, :nf] = np.dot(G_inv[:, :nf], P.T)
+            return G_inv
+
+        return self._cached(('Ginv', massWeight), geom, compute)
+
+    def Bmat(self, geom=None, massWeight=False):
+        """ B matrix; the intrafragment part is block diagonal and each fragment's
+        block is built independently.  Interfragment coordinates add the last rows. """
+        return self._Bmat(geom, massWeight).copy()
+
+    def Gmat(self, geom=None, massWeight=False):
+        """ G matrix; mass-weighted if massWeight.  Block diagonal over fragments
+        unless there are interfragment coordinates. """
+        return self._Gmat(geom, massWeight).copy()
+
+    def Ginv(self, geom=None, massWeight=False):
+        """ Generalized inverse of G; mass-weighted if massWeight.
+
+        Without interfragment coordinates, only the fragment blocks of G are
+        inverted.  Otherwise, the intrafragment block G_ff is block diagonal, and
+        only its fragment blocks and the small Schur complement
+        S = G_dd - G_df G_ff^-1 G_fd of the interfragment block are inverted.  When
+        S is nonsingular, the interfragment coordinates are independent of the
+        intrafragment ones and G^+ = P G^- P with P = diag(G_ff G_ff^-1, 1).
+        Otherwise, the full G is inverted.
+        """
+        return self._Ginv(geom, massWeight).copy()
+
+    def Groot(self, geom=None, massWeight=False, Inverse=False):
+        """ G^(1/2), or G^(-1/2) if Inverse; mass-weighted if massWeight. """
+        return self._cached(('Groot', massWeight, Inverse), geom, lambda: symmMatRoot(
+            self._Gmat(geom, massWeight), Inverse)).copy()
+
+    def fragAmats(self, geom=None):
+        """ A^T = G^-1 B for each fragment; the forces on the coordinates of
+        fragment iF are A[iF] f_x of its atoms. """
+        B = self._fragBmats(geom)
+        G_inv = self._fragGinvs(geom)
+        A = self._cached('fragA', geom, lambda: [np.dot(Gi, Bi) for Gi, Bi in zip(G_inv, B)])
+        return [a.copy() for a in A]
+
+    def isCartesian(self):
+        """ Whether the coordinates are the cartesians of all atoms, in order.  The
+        forces, Hessian and steps are then used as they are, without B. """
+        return self._cached('cartesian', None, lambda: not self._dimers and all(
+            intcosMisc.isCartesian(F.intcos, F.Natom) for F in self._fragments))
+
+    def qForces(self, gradient_x, geom=None):
+        """ Transforms the cartesian gradient into internal coordinate forces, one
+        fragment at a time so that only the fragment blocks of G are inverted. """
+        gradient_x = np.asarray(gradient_x).ravel()
+        if self.isCartesian():
+            return -gradient_x
+        if self._dimers:
+            return -np.dot(self._Ginv(geom), np.dot(self._Bmat(geom), gradient_x))
+
+        fq = [-np.dot(A, gradient_x[self.frag_cart_slice(iF)])
+              for iF, A in enumerate(self.fragAmats(geom))]
+        return np.concatenate(fq) if fq else np.zeros(0, float)
+
+    def updateDihedralOrientations(self, geom=None):
+        geoms = self._fragGeoms(geom)
+        for F, x in zip(self._fragments, geoms):
+            intcosMisc.updateDihedralOrientations(F.intcos, x)
+        for D in self._dimers:
+            D.updateOrientation(geoms[D.A_idx], geoms[D.B_idx])
+        # the values of torsions near 180 depend on their orientation
+        self.clearCache()
+
+    def dihedralOrientations(self):
+        """ Orientations of all torsions and out-of-plane angles; with the
+        coordinate version, these fix the coordinate values at any geometry. """
+        orientations = [intcosMisc.dihedralOrientations(F.intcos) for F in self._fragments]
+        orientations += [intcosMisc.dihedralOrientations(D.intcos) for D in self._dimers]
+        return tuple(orientations)
+
+    def detectPointGroup(self, tol=1.0e-3):
+        """ Finds the point group of the geometry and symmetrizes the geometry.
+
+        Parameters
+        ----------
+        tol : float
+            largest distance [a0] between an atom and the image of an equivalent atom
+        """
+        self.pointGroup = symmetry.PointGroup.fromGeometry(self.geom, self.Z, self.masses, tol)
+        self.restrictPointGroup()
+        self.symmetrizeGeom()
+
+    def restrictPointGroup(self):
+        """ Keeps the subgroup of the point group that maps each frozen or fixed
+        coordinate onto itself and the core atoms onto core atoms; called again
+        whenever the coordinates are chosen. """
+        if self.pointGroup is None:
+            return
+        pointGroup = self.pointGroup.subgroup(self._keepsConstraints)
+        if pointGroup.order < self.pointGroup.order:
+            self.logger.info("\tUsing the subgroup %s, which keeps the constraints and core atoms."
+                             % pointGroup.label)
+        self.pointGroup = pointGroup
+        self._cache.pop('Psym', None)
+        if self.intcos and self.pointGroup.order > 1:
+            G, G_inv = self._Gmat(), self._Ginv()
+            self.logger.info("\t%d of %d internal degrees of freedom are totally symmetric."
+                             % (round(np.trace(self.symmetryProjector())),
+                                round(np.trace(np.dot(G, G_inv)))))
+
+    def _keepsConstraints(self, R, p):
+        """ Whether the symmetry operation (R, p) maps each frozen or fixed
+        coordinate onto itself, and the core atoms onto core atoms.  Averaging
+        over an operation that exchanges a constrained coordinate with another
+        would move the constrained coordinate with its partner. """
+        core = np.array(op.Params.core_atoms, int) - 1
+        if len(core) and set(p[core]) != set(core):
+            return False
+
+        for F, first in zip(self._fragments, self._fragStarts()):
+            for intco in F.intcos:
+                if not intco.frozen and not intco.fixed:
+                    continue
+                atoms = np.array(intco.atoms) + first
+                image = p[atoms]
+                if isinstance(intco, cart.Cart):
+                    # the atom stays and its axis is kept, or for a frozen one reversed
+                    axis = R[intco.xyz, intco.xyz]
+                    if image[0] != atoms[0] or abs(abs(axis) - 1.0) > 1.0e-6 or \
+                            (intco.fixed and axis < 0.0):
+                        return False
+                elif isinstance(intco, bend.Bend):
+                    if image[1] != atoms[1] or set(image) != set(atoms):
+                        return False
+                elif isinstance(intco, tors.Tors) or isinstance(intco, oofp.Oofp):
+                    # improper operations change the sign of a dihedral angle
+                    kept = np.array_equal(image, atoms) or \
+                        (isinstance(intco, tors.Tors) and np.array_equal(image, atoms[::-1]))
+                    if not kept or (intco.fixed and np.linalg.det(R) < 0.0):
+                        return False
+                elif set(image) != set(atoms):
+                    return False
+
+        # interfragment coordinates are built from reference points of whole fragments
+        for D in self._dimers:
+            if any(intco.frozen or intco.fixed for intco in D.intcos):
+                atoms = np.array(list(self.frag_atom_range(D.A_idx))
+                                 + list(self.frag_atom_range(D.B_idx)))
+                if not np.array_equal(p[atoms], atoms):
+                    return False
+        return True
+
+    def checkPointGroup(self, tol=1.0e-3):
+        """ Stops using the point group if the geometry is no longer symmetric,
+        e.g. after the environment of the core atoms was relaxed.
+
+        Parameters
+        ----------
+        tol : float
+            largest distance [a0] between an atom and its symmetrized position
+        """
+        if self.pointGroup is None or self.pointGroup.order == 1:
+            return
+        deviation = np.max(np.abs(self.pointGroup.symmetrizeGeom(self.geom) - self.geom))
+        if deviation > tol:
+            self.logger.warning("\tThe geometry is no longer %s symmetric (deviation %.2e);"
+                                % (self.pointGroup.label, deviation) + " not using symmetry.")
+            self.pointGroup = None
+            self._cache.pop('Psym', None)
+
+    def symmetrizeGeom(self, geom=None):
+        """ Symmetrizes the geometry of the system, or the (nat, 3) geom, in place. """
+        if self.pointGroup is None:
+            return
+        if geom is None:
+            self.geom = self.pointGroup.symmetrizeGeom(self.geom)
+        else:
+            geom[:] = self.pointGroup.symmetrizeGeom(geom)
+
+    def symmetrizeVector(self, v):
+        """ Totally symmetric part of a cartesian vector, e.g. a gradient. """
+        if self.pointGroup is None:
+            return np.array(v, float)
+        return self.pointGroup.symmetrizeVector(v)
+
+    def symmetryProjector(self):
+        """ Projector S_q = B S_x B^T G^-1 onto the totally symmetric internal
+        coordinate displacements, from the cartesian projector S_x of the point
+        group.  At a symmetric geometry, S_q commutes with P = G G^-1. """
+        def compute():
+            S_x = self.pointGroup.cartesianProjector()
+            B = self._Bmat()
+            return np.dot(np.dot(B, S_x), np.dot(B.T, self._Ginv()))
+
+        return self._cached('Psym', None, compute).copy()
+
+    def isDqSymmetric(self, dq, tol):
+        """ Whether the step dq in internal coordinates keeps the point group, to
+        within a fraction tol of the length of its cartesian displacement. """
+        if self.pointGroup is None or self.pointGroup.order == 1:
+            return True
+        dx = np.dot(self._Bmat().T, np.dot(self._Ginv(), dq))
+        return self.pointGroup.isSymmetric(dx, tol)
+
+    def projectRedundanciesAndConstraints(self, fq, H):
+        """ Projects redundancies and constraints out of forces and Hessian.
+
+        The projector P = G G^-1 is block diagonal over fragments, so each block
+        is formed separately and H_ij -> P_i H_ij P_j.  Interfragment coordinates
+        are not redundant, and their block of P is the unit matrix.  With a point
+        group, the forces are first projected onto the totally symmetric
+        coordinates, so the step keeps the point group, and the Hessian is made
+        block diagonal, S H S^T + (1 - S) H (1 - S)^T.  The curvature of the other
+        coordinates is kept: the B-matrix rows of a linear bend change sign as it
+        passes through 180 degrees, which can turn a symmetric combination of the
+        old steps into an asymmetric one.  In cartesian
+        coordinates, there are no redundancies; see _cartesianProjector().
+        """
+        if self.pointGroup is not None and self.pointGroup.order > 1:
+            S = self.symmetryProjector()
+            A = np.identity(len(S)) - S
+            fq[:] = np.dot(S, fq)
+            H[:, :] = np.dot(S, np.dot(H, S.T)) + np.dot(A, np.dot(H, A.T))
+        if self.isCartesian():
+            P = self._cached('cartP', None, self._cartesianProjector)
+            fq[:] = np.dot(P, fq)
+            H[:, :] = np.dot(P, np.dot(H, P))
+        else:
+            G, G_inv = self._fragGmats(), self._fragGinvs()
+            P = list(self._cached('fragP', None, lambda: self._fragmentMap(
+                lambda iF, F, x: intcosMisc.projectionMatrix(F.intcos, x, G[iF], G_inv[iF]))))
+            slices = [self.frag_intco_slice(iF) for iF in range(len(self._fragments))]
+            for iD, D in enumerate(self._dimers):
+                P.append(np.identity(len(D.intcos)))
+                slices.append(self.dimer_intco_slice(iD))
+            for i, si in enumerate(slices):
+                fq[si] = np.dot(P[i], fq[si])
+                for j, sj in enumerate(slices):
+                    H[si, sj] = np.dot(P[i], np.dot(H[si, sj], P[j].T))
+        self.logger.debug("\n\tInternal forces in au, after projection of redundancies"
+                          + " and constraints.\n" + printArrayString(fq))
+        if op.Params.print_lvl >= 3:
+            self.logger.debug("Projected (PHP) Hessian matrix\n" + printMatString(H))
+
+    def _cartesianProjector(self):
+        """ Projector for cartesian coordinates: the constrained cartesians are
+        removed, or without constraints, the overall translations and rotations. """
+        c = intcosMisc.constrainedMask(self.intcos)
+        if np.any(c):
+            return np.diag((~c).astype(float))
+        T = hessian.rigidBodyVectors(self.geom)
+        return np.identity(3 * self.Natom) - np.dot(T, T.T)
+
+    def convertHessianToInternals(self, H, g_x=None):
+        """ Converts a cartesian Hessian into internal coordinates, using
+        A^T = G^-1 B for each fragment block.
+
+        Parameters
+        ----------
+        H : ndarray
+            (3nat, 3nat) cartesian Hessian
+        g_x : ndarray, optional
+            cartesian gradient; if given, the B-matrix derivative term is included
+
+        Returns
+        -------
+        ndarray
+        """
+        self.logger.info("Converting Hessian from cartesians to internals.\n")
+        if self.isCartesian():
+            return np.array(H, float)
+        if self._dimers:
+            return self._convertHessianWithDimers(H, g_x)
+        carts = [self.frag_cart_slice(iF) for iF in range(len(self._fragments))]
+        A = self.fragAmats()
+
+        # H may be memory-mapped; it is only copied to subtract the derivative term
+        Hworking = H if g_x is None else np.array(H, float)
+        if g_x is None:
+            self.logger.info("Neglecting force/B-matrix derivative term, only correct at"
+                             + " stationary points.\n")
+        else:
+            self.logger.info("Including force/B-matrix derivative term.\n")
+            g_x = np.asarray(g_x).ravel()
+            for iF, F in enumerate(self._fragments):
+                g_q = np.dot(A[iF], g_x[carts[iF]])
+                Hworking[carts[iF], carts[iF]] -= intcosMisc.gradientBDerivativeTerm(
+                    F.intcos, F.geom, g_q)
+
+        Hq = np.zeros((len(self.intcos), len(self.intcos)), float)
+        for i, ci in enumerate(carts):
+            AH = np.dot(A[i], Hworking[ci, :])
+            for j, cj in enumerate(carts):
+                Hq[self.frag_intco_slice(i), self.frag_intco_slice(j)] = \
+                    np.dot(AH[:, cj], A[j].T)
+        return Hq
+
+    def _convertHessianWithDimers(self, H, g_x=None):
+        """ convertHessianToInternals() with interfragment coordinates; A^T = G^-1 B
+        couples the fragments, so the whole system is transformed at once. """
+        A = np.dot(self._Ginv(), self._Bmat())
+        Hworking = H if g_x is None else np.array(H, float)
+        if g_x is not None:
+            g_q = np.dot(A, np.asarray(g_x).ravel())
+            for iF, F in enumerate(self._fragments):
+                c = self.frag_cart_slice(iF)
+                Hworking[c, c] -= intcosMisc.gradientBDerivativeTerm(
+                    F.intcos, F.geom, g_q[self.frag_intco_slice(iF)])
+            for iD, D in enumerate(self._dimers):
+                A_geom = self._fragments[D.A_idx].geom
+                B_geom = self._fragments[D.B_idx].geom
+                c = np.r_[self.frag_cart_slice(D.A_idx), self.frag_cart_slice(D.B_idx)]
+                Hworking[np.ix_(c, c)] -= D.gradientBDerivativeTerm(
+                    A_geom, B_geom, g_q[self.dimer_intco_slice(iD)])
+        return np.dot(A, np.dot(Hworking, A.T))
+
+    def convertHessianToCartesians(self, H, geom=None):
+        """ Transforms an internal coordinate Hessian to cartesians, as B^T H B.
+        The B-matrix derivative term is neglected, so the result is correct at
+        stationary points.
+
+        Parameters
+        ----------
+        H : ndarray
+            internal coordinate Hessian
+        geom : ndarray, optional
+            (nat, 3) geometry; the current one by default
+
+        Returns
+        -------
+        ndarray
+            (3nat, 3nat) cartesian Hessian
+        """
+        self.logger.info("Converting Hessian from internals to cartesians.\n")
+        if self.isCartesian():
+            return np.array(H, float)
+        B = self._Bmat(geom)
+        return np.dot(B.T, np.dot(H, B))
+
+    def hessianGuess(self, guessType):
+        """ Model Hessian; each fragment is guessed from its own connectivity, and
+        the interfragment coordinates get the op.Params.interfrag_hess guess. """
+        def fragH(iF, F, x):
+            return hessian.guess(F.intcos, x, F.Z,
+                                 connectivityFromDistances(x, F.Z), guessType)
+
+        blocks = self._fragmentMap(fragH)
+        for D in self._dimers:
+            A, B = self._fragments[D.A_idx], self._fragments[D.B_idx]
+            blocks.append(np.diag(D.hessianGuess(A.geom, B.geom, A.Z, B.Z,
+                                                 op.Params.interfrag_hess)))
+        return self._blockDiagonal(blocks)
+
+    def linearBendCheck(self, dq):
+        """ Checks each fragment for bends that the step dq makes (near) linear.
+
+        Returns
+        -------
+        list(Bend)
+            missing linear bends, in atom numbering of the molecular system
+        """
+        linearBends = []
+        for iF, F in enumerate(self._fragments):
+            offset = self.frag_1st_atom(iF)
+            for b in linearBendCheck(F.intcos, F.geom, dq[self.frag_intco_slice(iF)]):
+                linearBends.append(bend.Bend(b.A + offset, b.B + offset, b.C + offset,
+                                             bendType=b.bendType))
+        return linearBends
+
     def printIntcos(self):
         for iF, F in enumerate(self._fragments):
             self.logger.info("Fragment %d\n" % (iF + 1))
             F.printIntcos()
+        for iD, D in enumerate(self._dimers):
+            A, B = self._fragments[D.A_idx], self._fragments[D.B_idx]
+            s = str(D)
+            for label, q in zip(D.labels, D.qShow(A.geom, B.geom)):
+                s += "\t  %-10s %12.5f\n" % (label, q)
+            self.logger.info(s)
         return
 
     def addIntcosFromConnectivity(self, C=None):
-        for F in self._fragments:
+        """ Adds coordinates to each fragment from its block of the (nat, nat)
+        connectivity matrix C, or from its own distances if C is None. """
+        for iF, F in enumerate(self._fragments):
             if C is None:
-                C = F.connectivityFromDistances()
-            F.addIntcosFromConnectivity(C)
+                F.addIntcosFromConnectivity(F.connectivityFromDistances())
+            else:
+                atoms = self.frag_atom_range(iF)
+                F.addIntcosFromConnectivity(C[np.ix_(atoms, atoms)])
+        self.clearCache(newCoordinates=True)
+
+    def addDimerFrags(self):
+        """ Adds interfragment coordinates that join all the fragments.
+
+        The fragments are joined along a spanning tree with the shortest
+        interatomic contacts between fragments (Prim's algorithm), so N fragments
+        get N-1 sets of interfragment coordinates.  The dimers are ordered so
+        that each fragment B is moved only after the fragment A it hangs from.
+        Reference points are taken from op.Params.frag_ref_atoms if given.
+        """
+        del self._dimers[:]
+        self.clearCache(newCoordinates=True)
+        nF = len(self._fragments)
+        if nF < 2:
+            return
+
+        geoms = self._fragGeoms()
+        for A, B in minimumSpanningTree(self.interfragmentDistances()):
+            self.logger.info("\tAdding interfragment coordinates between fragments %d and %d."
+                             % (A + 1, B + 1))
+            self._dimers.append(dimerfrag.DimerFrag(A, self._refPointWeights(A, geoms[B]),
+                                                    B, self._refPointWeights(B, geoms[A])))
+
+    def _refPointWeights(self, iF, partner_geom):
+        """ Reference point weights for fragment iF in a dimer with the fragment at
+        partner_geom; user-specified atoms are 1-based in the numbering of the
+        molecular system. """
+        F = self._fragments[iF]
+        ref_atoms = None
+        if op.Params.frag_ref_atoms:
+            if len(op.Params.frag_ref_atoms) != len(self._fragments):
+                raise OptError("frag_ref_atoms must be given for every fragment.")
+            first = self.frag_1st_atom(iF)
+            ref_atoms = []
+            for point in op.Params.frag_ref_atoms[iF]:
+                atoms = [a - 1 - first for a in point]
+                if min(atoms) < 0 or max(atoms) >= F.Natom:
+                    raise OptError("Reference atoms %s are not in fragment %d."
+                                   % (str(point), iF + 1))
+                ref_atoms.append(atoms)
+            if not 1 <= len(ref_atoms) <= 3:
+                raise OptError("Fragment %d needs 1 to 3 reference points." % (iF + 1))
+        return dimerfrag.referenceWeights(F.geom, ref_atoms, np.mean(partner_geom, axis=0))
 
     def addCartesianIntcos(self):
         for F in self._fragments:
             addCartesianIntcos(F._intcos, F._geom)
+        self.clearCache(newCoordinates=True)
+
+    def formCombinationIntcos(self, natural=False):
+        """ Replace each fragment's primitives by delocalized or natural coordinates. """
+        for F in self._fragments:
+            F.formCombinationIntcos(natural)
+        self.clearCache(newCoordinates=True)
 
     def printGeom(self):
         """Returns a string of the geometry for logging in [a0]"""
@@ -261,126 +904,107 @@ class Molsys(object):
         consolidatedFrag = frag.Frag(self.Z, self.geom, self.masses)
         del self._fragments[:]
         self._fragments.append(consolidatedFrag)
+        self.clearCache(newCoordinates=True)
 
     def splitFragmentsByConnectivity(self):
-        """ Split any fragment not connected by bond connectivity."""
-        tempZ = np.copy(self.Z)
-        tempGeom = np.copy(self.geom)
-        tempMasses = np.copy(self.masses)
+        """ Split any fragment not connected by bond connectivity.
 
+        The new fragments are the connected components of each fragment's bond
+        graph, ordered by their first atom.
+        """
         newFragments = []
         for F in self._fragments:
             C = connectivityFromDistances(F.geom, F.Z)
-            atomsToAllocate = list(reversed(range(F.Natom)))
-            while atomsToAllocate:
-                frag_atoms = [atomsToAllocate.pop()]
-
-                more_found = True
-                while more_found:
-                    more_found = False
-                    addAtoms = []
-                    for A in frag_atoms:
-                        for B in atomsToAllocate:
-                            if C[A, B]:
-                                if B not in addAtoms:
-                                    addAtoms.append(B)
-                                more_found = True
-                    for a in addAtoms:
-                        frag_atoms.append(a)
-                        atomsToAllocate.remove(a)
-
-                frag_atoms.sort()
-                subNatom = len(frag_atoms)
-                subZ = np.zeros(subNatom, float)
-                subGeom = np.zeros((subNatom, 3), float)
-                subMasses = np.zeros(subNatom, float)
-                for i, I in enumerate(frag_atoms):
-                    subZ[i] = tempZ[I]
-                    subGeom[i, 0:3] = tempGeom[I, 0:3]
-                    subMasses[i] = tempMasses[I]
-                newFragments.append(frag.Frag(subZ, subGeom, subMasses))
+            Z = np.asarray(F.Z)
+            masses = np.asarray(F.masses, float)
+            for atoms in connectedComponents(F.Natom, np.argwhere(np.triu(C, 1))):
+                newFragments.append(frag.Frag(Z[atoms], F.geom[atoms].copy(), masses[atoms]))
 
         del self._fragments[:]
         self._fragments = newFragments
+        self.clearCache(newCoordinates=True)
+
+    def interfragmentDistances(self, geom=None):
+        """ Shortest interatomic distance between each pair of fragments.
+
+        Returns
+        -------
+        ndarray
+            (nF, nF) distances; the diagonal is infinite
+        """
+        if geom is None:
+            geom = self.geom
+        starts = self._fragStarts()
+
+        nF = len(self._fragments)
+        D = np.zeros((nF, nF), float)
+        for iF in range(nF):
+            x = geom[starts[iF]:starts[iF + 1]]
+            R = np.linalg.norm(x[:, None, :] - geom[None, :, :], axis=2)
+            D[iF] = np.min(np.minimum.reduceat(R, starts[:-1], axis=1), axis=0)
+        np.fill_diagonal(D, np.inf)
+        return D
 
     # Supplements a connectivity matrix to connect all fragments.  Assumes the
     # definition of the fragments has ALREADY been determined before function called.
     def augmentConnectivityToSingleFragment(self, C):
-        self.logger.info('\tAugmenting connectivity matrix to join fragments.')
-        fragAtoms = []
-        geom = self.geom
-        for iF, F in enumerate(self._fragments):
-            fragAtoms.append(
-                range(self.frag_1st_atom(iF),
-                      self.frag_1st_atom(iF) + F.Natom))
+        """ Joins the fragments in the (nat, nat) connectivity matrix C.
 
-        # Which fragments are connected?
+        Fragments whose closest atoms are within 1.3 times the sum of their
+        covalent radii are joined.  Any fragments still apart are then joined
+        along a minimum spanning tree of the shortest interfragment distances.
+        Each join connects the closest pair of atoms and every other pair just
+        as close, to avoid breaking symmetry.
+        """
+        self.logger.info('\tAugmenting connectivity matrix to join fragments.')
         nF = self.Nfragments
-        self.logger.critical(str(self.Nfragments))
-        if self.Nfragments == 1:
+        if nF == 1:
             return
 
-        frag_connectivity = np.zeros((nF, nF))
-        for iF in range(nF):
-            frag_connectivity[iF, iF] = 1
-
-        Z = self.Z
+        geom = self.geom
+        Rcov = covalentRadiiFromZ(self.Z)
+        D = self.interfragmentDistances(geom)
+        starts = self._fragStarts()
+
+        def closestAtoms(f1, f2):
+            r1, r2 = range(starts[f1], starts[f1 + 1]), range(starts[f2], starts[f2 + 1])
+            R = np.linalg.norm(geom[r1, None, :] - geom[None, r2, :], axis=2)
+            i, j = np.argwhere(np.fabs(R - D[f1, f2]) < 1.0e-10).T
+            return i + r1.start, j + r2.start
+
+        def join(f1, f2, atoms_i, atoms_j):
+            self.logger.info("\tConnecting fragments with atoms %d and %d"
+                             % (atoms_i[0] + 1, atoms_j[0] + 1))
+            for i, j in zip(atoms_i[1:], atoms_j[1:]):
+                self.logger.info("\tAlso, with atoms %d and %d\n" % (i + 1, j + 1))
+            C[atoms_i, atoms_j] = C[atoms_j, atoms_i] = True
 
         scale_dist = 1.3
-        all_connected = False
-        while not all_connected:
-            for f2 in range(nF):
-                for f1 in range(f2):
-                    if frag_connectivity[f1][f2]:
-                        continue  # already connected
-                    minVal = 1.0e12
-
-                    # Find closest 2 atoms between fragments.
-                    for f1_atom in fragAtoms[f1]:
-                        for f2_atom in fragAtoms[f2]:
-                            tval = v3d.dist(geom[f1_atom], geom[f2_atom])
-                            if tval < minVal:
-                                minVal = tval
-                                i = f1_atom
-                                j = f2_atom
-
-                    Rij = v3d.dist(geom[i], geom[j])
-                    R_i = qcel.covalentradii.get(Z[i], missing=4.0)
-                    R_j = qcel.covalentradii.get(Z[j], missing=4.0)
-                    if Rij > scale_dist * (R_i + R_j):
-                        # ignore this as too far - for starters.  may have A-B-C situation.
-                        continue
-
-                    self.logger.info("\tConnecting fragments with atoms %d and %d"
-                                     % (i + 1, j + 1))
-                    C[i][j] = C[j][i] = True
-                    frag_connectivity[f1][f2] = frag_connectivity[f2][f1] = True
-
-                    # Now check for possibly symmetry-related atoms which are just as close
-                    # We need them all to avoid symmetry breaking.
-                    for f1_atom in fragAtoms[f1]:
-                        for f2_atom in fragAtoms[f2]:
-                            if f1_atom == i and f2_atom == j:  # already have this one
-                                continue
-                            tval = v3d.dist(geom[f1_atom], geom[f2_atom])
-                            if np.fabs(tval - minVal) < 1.0e-10:
-                                i = f1_atom
-                                j = f2_atom
-                                self.logger.info("\tAlso, with atoms %d and %d\n"
-                                                 % (i + 1, j + 1))
-                                C[i][j] = C[j][i] = True
-
-            # Test whether all frags are connected using current distance threshold
-            if np.sum(frag_connectivity[0]) == nF:
-                self.logger.info("\tAll fragments are connected in connectivity matrix.")
-                all_connected = True
-            else:
-                scale_dist += 0.2
-                self.logger.info(
-                    "\tIncreasing scaling to %6.3f to connect fragments." % scale_dist)
+        fragSets = DisjointSets(nF)
+        f1s, f2s = np.triu_indices(nF, 1)
+        # no pair of fragments farther apart than this can be in contact
+        nearby = D[f1s, f2s] <= scale_dist * 2.0 * Rcov.max()
+        for f1, f2 in zip(f1s[nearby], f2s[nearby]):
+            atoms_i, atoms_j = closestAtoms(f1, f2)
+            if D[f1, f2] <= scale_dist * (Rcov[atoms_i[0]] + Rcov[atoms_j[0]]):
+                join(f1, f2, atoms_i, atoms_j)
+                fragSets.union(f1, f2)
+
+        # Fragments already joined are at zero distance in the spanning tree.
+        roots = np.array([fragSets.find(iF) for iF in range(nF)])
+        D_tree = np.where(roots[:, None] == roots[None, :], 0.0, D)
+        for f1, f2 in minimumSpanningTree(D_tree):
+            if D_tree[f1, f2] > 0.0:
+                self.logger.info("\tJoining fragments %d and %d at %.3f bohr."
+                                 % (f1 + 1, f2 + 1, D[f1, f2]))
+                join(f1, f2, *closestAtoms(f1, f2))
+
+        self.logger.info("\tAll fragments are connected in connectivity matrix.")
         return
 
     def clear(self):
         self._fragments.clear()
         self._fb_fragments.clear()
+        self._dimers.clear()
+        self.clearCache(newCoordinates=True)
 
@@ -1,8 +1,7 @@
 import math
 import logging
 
-import qcelemental as qcel
-
+from .lazyModule import qcel
 from .exceptions import AlgError, OptError
 from . import optparams as op
 from . import v3d
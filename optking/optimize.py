@@ -1,15 +1,17 @@
 import numpy as np
 import copy
 import logging
-
-from psi4.driver import json_wrapper  # COMMENT FOR INDEP DOCS BUILD
+import os
 
 from . import hessian
+from . import hessianFile
+from . import hessianLibrary
 from . import stepAlgorithms
 from . import caseInsensitiveDict
 from . import optparams as op
 from .exceptions import OptError, AlgError, IRCendReached
 from . import addIntcos
+from . import bend
 from . import history
 from . import intcosMisc
 from . import convCheck
@@ -17,14 +19,18 @@ from . import testB
 from . import IRCfollowing
 from . import psi4methods
 from . import IRCdata
-from .linearAlgebra import lowestEigenvectorSymmMat, symmMatRoot, symmMatInv
+from . import layered
+from . import lowestMode
+from . import topology
+from .displace import displaceMolsys
+from .linearAlgebra import lowestEigenvectorSymmMat
 from .qcdbjson import jsonSchema
 from .printTools import (printGeomGrad,
                          printMatString,
                          printArrayString,
                          welcome)
 
-def optimize(oMolsys, options_in, json_in=None):
+def optimize(oMolsys, options_in, json_in=None, ts_data=None):
     """Driver for OptKing's optimization procedure
 
     Parameters
@@ -35,6 +41,10 @@ def optimize(oMolsys, options_in, json_in=None):
         options for QM program and optking
     json_in : dict, optional
         MolSSI qc schema
+    ts_data : dict, optional
+        Cartesian 'hessian', 'energy', 'gradient', nuclear repulsion energy 'nuc' and
+        'qcjson' output at the transition state, computed once for both branches of an
+        IRC (irc_direction BOTH); see followIRCBothDirections()
 
     Returns
     -------
@@ -65,16 +75,33 @@ def optimize(oMolsys, options_in, json_in=None):
         else:
             o_json = json_in
 
+        if op.Params.opt_type == 'IRC' and op.Params.irc_direction == 'BOTH':
+            json_output = followIRCBothDirections(oMolsys, options_in, o_json)
+            oMolsys.clear()
+            del op.Params
+            return json_output
+
         # Prepare for multiple IRC computation
         if op.Params.opt_type == 'IRC':
             IRCstepNumber = 0
             IRCdata.history = IRCdata.IRCdata()
             IRCdata.history.set_atom_symbols(oMolsys.atom_symbols)
             IRCdata.history.set_step_size_and_direction(op.Params.irc_step_size, op.Params.irc_direction)
+            # the two branches of irc_direction BOTH are written to separate files
+            path_file = 'ircprogress.log' if ts_data is None else \
+                        'ircprogress_%s.log' % op.Params.irc_direction.lower()
+            IRCdata.history.set_path_file(os.path.join(os.getcwd(), path_file))
             optimize_log.info("\tIRC data object created\n")
 
+        # the IRC leaves the point group of the transition state
+        if op.Params.opt_type != 'IRC' and not op.Params.accept_symmetry_breaking:
+            oMolsys.detectPointGroup(op.Params.point_group_tol)
+
         converged = False
         totalStepsTaken = -1
+        H = None
+        transfer = None  # Hessian and coordinate keys carried over a change of coordinates
+        restartGradient = None
         # following loop may repeat over multiple algorithms OR over IRC points
         while not converged:
             try:
@@ -83,25 +110,63 @@ def optimize(oMolsys, options_in, json_in=None):
 
                 # if optimization coordinates are absent, choose them.
                 if not oMolsys.intcos:
-                    connectivity = addIntcos.connectivityFromDistances(oMolsys.geom, oMolsys.Z)
-                    optimize_log.debug("Connectivity Matrix\n" + printMatString(connectivity))
-
-                    if op.Params.frag_mode == 'SINGLE':
-                        oMolsys.splitFragmentsByConnectivity()
-                        oMolsys.augmentConnectivityToSingleFragment(connectivity)
-                        oMolsys.consolidateFragments()
-                    elif op.Params.frag_mode == 'MULTI':
-                        oMolsys.splitFragmentsByConnectivity() # does nothing if already split
+                    input_geom = oMolsys.geom
+                    fromTemplate = bool(op.Params.topology_read) and topology.applyTemplate(
+                        oMolsys, topology.readTemplate(op.Params.topology_read))
+                    if not fromTemplate:
+                        connectivity = addIntcos.connectivityFromDistances(oMolsys.geom, oMolsys.Z)
+                        optimize_log.debug("Connectivity Matrix\n" + printMatString(connectivity))
+
+                        if op.Params.frag_mode == 'SINGLE':
+                            oMolsys.splitFragmentsByConnectivity()
+                            oMolsys.augmentConnectivityToSingleFragment(connectivity)
+                            oMolsys.consolidateFragments()
+                            if op.Params.core_atoms:
+                                layered.coreConnectivity(connectivity, oMolsys.geom)
+                        elif op.Params.frag_mode == 'MULTI':
+                            oMolsys.splitFragmentsByConnectivity() # does nothing if already split
+                            connectivity = None  # each fragment uses its own
+
+                        if op.Params.opt_coordinates in ['REDUNDANT', 'INTERNAL', 'BOTH',
+                                                         'DELOCALIZED', 'NATURAL']:
+                            oMolsys.addIntcosFromConnectivity(connectivity)
+
+                        if op.Params.opt_coordinates in ['CARTESIAN', 'BOTH']:
+                            oMolsys.addCartesianIntcos()
 
-                    if op.Params.opt_coordinates in ['REDUNDANT', 'BOTH']:
-                        oMolsys.addIntcosFromConnectivity(connectivity)
+                    addIntcos.addFrozenAndFixedIntcos(oMolsys) # make sure these are in the set
 
-                    if op.Params.opt_coordinates in ['CARTESIAN', 'BOTH']:
-                        oMolsys.addCartesianIntcos()
+                    if op.Params.opt_coordinates in ['DELOCALIZED', 'NATURAL']:
+                        oMolsys.formCombinationIntcos(op.Params.opt_coordinates == 'NATURAL')
 
-                    addIntcos.addFrozenAndFixedIntcos(oMolsys) # make sure these are in the set
+                    if op.Params.frag_mode == 'MULTI' and op.Params.opt_coordinates != 'CARTESIAN' \
+                            and not fromTemplate:
+                        oMolsys.addDimerFrags()
+                    oMolsys.restrictPointGroup()
                     oMolsys.printIntcos()
 
+                    if op.Params.topology_write:
+                        topology.writeTemplate(op.Params.topology_write,
+                                               topology.exportTemplate(oMolsys, input_geom))
+                    if op.Params.generate_intcos_exit:
+                        optimize_log.info("\tCoordinates generated; stopping as requested.")
+                        json_original = o_json._get_original(oMolsys.geom)
+                        json_original["success"] = True
+                        oMolsys.clear()
+                        del op.Params
+                        return json_original
+
+                if transfer is not None:
+                    H, restartGradient = transferToNewCoordinates(oMolsys, *transfer)
+                    transfer = None
+
+                if op.Params.opt_type == 'IRC' and op.Params.irc_algorithm == 'HPC':
+                    H, gX, completed = followIRCpredictorCorrector(oMolsys, o_json, ts_data)
+                    if not completed:
+                        raise OptError("Maximum number of steps exceeded: {}.".format(
+                                       op.Params.geom_maxiter))
+                    raise IRCendReached()
+
                 # Do special initial step-0 for each IRC point.
                 # For IRC point, we form/get the Hessian now.
                 if op.Params.opt_type == 'IRC':
@@ -112,17 +177,18 @@ def optimize(oMolsys, options_in, json_in=None):
                         #C = addIntcos.connectivityFromDistances(oMolsys.geom, oMolsys.Z)
                         #H = hessian.guess(oMolsys.intcos, oMolsys.geom, oMolsys.Z, C, op.Params.intrafrag_hess)
 
-                        # TODO: Use computed Hessian.
-                        Hcart = get_hessian(oMolsys.geom, o_json, printResults=False)
-                        E = get_energy(oMolsys.geom, o_json, nuc=False)
-                        (E, gX), qcjson  = get_gradient(oMolsys.geom, o_json, wantNuc=False)
-                        H = intcosMisc.convertHessianToInternals(Hcart, oMolsys.intcos, oMolsys.geom)
+                        if ts_data is None:
+                            (E, gX), qcjson  = get_gradient(oMolsys.geom, o_json, wantNuc=False)
+                            Hcart = get_initial_hessian(oMolsys, o_json, gX=gX)
+                        else:
+                            Hcart, E, gX = ts_data['hessian'], ts_data['energy'], ts_data['gradient']
+                        H = oMolsys.convertHessianToInternals(Hcart)
                         optimize_log.debug(printMatString(H, title="Transformed Hessian in internal coordinates."))
 
                         # Add the transition state as the first IRC point
                         x_0 = oMolsys.geom
-                        q_0 = intcosMisc.qValues(oMolsys.intcos, x_0)
-                        f_x = np.zeros(len(oMolsys.geom))
+                        q_0 = oMolsys.qValues(x_0)
+                        f_x = np.zeros(oMolsys.geom.size)
                         f_q = np.zeros(len(oMolsys.intcos))
                         #f_q = np.array( for debugging with C++ code
                         #    [0.000003625246638, -0.000060308327958, 0.000003625246638,
@@ -132,14 +198,13 @@ def optimize(oMolsys, options_in, json_in=None):
                         IRCstepNumber += 1
 
                         # Lowest eigenvector of mass-weighted Hessian.
-                        G = intcosMisc.Gmat(oMolsys.intcos, oMolsys.geom, oMolsys.masses)
-                        G_root = symmMatRoot(G)
+                        G_root = oMolsys.Groot(massWeight=True)
                         H_q_m = np.dot(np.dot(G_root, H), G_root.T)
                         vM = lowestEigenvectorSymmMat(H_q_m)
                         optimize_log.info(printArrayString(vM, title="Lowest evect of H_q_M"))
 
                         # Un mass-weight vector.
-                        G_root_inv = symmMatInv(G_root)
+                        G_root_inv = oMolsys.Groot(massWeight=True, Inverse=True)
                         v = np.dot(G_root_inv, vM)
 
                         if op.Params.irc_direction == 'BACKWARD':
@@ -164,22 +229,40 @@ def optimize(oMolsys, options_in, json_in=None):
                 for stepNumber in range(op.Params.alg_geom_maxiter):
                     optimize_log.info("Beginning algorithm loop, step number %d" % stepNumber) 
                     totalStepsTaken += 1
+                    # relax the environment on the cheap backend, corrected by the last gradient
+                    if op.Params.core_atoms and stepNumber > 0:
+                        DE_env = layered.relaxEnvironment(oMolsys, xyz, gX)[1]
+                        # the relaxation is part of the energy change of the last step
+                        lastStep = history.oHistory.steps[-1] if history.oHistory.steps else None
+                        if lastStep is not None and lastStep.projectedDE is not None:
+                            lastStep.projectedDE += DE_env
+
                     # compute energy and gradient
                     xyz = oMolsys.geom.copy()
-                    (E, gX, nuc), qcjson = get_gradient(xyz, o_json, printResults=False, wantNuc=True)
+                    if restartGradient is not None:
+                        # computed at this geometry before the coordinates were changed
+                        (E, gX, nuc), qcjson = restartGradient
+                        restartGradient = None
+                    else:
+                        (E, gX, nuc), qcjson = get_gradient(xyz, o_json, printResults=False,
+                                                            wantNuc=True)
                     oMolsys.geom = xyz  # use setter function to save data in fragments
+                    oMolsys.checkPointGroup(op.Params.point_group_tol)
+                    gX = oMolsys.symmetrizeVector(gX)
                     printGeomGrad(oMolsys.geom, gX)
                     energies.append(E)
 
-                    if op.Params.test_B:
-                        testB.testB(oMolsys.intcos, oMolsys.geom)
-                    if op.Params.test_derivative_B:
-                        testB.testDerivativeB(oMolsys.intcos, oMolsys.geom)
+                    for F in oMolsys._fragments:
+                        if op.Params.test_B:
+                            testB.testB(F.intcos, F.geom)
+                        if op.Params.test_derivative_B:
+                            testB.testDerivativeB(F.intcos, F.geom)
 
-                    B = intcosMisc.Bmat(oMolsys.intcos, oMolsys.geom)
-                    optimize_log.debug(printMatString(B, title="B matrix"))
+                    if op.Params.print_lvl >= 3:
+                        B = oMolsys.Bmat()
+                        optimize_log.debug(printMatString(B, title="B matrix"))
 
-                    f_q = intcosMisc.qForces(oMolsys.intcos, oMolsys.geom, gX)
+                    f_q = oMolsys.qForces(gX)
                     # Check if forces indicate we are approaching minimum.
                     if op.Params.opt_type == "IRC" and IRCstepNumber > 2:
                         if ( IRCdata.history.testForIRCminimum(f_q) ):
@@ -189,7 +272,7 @@ def optimize(oMolsys, options_in, json_in=None):
                     #0.001090978572604,  -0.003640029745080], float)
                     optimize_log.info(printArrayString(f_q, title="Internal forces in au"))
 
-                    history.oHistory.append(oMolsys.geom, E, f_q, qcjson)  # Save initial step info.
+                    history.oHistory.append(oMolsys.geom, E, f_q, qcjson, gX)  # Save initial step info.
                     history.oHistory.nuclear_repulsion_energy = nuc
                     # Analyze previous step performance; adjust trust radius accordingly.
                     # Returns true on first step (no history)
@@ -222,24 +305,35 @@ def optimize(oMolsys, options_in, json_in=None):
                     # Produce Hessian via guess, update, or transformation.
                     if op.Params.opt_type != "IRC":
                         if stepNumber == 0:
-                            if op.Params.full_hess_every > -1: # compute hessian at least once. 
-                                xyz = oMolsys.geom.copy()
-                                Hcart = get_hessian( xyz, o_json, printResults=True)
-                                H = intcosMisc.convertHessianToInternals(Hcart, oMolsys.intcos, xyz)
+                            if H is not None:
+                                # carried over from the previous coordinates
+                                history.oHistory.hessianUpdate(H, oMolsys)
+                            elif op.Params.hessian_free_mode and not op.Params.cart_hess_read:
+                                H = get_mode_hessian(oMolsys, o_json, gX)
+                            # read or compute hessian at least once.
+                            elif op.Params.cart_hess_read or op.Params.full_hess_every > -1:
+                                Hcart = get_initial_hessian(oMolsys, o_json, printResults=True)
+                                H = oMolsys.convertHessianToInternals(Hcart)
                             else:
-                                C = addIntcos.connectivityFromDistances(oMolsys.geom, oMolsys.Z)
-                                H = hessian.guess(oMolsys.intcos, oMolsys.geom, oMolsys.Z, C,
-                                                  op.Params.intrafrag_hess)
+                                H = oMolsys.hessianGuess(op.Params.intrafrag_hess)
+                                if op.Params.hessian_library:
+                                    hessianLibrary.warmStart(oMolsys, H)
                         else: # not IRC, not first step
-                            if op.Params.full_hess_every < 1:
-                                history.oHistory.hessianUpdate(H, oMolsys.intcos)
-                            elif stepNumber % op.Params.full_hess_every == 0:
-                                xyz = copy.deepcopy(oMolsys.geom)
-                                Hcart = get_hessian( xyz, o_json, printResults=False)
-                                H = intcosMisc.convertHessianToInternals(
-                                    Hcart, oMolsys.intcos, xyz)
+                            if op.Params.full_hess_every > 0 and \
+                                    stepNumber % op.Params.full_hess_every == 0:
+                                if op.Params.hessian_free_mode:
+                                    history.oHistory.hessianUpdate(H, oMolsys)
+                                    guess = history.oHistory[-2].followedUnitVector \
+                                        if len(history.oHistory) > 1 else None
+                                    H = get_mode_hessian(oMolsys, o_json, gX, H, guess)
+                                else:
+                                    xyz = copy.deepcopy(oMolsys.geom)
+                                    Hcart = get_hessian( xyz, o_json, printResults=False)
+                                    H = oMolsys.convertHessianToInternals(Hcart)
+                            elif op.Params.h_guess_every:
+                                H = oMolsys.hessianGuess(op.Params.intrafrag_hess)
                             else:
-                                history.oHistory.hessianUpdate(H, oMolsys.intcos)
+                                history.oHistory.hessianUpdate(H, oMolsys)
                     else: # IRC
                         if stepNumber == 0:
                             if IRCstepNumber == 0:
@@ -248,23 +342,21 @@ def optimize(oMolsys, options_in, json_in=None):
                                 #history.oHistory.hessianUpdate(H, oMolsys.intcos)
                         else: # IRC, not first step
                             if op.Params.full_hess_every < 1:
-                                history.oHistory.hessianUpdate(H, oMolsys.intcos)
+                                history.oHistory.hessianUpdate(H, oMolsys)
                             elif stepNumber % op.Params.full_hess_every == 0:
                                 xyz = copy.deepcopy(oMolsys.geom)
                                 Hcart = get_hessian( xyz, o_json, printResults=False)
-                                H = intcosMisc.convertHessianToInternals(
-                                    Hcart, oMolsys.intcos, xyz)
+                                H = oMolsys.convertHessianToInternals(Hcart)
                             else:
-                                history.oHistory.hessianUpdate(H, oMolsys.intcos)
+                                history.oHistory.hessianUpdate(H, oMolsys)
 
 
                     if op.Params.print_lvl >= 4:
                         hessian.show(H, oMolsys.intcos)
 
-                    intcosMisc.applyFixedForces(oMolsys, f_q, H, stepNumber)
-                    intcosMisc.projectRedundanciesAndConstraints(oMolsys.intcos, oMolsys.geom,
-                                                                 f_q, H)
-                    intcosMisc.qShowValues(oMolsys.intcos, oMolsys.geom)
+                    intcosMisc.applyFixedForces(oMolsys, f_q, H)
+                    oMolsys.projectRedundanciesAndConstraints(f_q, H)
+                    oMolsys.qShowValues()
 
                     if op.Params.opt_type == 'IRC':
                         DqGuess = IRCdata.history.q_pivot() - IRCdata.history.q()
@@ -282,15 +374,16 @@ def optimize(oMolsys, options_in, json_in=None):
                             arcDistStep  = IRCfollowing.calcArcDistStep(oMolsys)
 
                             IRCdata.history.add_irc_point(IRCstepNumber,
-                                intcosMisc.qValues(oMolsys.intcos, oMolsys.geom),
+                                oMolsys.qValues(),
                                 oMolsys.geom,
-                                intcosMisc.qForces(oMolsys.intcos, oMolsys.geom, gX),
+                                oMolsys.qForces(gX),
                                 np.multiply(-1, gX),
                                 energies[-1], lineDistStep, arcDistStep)
-                            IRCdata.history.progress_report()
 
                     else:  #not IRC.
                         converged = convCheck.convCheck(stepNumber, oMolsys, Dq, f_q, energies)
+                        if converged and op.Params.core_atoms:
+                            converged = layered.environmentConverged(gX)
                         optimize_log.info("\tConvergence check returned %s" % converged)
                     
                     if converged:  # changed from elif when above if statement active
@@ -332,14 +425,33 @@ def optimize(oMolsys, options_in, json_in=None):
                 optimize_log.error("\n\tCaught AlgError exception\n")
                 eraseHistory = False
                 eraseIntcos = False
-
-                if AF.linearBends:
+                # The Hessian is kept in cartesians, to be transformed to the new coordinates.
+                # Before its first update it is only the guess, which is made again instead.
+                if H is not None and op.Params.opt_type != 'IRC' and len(history.oHistory) > 1:
+                    transfer = (oMolsys.convertHessianToCartesians(H),
+                                hessianLibrary.coordinateKeys(oMolsys), AF.linearBends)
+
+                if AF.linearBends and op.Params.opt_coordinates in ['DELOCALIZED', 'NATURAL']:
+                    # Add the linear bends to the primitives and form new combinations.
+                    for F in oMolsys._fragments:
+                        F._intcos[:] = F.primitiveIntcos()
+                    for l in AF.linearBends:
+                        F, atoms = addIntcos.fragmentLocalAtoms(l.atoms, oMolsys)
+                        l = bend.Bend(*atoms, bendType=l.bendType)
+                        if l.bendType == "LINEAR":
+                            intcosMisc.removeOldNowLinearBend(l.atoms,
+                                                              oMolsys._fragments[F].intcos)
+                        if l not in oMolsys._fragments[F].intcos:
+                            oMolsys._fragments[F].intcos.append(l)
+                    oMolsys.formCombinationIntcos(op.Params.opt_coordinates == 'NATURAL')
+                    eraseHistory = True
+                elif AF.linearBends:
                     # New linear bends detected; Add them, and continue at current level.
                     # from . import bend # import not currently being used according to IDE
                     for l in AF.linearBends:
                         if l.bendType == "LINEAR":  # no need to repeat this code for "COMPLEMENT"
-                            F = addIntcos.checkFragment(l.atoms, oMolsys)
-                            intcosMisc.removeOldNowLinearBend(l.atoms,
+                            F, atoms = addIntcos.fragmentLocalAtoms(l.atoms, oMolsys)
+                            intcosMisc.removeOldNowLinearBend(atoms,
                                                               oMolsys._fragments[F].intcos)
                     oMolsys.addIntcosFromConnectivity()
                     eraseHistory = True
@@ -362,17 +474,25 @@ def optimize(oMolsys, options_in, json_in=None):
                     optimize_log.warning("\n\t Erasing coordinates.\n")
                     for f in oMolsys._fragments:
                         del f._intcos[:]
+                    del oMolsys.dimers[:]
+                    oMolsys.clearCache(newCoordinates=True)
 
                 if eraseHistory:
-                    optimize_log.warning("\n\t Erasing history.\n")
                     stepNumber = 0
-                    del H
-                    del history.oHistory[:]  # delete steps in history
-                    history.oHistory.stepsSinceLastHessian = 0
-                    history.oHistory.consecutiveBacksteps = 0
+                    H = None
+                    if transfer is None:
+                        optimize_log.warning("\n\t Erasing history.\n")
+                        del history.oHistory[:]  # delete steps in history
+                        history.oHistory.stepsSinceLastHessian = 0
+                        history.oHistory.consecutiveBacksteps = 0
 
         # print summary
         logging.info("\tOptimization Finished\n" + history.summaryString())
+        if op.Params.hessian_write:
+            hessianFile.writeCartesianHessian(op.Params.hessian_file,
+                oMolsys.convertHessianToCartesians(H, history.oHistory[-1].geom))
+        if op.Params.hessian_library:
+            hessianLibrary.store(oMolsys, H)
         output_dict = o_json.generate_json_output(history.oHistory[-1].geom, gX)
         json_original = o_json._get_original(oMolsys.geom)
         json_original["success"] = True
@@ -405,6 +525,10 @@ def optimize(oMolsys, options_in, json_in=None):
         optimize_log.debug(rxnpath)
         json_original['properties']['IRC'] = rxnpath
         json_original["success"] = True
+        # the two branches of irc_direction BOTH would write the same file
+        if op.Params.hessian_write and ts_data is None:
+            hessianFile.writeCartesianHessian(op.Params.hessian_file,
+                oMolsys.convertHessianToCartesians(H, IRCdata.history.x(-1).reshape(-1, 3)))
 
         # delete some stuff
         del H
@@ -427,15 +551,19 @@ def optimize(oMolsys, options_in, json_in=None):
         except:
             pass
 
-        output_dict = o_json.generate_json_output(history.oHistory[-1].geom, gX)
         json_original = o_json._get_original(oMolsys.geom)
-        json_original.update(output_dict)  # may not be wise or feasable in all cases
+        # gX is not bound if the error came from followIRCpredictorCorrector(); the
+        # last step keeps its own gradient
+        if history.oHistory and history.oHistory[-1].gradient is not None:
+            output_dict = o_json.generate_json_output(history.oHistory[-1].geom,
+                                                      history.oHistory[-1].gradient)
+            json_original.update(output_dict)  # may not be wise or feasable in all cases
         json_original["error"] = repr(error)
         json_original["success"] = False
         if op.Params.opt_type == 'IRC':
             rxnpath = IRCdata.history.rxnpathDict()
             optimize_log.debug(rxnpath)
-            json_original['properties']['IRC'] = rxnpath
+            json_original.setdefault('properties', {})['IRC'] = rxnpath
 
         del history.oHistory[:]
         oMolsys.clear()
@@ -451,8 +579,9 @@ def optimize(oMolsys, options_in, json_in=None):
         optimize_log.exception("Error caught:" + str(error))
 
         json_original = o_json._get_original(oMolsys.geom)
-        if history.oHistory:
-            output_dict = o_json.generate_json_output(history.oHistory[-1].geom, gX)
+        if history.oHistory and history.oHistory[-1].gradient is not None:
+            output_dict = o_json.generate_json_output(history.oHistory[-1].geom,
+                                                      history.oHistory[-1].gradient)
             json_original.update(output_dict)
         json_original["error"] = repr(error)
         json_original["success"] = False
@@ -464,6 +593,200 @@ def optimize(oMolsys, options_in, json_in=None):
 
         return json_original
 
+def followIRCBothDirections(oMolsys, options_in, o_json):
+    """ Follows the backward and forward branches of the IRC concurrently
+    (irc_direction BOTH).
+
+    The Hessian, energy and gradient at the transition state are computed once;
+    each branch is then followed by optimize() in its own process, or in turn in a
+    daemonic process, which cannot start others.
+
+    Parameters
+    ----------
+    oMolsys : cls
+        optking molecular system, at the transition state
+    options_in : dict
+        options for QM program and optking
+    o_json : cls
+        optking's jsonSchema object
+
+    Returns
+    -------
+    dict
+        MolSSI qc_schema_output of the forward branch, with the joined path from
+        the end of the backward branch to the end of the forward branch in
+        ['properties']['IRC']
+    """
+    optimize_log = logging.getLogger(__name__)
+    optimize_log.info("Computing the transition state Hessian and gradient for both IRC branches.\n")
+    (E, gX, nuc), qcjson = get_gradient(oMolsys.geom, o_json, wantNuc=True)
+    Hcart = get_initial_hessian(oMolsys, o_json, gX=gX)
+    ts_data = {'hessian': Hcart, 'energy': E, 'gradient': gX, 'nuc': nuc, 'qcjson': qcjson}
+
+    if _canStartProcesses():
+        # imported here, since multiprocessing is slow to import and rarely needed
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            branches = [pool.submit(_followIRCBranch, oMolsys, options_in, o_json, direction, ts_data)
+                        for direction in ('BACKWARD', 'FORWARD')]
+            branches = [b.result() for b in branches]
+    else:
+        optimize_log.info("Following the IRC branches in turn, in a daemonic process.\n")
+        params = op.Params
+        branches = []
+        for direction in ('BACKWARD', 'FORWARD'):
+            history.resetHistory()
+            branches.append(_followIRCBranch(copy.deepcopy(oMolsys), options_in,
+                                             copy.deepcopy(o_json), direction, ts_data))
+        op.Params = params
+    (backward, backward_path), (forward, forward_path) = branches
+
+    IRCdata.history = IRCdata.joinBranches(backward_path, forward_path)
+    IRCdata.history.set_path_file(os.path.join(os.getcwd(), 'ircprogress.log'))
+    optimize_log.info("Tabulating rxnpath results for both branches.")
+    IRCdata.history.progress_report()
+
+    json_output = forward
+    json_output.setdefault('properties', {})['IRC'] = IRCdata.history.rxnpathDict()
+    json_output['success'] = backward['success'] and forward['success']
+    errors = [branch['error'] for branch in (backward, forward) if 'error' in branch]
+    if errors:
+        json_output['error'] = '; '.join(errors)
+    return json_output
+
+
+def _followIRCBranch(oMolsys, options_in, o_json, direction, ts_data):
+    # Runs in a worker process, or in turn: follow one branch and return its path as well.
+    options = {k: v for k, v in options_in.items() if k.upper() != 'IRC_DIRECTION'}
+    options['IRC_DIRECTION'] = direction
+    json_output = optimize(oMolsys, options, o_json, ts_data)
+    return json_output, IRCdata.history
+
+
+def followIRCpredictorCorrector(oMolsys, o_json, ts_data=None):
+    """ Follows the IRC from the transition state with the Hessian-based
+    predictor-corrector integrator (irc_algorithm HPC).
+
+    The first point is a step along the transition vector.  From each point, an
+    LQA predictor step is taken on the quadratic model with the current Hessian.
+    The Hessian is updated with the gradient at the predicted point, and the
+    corrector follows the path again on the distance-weighted interpolant of the
+    two quadratic models.  Energy and forces at the corrected point are taken from
+    the quadratic model about the predicted point, so each point costs one gradient.
+
+    Parameters
+    ----------
+    oMolsys : cls
+        optking molecular system, at the transition state
+    o_json : cls
+        optking's jsonSchema object
+    ts_data : dict, optional
+        Hessian, energy and gradient at the transition state; see optimize()
+
+    Returns
+    -------
+    ndarray, ndarray, bool
+        Hessian and cartesian gradient at the last point; whether the path ended
+        normally, rather than exceeding geom_maxiter gradients
+    """
+    optimize_log = logging.getLogger(__name__)
+    s = op.Params.irc_step_size
+
+    def gradient(ts_data=None):
+        xyz = oMolsys.geom.copy()
+        if ts_data is None:
+            (E, gX, nuc), qcjson = get_gradient(xyz, o_json, printResults=False, wantNuc=True)
+        else:
+            E, gX, nuc, qcjson = (ts_data[k] for k in ('energy', 'gradient', 'nuc', 'qcjson'))
+        f_q = oMolsys.qForces(gX)
+        history.oHistory.append(oMolsys.geom, E, f_q, qcjson, gX)
+        history.oHistory.nuclear_repulsion_energy = nuc
+        return E, gX, f_q
+
+    def massWeighting():
+        return oMolsys.Groot(massWeight=True), oMolsys.Groot(massWeight=True, Inverse=True)
+
+    optimize_log.info("Beginning IRC from the transition state.\n")
+    E, gX, f_q = gradient(ts_data)
+    if ts_data is None:
+        Hcart = get_initial_hessian(oMolsys, o_json, gX=gX)
+        nGradients = 1
+    else:
+        Hcart = ts_data['hessian']
+        nGradients = 0
+    H = oMolsys.convertHessianToInternals(Hcart)
+    IRCdata.history.add_irc_point(0, oMolsys.qValues(), oMolsys.geom, np.zeros(len(oMolsys.intcos)),
+                                  np.zeros(len(gX)), E)
+
+    for IRCstepNumber in range(1, op.Params.irc_points):
+        x_k, E_k, f_k, H_k = oMolsys.geom, E, f_q, H.copy()
+        G_root, G_root_inv = massWeighting()
+        H_M = np.dot(np.dot(G_root, H_k), G_root)
+
+        # Predictor
+        if IRCstepNumber == 1:
+            optimize_log.info("\tStepping along lowest Hessian eigenvector.\n")
+            vM = lowestEigenvectorSymmMat(H_M)
+            if op.Params.irc_direction == 'BACKWARD':
+                vM *= -1
+            dq_M, arc = s * vM, s
+        else:
+            optimize_log.info("\tTaking LQA predictor step.\n")
+            dq_M, arc = IRCfollowing.lqaStep(np.dot(G_root, -f_k), H_M, s)
+        dq = np.dot(G_root, dq_M)
+        displaceMolsys(oMolsys, dq)
+        E, gX, f_q = gradient()
+        nGradients += 1
+        oMolsys.projectRedundanciesAndConstraints(f_q, H)
+
+        if IRCstepNumber > 2 and IRCdata.history.testForIRCminimum(f_q):
+            optimize_log.info("A mininum has been reached on the IRC.  Stopping here.\n")
+            return H, gX, True
+        history.oHistory.hessianUpdate(H, oMolsys)
+
+        # Corrector.  The first path leaves the transition state along the transition
+        # vector; the residual gradient at the transition state is removed from both
+        # models, as a linear tilt of the surface, so that the path starts stationary.
+        optimize_log.info("\tTaking DWI corrector step.\n")
+        g_M = np.dot(G_root, -f_k)
+        tilt = g_M if IRCstepNumber == 1 else np.zeros(len(g_M))
+        y_p = np.dot(G_root_inv, dq)
+        points = [(np.zeros(len(dq)), E_k, g_M - tilt, H_M),
+                  (y_p, E - np.dot(tilt, y_p), np.dot(G_root, -f_q) - tilt,
+                   np.dot(np.dot(G_root, H), G_root))]
+        dq = np.dot(G_root, IRCfollowing.dwiStep(points, arc, v_start=dq_M / np.linalg.norm(dq_M)))
+        x_p = oMolsys.geom
+        oMolsys.geom = x_k
+        displaceMolsys(oMolsys, dq)
+
+        # Energy and forces at the corrected point from the quadratic model about
+        # the predicted point; no further gradient is computed.
+        d = oMolsys.qValues() - oMolsys.qValues(x_p)
+        E = E - np.dot(f_q, d) + 0.5 * np.dot(d, np.dot(H, d))
+        f_q = f_q - np.dot(H, d)
+        gX = -np.dot(oMolsys.Bmat().T, f_q)
+
+        if op.Params.full_hess_every > 0 and IRCstepNumber % op.Params.full_hess_every == 0:
+            Hcart = get_hessian(oMolsys.geom, o_json, printResults=False)
+            H = oMolsys.convertHessianToInternals(Hcart)
+
+        lineDistStep = IRCfollowing.calcLineDistStep(oMolsys)
+        IRCdata.history.add_irc_point(IRCstepNumber, oMolsys.qValues(), oMolsys.geom, f_q,
+                                      np.multiply(-1, gX), E, lineDistStep, arc)
+
+        if IRCdata.history.testForIRCminimum(f_q):
+            optimize_log.info("A mininum has been reached on the IRC.  Stopping here.\n")
+            return H, gX, True
+
+        if nGradients >= op.Params.geom_maxiter:
+            optimize_log.error("\tTotal number of gradients (%d) exceeds maximum allowed (%d).\n"
+                               % (nGradients, op.Params.geom_maxiter))
+            return H, gX, False
+
+    optimize_log.info("\tThe requested (%d) IRC points have been obtained." % op.Params.irc_points)
+    return H, gX, True
+
+
 # TODO move these elsewhere
 # TODO need to activate printResults for get_x methods
 def get_gradient(new_geom, o_json, printResults=False, wantNuc=True, QM='psi4'):
@@ -521,6 +844,196 @@ def get_hessian(new_geom, o_json, printResults=False, QM='psi4'):
     return np.array(o_json.get_JSON_result(json_output, 'hessian'))
 
 
+def get_initial_hessian(oMolsys, o_json, printResults=False, gX=None):
+    """ Cartesian Hessian at the start of an optimization or IRC: read from
+    op.Params.hessian_file if op.Params.cart_hess_read, else computed, or with
+    op.Params.hessian_free_mode, the model Hessian corrected along the lowest mode.
+
+    Parameters
+    ----------
+    oMolsys : cls
+        optking molecular system
+    o_json : object
+        instance of optking's jsonSchema class
+    printResults : Boolean, optional
+        flag to print the hessian
+    gX : ndarray, optional
+        cartesian gradient at the current geometry, for op.Params.hessian_free_mode;
+        computed if not given
+
+    Returns
+    -------
+    ndarray
+        (3nat, 3nat) hessian in cartesians
+    """
+    if op.Params.cart_hess_read:
+        return hessianFile.readCartesianHessian(op.Params.hessian_file, oMolsys.Natom)
+    if op.Params.hessian_free_mode:
+        if gX is None:
+            (E, gX), qcjson = get_gradient(oMolsys.geom, o_json, wantNuc=False)
+        if not oMolsys.intcos:
+            # e.g. at the transition state of irc_direction BOTH, before the
+            # coordinates of the branches are chosen
+            oMolsys = copy.deepcopy(oMolsys)
+            oMolsys.addIntcosFromConnectivity()
+        return oMolsys.convertHessianToCartesians(get_mode_hessian(oMolsys, o_json, gX))
+    return get_hessian(oMolsys.geom.copy(), o_json, printResults)
+
+
+def get_mode_hessian(oMolsys, o_json, gX, H=None, guess=None):
+    """ Internal coordinate Hessian corrected along the lowest mode, which is
+    found from gradient differences; see lowestMode.
+
+    Parameters
+    ----------
+    oMolsys : cls
+        optking molecular system
+    o_json : object
+        instance of optking's jsonSchema class
+    gX : ndarray
+        cartesian gradient at the current geometry
+    H : ndarray, optional
+        Hessian to correct; the model guess by default
+    guess : ndarray, optional
+        approximate lowest mode
+
+    Returns
+    -------
+    ndarray
+        internal coordinate Hessian
+    """
+    if H is None:
+        H = oMolsys.hessianGuess(op.Params.intrafrag_hess)
+        if op.Params.hessian_library:
+            hessianLibrary.warmStart(oMolsys, H)
+    # one pool of processes computes the gradients of all the blocks
+    pool = None
+    if op.Params.mode_block > 1 and _canStartProcesses():
+        # imported here, since multiprocessing is slow to import and rarely needed
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=op.Params.mode_block)
+    try:
+        H, v, curvature, nGradients = lowestMode.lowestMode(
+            oMolsys, gX, H, lambda geoms: get_gradients(geoms, o_json, pool), guess)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    logging.getLogger(__name__).info(
+        "\tLowest mode found with %d gradients; curvature %12.8f" % (nGradients, curvature))
+    return H
+
+
+def get_gradients(geoms, o_json, pool=None):
+    """ Cartesian gradients at several geometries, computed concurrently by the
+    processes of pool, or in turn.
+
+    Parameters
+    ----------
+    geoms : list
+        (nat, 3) geometries
+    o_json : object
+        instance of optking's jsonSchema class
+    pool : concurrent.futures.Executor, optional
+        processes that compute the gradients; in this process if None
+
+    Returns
+    -------
+    list
+        (3nat, ) cartesian gradients
+    """
+    if pool is None or len(geoms) == 1:
+        return [_cartesianGradient(geom, o_json) for geom in geoms]
+    return list(pool.map(_cartesianGradient, geoms, [o_json] * len(geoms)))
+
+
+def _cartesianGradient(geom, o_json):
+    # Runs in a worker process of get_gradients().
+    (E, gX), qcjson = get_gradient(geom, o_json, wantNuc=False)
+    return np.asarray(gX, float).ravel()
+
+
+def _canStartProcesses():
+    """ Whether this process may start worker processes; daemonic processes, e.g.
+    the workers of the optimization service, may not. """
+    # imported here, since multiprocessing is slow to import and rarely needed
+    import multiprocessing
+    return not multiprocessing.current_process().daemon
+
+
+def transferToNewCoordinates(oMolsys, Hcart, oldKeys, linearBends=None):
+    """ Carries the Hessian and the history of an optimization into new
+    coordinates, after an AlgError changed them, so that no gradient
+    information is lost.  Simple coordinates that are new to the set, such as
+    torsions through a new linear bend, take the model guess instead, since
+    the old coordinates need not describe their curvature.
+
+    Over a change to linear bends only the Hessian is carried: the torsions
+    through the bends need not be defined at the geometries of the history.
+    The coordinates that contain the atoms of such a bend take the guess too,
+    which limits the first step along them, as the old curvature would take
+    the bend straight through linearity.
+
+    Parameters
+    ----------
+    oMolsys : Molsys
+        molecular system with the new coordinates
+    Hcart : ndarray
+        cartesian Hessian at the current geometry, from the old coordinates
+    oldKeys : list
+        hessianLibrary.coordinateKeys() of the old coordinates
+    linearBends : list(Bend), optional
+        bends, in atom numbering of the molecular system, that became linear
+
+    Returns
+    -------
+    ndarray or None, tuple or None
+        Hessian in the new coordinates, or None if the history could not be
+        kept and was erased; and the ((E, gX, nuc), qcjson) of the last step if
+        its geometry is the current one, so that its gradient is not computed again
+    """
+    optimize_log = logging.getLogger(__name__)
+    keepHistory = not linearBends and history.oHistory.reexpress(oMolsys)
+    if not keepHistory:
+        optimize_log.warning("\n\t Erasing history.\n")
+        del history.oHistory[:]
+        history.oHistory.stepsSinceLastHessian = 0
+        history.oHistory.consecutiveBacksteps = 0
+        if not linearBends:
+            return None, None
+        optimize_log.info("\tTransformed the Hessian to the new coordinates.\n")
+    else:
+        optimize_log.info("\tTransformed the Hessian and %d steps of history to the new coordinates.\n"
+                          % len(history.oHistory))
+
+    H = oMolsys.convertHessianToInternals(Hcart)
+    old = set(oldKeys)
+    new = [i for i, key in enumerate(hessianLibrary.coordinateKeys(oMolsys))
+           if key is not None and key not in old]
+    if linearBends:
+        bendAtoms = [set(b.atoms) for b in linearBends]
+        i = 0
+        for iF, F in enumerate(oMolsys._fragments):
+            first = oMolsys.frag_1st_atom(iF)
+            for intco in F.intcos:
+                atoms = set(first + a for a in getattr(intco, 'atoms', ()))
+                if any(b <= atoms for b in bendAtoms) and i not in new:
+                    new.append(i)
+                i += 1
+    if new:
+        H_guess = oMolsys.hessianGuess(op.Params.intrafrag_hess)
+        H[new, :] = H_guess[new, :]
+        H[:, new] = H_guess[:, new]
+    if not keepHistory:
+        return H, None
+    last = history.oHistory[-1]
+    if not np.array_equal(last.geom, oMolsys.geom):
+        return H, None
+    # the step is appended again when its gradient is reused
+    del history.oHistory[-1]
+    history.History.stepsSinceLastHessian -= 1
+    return H, ((last.E, last.gradient, history.oHistory.nuclear_repulsion_energy), last.qcout)
+
+
 def get_energy(new_geom, o_json, printResults=False, nuc=True, QM='psi4'):
     """ Use JSON interface to have QM program perform energy calculation
     Only psi4 is current implemented
@@ -31,10 +31,11 @@ def stringOption(storage_name):
 # The keys on the left here should be lower-case, as should the storage name of the property.
 allowedStringOptions = {
     'opt_type': ('MIN', 'TS', 'IRC'),
-    'step_type': ('RFO', 'P_RFO', 'NR', 'SD', 'LINESEARCH'),
+    'step_type': ('RFO', 'P_RFO', 'NR', 'SD', 'LINESEARCH', 'GDIIS', 'GEDIIS'),
     'opt_coordinates': ('REDUNDANT', 'INTERNAL', 'DELOCALIZED', 'NATURAL', 'CARTESIAN',
                         'BOTH'),
-    'irc_direction': ('FORWARD', 'BACKWARD'),
+    'irc_direction': ('FORWARD', 'BACKWARD', 'BOTH'),
+    'irc_algorithm': ('GS', 'HPC'),
     'g_convergence': ('QCHEM', 'MOLPRO', 'GAU', 'GAU_LOOSE', 'GAU_TIGHT', 'GAU_VERYTIGHT',
                       'TURBOMOLE', 'CFOUR', 'NWCHEM_LOOSE'),
     'hess_update': ('NONE', 'BFGS', 'MS', 'POWELL', 'BOFILL'),
@@ -55,13 +56,14 @@ class OptParams(object):
     step_type = stringOption('step_type')
     opt_coordinates = stringOption('opt_coordinates')
     irc_direction = stringOption('irc_direction')
+    irc_algorithm = stringOption('irc_algorithm')
     g_convergence = stringOption('g_convergence')
     hess_update = stringOption('hess_update')
     intrafrag_hess = stringOption('intrafrag_hess')
     frag_mode = stringOption('frag_mode')
 
     # interfrag_mode  = stringOption( 'interfrag_mode' )
-    # interfrag_hess  = stringOption( 'interfrag_hess' )
+    interfrag_hess = stringOption('interfrag_hess')
 
     def __str__(P):
         s = "\n\t\t -- Optimization Parameters --\n"
@@ -90,6 +92,8 @@ class OptParams(object):
         P.opt_type = uod.get('OPT_TYPE', 'MIN')
         # Geometry optimization step type, e.g., Newton-Raphson or Rational Function Optimization
         P.step_type = uod.get('STEP_TYPE', 'RFO')
+        # Number of previous geometries combined by GDIIS and GEDIIS steps.
+        P.diis_max_vecs = uod.get('DIIS_MAX_VECS', 5)
         # Geometry optimization coordinates to use.
         # REDUNDANT and INTERNAL are synonyms and the default.
         # DELOCALIZED are the coordinates of Baker.
@@ -103,6 +107,8 @@ class OptParams(object):
         P.rfo_root = uod.get('RFO_ROOT', 0)
         # Whether to accept geometry steps that lower the molecular point group.
         P.accept_symmetry_breaking = uod.get('ACCEPT_SYMMETRY_BREAKING', False)
+        # Tolerance [a0] for the detection of the molecular point group.
+        P.point_group_tol = uod.get('POINT_GROUP_TOL', 1.0e-3)
         # Starting level for dynamic optimization (0=nondynamic, higher=>more conservative)
         P.dynamic_level = uod.get('DYNAMIC_LEVEL', 0)
         if P.dynamic_level == 0:  # don't change parameters
@@ -111,10 +117,16 @@ class OptParams(object):
             P.dynamic_level_max = uod.get('DYNAMIC_LEVEL_MAX', 7)  # 7 level currently defined
         # IRC step size in bohr(amu)\ $^{1/2}$.
         P.irc_step_size = uod.get('IRC_STEP_SIZE', 0.2)
-        # IRC mapping direction
+        # IRC mapping direction.  BOTH follows the two branches from the transition
+        # state in parallel processes, sharing one Hessian and gradient at the TS.
         P.irc_direction = uod.get('IRC_DIRECTION', 'FORWARD')
         # Decide when to stop IRC calculations
-        P.irc_points = uod.get('IRC_POINTS', '10')
+        P.irc_points = uod.get('IRC_POINTS', 10)
+        # IRC integrator.  GS is the constrained optimization of Gonzalez and Schlegel
+        # on a hypersphere for each point.  HPC is the Hessian-based predictor-corrector
+        # of Hratchian and Schlegel, which updates the Hessian along the path and takes
+        # one gradient per point.
+        P.irc_algorithm = uod.get('IRC_ALGORITHM', 'GS')
         #
         # Initial maximum step size in bohr or radian along an internal coordinate
         P.intrafrag_trust = uod.get('INTRAFRAG_STEP_LIMIT', 0.5)
@@ -123,7 +135,7 @@ class OptParams(object):
         # Upper bound for dynamic trust radius [au]
         P.intrafrag_trust_max = uod.get('INTRAFRAG_STEP_LIMIT_MAX', 1.0)
         # Maximum step size in bohr or radian along an interfragment coordinate
-        # P.interfrag_trust = uod.get('INTERFRAG_TRUST', 0.5)
+        P.interfrag_trust = uod.get('INTERFRAG_TRUST', 0.5)
         # Reduce step size as necessary to ensure convergence of back-transformation of
         # internal coordinate step to cartesian coordinates.
         # P.ensure_bt_convergence = uod.get('ENSURE_BT_CONVERGENCE', False)
@@ -165,10 +177,28 @@ class OptParams(object):
         fixed = uod.get("FIXED_DIHEDRAL", "")
         P.fixed_dihedral = intIntIntIntFloatList(tokenizeInputString(fixed))
         #
+        # SUBSECTION Layered optimization.
+        # Atoms optimized on the expensive gradient; all others are relaxed in
+        # microiterations on the cheap backend (see layered.py).  None by default.
+        P.core_atoms = intList(tokenizeInputString(uod.get('CORE_ATOMS', '')))
+        # Largest number of microiterations in one relaxation of the environment.
+        P.micro_maxiter = uod.get('MICRO_MAXITER', 500)
+        # Largest cartesian force [Eh/a0] on the environment after its relaxation.
+        P.micro_g_convergence = uod.get('MICRO_G_CONVERGENCE', 1.0e-5)
+        # Largest displacement [a0] of an environment atom in one relaxation; the
+        # trust radius of the core steps also limits it.
+        P.micro_trust = uod.get('MICRO_TRUST', 0.5)
+        # Number of steps kept by the L-BFGS microiterations.
+        P.micro_history = uod.get('MICRO_HISTORY', 10)
+        # Parameters of the Lennard-Jones potential 4 epsilon [(sigma/r)^12 - (sigma/r)^6]
+        # of the default cheap backend: sigma [a0] and epsilon [Eh].
+        P.lj_sigma = uod.get('LJ_SIGMA', 6.0)
+        P.lj_epsilon = uod.get('LJ_EPSILON', 4.0e-4)
+        #
         # Should an xyz trajectory file be kept (useful for visualization)?
         # P.print_trajectory_xyz = uod.get('PRINT_TRAJECTORY_XYZ', False)
         # Symmetry tolerance for testing whether a mode is symmetric.
-        # P.symm_tol("SYMM_TOL", 0.05)
+        P.symm_tol = uod.get('SYMM_TOL', 0.05)
         #
         # SUBSECTION Convergence Control.
         # Set of optimization criteria. Specification of any MAX_*_G_CONVERGENCE
@@ -211,9 +241,26 @@ class OptParams(object):
         P.hess_update_dq_tol = 0.5
 
         # SUBSECTION Using external Hessians
-        # Do read Cartesian Hessian?  Only for experts - use
-        # |optking__full_hess_every| instead.
+        # Do read the initial Cartesian Hessian from |optking__hessian_file|, e.g. from a
+        # frequency job, instead of computing it?  Used for the first step of an
+        # optimization and at the start of an IRC; |optking__full_hess_every| recomputes.
         P.cart_hess_read = uod.get('CART_HESS_READ', False)
+        # File of the cartesian Hessian read for |optking__cart_hess_read| and written
+        # for |optking__hessian_write|.  A .npy file is numpy binary, read memory-mapped;
+        # any other name is text, as written by psi4 for a frequency job.
+        P.hessian_file = uod.get('HESSIAN_FILE', 'optking.hess')
+        # Do write the final Hessian, transformed to cartesians, to |optking__hessian_file|?
+        P.hessian_write = uod.get('HESSIAN_WRITE', False)
+        # Directory of a library of converged internal coordinate Hessians.  If given, a
+        # guessed initial Hessian takes the force constants of the coordinates shared with
+        # the closest entry, and the final Hessian is saved as a new entry.
+        P.hessian_library = uod.get('HESSIAN_LIBRARY', None)
+        # Fraction of the coordinates that must be shared with a library entry to use it.
+        P.hessian_library_min_overlap = uod.get('HESSIAN_LIBRARY_MIN_OVERLAP', 0.5)
+        # Maximum number of entries and total size in megabytes of the library; the least
+        # recently used entries are removed beyond these.
+        P.hessian_library_max_entries = uod.get('HESSIAN_LIBRARY_MAX_ENTRIES', 1000)
+        P.hessian_library_max_size = uod.get('HESSIAN_LIBRARY_MAX_SIZE', 100.0)
         # Frequency with which to compute the full Hessian in the course
         # of a geometry optimization. 0 means to compute the initial Hessian only,
         # 1 means recompute every step, and N means recompute every N steps. The
@@ -223,6 +270,17 @@ class OptParams(object):
         P.intrafrag_hess = uod.get('INTRAFRAG_HESS', 'SCHLEGEL')
         # Re-estimate the Hessian at every step, i.e., ignore the currently stored Hessian.
         P.h_guess_every = uod.get('H_GUESS_EVERY', False)
+        # Do find the lowest mode from gradient differences, and correct the model
+        # Hessian along it, instead of computing full Hessians?  Used for the initial
+        # Hessian, those of |optking__full_hess_every|, and at the start of an IRC.
+        P.hessian_free_mode = uod.get('HESSIAN_FREE_MODE', False)
+        # Displacement [a0 or rad] of the gradient differences along trial vectors.
+        P.mode_fd_step = uod.get('MODE_FD_STEP', 0.005)
+        # Number of trial vectors, and of concurrent gradients, in each iteration.
+        P.mode_block = uod.get('MODE_BLOCK', 2)
+        # Maximum number of iterations, and residual norm [au] of the converged mode.
+        P.mode_max_iter = uod.get('MODE_MAX_ITER', 8)
+        P.mode_tol = uod.get('MODE_TOL', 1.0e-3)
 
         P.working_steps_since_last_H = 0
         #
@@ -235,8 +293,12 @@ class OptParams(object):
         # coordinates. A primary difference is that in ``MULTI`` mode, the interfragment
         # coordinates are not redundant.
         P.frag_mode = uod.get('FRAG_MODE', 'SINGLE')
-        # Which atoms define the reference points for interfragment coordinates?
-        # P.frag_ref_atoms = uod.get('FRAG_REF_ATOMS', '')
+        # In ``MULTI`` mode, the B matrix, G inverse and projections are built for each
+        # fragment separately.  Number of threads used to work on fragments concurrently.
+        P.frag_threads = uod.get('FRAG_THREADS', 1)
+        # Which atoms define the reference points for interfragment coordinates?  For each
+        # fragment, a list of up to three reference points, each a list of (1-based) atoms.
+        P.frag_ref_atoms = uod.get('FRAG_REF_ATOMS', [])
         # Do freeze all fragments rigid?
         # P.freeze_intrafrag = uod.get('FREEZE_INTRAFRAG', False)
         # Do freeze all interfragment modes?
@@ -249,9 +311,9 @@ class OptParams(object):
         # This factor times standard covalent distance is used to add extra stretch coordinates.
         # P.auxiliary_bond_factor = uod.get('AUXILIARYBOND_FACTOR', 2.5)
         # Do use 1/R for the interfragment stretching coordinate instead of R?
-        # P.interfrag_dist_inv = uod.get('INTERFRAG_DIST_INV', False)
+        P.interfrag_dist_inv = uod.get('INTERFRAG_DIST_INV', False)
         # Model Hessian to guess interfragment force constants
-        # P.interfrag_hess = uod.get('INTERFRAG_HESS', 'DEFAULT')
+        P.interfrag_hess = uod.get('INTERFRAG_HESS', 'DEFAULT')
         # When determining connectivity, a bond is assigned if interatomic distance
         # is less than (this number) * sum of covalent radii.
         P.covalent_connect = uod.get('COVALENT_CONNECT', 1.3)
@@ -264,6 +326,12 @@ class OptParams(object):
         # P.h_bond_connect = uod.get('h_bond_connect', 4.3)
         # Only generate the internal coordinates and then stop (boolean)
         P.generate_intcos_exit = uod.get('GENERATE_INTCOS_EXIT', False)
+        # File of a topology template to take the fragments and coordinates from,
+        # instead of generating them.  The template is checked against the geometry;
+        # if it does not fit, the coordinates are generated as usual.
+        P.topology_read = uod.get('TOPOLOGY_READ', None)
+        # File to save the topology template of the coordinates to, once they are chosen.
+        P.topology_write = uod.get('TOPOLOGY_WRITE', None)
         #
         #
         # SUBSECTION Misc.
@@ -278,16 +346,20 @@ class OptParams(object):
         P.test_derivative_B = uod.get('TEST_DERIVATIVE_B', False)
         # Keep internal coordinate definition file.
         P.keep_intcos = uod.get('KEEP_INTCOS', False)
-        # In constrained optimizations, for coordinates with user-specified
-        # equilibrium values, this is the initial force constant (in au) used to apply an
-        # additional force to each coordinate.
-        P.fixed_coord_force_constant = uod.get('FIXED_COORD_FORCE_CONSTANT', 0.5)
+        # Deprecated and ignored: the force constant of the penalty force that used to
+        # apply fixed coordinates, which are now reached by a projected step.
+        P.fixed_coord_force_constant = uod.get('FIXED_COORD_FORCE_CONSTANT', None)
         P.linesearch_step = uod.get('LINESEARCH_STEP', 0.100)
         # Guess at Hessian in steepest-descent direction.
         P.sd_hessian = uod.get('SD_HESSIAN', 1.0)
         #
         # --- Complicated defaults ---
         #
+        if P.core_atoms and P.opt_type == 'IRC':
+            raise OptError('Layered optimization (core_atoms) is not available for IRC.')
+        if P.core_atoms and P.frag_mode != 'SINGLE':
+            raise OptError('Layered optimization (core_atoms) requires frag_mode SINGLE.')
+
         # Assume RFO means P-RFO for transition states.
         if P.opt_type == 'TS':
             if P.step_type == 'RFO' or 'STEP_TYPE' not in uod:
@@ -314,7 +386,7 @@ class OptParams(object):
             if 'INTRAFRAG_HESS' not in uod:
                 P.intrafrag_hess = 'LINDH'
                 if 'H_GUESS_EVERY' not in uod:
-                    P.H_guess_every = False;
+                    P.h_guess_every = False
 
         # Set Bofill as default for TS optimizations.
         if P.opt_type == 'TS' or P.opt_type == 'IRC':
@@ -325,10 +397,6 @@ class OptParams(object):
         if P.opt_type == 'IRC' and 'PRINT_TRAJECTORY_XYZ_FILE' not in uod:
             P.print_trajectory_xyz_file = True
 
-        # Read cartesian Hessian by default for IRC.
-        if P.opt_type == 'IRC' and 'CART_HESS_READ' not in uod:
-            P.read_cartesian_H = True
-
         if P.generate_intcos_exit:
             P.keep_intcos = True
 
@@ -336,7 +404,6 @@ class OptParams(object):
         # Set full_hess_every to 0 if -1
         if P.opt_type == 'IRC' and P.full_hess_every < 0:
             P.full_hess_every = 0
-            P.cart_hess_read = True # not sure about this one - test
 
         # if steepest-descent, then make much larger default
         if P.step_type == 'SD' and 'CONSECUTIVE_BACKSTEPS' not in uod:
@@ -351,6 +418,11 @@ class OptParams(object):
         # P.rfo_normalization_max = 1.0e5
         # If arbitrary user forces, don't shrink step_size if Delta(E) is poor.
 
+        if P.fixed_coord_force_constant is not None:
+            logging.getLogger(__name__).warning(
+                "\tFIXED_COORD_FORCE_CONSTANT is deprecated and ignored; fixed coordinates"
+                + " are reached by a projected step instead of a penalty force.")
+
         if P.fixed_distance or P.fixed_bend or P.fixed_dihedral:
             if 'INTRAFRAGMENT_TRUST' not in uod:
                 P.intrafrag_trust = 0.1
@@ -368,7 +440,7 @@ class OptParams(object):
         # Only used for determining which atoms in a fragment are acceptable for use
         # as reference atoms.  We avoid collinear sets.
         # angle is 0/pi if the bond angle is within this fraction of pi from 0/pi
-        # P.interfrag_collinear_tol = 0.01
+        P.interfrag_collinear_tol = 0.01
 
         # Torsional angles will not be computed if the contained bond angles are within
         # this many radians of zero or 180. (< ~1 and > ~179 degrees)
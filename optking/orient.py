@@ -1,6 +1,7 @@
-from math import sin,cos,sqrt
+from math import sin,cos,sqrt,acos
 import numpy as np
 from optking import v3d
+from .exceptions import AlgError
 
 """ Tools for analytic rotation and orientation of one fragment relative to another """
 
@@ -42,7 +43,7 @@ def rotateVector(rot_axis, phi, v):
     R[2][1] =  wx * sin_phi + wy * wz * cp;
     R[2][2] =       cos_phi + wz * wz * cp;
 
-    v_new = np.dot(R, v)
+    v_new = np.dot(v, R.T)
 
     v[:] = v_new
 
@@ -89,263 +90,83 @@ def zmatPoint(A, B, C, R_CD, theta_BCD, phi_ABCD):
                         eY * sin(theta_BCD) * sin(phi_ABCD) )
     return D
 
-"""
-# We'll have to modify because not in an interfragment class
-def orient_fragment(double *dq, double *fq) {
-        orient_fragment() moves the geometry of fragment B so that the
+def orientFragment(ref_A, weightsB, B_geom, R_AB, theta_A, theta_B, tau, phi_A, phi_B):
+    """ orientFragment(): moves the geometry of fragment B rigidly so that the
         interfragment coordinates have the given values
 
     Parameters
     ----------
-    dq : numpy array float[6]
-         displacements
-    fq : numpy array float[6]
-         forces along 6 interfragment coordinates
-
-   ndA = # of ref pts on A to worry about
-   ndB = # of ref pts on B to worry about
-
-   Value at least
-    ndA   ndB
-   ------------
-     1     1     R_AB
-     2     1     + theta_A (not B)
-     1     2     + theta_B (not A)
-     2     2     + theta_A + theta_B + tau (1-2-3-4)
-     3     2     + phi_A
-     2     3     + phi_A + phi_B
-   ------------
-   
-   returns true if successful, false if not
-
-    int pts, i, xyz;
-    double tval, B_angle, R_B1B2, R_B2B3, e12[3], e12b[3], erot[3];
-    double **ref_A, **ref_B, **ref_B_final;
-
-  // fill-in unused values with defaults to make code below work
-  double R_AB, theta_A, theta_B, tau, phi_A, phi_B;
-  R_AB  = 1.0;
-  theta_A = theta_B = tau = phi_A = phi_B = _pi/2;
-
-  double *q_orig = coord_values();
-  double *q_target = init_array(Ncoord());
-
-  for (i=0; i<Ncoord(); ++i) {
-    if (D_on[i])
-      q_target[i] = q_orig[i] + dq[i];
-  }
-
-  int cnt = 0;
-  if (D_on[0]) R_AB    = q_target[cnt++];
-  if (D_on[1]) theta_A = q_target[cnt++];
-  if (D_on[2]) theta_B = q_target[cnt++];
-  if (D_on[3]) tau     = q_target[cnt++];
-  if (D_on[4]) phi_A   = q_target[cnt++];
-  if (D_on[5]) phi_B   = q_target[cnt++];
-
-  // Make labels for printing
-  std::vector<string> lbl(6);
-  for (i=0; i<6; ++i)
-    if (inter_frag->coords.simples[i]->is_frozen())
-      lbl[i] = "*";
-
-  if (inter_frag->coords.simples[0]->is_inverse_stre())
-    lbl[0] += "1/R_AB";
-  else
-    lbl[0] += "R_AB";
-  lbl[1] += "theta_A";
-  lbl[2] += "theta_B";
-  lbl[3] += "tau";
-  lbl[4] += "phi_A";
-  lbl[5] += "phi_B";
-
-  oprintf_out("\t---Interfragment coordinates between fragments %d and %d\n", A_index+1, B_index+1);
-  oprintf_out("\t---Internal Coordinate Step in ANG or DEG, aJ/ANG or AJ/DEG ---\n");
-  oprintf_out("\t ----------------------------------------------------------------------\n");
-  oprintf_out("\t Coordinate             Previous        Force       Change         New \n");
-  oprintf_out("\t ----------             --------       ------       ------       ------\n");
-
-  cnt = 0;
-  for (i=0; i<6; ++i) {
-    double val, force, change, target;
-    if (D_on[i]) {
-      val    = q_orig[cnt];
-      force  = fq[cnt];
-      change = dq[cnt];
-      target = q_target[cnt];
-
-      if (i == 0) { // change units for bond length coordinate
-        if (inter_frag->coords.simples[0]->is_inverse_stre()) { // 1/R(AB)
-          val    /= _bohr2angstroms;
-          force  /= _hartree2aJ/_bohr2angstroms;
-          change /= _bohr2angstroms;
-          target /= _bohr2angstroms;
-        }
-        else { // R(AB)
-          val    *= _bohr2angstroms;
-          force  *= _hartree2aJ/_bohr2angstroms;
-          change *= _bohr2angstroms;
-          target *= _bohr2angstroms;
-        }
-      } else { // change units for angle in degrees
-        val    *= 180.0/_pi;
-        force  *= _hartree2aJ*_pi/180.0;
-        change *= 180.0/_pi;
-        target *= 180.0/_pi;
-      }
-      oprintf_out("\t%-20s%12.5f%13.5f%13.5f%13.5f\n", lbl[i].c_str(), val, force, change, target);
-      ++cnt;
-    }
-  }
-  oprintf_out(  "\t ----------------------------------------------------------------------\n");
-
-  // copy B->geom in case this fails
-  double **B_geom = B->g_geom();
-
-  ref_A = init_matrix(3,3);
-  ref_B = init_matrix(ndB,3);
-  ref_B_final = init_matrix(ndB,3);
-
-  // stick SOMETHING in for non-specified reference atoms for zmat_point() function
-  if (ndA < 3)
-    for (xyz=0; xyz<3; ++xyz)
-      ref_A[2][xyz] = (xyz+1);
-
-  if (ndA < 2)
-    for (xyz=0; xyz<3; ++xyz)
-      ref_A[1][xyz] = (xyz+2);
-
-  // compute current location of reference points on A and B
-  for (pts=0; pts<ndA; ++pts)
-    for (i=0; i<A->natom;++i)
-      for (xyz=0; xyz<3; ++xyz)
-        ref_A[pts][xyz] += weightA[pts][i] * A->geom[i][xyz];
-
-  for (pts=0; pts<ndB; ++pts)
-    for (i=0; i<B->natom;++i)
-      for (xyz=0; xyz<3; ++xyz)
-        ref_B[pts][xyz] += weightB[pts][i] * B_geom[i][xyz];
-
-  // compute B1-B2 distance, B2-B3 distance, and B1-B2-B3 angle
-  if (ndB>1)
-    R_B1B2 = v3d_dist(ref_B[1], ref_B[0]);
-
-  if (ndB>2) {
-    R_B2B3 = v3d_dist(ref_B[2], ref_B[1]);
-    v3d_angle(ref_B[0], ref_B[1], ref_B[2], B_angle);
-  }
-
-  // determine target location of reference pts for B in coordinate system of A
-  zmat_point(ref_A[2], ref_A[1], ref_A[0], R_AB, theta_A, phi_A, ref_B_final[0]);
-  if (ndB>1)
-    zmat_point(ref_A[1], ref_A[0], ref_B_final[0], R_B1B2, theta_B, tau, ref_B_final[1]);
-  if (ndB>2)
-    zmat_point(ref_A[0], ref_B_final[0], ref_B_final[1], R_B2B3, B_angle, phi_B, ref_B_final[2]);
-
-  //oprintf_out("ref_B original location\n");
-  //oprint_matrix_out(ref_B, ndB, 3);
-  //oprintf_out("ref_B_final target\n");
-  //oprint_matrix_out(ref_B_final, ndB, 3);
-
-  // translate B->geom to place B1 in correct location
-  for (xyz=0; xyz<3; ++xyz) {
-    tval = ref_B_final[0][xyz] - ref_B[0][xyz];
-    for (i=0; i<B->natom; ++i)
-      B_geom[i][xyz] += tval;
-  }
-
-  // recompute B reference points
-  zero_matrix(ref_B, ndB, 3);
-  for (pts=0; pts<ndB; ++pts)
-    for (i=0; i<B->natom;++i)
-      for (xyz=0; xyz<3; ++xyz)
-        ref_B[pts][xyz] += weightB[pts][i] * B_geom[i][xyz];
-
-  //oprintf_out("ref_B with B1 corrected\n");
-  //oprint_matrix_out(ref_B, ndB, 3);
-
-  if (ndB>1) { /* move fragment B to place reference point B2 in correct location */
-    /* Determine rotational angle and axis */
-    v3d_eAB(ref_B[0], ref_B[1], e12);  /* v B1->B2 */
-    v3d_eAB(ref_B[0], ref_B_final[1], e12b); /* v B1->B2_final */
-    B_angle = acos(v3d_dot(e12b,e12));
-
-    if (std::fabs(B_angle) > 1.0e-7) {
-      erot = v3d.cross(e12,e12b);
-
-      /* Move B to put B1 at origin */
-      for (xyz=0; xyz<3; ++xyz)
-        for (i=0; i<B->natom;++i)
-          B_geom[i][xyz] -= ref_B[0][xyz];
-
-      /* Rotate B */
-      rotate_vecs(erot, B_angle, B_geom, B->natom);
-
-      /* Move B back to coordinate system of A */
-      for (xyz=0; xyz<3; ++xyz)
-        for (i=0; i<B->natom;++i)
-          B_geom[i][xyz] += ref_B[0][xyz];
-
-      // recompute current B reference points
-      zero_matrix(ref_B, ndB, 3);
-      for (pts=0; pts<ndB; ++pts) 
-        for (xyz=0; xyz<3; ++xyz)
-          for (i=0; i<B->natom;++i)
-            ref_B[pts][xyz] += weightB[pts][i] * B_geom[i][xyz];
-    }
-    //oprintf_out("ref_B with B2 corrected\n");
-    //oprint_matrix_out(ref_B, ndB, 3);
-  }
-  if (ndB==3) { // move fragment B to place reference point B3 in correct location
-    // Determine rotational angle and axis
-    v3d_eAB(ref_B[0], ref_B[1], erot);  /* B1 -> B2 is rotation axis */
-
-    // Calculate B3-B1-B2-B3' torsion angle
-    v3d_tors(ref_B[2], ref_B[0], ref_B[1], ref_B_final[2], B_angle);
-
-    //oprintf_out("B_angle: %15.10lf\n",B_angle);
-    if (std::fabs(B_angle) > 1.0e-10) {
-
-      // Move B to put B2 at origin
-      for (xyz=0; xyz<3; ++xyz)
-        for (i=0; i<B->natom;++i)
-          B_geom[i][xyz] -= ref_B[1][xyz];
-
-      rotate_vecs(erot, B_angle, B_geom, B->natom);
-
-      // Translate B1 back to coordinate system of A
-      for (xyz=0; xyz<3; ++xyz)
-        for (i=0; i<B->natom;++i)
-          B_geom[i][xyz] += ref_B[1][xyz];
-
-      // update B reference points
-      zero_matrix(ref_B, ndB, 3);
-      for (pts=0; pts<ndB; ++pts)
-        for (xyz=0; xyz<3; ++xyz)
-          for (i=0; i<B->natom;++i)
-            ref_B[pts][xyz] += weightB[pts][i] * B_geom[i][xyz];
-    }
-    //oprintf_out("ref_B with B3 corrected\n");
-    //oprint_matrix_out(ref_B, ndB, 3);
-  }
-
-  // check to see if desired reference points were obtained
-  tval = 0.0;
-  for (i=0; i<ndB; ++i)
-    for (xyz=0; xyz<3; ++xyz)
-      tval += (ref_B[i][xyz] - ref_B_final[i][xyz])*(ref_B[i][xyz] - ref_B_final[i][xyz]);
-  tval = sqrt(tval);
-
-  free_matrix(ref_A);
-  free_matrix(ref_B);
-  free_matrix(ref_B_final);
-
-  oprintf_out("\tDifference from target, |x_target - x_achieved| = %.2e\n",tval);
-
-  B->set_geom(B_geom);
-  free_matrix(B_geom);
-  return true;
-}
-
-"""
+    ref_A : numpy array float[3][3]
+        reference points A1, A2, A3 on fragment A; points that are not defined
+        for A must be filled in with (non-collinear) dummy points
+    weightsB : numpy array float[ndB][natomB]
+        weights of the atoms of B in each of its ndB reference points
+    B_geom : numpy array float[natomB][3]
+        geometry of fragment B ; overwritten on exit
+    R_AB, theta_A, theta_B, tau, phi_A, phi_B : float
+        target values; those not defined for ndB are ignored
 
+    Returns
+    -------
+    float
+        |x_target - x_achieved| for the reference points of B
+    """
+    ndB = len(weightsB)
+    ref_B = np.dot(weightsB, B_geom)
+
+    # compute B1-B2 distance, B2-B3 distance, and B1-B2-B3 angle
+    if ndB > 1:
+        R_B1B2 = v3d.dist(ref_B[1], ref_B[0])
+    if ndB > 2:
+        R_B2B3 = v3d.dist(ref_B[2], ref_B[1])
+        B_angle = v3d.angle(ref_B[0], ref_B[1], ref_B[2])
+
+    # determine target location of reference pts for B in coordinate system of A
+    ref_B_final = np.zeros((ndB, 3))
+    ref_B_final[0] = zmatPoint(ref_A[2], ref_A[1], ref_A[0], R_AB, theta_A, phi_A)
+    if ndB > 1:
+        ref_B_final[1] = zmatPoint(ref_A[1], ref_A[0], ref_B_final[0], R_B1B2, theta_B, tau)
+    if ndB > 2:
+        ref_B_final[2] = zmatPoint(ref_A[0], ref_B_final[0], ref_B_final[1], R_B2B3,
+                                   B_angle, phi_B)
+
+    # translate B->geom to place B1 in correct location
+    B_geom += ref_B_final[0] - ref_B[0]
+    ref_B = np.dot(weightsB, B_geom)
+
+    if ndB > 1:  # move fragment B to place reference point B2 in correct location
+        # Determine rotational angle and axis
+        e12 = v3d.eAB(ref_B[0], ref_B[1])  # v B1->B2
+        e12b = v3d.eAB(ref_B[0], ref_B_final[1])  # v B1->B2_final
+        B_angle = acos(max(-1.0, min(1.0, v3d.dot(e12b, e12))))
+
+        if abs(B_angle) > 1.0e-7:
+            erot = v3d.cross(e12, e12b)
+            if v3d.norm(erot) < 1.0e-10:  # antiparallel; any perpendicular axis will do
+                erot = v3d.cross(e12, [1.0, 0.0, 0.0])
+                if v3d.norm(erot) < 1.0e-3:
+                    erot = v3d.cross(e12, [0.0, 1.0, 0.0])
+
+            # Rotate B about B1
+            origin = ref_B[0].copy()
+            B_geom -= origin
+            rotateVector(erot, B_angle, B_geom)
+            B_geom += origin
+            ref_B = np.dot(weightsB, B_geom)
+
+    if ndB == 3:  # move fragment B to place reference point B3 in correct location
+        # B1 -> B2 is rotation axis
+        erot = v3d.eAB(ref_B[0], ref_B[1])
+
+        # Calculate B3-B1-B2-B3' torsion angle
+        B_angle = v3d.tors(ref_B[2], ref_B[0], ref_B[1], ref_B_final[2])
+
+        if abs(B_angle) > 1.0e-10:
+            origin = ref_B[1].copy()
+            B_geom -= origin
+            rotateVector(erot, B_angle, B_geom)
+            B_geom += origin
+            ref_B = np.dot(weightsB, B_geom)
+
+    # check to see if desired reference points were obtained
+    return np.linalg.norm(ref_B - ref_B_final)
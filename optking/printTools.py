@@ -1,7 +1,7 @@
 from __future__ import print_function
 import numpy as np
 import logging
-import qcelemental as qcel
+from .lazyModule import qcel
 # from sys import stdout
 
 def printMatString(M, Ncol=7, title="\n"):
@@ -1,6 +1,5 @@
 """ various methods for interacting with psi4. i.e. getting gradients, hessians, options etc """
 import logging
-from psi4.driver import json_wrapper
 from .printTools import (printArrayString, printMatString)
 
 
@@ -35,6 +34,8 @@ def get_optking_options_psi4(all_options):
 
 def psi4_calculation(new_geom, o_json, driver='gradient'):
     """ Call psi4 to perform a calculation"""
+    # psi4 is imported on first use, so that optking can be imported without it
+    from psi4.driver import json_wrapper
 
     # is there something broken about dummy atoms here?
     logger = logging.getLogger(__name__)
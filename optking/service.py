@@ -0,0 +1,490 @@
+""" A long-lived local optimization service with a pool of warm workers.
+
+Starting an interpreter, importing optking and initializing the QM program
+often take longer than the optimization of a small molecule.  The service
+starts its worker processes once; each imports optking, the modules in
+warm_modules (psi4 by default, if present) and runs an optional initializer,
+then optimizes any number of QCSchema inputs in turn.  Optimizations are
+queued first-in first-out and run concurrently on up to `workers` processes.
+Each worker runs in its own scratch directory, where its opt_log.out and IRC
+progress files are written.  The workers are daemonic processes, which cannot
+start processes of their own, so within a job the two branches of an IRC
+(irc_direction BOTH) and the gradients of a block of the lowest mode
+(hessian_free_mode) are computed in turn.
+
+Jobs report progress events: 'queued', 'started', one 'calculation' event
+for every energy, gradient or Hessian computed, and finally 'finished',
+'failed' or 'cancelled'.  A queued job is cancelled by removing it from the
+queue; a running one by terminating its worker, which is replaced.
+
+The service is used from Python (OptimizationService.submit(), result(),
+events(), cancel()) or over HTTP on localhost, after serve(port):
+
+    POST   /jobs              QCSchema input; returns {"id": ..., "status": "queued"}
+    GET    /jobs/<id>         status, and the QCSchema output when finished
+    GET    /jobs/<id>/events  progress events as JSON lines, until the job ends
+    DELETE /jobs/<id>         cancels the job
+    GET    /status            numbers of workers and of queued and running jobs
+
+From the command line: python -m optking.service --port 8000 --workers 4
+"""
+import argparse
+import collections
+import copy
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from .exceptions import OptError
+
+FINAL = ('finished', 'failed', 'cancelled')
+
+
+def _worker(conn, workdir, warm_modules, initializer, initargs):
+    """ Main loop of a worker process: optimizes the QCSchema inputs received
+    on conn, sending back events and results. """
+    os.chdir(workdir)
+    import logging.config
+    from . import history, jsonoptwrapper, loggingconfig, psi4methods
+    # the log of each worker goes to its own directory
+    config = copy.deepcopy(loggingconfig.logging_configuration)
+    for handler in config['handlers'].values():
+        if 'filename' in handler:
+            handler['filename'] = os.path.join(workdir, 'opt_log.out')
+    logging.config.dictConfig(config)
+
+    try:
+        for name in warm_modules:
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                pass
+        if initializer is not None:
+            initializer(*initargs)
+    except Exception as error:
+        conn.send(('error', repr(error)))
+        return
+
+    calculation = psi4methods.psi4_calculation
+
+    def reportingCalculation(new_geom, o_json, driver='gradient'):
+        json_output = calculation(new_geom, o_json, driver)
+        conn.send(('event', {'event': 'calculation', 'driver': driver,
+                             'energy': json_output.get('properties', {}).get('return_energy')}))
+        return json_output
+
+    psi4methods.psi4_calculation = reportingCalculation
+    conn.send(('ready', os.getpid()))
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            return
+        history.resetHistory()
+        try:
+            result = jsonoptwrapper.run_qcschema(message)
+        except Exception as error:
+            result = {'success': False, 'error': repr(error)}
+        conn.send(('result', result))
+
+
+class Job(object):
+    """ An optimization submitted to the service. """
+    def __init__(self, json_dict):
+        self.id = uuid.uuid4().hex
+        self.request = json_dict
+        self.status = 'queued'
+        self.result = None
+        self.events = []
+        self.cancel_requested = False
+        self._changed = threading.Condition(threading.RLock())
+        self.addEvent({'event': 'queued'})
+
+    def addEvent(self, event):
+        with self._changed:
+            self.events.append(dict(event, id=self.id))
+            if event['event'] in ('started',) + FINAL:
+                self.status = event['event']
+            self._changed.notify_all()
+
+    @property
+    def done(self):
+        return self.status in FINAL
+
+    def tryStart(self, worker):
+        """ Marks the job as started, unless it was cancelled. """
+        with self._changed:
+            if self.cancel_requested:
+                return False
+            self.addEvent({'event': 'started', 'worker': worker})
+            return True
+
+    def requestCancel(self):
+        """ Asks for the job to be cancelled; a queued job is cancelled at once.
+        Returns False if the job had already ended. """
+        with self._changed:
+            if self.done:
+                return False
+            self.cancel_requested = True
+            if self.status == 'queued':
+                self.addEvent({'event': 'cancelled'})
+            return True
+
+    def waitForEvent(self, index, timeout=None):
+        """ Waits until event number index exists or the job is done;
+        returns whether it exists. """
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.events) > index or self.done, timeout)
+            return len(self.events) > index
+
+    def toDict(self):
+        d = {'id': self.id, 'status': self.status}
+        if self.done:
+            d['result'] = self.result
+        return d
+
+
+class _WorkerSlot(object):
+    """ One worker process and the thread that feeds it jobs from the queue. """
+    def __init__(self, service, index):
+        self.service = service
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.workdir = tempfile.mkdtemp(prefix='optking-worker%d-' % index, dir=service.workdir)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.conn, child_conn = self.service.context.Pipe()
+        s = self.service
+        self.process = s.context.Process(target=_worker, daemon=True,
+                                         args=(child_conn, self.workdir, s.warm_modules,
+                                               s.initializer, s.initargs))
+        self.process.start()
+        child_conn.close()
+
+    def waitUntilReady(self):
+        try:
+            kind, payload = self.conn.recv()
+        except EOFError:
+            kind, payload = 'error', 'the worker exited'
+        if kind != 'ready':
+            raise OptError("Worker %d of the optimization service failed to start: %s"
+                           % (self.index, payload))
+
+    def stop(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+    def restart(self):
+        self.stop()
+        self.start()
+        self.waitUntilReady()
+
+    def run(self):
+        logger = logging.getLogger(__name__)
+        while True:
+            job = self.service._queue.get()
+            if job is None:
+                break
+            if not job.tryStart(self.index):
+                continue
+            try:
+                self.conn.send(job.request)
+                self._follow(job)
+            except (EOFError, OSError):
+                job.result = {'success': False, 'error': 'the worker exited'}
+                job.addEvent({'event': 'failed'})
+                if self.service._closing:
+                    break
+                logger.error("\tWorker %d of the optimization service exited; restarting it."
+                             % self.index)
+                self.restart()
+
+    def _follow(self, job):
+        """ Relays the events of job until its result arrives or it is cancelled. """
+        while True:
+            if job.cancel_requested:
+                if self.service._closing:
+                    self.stop()
+                else:
+                    self.restart()
+                job.addEvent({'event': 'cancelled'})
+                return
+            if not self.conn.poll(0.05):
+                if not self.process.is_alive():
+                    raise EOFError()
+                continue
+            kind, payload = self.conn.recv()
+            if kind == 'event':
+                job.addEvent(payload)
+            elif kind == 'result':
+                job.result = payload
+                job.addEvent({'event': 'finished' if payload.get('success') else 'failed'})
+                return
+
+
+class OptimizationService(object):
+    """ A pool of warm optimization workers with a job queue.
+
+    Parameters
+    ----------
+    workers : int, optional
+        number of worker processes, i.e. of optimizations run at the same time
+    max_queue : int, optional
+        number of jobs that may wait for a worker; submit() raises OptError
+        beyond it
+    warm_modules : tuple of str, optional
+        modules each worker imports at startup, if available
+    initializer : function, optional
+        initializer(*initargs) is called in each worker at startup, e.g. to
+        initialize the QM program or to install a calculation backend as
+        psi4methods.psi4_calculation.  It must be importable by the workers.
+    initargs : tuple, optional
+    workdir : str, optional
+        directory for the scratch directories of the workers
+    keep_jobs : int, optional
+        number of finished jobs whose results are kept
+
+    Notes
+    -----
+    The constructor returns when all workers are ready.  Use close(), or the
+    service as a context manager, to stop them.  The workers are spawned, so
+    a script that creates the service must do so under
+    ``if __name__ == '__main__':``.
+    """
+    def __init__(self, workers=2, max_queue=100, warm_modules=('psi4',), initializer=None,
+                 initargs=(), workdir=None, keep_jobs=1000):
+        if workers < 1:
+            raise OptError("The optimization service needs at least one worker.")
+        # workers are started afresh rather than forked from a threaded process
+        self.context = multiprocessing.get_context('spawn')
+        self.warm_modules = tuple(warm_modules)
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
+        self.workdir = workdir
+        self.keep_jobs = keep_jobs
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._server = None
+        self._closing = False
+
+        self._slots = [_WorkerSlot(self, i) for i in range(workers)]
+        try:
+            for slot in self._slots:
+                slot.start()
+            for slot in self._slots:
+                slot.waitUntilReady()
+        except OptError:
+            for slot in self._slots:
+                slot.stop()
+            raise
+        for slot in self._slots:
+            slot.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, json_dict):
+        """ Queues an optimization.
+
+        Parameters
+        ----------
+        json_dict : dict
+            MolSSI QCSchema input with driver 'optimize'
+
+        Returns
+        -------
+        str
+            job id
+        """
+        if json_dict.get('driver') != 'optimize':
+            raise OptError("The optimization service only runs inputs with driver 'optimize'.")
+        job = Job(json_dict)
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise OptError("The queue of the optimization service is full.")
+            self._jobs[job.id] = job
+            finished = [i for i, j in self._jobs.items() if j.done]
+            for i in finished[:max(0, len(finished) - self.keep_jobs)]:
+                del self._jobs[i]
+        return job.id
+
+    def job(self, job_id):
+        try:
+            return self._jobs[job_id]
+        except KeyError:
+            raise OptError("No job %s in the optimization service." % job_id)
+
+    def result(self, job_id, timeout=None):
+        """ Waits for a job to end and returns its QCSchema output, or None if
+        it was cancelled or did not end within timeout seconds. """
+        job = self.job(job_id)
+        for _ in self.events(job_id, timeout):
+            pass
+        return job.result
+
+    def events(self, job_id, timeout=None):
+        """ Generator of the events of a job, from the first one, until the job
+        ends or no event arrives within timeout seconds. """
+        job = self.job(job_id)
+        n = 0
+        while job.waitForEvent(n, timeout):
+            yield job.events[n]
+            n += 1
+            if job.done and n == len(job.events):
+                return
+
+    def cancel(self, job_id):
+        """ Cancels a job; returns False if it had already ended. """
+        return self.job(job_id).requestCancel()
+
+    def status(self):
+        jobs = list(self._jobs.values())
+        return {'workers': len(self._slots),
+                'queued': sum(j.status == 'queued' for j in jobs),
+                'running': sum(j.status == 'started' for j in jobs)}
+
+    def serve(self, port=0, host='127.0.0.1', block=False):
+        """ Serves the HTTP interface on host:port (an unused port if 0).
+
+        Returns
+        -------
+        int
+            the port, if not block
+        """
+        self._server = _ThreadingHTTPServer((host, port), _RequestHandler)
+        self._server.service = self
+        if block:
+            self._server.serve_forever()
+            return self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address[1]
+
+    def close(self):
+        """ Stops the HTTP server and the workers; running jobs are cancelled. """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        self._closing = True
+        for job in list(self._jobs.values()):
+            job.requestCancel()
+        for slot in self._slots:
+            while True:
+                try:
+                    self._queue.put_nowait(None)
+                    break
+                except queue.Full:
+                    self._queue.get_nowait()
+        for slot in self._slots:
+            slot.thread.join()
+            try:
+                slot.conn.send(None)
+            except (OSError, ValueError):
+                pass
+            slot.process.join(5)
+            slot.stop()
+
+
+def _toJSON(value):
+    # numpy arrays and numbers in the QCSchema output
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+    def _reply(self, code, body):
+        data = json.dumps(body, default=_toJSON).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _job(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) < 2 or parts[0] != 'jobs':
+            return None, None
+        try:
+            return self.server.service.job(parts[1]), parts[2:]
+        except OptError:
+            return None, None
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            return self._reply(404, {'error': 'not found'})
+        try:
+            json_dict = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            job_id = self.server.service.submit(json_dict)
+        except ValueError as error:
+            return self._reply(400, {'error': 'invalid JSON: %s' % error})
+        except OptError:
+            full = self.server.service._queue.full()
+            return self._reply(503 if full else 400,
+                               {'error': 'queue full' if full else "driver must be 'optimize'"})
+        self._reply(202, {'id': job_id, 'status': 'queued'})
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/status':
+            return self._reply(200, self.server.service.status())
+        job, rest = self._job()
+        if job is None:
+            return self._reply(404, {'error': 'no such job'})
+        if rest == ['events']:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.end_headers()
+            for event in self.server.service.events(job.id):
+                self.wfile.write((json.dumps(event, default=_toJSON) + '\n').encode('utf-8'))
+                self.wfile.flush()
+            return
+        self._reply(200, job.toDict())
+
+    def do_DELETE(self):
+        job, _ = self._job()
+        if job is None:
+            return self._reply(404, {'error': 'no such job'})
+        self.server.service.cancel(job.id)
+        self._reply(200, {'id': job.id, 'status': job.status})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local optimization service with warm workers")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-queue', type=int, default=100)
+    args = parser.parse_args(argv)
+    with OptimizationService(args.workers, args.max_queue) as service:
+        try:
+            service.serve(args.port, args.host, block=True)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
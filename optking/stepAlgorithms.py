@@ -10,12 +10,11 @@ from .exceptions import AlgError, OptError
 from . import optparams as op
 from . import optimize
 from .history import oHistory
-from .displace import displace
+from .displace import displaceMolsys
 from .intcosMisc import qShowForces
-from .addIntcos import linearBendCheck
-from .misc import isDqSymmetric
 from .printTools import printArrayString, printMatString
-from .linearAlgebra import absMax, symmMatEig, asymmMatEig, symmMatInv, norm
+from .linearAlgebra import absMax, rms, symmMatEig, asymmMatEig, symmMatInv, norm
+from .linearAlgebra import lowestEigenpairsSymmMat
 
 
 # TODO I'd like to move the displace call and wrap up here. Make this a proper wrapper
@@ -68,6 +67,10 @@ def Dq(oMolsys, E, qForces, H, stepType=None, o_json=None):
         return Dq_P_RFO(oMolsys, E, qForces, H)
     elif stepType == 'LINESEARCH':
         return Dq_LINESEARCH(oMolsys, E, qForces, H, o_json)
+    elif stepType == 'GDIIS':
+        return Dq_DIIS(oMolsys, E, qForces, H)
+    elif stepType == 'GEDIIS':
+        return Dq_DIIS(oMolsys, E, qForces, H, energyWeighted=True)
     else:
         raise OptError('Dq: step type not yet implemented')
 
@@ -146,18 +149,15 @@ def Dq_NR(oMolsys, E, fq, H):
 
     # Scale fq into aJ for printing
     fq_aJ = qShowForces(oMolsys.intcos, fq)
-    displace(oMolsys._fragments[0].intcos, oMolsys._fragments[0].geom, dq, fq_aJ)
+    displaceMolsys(oMolsys, dq, fq_aJ)
     dq_actual = sqrt(np.dot(dq, dq))
     logger.info("\tNorm of achieved step-size %15.10f" % dq_actual)
 
-    # Symmetrize the geometry for next step
-    # symmetrize_geom()
-
     # save values in step data
     oHistory.appendRecord(DEprojected, dq, nr_u, nr_g, nr_h)
 
     # Can check full geometry, but returned indices will correspond then to that.
-    linearList = linearBendCheck(oMolsys.intcos, oMolsys.geom, dq)
+    linearList = oMolsys.linearBendCheck(dq)
     if linearList:
         raise AlgError("New linear angles", newLinearBends=linearList)
 
@@ -283,7 +283,7 @@ def Dq_RFO(oMolsys, E, fq, H):
                     # Check symmetry of root.
                     dq[:] = SRFOevects[i, 0:dim]
                     if not op.Params.accept_symmetry_breaking:
-                        symm_rfo_step = isDqSymmetric(oMolsys.intcos, oMolsys.geom, dq)
+                        symm_rfo_step = oMolsys.isDqSymmetric(dq, op.Params.symm_tol)
 
                         if not symm_rfo_step:  # Root is assymmetric so reject it.
                             logger.warning("\tRejecting RFO root %d because it breaks \
@@ -417,10 +417,7 @@ def Dq_RFO(oMolsys, E, fq, H):
     # Scale fq into aJ for printing
     fq_aJ = qShowForces(oMolsys.intcos, fq)
 
-    # TODO multi fragment treatment for dq and fq
-    # this won't work for multiple fragments yet until dq and fq get cut up.
-    for F in oMolsys._fragments:
-        displace(F.intcos, F.geom, dq, fq_aJ)
+    displaceMolsys(oMolsys, dq, fq_aJ)
     # For now, saving RFO unit vector and using it in projection to match C++ code,
     # could use actual Dq instead.
     dqnorm_actual = sqrt(np.dot(dq, dq))
@@ -438,11 +435,8 @@ def Dq_RFO(oMolsys, E, fq, H):
     # change = sqrt(change);
     # printxopt("Step-size in mass-weighted cartesian coordinates [bohr (amu)^1/2] : %20.10lf\n"
     #    % change)
-
-    # printxopt("\tSymmetrizing new geometry\n")
-    # geom = symmetrizeXYZ(geom)
     oHistory.appendRecord(DEprojected, dq, rfo_u, rfo_g, rfo_h)
-    linearList = linearBendCheck(oMolsys.intcos, oMolsys.geom, dq)
+    linearList = oMolsys.linearBendCheck(dq)
     if linearList:
         raise AlgError("New linear angles", newLinearBends=linearList)
 
@@ -454,6 +448,66 @@ def Dq_RFO(oMolsys, E, fq, H):
     return dq
 
 
+def pRFOStep(fq, H, guess=None):
+    """ Partitioned RFO step, which maximizes the energy along the lowest
+    eigenvector of H and minimizes it in the space orthogonal to it.  Only the
+    lowest eigenpairs of H and of the RFO matrix of the orthogonal space are
+    computed, with lowestEigenpairsSymmMat().
+
+    Parameters
+    ----------
+    fq : ndarray
+        (n, ) forces in internal coordinates
+    H : ndarray
+        (n, n) hessian in internal coordinates
+    guess : ndarray, optional
+        approximate lowest eigenvector of H, e.g. the followed vector of the
+        previous step
+
+    Returns
+    -------
+    ndarray, ndarray
+        (n, ) step, and (2, ) its components along the lowest eigenvector and
+        orthogonal to it
+    """
+    logger = logging.getLogger(__name__)
+    dim = len(fq)
+    hEigValues, hEigVectors = lowestEigenpairsSymmMat(H, 1, guess)
+    v = hEigVectors[:, 0]
+    logger.info("\tLowest eigenvalue of Hessian: %15.10f" % hEigValues[0])
+
+    # RFO max, along v
+    fv = np.dot(v, fq)
+    maximizeRFO = np.array([[hEigValues[0], -fv], [-fv, 0.0]])
+    RFOMaxEValues, RFOMaxEVectors = symmMatEig(maximizeRFO)
+    VectorP = RFOMaxEVectors[1]
+    if abs(VectorP[1]) > 1.0e-10 and abs(VectorP[0] / VectorP[1]) < op.Params.rfo_normalization_max:
+        VectorP = VectorP / VectorP[1]
+
+    # RFO min, with H and fq projected on the space orthogonal to v.  [v, 0] is
+    # an eigenvector of this RFO matrix, with eigenvalue 0, which is excluded.
+    Hv = np.dot(H, v)
+    minimizeRFO = np.zeros((dim + 1, dim + 1), float)
+    minimizeRFO[:dim, :dim] = H - np.outer(v, Hv) - np.outer(Hv, v) \
+        + np.dot(v, Hv) * np.outer(v, v)
+    minimizeRFO[:dim, dim] = minimizeRFO[dim, :dim] = -(fq - fv * v)
+    RFOMinEValues, RFOMinEVectors = lowestEigenpairsSymmMat(
+        minimizeRFO, 1, np.append(np.zeros(dim), 1.0), np.append(v, 0.0))
+    VectorN = RFOMinEVectors[:, 0]
+    if abs(VectorN[dim]) > 1.0e-10:
+        tval = abs(absMax(VectorN[:dim]) / VectorN[dim])
+        if tval < op.Params.rfo_normalization_max:
+            VectorN = VectorN / VectorN[dim]
+
+    logger.info("\tRFO min eigenvalue: %15.10f" % RFOMinEValues[0])
+    logger.info("\tRFO max eigenvalues:\n\n\t" + printArrayString(RFOMaxEValues))
+    logger.debug("\tVector P\n\n\t" + printArrayString(VectorP))
+    logger.debug("\tVector N\n\n\t" + printArrayString(VectorN))
+
+    dq = VectorP[0] * v + VectorN[:dim]
+    return dq, np.array([VectorP[0], norm(VectorN[:dim])])
+
+
 def Dq_P_RFO(oMolsys, E, fq, H):
     logger = logging.getLogger(__name__)
     Hdim = len(fq)  # size of Hessian
@@ -465,26 +519,17 @@ def Dq_P_RFO(oMolsys, E, fq, H):
     if print_lvl > 2:
         logger.info("\tHessian matrix\n" + printMatString(H))
 
-    # Diagonalize H (technically only have to semi-diagonalize)
-    hEigValues, hEigVectors = symmMatEig(H)
-
-    if print_lvl > 2:
-        logger.info("\tEigenvalues of Hessian\n\n\t" + printArrayString(hEigValues))
-        logger.info("\tEigenvectors of Hessian (rows)\n" + printMatString(hEigVectors))
-
-    # Construct diagonalized Hessian with evals on diagonal
-    HDiag = np.zeros((Hdim, Hdim), float)
-    for i in range(Hdim):
-        HDiag[i, i] = hEigValues[i]
-
-    if print_lvl > 2:
-        logger.info("\tH diagonal\n" + printMatString(HDiag))
+    # Only the lowest eigenvector of H is needed; start from the vector followed
+    # in the previous step, which is close to it near the transition state.
+    guess = None
+    if len(oHistory.steps) > 1 and oHistory.steps[-2].followedUnitVector is not None \
+            and len(oHistory.steps[-2].followedUnitVector) == Hdim:
+        guess = oHistory.steps[-2].followedUnitVector
 
     logger.debug(
         "\tFor P-RFO, assuming rfo_root=1, maximizing along lowest eigenvalue of Hessian.")
     logger.debug("\tLarger values of rfo_root are not yet supported.")
 
-    rfo_root = 0
     """  TODO: use rfo_root to decide which eigenvectors are moved into the max/mu space.
     if not rfo_follow_root or len(oHistory.steps) < 2:
         rfo_root = op.Params.rfo_root
@@ -497,76 +542,12 @@ def Dq_P_RFO(oMolsys, E, fq, H):
         printxopt("\tMaximizing along %d lowest eigenvalue of Hessian.\n" % (rfo_root+1) )
     """
 
-    # number of degrees along which to maximize; assume 1 for now
-    mu = 1
-
     logger.info("\tInternal forces in au:\n\n\t" + printArrayString(fq))
 
-    fqTransformed = np.dot(hEigVectors, fq)  # gradient transformation
-    logger.info("\tInternal forces in au, in Hevect basis:\n\n\t"
-                + printArrayString(fqTransformed))
-    # Build RFO max
-    maximizeRFO = np.zeros((mu + 1, mu + 1), float)
-    for i in range(mu):
-        maximizeRFO[i, i] = hEigValues[i]
-        maximizeRFO[i, -1] = -fqTransformed[i]
-        maximizeRFO[-1, i] = -fqTransformed[i]
-    if print_lvl > 2:
-        logger.info("\tRFO max\n" + printMatString(maximizeRFO))
-
-    # Build RFO min
-    minimizeRFO = np.zeros((Hdim - mu + 1, Hdim - mu + 1), float)
-    for i in range(0, Hdim - mu):
-        minimizeRFO[i, i] = HDiag[i + mu, i + mu]
-        minimizeRFO[i, -1] = -fqTransformed[i + mu]
-        minimizeRFO[-1, i] = -fqTransformed[i + mu]
-    if print_lvl > 2:
-        logger.info("\tRFO min\n" + printMatString(minimizeRFO))
-
-    RFOMaxEValues, RFOMaxEVectors = symmMatEig(maximizeRFO)
-    RFOMinEValues, RFOMinEVectors = symmMatEig(minimizeRFO)
-
-    logger.info("\tRFO min eigenvalues:\n\n\t" + printArrayString(RFOMinEValues))
-    logger.info("\tRFO max eigenvalues:\n\n\t" + printArrayString(RFOMaxEValues))
-
-    if print_lvl > 2:
-        logger.info("\tRFO min eigenvectors (rows) before normalization:\n"
-                    + printMatString(RFOMinEVectors))
-        logger.info("\tRFO max eigenvectors (rows) before normalization:\n"
-                    + printMatString(RFOMaxEVectors))
-
-    # Normalize max and min eigenvectors
-    for i in range(mu + 1):
-        if abs(RFOMaxEVectors[i, mu]) > 1.0e-10:
-            tval = abs(absMax(RFOMaxEVectors[i, 0:mu]) / RFOMaxEVectors[i, mu])
-            if fabs(tval) < op.Params.rfo_normalization_max:
-                RFOMaxEVectors[i] /= RFOMaxEVectors[i, mu]
-    if print_lvl > 2:
-        logger.info("\tRFO max eigenvectors (rows):\n" + printMatString(RFOMaxEVectors))
-
-    for i in range(Hdim - mu + 1):
-        if abs(RFOMinEVectors[i][Hdim - mu]) > 1.0e-10:
-            tval = abs(
-                absMax(RFOMinEVectors[i, 0:Hdim - mu]) / RFOMinEVectors[i, Hdim - mu])
-            if fabs(tval) < op.Params.rfo_normalization_max:
-                RFOMinEVectors[i] /= RFOMinEVectors[i, Hdim - mu]
-    if print_lvl > 2:
-        logger.info("\tRFO min eigenvectors (rows):\n" + printMatString(RFOMinEVectors))
-
-    VectorP = RFOMaxEVectors[mu, 0:mu]
-    VectorN = RFOMinEVectors[rfo_root, 0:Hdim - mu]
-    logger.debug("\tVector P\n\n\t" + printArrayString(VectorP))
-    logger.debug("\tVector N\n\n\t" + printArrayString(VectorN))
-
-    # Combines the eignvectors from RFO max and min
-    PRFOEVector = np.zeros(Hdim, float)
-    PRFOEVector[0:len(VectorP)] = VectorP
-    PRFOEVector[len(VectorP):] = VectorN
-
-    PRFOStep = np.dot(hEigVectors.transpose(), PRFOEVector)
+    PRFOStep, PRFOEVector = pRFOStep(fq, H, guess)
 
     if print_lvl > 1:
-        logger.info("\tRFO step in Hessian Eigenvector Basis\n\n\t"
+        logger.info("\tRFO step along, and orthogonal to, the lowest Hessian eigenvector\n\n\t"
                     + printArrayString(PRFOEVector))
         logger.info("\tRFO step in original Basis\n\n\t"
                     + printArrayString(PRFOStep))
@@ -593,9 +574,7 @@ def Dq_P_RFO(oMolsys, E, fq, H):
     # Scale fq into aJ for printing
     fq_aJ = qShowForces(oMolsys.intcos, fq)
 
-    # this won't work for multiple fragments yet until dq and fq get cut up.
-    for F in oMolsys._fragments:
-        displace(F.intcos, F.geom, dq, fq_aJ)
+    displaceMolsys(oMolsys, dq, fq_aJ)
 
     # For now, saving RFO unit vector and using it in projection to match C++ code,
     # could use actual Dq instead.
@@ -604,7 +583,7 @@ def Dq_P_RFO(oMolsys, E, fq, H):
 
     oHistory.appendRecord(DEprojected, dq, rfo_u, rfo_g, rfo_h)
 
-    linearList = linearBendCheck(oMolsys.intcos, oMolsys.geom, dq)
+    linearList = oMolsys.linearBendCheck(dq)
     if linearList:
         raise AlgError("New linear angles", newLinearBends=linearList)
 
@@ -671,16 +650,207 @@ def Dq_SD(oMolsys, E, fq):
         "\tProjected energy change by quadratic approximation: %20.5lf" % DEprojected)
 
     fq_aJ = qShowForces(oMolsys.intcos, fq)  # for printing
-    displace(oMolsys._fragments[0].intcos, oMolsys._fragments[0].geom, dq, fq_aJ)
+    displaceMolsys(oMolsys, dq, fq_aJ)
     dqnorm_actual = np.linalg.norm(dq)
     logger.info("\tNorm of achieved step-size %15.10f" % dqnorm_actual)
 
-    # Symmetrize the geometry for next step
-    # symmetrize_geom()
-
     oHistory.appendRecord(DEprojected, dq, sd_u, sd_g, sd_h)
 
-    linearList = linearBendCheck(oMolsys.intcos, oMolsys.geom, dq)
+    linearList = oMolsys.linearBendCheck(dq)
+    if linearList:
+        raise AlgError("New linear angles", newLinearBends=linearList)
+
+    return dq
+
+
+def gdiisCoefficients(errors):
+    """ Coefficients c of the GDIIS combination, which minimize |sum_i c_i e_i|
+    subject to sum_i c_i = 1.
+
+    Parameters
+    ----------
+    errors : ndarray
+        (n, dim) error vector of each point, e.g. its Newton step
+
+    Returns
+    -------
+    ndarray or None
+        (n,) coefficients; None if the error vectors are linearly dependent
+    """
+    n = len(errors)
+    B = np.dot(errors, errors.T)
+    # scale so that the conditioning does not depend on the size of the errors
+    scale = np.max(np.diag(B))
+    if scale == 0.0:
+        return None
+    A = np.ones((n + 1, n + 1), float)
+    A[:n, :n] = B / scale
+    A[n, n] = 0.0
+    rhs = np.zeros(n + 1, float)
+    rhs[n] = 1.0
+    if np.linalg.cond(A) > 1.0e12:
+        return None
+    return np.linalg.solve(A, rhs)[:n]
+
+
+def gediisCoefficients(energies, q, g):
+    """ Coefficients c of the GEDIIS combination, which minimize the interpolated
+    energy E(c) = sum_i c_i E_i - 1/4 sum_ij c_i c_j (g_i - g_j).(q_i - q_j)
+    subject to sum_i c_i = 1 and c_i >= 0.  E(c) is exact on a quadratic surface.
+    See Li and Frisch, J. Chem. Theory Comput. 2, 835 (2006).
+
+    Parameters
+    ----------
+    energies : ndarray
+        (n,) energies
+    q : ndarray
+        (n, dim) internal coordinates
+    g : ndarray
+        (n, dim) gradients in internal coordinates
+
+    Returns
+    -------
+    ndarray or None
+        (n,) coefficients; None if no combination of two or more points is found
+    """
+    n = len(energies)
+    M = np.dot(g, q.T)
+    M = 0.5 * (np.diag(M)[:, None] + np.diag(M)[None, :] - M - M.T)
+    # the points with negative coefficients are dropped, most negative first
+    active = list(range(n))
+    while len(active) > 1:
+        k = len(active)
+        A = np.ones((k + 1, k + 1), float)
+        A[:k, :k] = M[np.ix_(active, active)]
+        A[k, k] = 0.0
+        rhs = np.append(np.asarray(energies)[active], 1.0)
+        if np.linalg.cond(A) > 1.0e12:
+            return None
+        c_active = np.linalg.solve(A, rhs)[:k]
+        if np.all(c_active >= 0.0):
+            c = np.zeros(n, float)
+            c[active] = c_active
+            return c
+        del active[int(np.argmin(c_active))]
+    return None
+
+
+# smallest cosine between the DIIS step and the Newton step from the current
+# point, by number of points combined; see Farkas and Schlegel, PCCP 4, 11 (2002)
+_diisCosineMin = {2: 0.97, 3: 0.84, 4: 0.71, 5: 0.67, 6: 0.62, 7: 0.56, 8: 0.49, 9: 0.41}
+# largest magnitude of a coefficient; larger ones extrapolate far beyond the points
+_diisCoefficientMax = 3.0
+# GEDIIS steps switch to GDIIS below this rms force, as in Li and Frisch; above it,
+# GDIIS steps are RFO steps
+_diisRmsForceMax = 1.0e-2
+
+
+def Dq_DIIS(oMolsys, E, fq, H, energyWeighted=False):
+    """ Takes a GDIIS (or GEDIIS) step, which extrapolates from the geometries
+    and forces of the last op.Params.diis_max_vecs steps in history
+
+    Parameters
+    ----------
+    oMolsys : object
+        optking molecular system
+    E : float
+        energy
+    fq : ndarray
+        forces in internal coordinates, projected
+    H : ndarray
+        hessian in internal coordinates, projected
+    energyWeighted : bool
+        GEDIIS, which minimizes an interpolated energy, until the rms force is
+        below _diisRmsForceMax; GDIIS closer to convergence
+
+    Notes
+    -----
+    The points q_i and gradients g_i are combined into q* = sum_i c_i q_i and
+    g* = sum_i c_i g_i, and the step is dq = q* - H^-1 g* - q.  Since the previous
+    steps and the range of the projected Hessian keep the constraints and the
+    point group, so does dq.  Only the points since the last one farther than
+    op.Params.hess_update_dq_tol from the current point are combined, as in the
+    Hessian update.  The oldest points are dropped until the step is reliable:
+    all coefficients are small, and dq is close in direction to the Newton step.
+    If no combination is reliable, an RFO step is taken instead; so it is for
+    GDIIS above _diisRmsForceMax, and after a step that raised the energy.
+    The step is scaled to the trust radius.
+    """
+    logger = logging.getLogger(__name__)
+    method = 'GEDIIS' if energyWeighted else 'GDIIS'
+    logger.info("\tTaking %s optimization step." % method)
+
+    steps = oHistory.steps[-op.Params.diis_max_vecs:]
+    q = np.array([S.qValues(oMolsys) for S in steps])
+    near = np.max(np.abs(q - q[-1]), axis=1) <= op.Params.hess_update_dq_tol
+    start = len(steps) - 1
+    while start > 0 and near[start - 1]:
+        start -= 1
+    steps, q = steps[start:], q[start:]
+    g = -np.array([S.forces for S in steps])
+    energies = np.array([S.E for S in steps])
+    Hinv = symmMatInv(H, redundant=True)
+    dq_newton = np.dot(Hinv, fq)
+
+    if not energyWeighted and rms(fq) > _diisRmsForceMax:
+        logger.info("\tForces are too large for a %s step; taking RFO step instead." % method)
+        return Dq_RFO(oMolsys, E, fq, H)
+    if len(steps) > 1 and energies[-1] > energies[-2]:
+        logger.info("\tThe last step raised the energy; taking RFO step instead.")
+        return Dq_RFO(oMolsys, E, fq, H)
+
+    dq = None
+    for first in range(len(steps) - 1):
+        n = len(steps) - first
+        if energyWeighted and rms(fq) > _diisRmsForceMax:
+            c = gediisCoefficients(energies[first:], q[first:], g[first:])
+        else:
+            c = gdiisCoefficients(np.dot(g[first:], Hinv))
+        if c is None:
+            continue
+        if absMax(c) > _diisCoefficientMax:
+            logger.debug("\tRejecting %d point %s with coefficient %.2f." % (n, method, absMax(c)))
+            continue
+        dq_try = np.dot(c, q[first:]) - np.dot(Hinv, np.dot(c, g[first:])) - q[-1]
+        norms = np.linalg.norm(dq_try) * np.linalg.norm(dq_newton)
+        cosine = np.dot(dq_try, dq_newton) / norms if norms > 0.0 else 0.0
+        if cosine < _diisCosineMin.get(n, 0.41):
+            logger.debug("\tRejecting %d point %s with cosine %.3f to Newton step."
+                         % (n, method, cosine))
+            continue
+        logger.info("\t%s coefficients:\n\t" % method + printArrayString(c))
+        dq = dq_try
+        break
+
+    if dq is None:
+        logger.info("\tNo reliable %s step; taking RFO step instead." % method)
+        return Dq_RFO(oMolsys, E, fq, H)
+
+    applyIntrafragStepScaling(dq)
+
+    # get norm |q| and unit vector in the step direction
+    diis_dqnorm = sqrt(np.dot(dq, dq))
+    diis_u = dq.copy() / diis_dqnorm
+    logger.info("\tNorm of target step-size %15.10lf" % diis_dqnorm)
+
+    # get gradient and hessian in step direction
+    diis_g = -1 * np.dot(fq, diis_u)  # gradient, not force
+    diis_h = np.dot(diis_u, np.dot(H, diis_u))
+
+    DEprojected = DE_projected('NR', diis_dqnorm, diis_g, diis_h)
+    logger.info("\tProjected energy change by quadratic approximation: %10.10lf\n"
+                % DEprojected)
+
+    # Scale fq into aJ for printing
+    fq_aJ = qShowForces(oMolsys.intcos, fq)
+    displaceMolsys(oMolsys, dq, fq_aJ)
+    dq_actual = sqrt(np.dot(dq, dq))
+    logger.info("\tNorm of achieved step-size %15.10f" % dq_actual)
+
+    # save values in step data
+    oHistory.appendRecord(DEprojected, dq, diis_u, diis_g, diis_h)
+
+    linearList = oMolsys.linearBendCheck(dq)
     if linearList:
         raise AlgError("New linear angles", newLinearBends=linearList)
 
@@ -749,19 +919,17 @@ def Dq_BACKSTEP(oMolsys):
 
     fq_aJ = qShowForces(oMolsys.intcos, fq)  # for printing
     # Displace from previous geometry
-    displace(oMolsys._fragments[0].intcos, geom, dq, fq_aJ)
+    displaceMolsys(oMolsys, dq, fq_aJ, geom=geom)
     oMolsys.geom = geom  # uses setter; writes into all fragments
 
     dqNormActual = np.linalg.norm(dq)
     logger.info("\tNorm of achieved step-size %15.10f" % dqNormActual)
-    # Symmetrize the geometry for next step
-    # symmetrize_geom()
 
     # Update the history entries which changed.
     oHistory.steps[-1].projectedDE = DEprojected
     oHistory.steps[-1].Dq[:] = dq
 
-    linearList = linearBendCheck(oMolsys.intcos, oMolsys.geom, dq)
+    linearList = oMolsys.linearBendCheck(dq)
     if linearList:
         raise AlgError("New linear angles", newLinearBends=linearList)
 
@@ -812,7 +980,7 @@ def Dq_LINESEARCH(oMolsys, E, fq, H, o_json):
             logger.debug("\n\tStepping along forces distance %10.5f" % s)
             dq = s * fq_unit
             fq_aJ = qShowForces(oMolsys.intcos, fq)
-            displace(oMolsys._fragments[0].intcos, oMolsys._fragments[0].geom, dq, fq_aJ)
+            displaceMolsys(oMolsys, dq, fq_aJ)
             xyz = oMolsys.geom
             logger.debug("\tComputing energy at this point now.")
             Eb, nuc = optimize.get_energy(xyz, o_json, nuc=True)
@@ -822,7 +990,7 @@ def Dq_LINESEARCH(oMolsys, E, fq, H, o_json):
             logger.debug("\n\tStepping along forces distance %10.5f" % (stepScale * s))
             dq = (stepScale * s) * fq_unit
             fq_aJ = qShowForces(oMolsys.intcos, fq)
-            displace(oMolsys._fragments[0].intcos, oMolsys._fragments[0].geom, dq, fq_aJ)
+            displaceMolsys(oMolsys, dq, fq_aJ)
             xyz = oMolsys.geom
             logger.debug("\tComputing energy at this point now.")
             Ec, nuc = optimize.get_energy(xyz, o_json, nuc=True)
@@ -858,7 +1026,7 @@ def Dq_LINESEARCH(oMolsys, E, fq, H, o_json):
             Emin_projected = x[0] * Xmin * Xmin + x[1] * Xmin + Ea
             dq = Xmin * fq_unit
             logger.info("\tProjected step size to minimum is %12.6f" % Xmin)
-            displace(oMolsys._fragments[0].intcos, oMolsys._fragments[0].geom, dq, fq_aJ)
+            displaceMolsys(oMolsys, dq, fq_aJ)
             xyz = oMolsys.geom
             logger.debug("\tComputing energy at projected point.")
             Emin, nuc = optimize.get_energy(xyz, o_json, nuc=True)
@@ -904,14 +1072,11 @@ def Dq_LINESEARCH(oMolsys, E, fq, H, o_json):
     dq_actual = sqrt(np.dot(dq, dq))
     logger.info("\tNorm of achieved step-size %15.10f" % dq_actual)
 
-    # Symmetrize the geometry for next step
-    # symmetrize_geom()
-
     # save values in step data
     oHistory.appendRecord(DEprojected, dq, ls_u, ls_g, ls_h)
 
     # Can check full geometry, but returned indices will correspond then to that.
-    linearList = linearBendCheck(oMolsys.intcos, oMolsys.geom, dq)
+    linearList = oMolsys.linearBendCheck(dq)
     if linearList:
         raise AlgError("New linear angles", newLinearBends=linearList)
 
@@ -1,11 +1,11 @@
 import logging
 
 import numpy as np
-import qcelemental as qcel
 
+from .lazyModule import qcel
 from .exceptions import AlgError, OptError
 from . import v3d
-from .misc import delta, HguessLindhRho
+from .misc import delta, HguessLindhRho, covalentRadiiFromZ, periodsFromZ
 from .simple import Simple
 
 
@@ -72,6 +72,8 @@ class Stre(Simple):
         self._inverse = bool(setval)
 
     def q(self, geom):
+        if self._inverse:
+            return 1.0 / v3d.dist(geom[self.A], geom[self.B])
         return v3d.dist(geom[self.A], geom[self.B])
 
     def qShow(self, geom):
@@ -79,10 +81,14 @@ class Stre(Simple):
 
     @property
     def qShowFactor(self):
+        if self._inverse:
+            return 1.0 / qcel.constants.bohr2angstroms
         return qcel.constants.bohr2angstroms
 
     @property
     def fShowFactor(self):
+        if self._inverse:
+            return qcel.constants.hartree2aJ * qcel.constants.bohr2angstroms
         return qcel.constants.hartree2aJ / qcel.constants.bohr2angstroms
 
     # If mini == False, dqdx is 1x(3*number of atoms in fragment).
@@ -113,35 +119,36 @@ class Stre(Simple):
     def Dq2Dx2(self, geom, dq2dx2):
         try:
             eAB = v3d.eAB(geom[self.A], geom[self.B])  # A->B
-        except AlgError:
+        except AlgError as error:
             raise AlgError("Stre.Dq2Dx2: could not normalize s vector") from error
 
-        if not self._inverse:
-            length = self.q(geom)
+        length = v3d.dist(geom[self.A], geom[self.B])
 
-            for a in range(2):
-                for a_xyz in range(3):
-                    for b in range(2):
-                        for b_xyz in range(3):
-                            tval = (
-                                eAB[a_xyz] * eAB[b_xyz] - delta(a_xyz, b_xyz)) / length
-                            if a == b:
-                                tval *= -1.0
-                            dq2dx2[3*self.atoms[a]+a_xyz,
-                                   3*self.atoms[b]+b_xyz] = tval
-
-        else:  # using 1/R
-            val = self.q(geom)
+        for a in range(2):
+            for a_xyz in range(3):
+                for b in range(2):
+                    for b_xyz in range(3):
+                        tval = (
+                            eAB[a_xyz] * eAB[b_xyz] - delta(a_xyz, b_xyz)) / length
+                        if a == b:
+                            tval *= -1.0
+                        dq2dx2[3*self.atoms[a]+a_xyz,
+                               3*self.atoms[b]+b_xyz] = tval
+
+        if self._inverse:  # d2(1/R) = 2/R^3 dR dR - 1/R^2 d2R = 2/q dq dq - q^2 d2R
+            val = 1.0 / length
 
             dqdx = np.zeros((3 * len(self.atoms)), float)
             self.DqDx(geom, dqdx, mini=True)  # returned matrix is 1x6 for stre
 
-            for a in range(a):
+            for a in range(2):
                 for a_xyz in range(3):
-                    for b in range(b):
+                    for b in range(2):
                         for b_xyz in range(3):
-                            dq2dx2[3*self.atoms[a]+a_xyz, 3*self.atoms[b]+b_xyz] \
-                                = 2.0 / val * dqdx[3*a+a_xyz] * dqdx[3*b+b_xyz]
+                            i = 3*self.atoms[a]+a_xyz
+                            j = 3*self.atoms[b]+b_xyz
+                            dq2dx2[i, j] = -val * val * dq2dx2[i, j] \
+                                + 2.0 / val * dqdx[3*a+a_xyz] * dqdx[3*b+b_xyz]
 
         return
 
@@ -156,8 +163,8 @@ class Stre(Simple):
 
         if guessType == "SCHLEGEL":
             R = v3d.dist(geom[self.A], geom[self.B])
-            PerA = qcel.periodictable.to_period(Z[self.A])
-            PerB = qcel.periodictable.to_period(Z[self.B])
+            PerA = periodsFromZ(Z[self.A])
+            PerB = periodsFromZ(Z[self.B])
 
             AA = 1.734
             if PerA == 1:
@@ -186,7 +193,7 @@ class Stre(Simple):
             return F
 
         elif guessType == "FISCHER":
-            Rcov = qcel.covalentradii.get(Z[self.A], missing=4.0) + qcel.covalentradii.get(Z[self.B], missing=4.0)
+            Rcov = covalentRadiiFromZ(Z[self.A]) + covalentRadiiFromZ(Z[self.B])
             R = v3d.dist(geom[self.A], geom[self.B])
             AA = 0.3601
             BB = 1.944
@@ -0,0 +1,321 @@
+""" Point groups of molecular geometries.
+
+The symmetry operations are found by testing candidate axes and planes through
+the center of mass.  The candidates are the principal axes of inertia and
+directions built from the smallest set of equivalent atoms (same element, mass
+and distance from the center): the atom positions, the midpoints and
+differences of pairs, and the normals of planes through triples.  The
+operations found are closed into a group, and each operation is refit to its
+permutation of the atoms, so that averaging over the group is an exact
+projector onto the totally symmetric displacements.
+
+Linear molecules are given the D2h or C2v subgroup of D*h or C*v that contains
+the principal axes.
+"""
+import logging
+from fractions import Fraction
+from math import acos, cos, pi, sin
+
+import numpy as np
+
+# highest order of rotation axis that is tested
+_maxAxisOrder = 8
+# largest group that is closed; the icosahedral group Ih has 120 operations
+_maxGroupOrder = 120
+
+
+def _rotation(axis, angle):
+    """ (3, 3) rotation by angle about the unit vector axis. """
+    K = np.array([[0.0, -axis[2], axis[1]], [axis[2], 0.0, -axis[0]], [-axis[1], axis[0], 0.0]])
+    return np.identity(3) + sin(angle) * K + (1.0 - cos(angle)) * np.dot(K, K)
+
+
+def _reflection(normal):
+    """ (3, 3) reflection through the plane with unit normal. """
+    return np.identity(3) - 2.0 * np.outer(normal, normal)
+
+
+def _uniqueDirections(vectors, tol):
+    """ Unit vectors of the vectors longer than tol, with parallel and antiparallel
+    duplicates removed. """
+    vectors = np.array(vectors, float).reshape(-1, 3)
+    lengths = np.linalg.norm(vectors, axis=1)
+    units = vectors[lengths > tol] / lengths[lengths > tol, None]
+    unique = []
+    for u in units:
+        if not unique or np.max(np.abs(np.dot(unique, u))) < 1.0 - 1.0e-6:
+            unique.append(u)
+    return unique
+
+
+def _equivalenceClasses(r, labels, tol):
+    """ Sets of atoms with the same label and, within tol, the same distance from
+    the center. """
+    classes = []
+    for label in np.unique(labels):
+        atoms = np.flatnonzero(labels == label)
+        atoms = atoms[np.argsort(r[atoms])]
+        start = 0
+        for i in range(1, len(atoms) + 1):
+            if i == len(atoms) or r[atoms[i]] - r[atoms[i - 1]] > tol:
+                classes.append(atoms[start:i])
+                start = i
+    return classes
+
+
+def _permutation(X, labels, R, tol):
+    """ Atom permutation p with R x_i = x_p[i], or None if R is not a symmetry
+    operation of the (nat, 3) centered geometry X. """
+    Y = np.dot(X, R.T)
+    D = np.linalg.norm(Y[:, None, :] - X[None, :, :], axis=2)
+    D[labels[:, None] != labels[None, :]] = np.inf
+    p = np.argmin(D, axis=1)
+    if np.max(D[np.arange(len(X)), p]) > tol or len(set(p)) != len(p):
+        return None
+    return p
+
+
+def _fitOperation(X, masses, p, det):
+    """ Orthogonal matrix with determinant det that best maps each x_i onto x_p[i]. """
+    M = np.dot((X[p] * masses[:, None]).T, X)
+    U, s, Vt = np.linalg.svd(M)
+    d = np.ones(3)
+    d[2] = det * np.linalg.det(U) * np.linalg.det(Vt)
+    return np.dot(U * d, Vt)
+
+
+class PointGroup(object):
+    """ The symmetry operations of a molecular geometry.
+
+    Parameters
+    ----------
+    operations : list((ndarray, ndarray))
+        (3, 3) orthogonal matrix R and atom permutation p of each operation,
+        where R (x_i - center) = x_p[i] - center
+    center : ndarray
+        (3,) center of mass
+    linear : bool
+        whether the molecule is linear
+    """
+    def __init__(self, operations, center, linear=False):
+        self._operations = operations
+        self._center = np.array(center, float)
+        self._linear = linear
+        self.label = self._schoenflies()
+
+    def __str__(self):
+        return self.label
+
+    @classmethod
+    def fromGeometry(cls, geom, Z, masses, tol=1.0e-3):
+        """ Finds the point group of a geometry.
+
+        Parameters
+        ----------
+        geom : ndarray
+            (nat, 3) cartesian geometry
+        Z : list(int)
+            atomic numbers
+        masses : ndarray
+            atomic masses
+        tol : float
+            largest distance between an atom and the image of an equivalent atom
+
+        Returns
+        -------
+        PointGroup
+        """
+        logger = logging.getLogger(__name__)
+        geom = np.asarray(geom, float).reshape(-1, 3)
+        masses = np.asarray(masses, float)
+        center = np.dot(masses, geom) / np.sum(masses)
+        X = geom - center
+        # atoms of a different element or isotope are never equivalent
+        labels = np.unique(np.round(np.c_[Z, masses], 6), axis=0, return_inverse=True)[1].ravel()
+
+        M = np.dot(X.T * masses, X)
+        inertia = np.trace(M) * np.identity(3) - M
+        principal = list(np.linalg.eigh(inertia)[1].T)
+
+        candidates = [np.identity(3), -np.identity(3)]
+        along = principal[0]
+        linear = np.max(np.linalg.norm(X - np.outer(np.dot(X, along), along), axis=1)) < tol
+        if linear:
+            for a in principal:
+                candidates += [_rotation(a, pi), _reflection(a)]
+        else:
+            axes = principal[:]
+            normals = principal[:]
+            r = np.linalg.norm(X, axis=1)
+            # atoms on one line through the center do not fix the directions of the
+            # axes perpendicular to it
+            classes = [c for c in _equivalenceClasses(r, labels, tol)
+                       if np.linalg.matrix_rank(X[c], tol) > 1]
+            if classes:
+                atoms = min(classes, key=len)
+                x = X[atoms]
+                for anchor in x[:2]:
+                    axes += [anchor] + list(anchor + x) + list(np.cross(anchor, x))
+                    normals += list(anchor - x) + list(np.cross(anchor, x))
+                for j in range(1, len(x)):
+                    axes += list(np.cross(x[j] - x[0], x[j + 1:] - x[0]))
+            axes = _uniqueDirections(axes, tol)
+            normals = _uniqueDirections(normals + axes, tol)
+            for a in axes:
+                for n in range(2, _maxAxisOrder + 1):
+                    candidates.append(_rotation(a, 2.0 * pi / n))
+                    if n > 2:
+                        candidates.append(np.dot(_reflection(a), _rotation(a, 2.0 * pi / n)))
+            candidates += [_reflection(n) for n in normals]
+
+        # a candidate built from displaced atoms is itself a little off, so it is
+        # refit to the atoms it maps before the test at tol
+        operations = []
+        for R in candidates:
+            p = _permutation(X, labels, R, 10.0 * tol)
+            if p is None:
+                continue
+            if not linear:
+                R = _fitOperation(X, masses, p, np.sign(np.linalg.det(R)))
+                p = _permutation(X, labels, R, tol)
+            if p is not None:
+                operations = cls._addOperation(operations, R, p)
+
+        # products of the operations found are symmetry operations too
+        i = 0
+        while i < len(operations):
+            for j in range(i + 1):
+                for (Ra, pa), (Rb, pb) in [(operations[i], operations[j]),
+                                           (operations[j], operations[i])]:
+                    operations = cls._addOperation(operations, np.dot(Ra, Rb), pa[pb])
+            if len(operations) > _maxGroupOrder:
+                logger.warning("\tSymmetry operations do not close into a point group;"
+                               + " not using symmetry.")
+                return cls([(np.identity(3), np.arange(len(X)))], center)
+            i += 1
+
+        pointGroup = cls(operations, center, linear)
+        if not linear:
+            # refit the operations to the symmetrized geometry, until they are exact
+            for i in range(50):
+                X = pointGroup.symmetrizeGeom(geom) - center
+                refit = [(_fitOperation(X, masses, p, np.sign(np.linalg.det(R))), p)
+                         for R, p in operations]
+                change = max(np.max(np.abs(R - Ro)) for (R, p), (Ro, po) in zip(refit, operations))
+                operations = refit
+                pointGroup = cls(operations, center, linear)
+                if change < 1.0e-14:
+                    break
+        logger.info("\tPoint group is %s (%d operations)." % (pointGroup.label, pointGroup.order))
+        return pointGroup
+
+    @staticmethod
+    def _addOperation(operations, R, p):
+        for Ro, po in operations:
+            if np.array_equal(p, po) and np.allclose(R, Ro, atol=0.1):
+                return operations
+        return operations + [(R, p)]
+
+    def subgroup(self, keep):
+        """ Subgroup of the operations for which keep(R, p) is true.  keep must
+        define a stabilizer, e.g. of a set of atoms, for the result to be a group. """
+        operations = [(R, p) for R, p in self._operations if keep(R, p)]
+        return PointGroup(operations, self._center,
+                          self._linear and len(operations) == self.order)
+
+    @property
+    def order(self):
+        return len(self._operations)
+
+    @property
+    def operations(self):
+        return self._operations
+
+    def symmetrizeGeom(self, geom):
+        """ Averages the images of the atoms under the group; returns a new array. """
+        geom = np.asarray(geom, float)
+        X = geom.reshape(-1, 3) - self._center
+        X_sym = np.zeros(X.shape, float)
+        for R, p in self._operations:
+            X_sym += np.dot(X[p], R)
+        return (X_sym / self.order + self._center).reshape(geom.shape)
+
+    def symmetrizeVector(self, v):
+        """ Totally symmetric part of a cartesian vector, e.g. a gradient or a step. """
+        v = np.asarray(v, float)
+        V = v.reshape(-1, 3)
+        V_sym = np.zeros(V.shape, float)
+        for R, p in self._operations:
+            V_sym += np.dot(V[p], R)
+        return (V_sym / self.order).reshape(v.shape)
+
+    def cartesianProjector(self):
+        """ (3nat, 3nat) projector onto the totally symmetric cartesian displacements. """
+        nat = len(self._operations[0][1])
+        S = np.zeros((nat, 3, nat, 3), float)
+        for R, p in self._operations:
+            S[np.arange(nat), :, p, :] += R.T
+        return S.reshape(3 * nat, 3 * nat) / self.order
+
+    def isSymmetric(self, dx, tol):
+        """ Whether the cartesian displacement dx keeps the point group, to within
+        a fraction tol of its length. """
+        dx = np.asarray(dx, float).ravel()
+        return np.linalg.norm(self.symmetrizeVector(dx) - dx) <= tol * max(np.linalg.norm(dx), 1.0e-12)
+
+    def _schoenflies(self):
+        """ Schoenflies symbol from the rotation axes, mirror planes and inversion. """
+        if self._linear:
+            inversion = any(np.allclose(R, -np.identity(3)) for R, p in self._operations)
+            return 'D*h' if inversion else 'C*v'
+
+        rotations, reflections, improper, inversion = [], [], [], False
+        for R, p in self._operations:
+            det = np.linalg.det(R)
+            proper = R if det > 0 else -R
+            angle = acos(np.clip((np.trace(proper) - 1.0) / 2.0, -1.0, 1.0))
+            if angle < 1.0e-6:
+                inversion = inversion or det < 0
+                continue
+            evals, evecs = np.linalg.eig(R)
+            axis = np.real(evecs[:, np.argmin(np.abs(evals - np.sign(det)))])
+            if det > 0:
+                n = Fraction(angle / (2.0 * pi)).limit_denominator(2 * _maxAxisOrder).denominator
+                rotations.append((n, axis))
+            elif abs(np.trace(R) - 1.0) < 1.0e-6:
+                reflections.append(axis)
+            else:
+                improper.append(axis)
+
+        highAxes = _uniqueDirections([a for n, a in rotations if n > 2], 1.0e-6)
+        if len(highAxes) > 1:
+            orders = set(n for n, a in rotations)
+            if 5 in orders:
+                return 'Ih' if inversion else 'I'
+            if 4 in orders:
+                return 'Oh' if inversion else 'O'
+            if inversion:
+                return 'Th'
+            return 'Td' if reflections else 'T'
+
+        if not rotations:
+            if reflections:
+                return 'Cs'
+            return 'Ci' if inversion else 'C1'
+
+        n, principal = max(rotations, key=lambda r: r[0])
+        C2perp = _uniqueDirections([a for m, a in rotations
+                                    if m == 2 and abs(np.dot(a, principal)) < 1.0e-6], 1.0e-6)
+        sigma_h = any(abs(np.dot(s, principal)) > 1.0 - 1.0e-6 for s in reflections)
+        sigma_v = any(abs(np.dot(s, principal)) < 1.0e-6 for s in reflections)
+        if len(C2perp) >= n:
+            if sigma_h:
+                return 'D%dh' % n
+            return 'D%dd' % n if sigma_v else 'D%d' % n
+        if sigma_h:
+            return 'C%dh' % n
+        if sigma_v:
+            return 'C%dv' % n
+        if improper:
+            return 'S%d' % (2 * n)
+        return 'C%d' % n
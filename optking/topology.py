@@ -0,0 +1,156 @@
+""" Topology templates: the coordinates of a molecular system, saved for reuse.
+
+A template holds the fragment layout, the definitions of the primitive
+coordinates of each fragment (including the choice of linear bends) and the
+interfragment coordinates, as JSON.  Loaded into a Molsys with the same atoms,
+it replaces the connectivity analysis and coordinate generation.  Atoms are
+numbered as in the input, which the fragments may reorder.
+
+The constraints of a run are not part of the template; they are added from the
+options as usual.  Delocalized and natural coordinates are formed again from
+the primitives, since they depend on the geometry.
+"""
+import json
+import logging
+
+import numpy as np
+
+from . import bend, cart, dimerfrag, frag, oofp, stre, tors
+from . import optparams as op
+from .exceptions import AlgError, OptError
+from .misc import covalentRadiiFromZ
+
+_TYPES = {'Stre': stre.Stre, 'HBond': stre.HBond, 'Bend': bend.Bend, 'Tors': tors.Tors,
+          'Oofp': oofp.Oofp, 'Cart': cart.Cart}
+
+
+def _intcoDict(intco):
+    d = {'type': type(intco).__name__, 'atoms': [int(a) for a in intco.atoms]}
+    if isinstance(intco, stre.Stre):
+        d['inverse'] = intco.inverse
+    elif isinstance(intco, bend.Bend):
+        d['bendType'] = intco.bendType
+    elif isinstance(intco, cart.Cart):
+        d['xyz'] = intco.xyz
+    return d
+
+
+def _intcoFromDict(d):
+    try:
+        if d['type'] in ('Stre', 'HBond'):
+            return _TYPES[d['type']](*d['atoms'], inverse=d['inverse'])
+        elif d['type'] == 'Bend':
+            return bend.Bend(*d['atoms'], bendType=d['bendType'])
+        elif d['type'] == 'Cart':
+            return cart.Cart(d['atoms'][0], d['xyz'])
+        return _TYPES[d['type']](*d['atoms'])
+    except (KeyError, TypeError) as error:
+        raise OptError("Bad coordinate in topology template: %s (%s)" % (d, error))
+
+
+def _bonded(geom, Z, pairs):
+    """ Whether each atom pair is within op.Params.covalent_connect times the sum
+    of the covalent radii, as in addIntcos.connectivityFromDistances(). """
+    if len(pairs) == 0:
+        return np.zeros(0, bool)
+    pairs = np.asarray(pairs, int)
+    Rcov = covalentRadiiFromZ(Z)
+    R = np.linalg.norm(geom[pairs[:, 0]] - geom[pairs[:, 1]], axis=1)
+    return R < op.Params.covalent_connect * (Rcov[pairs[:, 0]] + Rcov[pairs[:, 1]])
+
+
+def exportTemplate(oMolsys, input_geom=None):
+    """ The topology template of the current coordinates of oMolsys.
+
+    Parameters
+    ----------
+    oMolsys : Molsys
+    input_geom : ndarray, optional
+        (nat, 3) geometry in the input order of the atoms, if the fragments have
+        reordered them
+
+    Returns
+    -------
+    dict
+    """
+    geom = oMolsys.geom
+    order = np.arange(oMolsys.Natom)
+    if input_geom is not None:
+        # the fragments hold copies of the input coordinates
+        R = np.linalg.norm(geom[:, None, :] - np.asarray(input_geom)[None, :, :], axis=2)
+        order = np.argmin(R, axis=1)
+
+    fragments = []
+    for iF, F in enumerate(oMolsys._fragments):
+        atoms = order[oMolsys.frag_atom_range(iF)]
+        intcos = F.primitiveIntcos()
+        pairs = [s.atoms for s in intcos if isinstance(s, stre.Stre)]
+        bonds = [list(p) for p, b in zip(pairs, _bonded(F.geom, F.Z, pairs)) if b]
+        fragments.append({'atoms': [int(a) for a in atoms],
+                          'intcos': [_intcoDict(intco) for intco in intcos],
+                          'bonds': bonds})
+    dimers = [{'A': D.A_idx, 'A_weights': D.A_weights.tolist(),
+               'B': D.B_idx, 'B_weights': D.B_weights.tolist()} for D in oMolsys.dimers]
+    return {'Z': [int(z) for z in np.asarray(oMolsys.Z)[np.argsort(order)]],
+            'fragments': fragments, 'dimers': dimers}
+
+
+def applyTemplate(oMolsys, template):
+    """ Replaces the fragments and coordinates of oMolsys by those of the
+    template, if it is valid for the current geometry: the atoms are the same,
+    the covalent bonds of the template are still bonded, no regular bend has
+    become linear and all coordinates are defined.  Otherwise, oMolsys is not
+    changed.
+
+    Returns
+    -------
+    bool
+        whether the template was applied
+    """
+    logger = logging.getLogger(__name__)
+    Z = np.asarray(oMolsys.Z)
+    if list(Z) != template['Z']:
+        logger.warning("\tTopology template is for other atoms; generating coordinates.")
+        return False
+    geom, masses = oMolsys.geom, np.asarray(oMolsys.masses, float)
+
+    fragments = []
+    for f in template['fragments']:
+        atoms = np.array(f['atoms'], int)
+        F = frag.Frag(Z[atoms], geom[atoms].copy(), masses[atoms],
+                      [_intcoFromDict(d) for d in f['intcos']])
+        if not np.all(_bonded(F.geom, F.Z, f['bonds'])):
+            logger.warning("\tBonds of the topology template are broken; generating coordinates.")
+            return False
+        for intco in F.intcos:
+            try:
+                q = intco.q(F.geom)
+            except (AlgError, RuntimeError):
+                q = None
+            if q is None or (isinstance(intco, bend.Bend) and intco.bendType == 'REGULAR'
+                             and q > op.Params.linear_bend_threshold):
+                logger.warning("\tCoordinate %s of the topology template is not defined or"
+                               " linear; generating coordinates." % str(intco).strip())
+                return False
+        fragments.append(F)
+
+    dimers = [dimerfrag.DimerFrag(d['A'], d['A_weights'], d['B'], d['B_weights'])
+              for d in template['dimers']]
+    oMolsys._fragments[:] = fragments
+    oMolsys._dimers[:] = dimers
+    oMolsys.clearCache(newCoordinates=True)
+    logger.info("\tCoordinates taken from the topology template.")
+    return True
+
+
+def writeTemplate(filename, template):
+    with open(filename, 'w') as f:
+        json.dump(template, f, indent=1)
+
+
+def readTemplate(filename):
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError) as error:
+        raise OptError("Cannot read a topology template from %s: %s" % (filename, error))
@@ -0,0 +1,32 @@
+"""
+Fixtures shared by the tests
+"""
+import numpy as np
+import pytest
+
+from optking import addIntcos, frag, molsys
+
+
+@pytest.fixture
+def hooh():
+    """ Geometry of HOOH, bohr """
+    return np.array([[1.7, 1.6, 0.8], [0.0, 1.35, -0.1], [0.0, -1.35, -0.1], [-1.5, -1.7, 0.9]])
+
+
+@pytest.fixture
+def hooh_molsys(hooh):
+    """ Molecular system of HOOH, with the coordinates from connectivity """
+    oMolsys = molsys.Molsys([frag.Frag([1, 8, 8, 1], hooh.copy(), [1.008, 15.995, 15.995, 1.008])])
+    oMolsys.addIntcosFromConnectivity()
+    return oMolsys
+
+
+@pytest.fixture
+def hooh_intcos(hooh):
+    """ Simple coordinates of HOOH and its connectivity """
+    C = addIntcos.connectivityFromDistances(hooh, [1, 8, 8, 1])
+    intcos = []
+    addIntcos.addStreFromConnectivity(C, intcos)
+    addIntcos.addBendFromConnectivity(C, intcos, hooh)
+    addIntcos.addTorsFromConnectivity(C, intcos, hooh)
+    return intcos, C
@@ -0,0 +1,54 @@
+"""
+Tests optimization steps in cartesian coordinates, which bypass the B matrix
+"""
+import numpy as np
+
+from optking import addIntcos, hessian, intcosMisc
+from optking.displace import displaceMolsys
+
+
+def addCartesians(oMolsys, internals):
+    if not internals:
+        del oMolsys._fragments[0]._intcos[:]
+    addIntcos.addCartesianIntcos(oMolsys._fragments[0]._intcos, oMolsys.geom)
+    oMolsys.clearCache(newCoordinates=True)
+    return oMolsys
+
+
+def test_cartesian_step(hooh, hooh_molsys):
+    oMolsys = addCartesians(hooh_molsys, False)
+    assert oMolsys.isCartesian()
+    rng = np.random.RandomState(5)
+    g = rng.uniform(-0.05, 0.05, 12)
+    fq = oMolsys.qForces(g)
+    assert np.allclose(fq, -g)
+
+    # without constraints, overall translations and rotations are projected out
+    H = np.identity(12)
+    oMolsys.projectRedundanciesAndConstraints(fq, H)
+    T = hessian.rigidBodyVectors(oMolsys.geom)
+    assert np.allclose(np.dot(T.T, fq), 0.0) and np.allclose(np.dot(H, T), 0.0)
+    assert np.allclose(fq, -g - np.dot(T, np.dot(T.T, -g)))
+
+    dq = 0.01 * fq
+    displaceMolsys(oMolsys, dq)
+    assert np.allclose(oMolsys.geom, hooh + 0.01 * fq.reshape(4, 3))
+
+    # a frozen cartesian is projected out instead, and stays put
+    addIntcos.freeze_cartesians_from_input_list([1, 'XYZ'], oMolsys)
+    oMolsys.clearCache(newCoordinates=True)
+    fq, H = oMolsys.qForces(g), np.identity(12)
+    oMolsys.projectRedundanciesAndConstraints(fq, H)
+    assert np.allclose(fq[:3], 0.0) and np.allclose(fq[3:], -g[3:])
+
+
+def test_both_bmatrix(hooh_molsys):
+    # cartesian rows of B are filled without the coordinate objects
+    oMolsys = addCartesians(hooh_molsys, True)
+    assert not oMolsys.isCartesian()
+    intcos, geom = oMolsys.intcos, oMolsys.geom
+    B = np.zeros((len(intcos), 12))
+    for i, intco in enumerate(intcos):
+        intco.DqDx(geom, B[i])
+    assert np.allclose(intcosMisc.Bmat(intcos, geom), B)
+    assert np.allclose(intcosMisc.qValues(intcos, geom), [intco.q(geom) for intco in intcos])
@@ -0,0 +1,58 @@
+"""
+Tests the projection of frozen and fixed coordinates and the displacement onto
+the targets of fixed coordinates
+"""
+import numpy as np
+
+from optking import addIntcos, intcosMisc
+from optking.displace import displaceMolsys
+
+
+def test_constrained_projection(hooh_molsys):
+    oMolsys = hooh_molsys
+    addIntcos.freezeTorsionsFromInputAtomList([1, 2, 3, 4], oMolsys)
+    addIntcos.fixStretchesFromInputList([2, 3, 1.5], oMolsys)
+    intcos, geom = oMolsys.intcos, oMolsys.geom
+    c = intcosMisc.constrainedMask(intcos)
+    assert np.count_nonzero(c) == 2
+
+    # the projector of the dense constraint matrix C
+    G = intcosMisc.Gmat(intcos, geom)
+    Pprime = np.dot(G, np.linalg.pinv(G))
+    C = np.diag(c.astype(float))
+    P_dense = Pprime - np.dot(Pprime, np.dot(C, np.dot(np.linalg.pinv(np.dot(C, np.dot(Pprime, C))),
+                                                        np.dot(C, Pprime))))
+    P = intcosMisc.projectionMatrix(intcos, geom)
+    assert np.allclose(P, P_dense)
+    assert np.allclose(P[c], 0.0) and np.allclose(P[:, c], 0.0)
+
+
+def test_displacement_to_fixed_targets(hooh_molsys):
+    oMolsys = hooh_molsys
+    addIntcos.fixTorsionsFromInputList([1, 2, 3, 4, 150.0], oMolsys)
+    addIntcos.fixStretchesFromInputList([2, 3, 1.45], oMolsys)
+    intcos = oMolsys.intcos
+    fixed = np.array([intco.fixed for intco in intcos])
+
+    # the fixed coordinates move by at most intrafrag_trust per step
+    for i in range(4):
+        displaceMolsys(oMolsys, np.zeros(len(intcos)))
+    assert np.allclose(intcosMisc.fixedErrors(intcos, oMolsys.geom), 0.0, atol=1.0e-10)
+    q = oMolsys.qShowValues()
+    assert np.allclose(np.abs(q[fixed]), [1.45, 150.0])
+
+    # the other coordinates are free, and a fixed coordinate does not drift
+    dq = 0.02 * np.ones(len(intcos))
+    dq[fixed] = 0.0
+    displaceMolsys(oMolsys, dq)
+    assert np.allclose(oMolsys.qShowValues()[fixed], q[fixed])
+
+
+def test_fixed_coord_force_constant_deprecated(caplog):
+    from optking import caseInsensitiveDict
+    from optking import optparams as op
+
+    options = caseInsensitiveDict.CaseInsensitiveDict({'fixed_coord_force_constant': 0.5})
+    params = op.OptParams(options)
+    assert params.fixed_coord_force_constant == 0.5
+    assert 'FIXED_COORD_FORCE_CONSTANT is deprecated' in caplog.text
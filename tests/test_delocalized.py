@@ -0,0 +1,40 @@
+"""
+Tests the delocalized and natural internal coordinates
+"""
+import optking
+import pytest
+import numpy as np
+
+from optking import delocalized, intcosMisc
+
+
+@pytest.mark.parametrize("natural", [False, True])
+def test_combinations_span_primitives(hooh, hooh_intcos, natural):
+    primitives = hooh_intcos[0]
+    combos = delocalized.formCombinations(primitives, hooh, natural)
+    assert len(combos) == 3 * len(hooh) - 6
+
+    B_prim = intcosMisc.Bmat(primitives, hooh)
+    B = intcosMisc.Bmat(combos, hooh)
+    assert np.linalg.matrix_rank(B) == len(combos)
+    assert np.linalg.matrix_rank(np.vstack((B, B_prim))) == len(combos)
+
+    prims, T = delocalized.expand(combos)
+    q_prim = np.array([p.q(hooh) for p in prims])
+    assert np.allclose(intcosMisc.qValues(combos, hooh), np.dot(T, q_prim))
+
+
+@pytest.mark.parametrize("natural", [False, True])
+def test_constrained_primitive_kept(hooh, hooh_intcos, natural):
+    primitives = hooh_intcos[0]
+    primitives[0].frozen = True
+    combos = delocalized.formCombinations(primitives, hooh, natural)
+
+    assert combos[0] is primitives[0]
+    assert len(combos) == 3 * len(hooh) - 6
+
+    # the combinations do not move the frozen primitive
+    B_frozen = intcosMisc.Bmat(combos[:1], hooh)
+    B = intcosMisc.Bmat(combos[1:], hooh)
+    P = np.eye(hooh.size) - np.dot(B_frozen.T, B_frozen) / np.dot(B_frozen, B_frozen.T)
+    assert np.linalg.matrix_rank(np.dot(B, P)) == len(combos) - 1
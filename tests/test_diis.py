@@ -0,0 +1,99 @@
+"""
+Tests the coefficients of the GDIIS and GEDIIS extrapolations on a quadratic
+surface, and the number of gradients of DIIS optimizations
+"""
+import numpy as np
+import pytest
+
+from optking import stepAlgorithms
+
+rng = np.random.RandomState(3)
+Q, _ = np.linalg.qr(rng.uniform(-1, 1, (3, 3)))
+H = np.dot(Q * [0.2, 0.5, 1.1], Q.T)
+q_min = np.array([0.3, -0.2, 0.1])
+
+
+def quadratic(q):
+    d = q - q_min
+    return 0.5 * np.dot(d, np.dot(H, d)), np.dot(H, d)
+
+
+def test_gdiis_coefficients():
+    # the minimum is in the span of the points: the errors combine to zero
+    q = q_min + np.array([[0.1, 0.05, -0.1], [-0.1, 0.1, 0.02], [0.02, -0.1, 0.1],
+                          [0.05, 0.05, 0.05]])
+    g = np.array([quadratic(qi)[1] for qi in q])
+    c = stepAlgorithms.gdiisCoefficients(np.dot(g, np.linalg.inv(H)))
+    assert np.isclose(np.sum(c), 1.0)
+    assert np.allclose(np.dot(c, q), q_min)
+
+    # linearly dependent errors
+    assert stepAlgorithms.gdiisCoefficients(np.array([g[0], g[0]])) is None
+
+
+def test_gediis_coefficients():
+    # the interpolated energy is exact on a quadratic surface
+    q = q_min + np.array([[0.3, 0.1, -0.2], [-0.2, 0.2, 0.1], [0.1, -0.3, 0.2], [-0.2, 0.0, -0.1]])
+    E, g = zip(*[quadratic(qi) for qi in q])
+    c = stepAlgorithms.gediisCoefficients(np.array(E), q, np.array(g))
+    assert np.isclose(np.sum(c), 1.0) and np.all(c >= 0.0)
+    assert np.allclose(np.dot(c, q), q_min)
+
+    # with the minimum outside of the points, the coefficients stay nonnegative
+    q_far = q + [1.0, 0.0, 0.0]
+    E, g = zip(*[quadratic(qi) for qi in q_far])
+    c = stepAlgorithms.gediisCoefficients(np.array(E), q_far, np.array(g))
+    assert np.isclose(np.sum(c), 1.0) and np.all(c >= 0.0)
+    E_c = quadratic(np.dot(c, q_far))[0]
+    for w in rng.dirichlet(np.ones(4), 200):
+        assert E_c <= quadratic(np.dot(w, q_far))[0] + 1.0e-12
+
+
+def hooh_model(new_geom, o_json, driver='gradient'):
+    # harmonic bonds and bends of HOOH, with a twofold torsional barrier
+    def energy(x):
+        r = [np.linalg.norm(x[i + 1] - x[i]) for i in range(3)]
+        bends = [np.arccos(np.dot(x[i] - x[i + 1], x[i + 2] - x[i + 1])
+                           / (np.linalg.norm(x[i] - x[i + 1]) * np.linalg.norm(x[i + 2] - x[i + 1])))
+                 for i in range(2)]
+        n1, n2 = np.cross(x[1] - x[0], x[2] - x[1]), np.cross(x[2] - x[1], x[3] - x[2])
+        phi = np.arccos(np.dot(n1, n2) / (np.linalg.norm(n1) * np.linalg.norm(n2)))
+        return 0.25 * ((r[0] - 1.83)**2 + (r[1] - 2.75)**2 + (r[2] - 1.83)**2) \
+            + 0.08 * sum((b - np.radians(100.0))**2 for b in bends) + 0.002 * (1.0 + np.cos(2.0 * phi))
+
+    x = np.asarray(new_geom, float).reshape(-1, 3)
+    steps = 1.0e-5 * np.eye(x.size)
+    gradient = np.array([energy(x + d.reshape(-1, 3)) - energy(x - d.reshape(-1, 3))
+                         for d in steps]) / 2.0e-5
+    return {'schema_name': 'qcschema_output', 'return_result': gradient.tolist(),
+            'properties': {'return_energy': energy(x), 'nuclear_repulsion_energy': 30.0}}
+
+
+@pytest.mark.parametrize('step_type', ['GDIIS', 'GEDIIS'])
+def test_diis_gradients(monkeypatch, hooh, step_type):
+    # on six starting geometries of HOOH, DIIS takes no more gradients than RFO
+    import optking
+    from optking import psi4methods
+    from optking import optparams as op
+
+    calls = []
+
+    def model(new_geom, o_json, driver='gradient'):
+        calls.append(driver)
+        return hooh_model(new_geom, o_json, driver)
+
+    def gradients(step_type, x):
+        del calls[:]
+        json_in = {"schema_name": "qcschema_input", "schema_version": 1, "driver": "optimize",
+                   "molecule": {"symbols": ["H", "O", "O", "H"], "geometry": x.ravel().tolist()},
+                   "model": {"method": "hf", "basis": "sto-3g"},
+                   "keywords": {"optimizer": {"step_type": step_type}}}
+        assert optking.run_qcschema(json_in)['success']
+        return len(calls)
+
+    # the optimization deletes the options, which the other tests use
+    monkeypatch.setattr(op, 'Params', op.Params)
+    monkeypatch.setattr(psi4methods, 'psi4_calculation', model)
+    starts = [hooh + 0.3 * np.random.RandomState(seed).normal(size=hooh.shape) for seed in range(6)]
+    rfo = sum(gradients('RFO', x) for x in starts)
+    assert sum(gradients(step_type, x) for x in starts) <= rfo
@@ -0,0 +1,121 @@
+"""
+Tests the interfragment (dimer) coordinates
+"""
+import optking
+import pytest
+import numpy as np
+
+from optking import dimerfrag, frag, molsys
+from optking import optparams as op
+from optking.linearAlgebra import symmMatInv
+
+water = np.array([[0.0, 0.0, 0.2], [0.0, 1.5, -0.9], [0.0, -1.4, -0.95]])
+
+
+@pytest.fixture
+def fragments(hooh):
+    return {'atom': np.array([[0.2, 0.1, -0.3]]),
+            'diatomic': np.array([[0.0, 0.0, 0.0], [0.3, 0.4, 1.3]]),
+            'water': water,
+            'hooh': hooh}
+
+
+def dimer(fragments, nameA, nameB):
+    A = fragments[nameA].copy()
+    # rotate B so that no interfragment torsion is zero
+    c, s = np.cos(0.7), np.sin(0.7)
+    B = np.dot(fragments[nameB], [[c, s, 0.0], [-s, c, 0.0], [0.0, 0.0, 1.0]]) + [6.0, 1.0, -0.5]
+    return dimerfrag.DimerFrag(0, dimerfrag.referenceWeights(A), 1,
+                               dimerfrag.referenceWeights(B)), A, B
+
+
+@pytest.mark.parametrize("nameA, nameB, Nintco",
+                         [('atom', 'atom', 1), ('diatomic', 'atom', 2), ('atom', 'water', 3),
+                          ('diatomic', 'diatomic', 4), ('water', 'diatomic', 5),
+                          ('water', 'hooh', 6)])
+def test_dimer_Bmat(fragments, nameA, nameB, Nintco):
+    D, A, B = dimer(fragments, nameA, nameB)
+    assert len(D.intcos) == Nintco
+
+    Bmat = D.Bmat(A, B)
+    x = np.vstack((A, B))
+    disp = 1.0e-5
+    for i in range(x.size):
+        xp, xm = x.copy().ravel(), x.copy().ravel()
+        xp[i] += disp
+        xm[i] -= disp
+        xp, xm = xp.reshape(-1, 3), xm.reshape(-1, 3)
+        fd = (D.q(xp[:len(A)], xp[len(A):]) - D.q(xm[:len(A)], xm[len(A):])) / (2 * disp)
+        assert np.allclose(Bmat[:, i], fd, atol=1.0e-7)
+
+
+@pytest.mark.parametrize("nameA, nameB", [('atom', 'water'), ('diatomic', 'diatomic'),
+                                          ('water', 'hooh'), ('hooh', 'water')])
+def test_dimer_orient(fragments, nameA, nameB):
+    D, A, B = dimer(fragments, nameA, nameB)
+    q_target = D.q(A, B) + np.linspace(0.1, -0.1, len(D.intcos))
+    B_rigid = B - B.mean(axis=0)
+
+    assert D.orient(A, B, q_target) < 1.0e-8
+    assert np.allclose(D.q(A, B), q_target)
+    # B is moved rigidly
+    assert np.allclose(np.linalg.svd(B - B.mean(axis=0))[1], np.linalg.svd(B_rigid)[1])
+
+
+def test_inverse_distance(fragments):
+    saved = op.Params.interfrag_dist_inv
+    op.Params.interfrag_dist_inv = True
+    try:
+        D, A, B = dimer(fragments, 'water', 'hooh')
+        assert D.labels[0] == '1/R_AB'
+        R = np.linalg.norm(D.refPoints(A, B)[0] - D.refPoints(A, B)[3])
+        assert np.isclose(D.q(A, B)[0], 1.0 / R)
+
+        # second derivatives of 1/R against finite differences of the B matrix
+        g_q = np.array([1.0, 0, 0, 0, 0, 0])
+        K = D.gradientBDerivativeTerm(A, B, g_q)
+        x = np.vstack((A, B)).ravel()
+        disp = 1.0e-5
+        for i in range(x.size):
+            xp, xm = x.copy(), x.copy()
+            xp[i] += disp
+            xm[i] -= disp
+            xp, xm = xp.reshape(-1, 3), xm.reshape(-1, 3)
+            fd = (D.Bmat(xp[:len(A)], xp[len(A):])[0] - D.Bmat(xm[:len(A)], xm[len(A):])[0])
+            assert np.allclose(K[i], fd / (2 * disp), atol=1.0e-7)
+
+        q_target = D.q(A, B) * [0.9, 1, 1, 1, 1, 1]
+        assert D.orient(A, B, q_target) < 1.0e-8
+        assert np.allclose(D.q(A, B), q_target)
+    finally:
+        op.Params.interfrag_dist_inv = saved
+
+
+def test_reference_points(fragments, hooh):
+    assert dimerfrag.referenceWeights(fragments['atom']).shape == (1, 1)
+    assert dimerfrag.referenceWeights(fragments['diatomic']).shape == (2, 2)
+    W = dimerfrag.referenceWeights(hooh)
+    assert W.shape == (3, 4)
+    assert np.allclose(W.sum(axis=1), 1.0)
+
+    W = dimerfrag.referenceWeights(hooh, [[0, 1], [2]])
+    assert np.allclose(W, [[0.5, 0.5, 0, 0], [0, 0, 1, 0]])
+
+
+def test_molsys_Ginv(hooh):
+    frags = [frag.Frag([8, 1, 1], water.copy(), [15.995, 1.008, 1.008]),
+             frag.Frag([1, 8, 8, 1], hooh + [7.0, 0.5, 0.0], [1.008, 15.995, 15.995, 1.008]),
+             frag.Frag([8, 1, 1], water + [0.0, 7.0, 0.3], [15.995, 1.008, 1.008])]
+    oMolsys = molsys.Molsys(frags)
+    oMolsys.addIntcosFromConnectivity()
+    oMolsys.addDimerFrags()
+    assert len(oMolsys.dimers) == 2
+    assert len(oMolsys.intcos) == 3 + 6 + 3 + 2 * 6
+
+    # the block (Schur complement) inverse is the Moore-Penrose inverse of G
+    G = oMolsys.Gmat()
+    assert np.allclose(oMolsys.Ginv(), symmMatInv(G, redundant=True))
+
+    gX = np.random.RandomState(3).uniform(-0.05, 0.05, 3 * oMolsys.Natom)
+    fq = oMolsys.qForces(gX)
+    assert np.allclose(fq, -np.dot(symmMatInv(G, redundant=True), np.dot(oMolsys.Bmat(), gX)))
@@ -0,0 +1,66 @@
+"""
+Tests the Davidson solver for the lowest eigenpairs of symmetric matrices, and
+the partitioned RFO step that uses it
+"""
+import numpy as np
+import pytest
+
+from optking import linearAlgebra, stepAlgorithms
+
+
+@pytest.fixture
+def davidson(monkeypatch):
+    # iterate on matrices of any size
+    monkeypatch.setattr(linearAlgebra, 'davidson_min_dim', 0)
+
+
+def hessian(n, rng):
+    H = 0.1 * rng.normal(size=(n, n)) / np.sqrt(n)
+    H = H + H.T + np.diag(rng.uniform(0.05, 1.0, n))
+    H[0, 0] = -0.2
+    return H
+
+
+@pytest.mark.parametrize('k', [1, 3])
+def test_lowest_eigenpairs(davidson, k):
+    rng = np.random.RandomState(7)
+    H = hessian(150, rng)
+    exact = np.linalg.eigvalsh(H)
+
+    evals, evects = linearAlgebra.lowestEigenpairsSymmMat(H, k)
+    assert np.allclose(evals, exact[:k])
+    assert np.allclose(np.dot(H, evects), evects * evals, atol=1.0e-7)
+    assert np.allclose(np.dot(evects.T, evects), np.eye(k))
+
+    # from a guess, and without the lowest eigenvector
+    guess = evects[:, 0] + 0.05 * rng.normal(size=150) / np.sqrt(150)
+    v = linearAlgebra.lowestEigenvectorSymmMat(H, guess)
+    assert np.allclose(v, evects[:, 0], atol=1.0e-7)
+    evals, evects = linearAlgebra.lowestEigenpairsSymmMat(H, k, exclude=v)
+    assert np.allclose(evals, exact[1:k + 1])
+    assert np.allclose(np.dot(v, evects), 0.0)
+
+
+def reference_P_RFO(fq, H):
+    # from the full diagonalization of H
+    n = len(fq)
+    w, V = np.linalg.eigh(H)
+    f = np.dot(V.T, fq)
+    Rmax = np.array([[w[0], -f[0]], [-f[0], 0.0]])
+    Rmin = np.zeros((n, n))
+    Rmin[:-1, :-1] = np.diag(w[1:])
+    Rmin[:-1, -1] = Rmin[-1, :-1] = -f[1:]
+    P = np.linalg.eigh(Rmax)[1][:, 1]
+    N = np.linalg.eigh(Rmin)[1][:, 0]
+    return np.dot(V, np.append(P[0] / P[1], N[:-1] / N[-1]))
+
+
+@pytest.mark.parametrize('iterative', [False, True])
+def test_P_RFO_step(monkeypatch, iterative):
+    if iterative:
+        monkeypatch.setattr(linearAlgebra, 'davidson_min_dim', 0)
+    rng = np.random.RandomState(5)
+    H = hessian(40, rng)
+    fq = 0.01 * rng.normal(size=40)
+    dq, _ = stepAlgorithms.pRFOStep(fq, H)
+    assert np.allclose(dq, reference_P_RFO(fq, H), atol=1.0e-7)
@@ -0,0 +1,38 @@
+"""
+Tests the batched optimization of an ensemble of conformers
+"""
+import numpy as np
+
+from optking import ensemble, intcosMisc
+
+
+def test_batched_coordinates(hooh, hooh_molsys):
+    oMolsys = hooh_molsys
+    coordinates = ensemble.BatchedIntcos(oMolsys)
+    X = hooh + 0.1 * np.random.RandomState(0).normal(size=(4,) + hooh.shape)
+    q, B = coordinates.qAndB(X)
+    for k in range(len(X)):
+        assert np.allclose(q[k], intcosMisc.qValues(oMolsys.intcos, X[k]))
+        assert np.allclose(B[k], intcosMisc.Bmat(oMolsys.intcos, X[k]))
+
+
+def test_ensemble_quadratic(hooh, hooh_molsys):
+    # a quadratic surface in the internal coordinates, with its minimum at q0
+    oMolsys = hooh_molsys
+    coordinates = ensemble.BatchedIntcos(oMolsys)
+    q0 = intcosMisc.qValues(oMolsys.intcos, hooh)
+    k = np.array([0.5, 0.4, 0.5, 0.2, 0.2, 0.05])
+
+    def gradients(X):
+        q, B = coordinates.qAndB(X)
+        dq = coordinates.difference(q, q0)
+        return 0.5 * np.sum(k * dq ** 2, axis=1), np.einsum('kix,ki->kx', B, k * dq)
+
+    X = hooh + 0.1 * np.random.RandomState(1).normal(size=(5,) + hooh.shape)
+    X_final, E, converged = ensemble.optimizeEnsemble(oMolsys, X, gradients,
+                                                       {'g_convergence': 'gau_tight'})
+    assert np.all(converged)
+    assert np.all(E < 1.0e-8)
+    for x in X_final:
+        assert np.allclose(coordinates.difference(intcosMisc.qValues(oMolsys.intcos, x), q0),
+                           0.0, atol=1.0e-3)
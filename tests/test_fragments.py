@@ -0,0 +1,69 @@
+"""
+Tests detection of fragments by connectivity and their joining into one
+"""
+import optking
+import pytest
+import numpy as np
+import qcelemental as qcel
+
+from optking import addIntcos, frag, molsys
+from optking.misc import connectedComponents
+
+water = np.array([[0.0, 0.0, 0.2], [0.0, 1.5, -0.9], [0.0, -1.4, -0.95]])
+
+
+def water_cluster(n, spacing=5.5):
+    """ n**3 waters on a slightly irregular cubic grid, as a single fragment """
+    rng = np.random.RandomState(11)
+    geom = []
+    for shift in np.ndindex(n, n, n):
+        geom.append(water + spacing * np.array(shift) + rng.uniform(-0.2, 0.2, (3, 3)))
+    geom = np.vstack(geom)
+    Z = [8, 1, 1] * n**3
+    return molsys.Molsys([frag.Frag(Z, geom, [15.995, 1.008, 1.008] * n**3)])
+
+
+def test_connectivity():
+    oMolsys = water_cluster(2)
+    geom, Z = oMolsys.geom, oMolsys.Z
+    C = addIntcos.connectivityFromDistances(geom, Z)
+
+    ref = np.zeros(C.shape, bool)
+    for i in range(len(Z)):
+        for j in range(len(Z)):
+            Rcov = qcel.covalentradii.get(Z[i], missing=4.0) + qcel.covalentradii.get(Z[j], missing=4.0)
+            ref[i, j] = i != j and np.linalg.norm(geom[i] - geom[j]) < 1.3 * Rcov
+    assert np.array_equal(C, ref)
+
+
+def test_connected_components():
+    edges = [(4, 2), (0, 5), (5, 3)]
+    components = connectedComponents(7, edges)
+    assert [list(c) for c in components] == [[0, 3, 5], [1], [2, 4], [6]]
+
+
+def test_split_and_join():
+    oMolsys = water_cluster(3)
+    oMolsys.splitFragmentsByConnectivity()
+    assert oMolsys.Nfragments == 27
+    for iF, F in enumerate(oMolsys._fragments):
+        assert list(F.Z) == [8, 1, 1]
+        assert np.allclose(F.geom, oMolsys.geom[3 * iF:3 * iF + 3])
+
+    C = addIntcos.connectivityFromDistances(oMolsys.geom, oMolsys.Z)
+    oMolsys.augmentConnectivityToSingleFragment(C)
+    assert len(connectedComponents(len(C), np.argwhere(np.triu(C, 1)))) == 1
+    assert np.array_equal(C, C.T)
+    # far apart fragments are joined along a spanning tree: 26 new connections
+    assert np.count_nonzero(np.triu(C, 1)) == 27 * 2 + 26
+
+
+def test_join_symmetric_contacts():
+    # two H2 molecules side by side; both H...H contacts are equally close
+    h2 = np.array([[0.0, 0.0, 0.0], [0.0, 0.0, 1.4]])
+    oMolsys = molsys.Molsys([frag.Frag([1, 1], h2, [1.008, 1.008]),
+                             frag.Frag([1, 1], h2 + [6.0, 0.0, 0.0], [1.008, 1.008])])
+    C = addIntcos.connectivityFromDistances(oMolsys.geom, oMolsys.Z)
+    oMolsys.augmentConnectivityToSingleFragment(C)
+    assert C[0, 2] and C[1, 3]
+    assert not C[0, 3] and not C[1, 2]
@@ -0,0 +1,41 @@
+"""
+Tests reading and writing cartesian Hessians, and their transformations
+"""
+import numpy as np
+import pytest
+
+from optking import hessian, hessianFile
+from optking.exceptions import OptError
+
+
+@pytest.mark.parametrize("name", ["hooh.hess", "hooh.npy"])
+def test_read_write(tmpdir, hooh, name):
+    filename = str(tmpdir.join(name))
+    H = hessian.lindhCartesianHessian(hooh, [1, 8, 8, 1])
+    hessianFile.writeCartesianHessian(filename, H)
+    H_read = hessianFile.readCartesianHessian(filename, 4)
+    assert np.allclose(H_read, H, atol=1.0e-10)
+    assert isinstance(H_read, np.memmap) == name.endswith('.npy')
+
+    with pytest.raises(OptError):
+        hessianFile.readCartesianHessian(filename, 3)
+    with pytest.raises(OptError):
+        hessianFile.readCartesianHessian(str(tmpdir.join("missing.hess")), 4)
+
+
+def test_transformations(tmpdir, hooh, hooh_molsys):
+    oMolsys = hooh_molsys
+    H = hessian.lindhCartesianHessian(hooh, [1, 8, 8, 1])
+    filename = str(tmpdir.join("hooh.npy"))
+    hessianFile.writeCartesianHessian(filename, H)
+
+    # the memory-mapped Hessian is transformed without being modified
+    Hq = oMolsys.convertHessianToInternals(hessianFile.readCartesianHessian(filename, 4))
+    assert np.allclose(Hq, oMolsys.convertHessianToInternals(H))
+    g = np.random.RandomState(4).uniform(-0.01, 0.01, 12)
+    oMolsys.convertHessianToInternals(hessianFile.readCartesianHessian(filename, 4), g)
+    assert np.array_equal(hessianFile.readCartesianHessian(filename, 4), H)
+
+    # the six coordinates of HOOH are not redundant; the transformation back is exact
+    assert len(oMolsys.intcos) == 6
+    assert np.allclose(oMolsys.convertHessianToInternals(oMolsys.convertHessianToCartesians(Hq)), Hq)
@@ -0,0 +1,41 @@
+"""
+Tests the model Hessian guesses
+"""
+import optking
+import pytest
+import numpy as np
+
+from optking import hessian
+
+Z = [1, 8, 8, 1]
+
+
+@pytest.mark.parametrize("guessType", ["SIMPLE", "SCHLEGEL", "FISCHER", "LINDH_SIMPLE"])
+def test_diagonal_guess(hooh, hooh_intcos, guessType):
+    intcos, C = hooh_intcos
+    ref = [intco.diagonalHessianGuess(hooh, Z, C, guessType) for intco in intcos]
+    H = hessian.guess(intcos, hooh, Z, C, guessType)
+
+    assert np.allclose(np.diag(H), ref)
+    assert np.allclose(H, np.diag(np.diag(H)))
+
+
+def test_lindh_cartesian_hessian(hooh):
+    H = hessian.lindhCartesianHessian(hooh, Z)
+    assert np.allclose(H, H.T)
+
+    # invariant to translations and infinitesimal rotations
+    for axis in np.eye(3):
+        assert np.allclose(H @ np.tile(axis, len(Z)), 0.0)
+        assert np.allclose(H @ np.cross(axis, hooh).ravel(), 0.0)
+
+    evals = np.linalg.eigvalsh(H)
+    assert np.count_nonzero(evals > 1.0e-8) == 3 * len(Z) - 6
+
+
+def test_lindh_internal_hessian(hooh, hooh_intcos):
+    intcos, C = hooh_intcos
+    H = hessian.guess(intcos, hooh, Z, C, "LINDH")
+    assert H.shape == (len(intcos), len(intcos))
+    assert np.allclose(H, H.T)
+    assert np.all(np.diag(H) > 0.0)
@@ -0,0 +1,69 @@
+"""
+Tests the library of converged Hessians used to warm-start optimizations
+"""
+import copy
+import os
+
+import numpy as np
+import pytest
+
+from optking import addIntcos, frag, hessianLibrary, molsys
+from optking import optparams as op
+
+water = np.array([[0.0, 0.0, 0.2], [0.0, 1.5, -0.9], [0.0, -1.4, -0.95]])
+
+
+@pytest.fixture
+def library(tmpdir):
+    names = ['hessian_library', 'hessian_library_max_entries', 'opt_type']
+    saved = [getattr(op.Params, name) for name in names]
+    op.Params.hessian_library = str(tmpdir.join('library'))
+    yield op.Params.hessian_library
+    for name, value in zip(names, saved):
+        setattr(op.Params, name, value)
+
+
+def water_molsys():
+    oMolsys = molsys.Molsys([frag.Frag([8, 1, 1], water.copy(), [15.995, 1.008, 1.008])])
+    oMolsys.addIntcosFromConnectivity()
+    return oMolsys
+
+
+def test_warm_start(library, hooh_molsys):
+    rng = np.random.RandomState(6)
+    H = rng.uniform(-0.1, 0.1, (6, 6))
+    H = H + H.T + np.identity(6)
+
+    # the torsion is frozen, so it is not stored
+    oMolsys = copy.deepcopy(hooh_molsys)
+    addIntcos.freezeTorsionsFromInputAtomList([1, 2, 3, 4], oMolsys)
+    hessianLibrary.store(oMolsys, H)
+    assert len(os.listdir(library)) == 1
+
+    oMolsys = hooh_molsys
+    keys = hessianLibrary.coordinateKeys(oMolsys)
+    assert keys[0] == 'R(1:1,2:8)' and keys[-1] == 'D(1:1,2:8,3:8,4:1)'
+    H_guess = oMolsys.hessianGuess('SIMPLE')
+    H_new = H_guess.copy()
+    assert hessianLibrary.warmStart(oMolsys, H_new) == 5
+    assert np.allclose(H_new[:5, :5], H[:5, :5])
+    assert np.allclose(H_new[5], H_guess[5]) and np.allclose(H_new[:, 5], H_guess[:, 5])
+
+    # entries are kept per optimization type
+    op.Params.opt_type = 'TS'
+    assert hessianLibrary.warmStart(oMolsys, H_guess.copy()) == 0
+
+
+def test_eviction(library, hooh_molsys):
+    op.Params.hessian_library_max_entries = 1
+    oWater = water_molsys()
+    hessianLibrary.store(oWater, np.identity(3))
+    path = os.path.join(library, os.listdir(library)[0])
+    os.utime(path, (os.path.getatime(path) - 10, os.path.getmtime(path) - 10))
+    oMolsys = hooh_molsys
+    hessianLibrary.store(oMolsys, np.identity(6))
+
+    # only the most recent entry is left
+    assert os.listdir(library) == [hessianLibrary.fingerprint(
+        hessianLibrary.coordinateKeys(oMolsys)) + '.npz']
+    assert hessianLibrary.warmStart(oWater, np.zeros((3, 3))) == 0
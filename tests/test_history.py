@@ -0,0 +1,111 @@
+"""
+Tests the internal coordinate values stored with the steps of the history
+"""
+import optking
+import pytest
+import numpy as np
+
+from optking import history
+
+
+def test_step_q_values(monkeypatch, hooh, hooh_molsys):
+    oMolsys = hooh_molsys
+
+    oHistory = history.History()
+    rng = np.random.RandomState(7)
+    for i in range(4):
+        x = hooh + 0.02 * rng.uniform(-1, 1, hooh.shape)
+        oHistory.append(x, -0.1 * i, rng.uniform(-0.01, 0.01, len(oMolsys.intcos)), None)
+    oMolsys.geom = oHistory[-1].geom
+
+    calls = []
+    qValues = oMolsys.qValues
+    monkeypatch.setattr(oMolsys, 'qValues', lambda geom=None: calls.append(1) or qValues(geom))
+
+    H = np.eye(len(oMolsys.intcos))
+    oHistory.hessianUpdate(H, oMolsys)
+    nCalls = len(calls)
+    assert nCalls == 3
+    oHistory.hessianUpdate(H, oMolsys)
+    assert len(calls) == nCalls
+    assert np.allclose(oHistory[-2].qValues(oMolsys), qValues(oHistory[-2].geom))
+
+    # new coordinates
+    oMolsys.addCartesianIntcos()
+    assert len(oHistory[-2].qValues(oMolsys)) == len(oMolsys.intcos)
+    assert len(calls) == nCalls + 1
+
+
+def test_reexpress_steps(hooh, hooh_molsys):
+    oMolsys = hooh_molsys
+
+    oHistory = history.History()
+    rng = np.random.RandomState(11)
+    geoms = [hooh + 0.02 * rng.uniform(-1, 1, hooh.shape) for i in range(4)]
+    for i, x in enumerate(geoms[:3]):
+        gX = rng.uniform(-0.01, 0.01, hooh.size)
+        oHistory.append(x, -0.1 * i, oMolsys.qForces(gX, x), None, gX)
+        Dq = oMolsys.qValues(geoms[i + 1]) - oMolsys.qValues(x)
+        oHistory.appendRecord(0.0, Dq, Dq / np.linalg.norm(Dq), 0.0, 0.0)
+    oMolsys.geom = geoms[3]
+
+    # new coordinates: the steps are expressed in them from the cartesian gradients
+    oMolsys.addCartesianIntcos()
+    assert oHistory.reexpress(oMolsys)
+    for i, step in enumerate(oHistory.steps):
+        assert len(step.forces) == len(oMolsys.intcos)
+        assert np.allclose(step.forces, oMolsys.qForces(step.gradient, step.geom))
+        assert np.allclose(step.Dq, oMolsys.qValues(geoms[i + 1]) - oMolsys.qValues(geoms[i]))
+        assert np.isclose(np.linalg.norm(step.followedUnitVector), 1.0)
+
+    # without the gradients, the steps are left as they are
+    oHistory.append(geoms[3], -0.3, np.zeros(len(oMolsys.intcos)), None)
+    forces = oHistory[0].forces.copy()
+    oMolsys.clearCache(newCoordinates=True)
+    assert not oHistory.reexpress(oMolsys)
+    assert np.array_equal(oHistory[0].forces, forces)
+
+
+def hcch_model(new_geom, o_json, driver='gradient'):
+    # harmonic bonds of HCCH, with linear minima of the bends
+    def energy(x):
+        r = [np.linalg.norm(x[i + 1] - x[i]) for i in range(3)]
+        cosBends = [np.dot(x[i] - x[i + 1], x[i + 2] - x[i + 1])
+                    / (np.linalg.norm(x[i] - x[i + 1]) * np.linalg.norm(x[i + 2] - x[i + 1]))
+                    for i in range(2)]
+        return 0.2 * ((r[0] - 2.0)**2 + (r[2] - 2.0)**2) + 0.5 * (r[1] - 2.27)**2 \
+            + 0.1 * sum(1.0 + c for c in cosBends)
+
+    x = np.asarray(new_geom, float).reshape(-1, 3)
+    steps = 1.0e-5 * np.eye(x.size)
+    gradient = np.array([energy(x + d.reshape(-1, 3)) - energy(x - d.reshape(-1, 3))
+                         for d in steps]) / 2.0e-5
+    return {'schema_name': 'qcschema_output', 'return_result': gradient.tolist(),
+            'properties': {'return_energy': energy(x), 'nuclear_repulsion_energy': 20.0}}
+
+
+@pytest.mark.parametrize('phi', [0.0, 60.0, 180.0])
+@pytest.mark.parametrize('step_type', ['RFO', 'GDIIS'])
+def test_linear_bends_from_bent_start(monkeypatch, step_type, phi):
+    # the bends become linear on the way; the torsions of the history are not
+    # defined through them, so only the Hessian is carried over
+    from optking import psi4methods
+    from optking import optparams as op
+
+    a, phi = np.radians(50.0), np.radians(phi)
+    c1, c2 = np.array([0.0, 0.0, -1.135]), np.array([0.0, 0.0, 1.135])
+    h1 = c1 + 2.0 * np.array([np.sin(a), 0.0, -np.cos(a)])
+    h2 = c2 + 2.0 * np.array([np.sin(a) * np.cos(phi), np.sin(a) * np.sin(phi), np.cos(a)])
+    json_in = {"schema_name": "qcschema_input", "schema_version": 1, "driver": "optimize",
+               "molecule": {"symbols": ["H", "C", "C", "H"],
+                            "geometry": np.array([h1, c1, c2, h2]).ravel().tolist()},
+               "model": {"method": "hf", "basis": "sto-3g"},
+               "keywords": {"optimizer": {"step_type": step_type}}}
+
+    # the optimization deletes the options, which the other tests use
+    monkeypatch.setattr(op, 'Params', op.Params)
+    monkeypatch.setattr(psi4methods, 'psi4_calculation', hcch_model)
+    json_out = optking.run_qcschema(json_in)
+    assert json_out['success']
+    geom = np.array(json_out['molecule']['geometry']).reshape(-1, 3)
+    assert np.isclose(np.linalg.norm(geom[3] - geom[0]), 6.27, atol=1.0e-3)
@@ -0,0 +1,21 @@
+"""
+Tests that importing optking does not load psi4 or qcelemental, which are
+imported on first use
+"""
+import subprocess
+import sys
+
+check_imports = """
+import sys
+import optking
+assert 'psi4' not in sys.modules and 'qcelemental' not in sys.modules
+# set on import, since a module __getattr__ needs Python 3.7
+assert isinstance(vars(optking)['__version__'], str)
+assert optking.misc.covalentRadiiFromZ([1])[0] > 0.0
+assert 'qcelemental' in sys.modules and 'psi4' not in sys.modules
+"""
+
+
+def test_lazy_imports(tmpdir):
+    # optking writes its log to the working directory when imported
+    subprocess.check_call([sys.executable, '-c', check_imports], cwd=str(tmpdir))
@@ -0,0 +1,74 @@
+"""
+Tests the store of IRC points: streaming, interpolation and joining the
+backward and forward branches into one path
+"""
+import optking
+import pytest
+import numpy as np
+
+from optking import IRCdata
+
+
+def branch(direction, energies):
+    path = IRCdata.IRCdata()
+    path.set_atom_symbols(['H', 'H'])
+    path.set_step_size_and_direction(0.2, direction)
+    for i, E in enumerate(energies):
+        x = np.array([[0.0, 0.0, 0.0], [0.0, 0.0, 1.4 + 0.1 * i]])
+        path.add_irc_point(i, np.array([1.4 + 0.1 * i]), x, np.zeros(1), np.zeros(6), E,
+                           lineDistStep=0.1, arcDistStep=0.2)
+    return path
+
+
+def test_join_branches():
+    backward = branch('BACKWARD', [0.0, -0.1, -0.3])
+    forward = branch('FORWARD', [0.0, -0.2, -0.4, -0.5])
+    path = IRCdata.joinBranches(backward, forward)
+
+    rxnpath = path.rxnpathDict()
+    assert [p['Step Number'] for p in rxnpath] == [-2, -1, 0, 1, 2, 3]
+    assert [p['Energy'] for p in rxnpath] == [-0.3, -0.1, 0.0, -0.2, -0.4, -0.5]
+    assert np.allclose([p['Arc Distance'] for p in rxnpath], [-0.4, -0.2, 0.0, 0.2, 0.4, 0.6])
+    assert path.step_size == 0.2
+
+
+def test_path_growth_and_file(tmp_path):
+    path = IRCdata.IRCdata()
+    path.set_atom_symbols(['H', 'H'])
+    path.set_step_size_and_direction(0.2, 'FORWARD')
+    path.set_path_file(str(tmp_path / 'ircprogress.log'))
+    for i in range(20):
+        x = np.array([[0.0, 0.0, 0.0], [0.0, 0.0, 1.4 + 0.1 * i]])
+        path.add_irc_point(i, np.array([1.4 + 0.1 * i]), x, np.zeros(1), np.zeros(6), -0.01 * i,
+                           lineDistStep=0.1, arcDistStep=0.2)
+        if i % 3 == 0:
+            path.add_pivot_point(np.array([1.45 + 0.1 * i]), x + [0.0, 0.0, 0.05])
+
+    assert len(path) == 20
+    assert path.step_number() == 19 and path.energy(-2) == -0.01 * 18
+    assert np.allclose(path.x(5), [[0.0, 0.0, 0.0], [0.0, 0.0, 1.9]])
+    assert np.allclose(path.q_pivot(6), [2.05]) and path.q_pivot(7) is None
+
+    lines = open(str(tmp_path / 'ircprogress.log')).readlines()
+    assert len(lines) == 21
+    assert [int(line.split()[1]) for line in lines[1:]] == list(range(20))
+
+
+def test_interpolation():
+    backward = branch('BACKWARD', [0.0, -0.1, -0.3])
+    forward = branch('FORWARD', [0.0, -0.2, -0.4, -0.5])
+    path = IRCdata.joinBranches(backward, forward)
+
+    # exact at the points
+    x, E = path.interpolate(np.array([-0.4, 0.0, 0.2, 0.6]))
+    assert np.allclose(E, [-0.3, 0.0, -0.2, -0.5])
+    assert np.allclose(x[:, 1, 2], [1.6, 1.4, 1.5, 1.7])
+
+    # the bond length is linear in the arc distance, and so is the interpolant
+    x, E = path.interpolate(0.3)
+    assert x.shape == (2, 3)
+    assert np.isclose(x[1, 2], 1.55)
+    assert -0.4 < E < -0.2
+
+    with pytest.raises(optking.OptError):
+        path.interpolate(0.7)
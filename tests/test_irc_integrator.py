@@ -0,0 +1,148 @@
+"""
+Tests the predictor (LQA) and corrector (distance-weighted interpolant) steps
+of the Hessian-based predictor-corrector IRC integrator
+"""
+import importlib
+
+import optking
+import pytest
+import numpy as np
+
+from optking import IRCfollowing
+
+rng = np.random.RandomState(7)
+Q, _ = np.linalg.qr(rng.uniform(-1, 1, (4, 4)))
+H = np.dot(Q * [-0.05, 0.2, 0.5, 1.1], Q.T)
+g = np.dot(Q, [0.02, -0.01, 0.015, 0.005])
+
+
+def quadratic(y):
+    return np.dot(g, y) + 0.5 * np.dot(y, np.dot(H, y)), g + np.dot(H, y)
+
+
+def steepest_descent(gradient, y, s, n_steps=4000):
+    h = s / n_steps
+    direction = lambda y: -gradient(y) / np.linalg.norm(gradient(y))
+    for i in range(n_steps):
+        k1 = direction(y)
+        k2 = direction(y + 0.5 * h * k1)
+        k3 = direction(y + 0.5 * h * k2)
+        k4 = direction(y + h * k3)
+        y = y + h * (k1 + 2 * k2 + 2 * k3 + k4) / 6.0
+    return y
+
+
+@pytest.mark.parametrize("s", [0.05, 0.3])
+def test_lqa_step(s):
+    dq, arc = IRCfollowing.lqaStep(g, H, s)
+    assert arc == s
+    ref = steepest_descent(lambda y: quadratic(y)[1], np.zeros(4), s)
+    assert np.allclose(dq, ref, atol=1.0e-6)
+
+
+def test_lqa_step_reaches_minimum():
+    H_pos = np.dot(Q * [0.3, 0.2, 0.5, 1.1], Q.T)
+    dq, arc = IRCfollowing.lqaStep(g, H_pos, 10.0)
+    assert arc < 10.0
+    assert np.allclose(dq, -np.linalg.solve(H_pos, g), atol=1.0e-6)
+
+
+def test_dwi_step_quadratic():
+    # both points on the same quadratic surface: the interpolant is exact
+    y_1 = np.array([0.1, -0.2, 0.05, 0.1])
+    points = [(np.zeros(4), 0.0, g, H), (y_1, quadratic(y_1)[0], quadratic(y_1)[1], H)]
+    ref = steepest_descent(lambda y: quadratic(y)[1], np.zeros(4), 0.3)
+    assert np.allclose(IRCfollowing.dwiStep(points, 0.3), ref, atol=1.0e-6)
+
+
+def test_dwi_gradient():
+    y_1 = np.array([0.1, -0.2, 0.05, 0.1])
+    H_1 = H + np.diag([0.1, 0.0, -0.05, 0.02])
+    points = [(np.zeros(4), 0.0, g, H), (y_1, 0.004, -g, H_1)]
+
+    def energy(y):
+        d = [y - p[0] for p in points]
+        T = [p[1] + np.dot(p[2], d_i) + 0.5 * np.dot(d_i, np.dot(p[3], d_i)) for p, d_i in zip(points, d)]
+        w = np.array([1.0 / np.dot(d_i, d_i) for d_i in d])
+        return np.dot(w, T) / np.sum(w)
+
+    y, disp = np.array([0.03, 0.05, -0.02, 0.04]), 1.0e-6
+    fd = [(energy(y + disp * e) - energy(y - disp * e)) / (2 * disp) for e in np.eye(4)]
+    assert np.allclose(IRCfollowing.dwiGradient(y, points), fd, atol=1.0e-8)
+    assert np.allclose(IRCfollowing.dwiGradient(y_1, points), -g)
+
+
+def test_dwi_step_from_stationary_point():
+    # the path leaves a transition state along the transition vector, with stiff
+    # modes across the valley
+    H_ts = np.dot(Q * [-0.008, 0.05, 0.45, 1.2], Q.T)
+    v = Q[:, 0]
+    y_1 = 0.2 * v + [0.001, -0.002, 0.0, 0.001]
+    points = [(np.zeros(4), 0.0, np.zeros(4), H_ts),
+              (y_1, 0.5 * np.dot(y_1, np.dot(H_ts, y_1)), np.dot(H_ts, y_1), H_ts)]
+    y = IRCfollowing.dwiStep(points, 0.2, v_start=v)
+    assert np.allclose(y, 0.2 * v, atol=1.0e-6)
+
+
+def test_dwi_hessian():
+    y_1 = np.array([0.1, -0.2, 0.05, 0.1])
+    y_2 = np.array([-0.05, 0.1, 0.15, -0.1])
+    H_1 = H + np.diag([0.1, 0.0, -0.05, 0.02])
+    points = [(np.zeros(4), 0.0, g, H), (y_1, 0.004, -g, H_1), (y_2, -0.002, 0.5 * g, H_1.T)]
+
+    y, disp = np.array([0.03, 0.05, -0.02, 0.04]), 1.0e-6
+    fd = np.array([(IRCfollowing.dwiGradient(y + disp * e, points) -
+                    IRCfollowing.dwiGradient(y - disp * e, points)) / (2 * disp) for e in np.eye(4)])
+    assert np.allclose(IRCfollowing.dwiHessian(y, points), fd, atol=1.0e-6)
+    assert np.allclose(IRCfollowing.dwiHessian(y_1, points), H_1)
+
+
+def water_model(new_geom, o_json, driver='gradient'):
+    # harmonic O-H bonds of 1.8 bohr and an H-O-H angle of 104.5 degrees
+    def energy(x):
+        u, v = x[1] - x[0], x[2] - x[0]
+        ru, rv = np.linalg.norm(u), np.linalg.norm(v)
+        theta = np.arccos(np.dot(u, v) / (ru * rv))
+        return 0.25 * ((ru - 1.8)**2 + (rv - 1.8)**2) + 0.08 * (theta - np.radians(104.5))**2
+
+    def gradient(x):
+        steps = 1.0e-5 * np.eye(x.size)
+        return np.array([energy(x + d.reshape(-1, 3)) - energy(x - d.reshape(-1, 3))
+                         for d in steps]) / 2.0e-5
+
+    x = np.asarray(new_geom, float).reshape(-1, 3)
+    if driver == 'hessian':
+        steps = 1.0e-4 * np.eye(x.size)
+        result = np.array([gradient(x + d.reshape(-1, 3)) - gradient(x - d.reshape(-1, 3))
+                           for d in steps]) / 2.0e-4
+    else:
+        result = gradient(x)
+    return {'schema_name': 'qcschema_output', 'return_result': result.ravel().tolist(),
+            'properties': {'return_energy': energy(x), 'nuclear_repulsion_energy': 9.0}}
+
+
+def test_hpc_failure_output(monkeypatch, tmp_path):
+    # an OptError within the HPC integrator returns an unsuccessful result
+    from optking import psi4methods
+    from optking import optparams as op
+    from optking.exceptions import OptError
+    optimize = importlib.import_module('optking.optimize')
+
+    def failing_displacement(*args, **kwargs):
+        raise OptError("Could not take the step.")
+
+    # the optimization deletes the options, which the other tests use
+    monkeypatch.setattr(op, 'Params', op.Params)
+    monkeypatch.setattr(psi4methods, 'psi4_calculation', water_model)
+    monkeypatch.setattr(optimize, 'displaceMolsys', failing_displacement)
+    # the IRC path file is written to the working directory
+    monkeypatch.chdir(tmp_path)
+    json_in = {"schema_name": "qcschema_input", "schema_version": 1, "driver": "optimize",
+               "molecule": {"symbols": ["O", "H", "H"],
+                            "geometry": [0.0, 0.0, 0.2, 0.0, 1.5, -0.9, 0.0, -1.4, -0.95]},
+               "model": {"method": "hf", "basis": "sto-3g"},
+               "keywords": {"optimizer": {"opt_type": "IRC", "irc_algorithm": "HPC"}}}
+    json_out = optking.run_qcschema(json_in)
+    assert json_out['success'] is False
+    assert 'Could not take the step' in json_out['error']
+    assert len(json_out['return_result']['gradient']) == 9
@@ -0,0 +1,33 @@
+"""
+Tests the solution of the secular equation for the IRC Lagrange multiplier
+"""
+import optking
+import pytest
+import numpy as np
+
+from optking import IRCfollowing
+
+
+@pytest.mark.parametrize("b_0", [-0.2, -1.0e-4, 0.0, 0.3])
+def test_secular_equation(b_0):
+    rng = np.random.RandomState(5)
+    HMEigValues = np.sort(np.append(b_0, b_0 + rng.uniform(0.01, 2.0, 999)))
+    numerators = rng.uniform(-0.05, 0.05, 1000)
+    s = 0.2
+
+    Lambda = IRCfollowing.solveSecularEquation(HMEigValues, numerators, s)
+    assert Lambda < HMEigValues[0]
+    assert abs(IRCfollowing.calcLagrangian(Lambda, HMEigValues, numerators, s)) < 1.0e-12
+
+    # the step (H_M - lambda)^-1 (lambda p_M - g_M) has length s/2
+    assert np.isclose(np.linalg.norm(numerators / (HMEigValues - Lambda)), 0.5 * s)
+
+
+def test_secular_equation_small_gradient():
+    # numerator of the lowest mode nearly zero: root is close to b_0
+    HMEigValues = np.array([-0.05, 0.2, 0.6])
+    numerators = np.array([1.0e-9, 0.01, 0.02])
+    Lambda = IRCfollowing.solveSecularEquation(HMEigValues, numerators, 0.3)
+    assert -0.05 - 1.0e-6 < Lambda < -0.05
+    assert np.isclose(np.linalg.norm(numerators / (HMEigValues - Lambda)), 0.15)
+
@@ -0,0 +1,103 @@
+"""
+Tests the microiterations of the environment in a layered optimization
+"""
+import numpy as np
+
+from optking import frag, layered, lj_functions, molsys
+from optking import optparams as op
+
+water = np.array([[0.0, 0.0, 0.2], [0.0, 1.5, -0.9], [0.0, -1.4, -0.95]])
+phi = (1.0 + 5.0 ** 0.5) / 2.0
+shell = np.array([[0, 1, phi], [0, -1, phi], [0, 1, -phi], [0, -1, -phi], [1, phi, 0], [-1, phi, 0],
+                  [1, -phi, 0], [-1, -phi, 0], [phi, 0, 1], [-phi, 0, 1], [phi, 0, -1], [-phi, 0, -1]])
+shell = 6.5 * shell / np.linalg.norm(shell[0]) + 0.3 * np.random.RandomState(1).normal(size=shell.shape)
+
+
+def layered_params(test):
+    names = ['core_atoms', 'lj_sigma', 'lj_epsilon']
+    saved = [getattr(op.Params, name) for name in names]
+    op.Params.core_atoms, op.Params.lj_sigma, op.Params.lj_epsilon = [1, 2, 3], 6.0, 4.0e-4
+    try:
+        test()
+    finally:
+        for name, value in zip(names, saved):
+            setattr(op.Params, name, value)
+
+
+def water_in_argon():
+    Z = [8, 1, 1] + [18] * 12
+    x = np.vstack([water, shell])
+    return molsys.Molsys([frag.Frag(Z, x, [15.995, 1.008, 1.008] + [39.962] * 12)])
+
+
+def test_core_connectivity():
+    def test():
+        oMolsys = water_in_argon()
+        C = np.ones((oMolsys.Natom, oMolsys.Natom), bool)
+        C[1, 2] = C[2, 1] = False
+        C[0, 1] = C[1, 0] = False  # H1 is bonded to O only through the environment
+        layered.coreConnectivity(C, oMolsys.geom)
+        assert not np.any(C[3:]) and not np.any(C[:, 3:])
+        assert C[0, 2] and C[0, 1] and not C[1, 2]
+
+    layered_params(test)
+
+
+def test_relax_environment():
+    def test():
+        oMolsys = water_in_argon()
+        x_start = oMolsys.geom
+        while layered.relaxEnvironment(oMolsys)[0]:
+            x = oMolsys.geom
+            assert np.allclose(x[:3], x_start[:3])
+            assert np.max(np.linalg.norm(x - x_start, axis=1)) <= op.Params.micro_trust + 1.0e-12
+            x_start = x
+        g = lj_functions.calc_energy_and_gradient(oMolsys.geom, 6.0, 4.0e-4, squared=False)[1]
+        assert np.max(np.abs(g[3:])) < op.Params.micro_g_convergence
+
+        # corrected by a gradient that is the cheap one plus a constant force on
+        # the environment, the relaxed environment balances that force
+        force = np.zeros(x_start.shape)
+        force[3:] = 1.0e-4 * np.random.RandomState(2).normal(size=(12, 3))
+        g_ref = lj_functions.calc_energy_and_gradient(x_start, 6.0, 4.0e-4, squared=False)[1] - force
+        while layered.relaxEnvironment(oMolsys, x_start, g_ref)[0]:
+            pass
+        g = lj_functions.calc_energy_and_gradient(oMolsys.geom, 6.0, 4.0e-4, squared=False)[1]
+        assert np.max(np.abs(g[3:] - force[3:])) < op.Params.micro_g_convergence
+
+    layered_params(test)
+
+
+def water_in_argon_model(new_geom, o_json, driver='gradient'):
+    # harmonic water; Lennard-Jones argon, a little different from the cheap backend
+    def water_energy(x):
+        u, v = x[1] - x[0], x[2] - x[0]
+        ru, rv = np.linalg.norm(u), np.linalg.norm(v)
+        theta = np.arccos(np.dot(u, v) / (ru * rv))
+        return 0.25 * ((ru - 1.8)**2 + (rv - 1.8)**2) + 0.08 * (theta - np.radians(104.5))**2
+
+    x = np.asarray(new_geom, float).reshape(-1, 3)
+    E, gradient = lj_functions.calc_energy_and_gradient(x, 6.2, 5.0e-4, atoms=np.arange(3, 15),
+                                                        squared=False)
+    steps = 1.0e-5 * np.eye(9)
+    gradient[:3] += np.reshape([water_energy(x[:3] + d.reshape(3, 3))
+                                - water_energy(x[:3] - d.reshape(3, 3)) for d in steps], (3, 3)) / 2.0e-5
+    return {'schema_name': 'qcschema_output', 'return_result': gradient.ravel().tolist(),
+            'properties': {'return_energy': E + water_energy(x), 'nuclear_repulsion_energy': 9.0}}
+
+
+def test_layered_optimization(monkeypatch):
+    # converged only once the expensive forces on the environment vanish too
+    import optking
+    from optking import psi4methods
+
+    monkeypatch.setattr(op, 'Params', op.Params)
+    monkeypatch.setattr(psi4methods, 'psi4_calculation', water_in_argon_model)
+    json_in = {"schema_name": "qcschema_input", "schema_version": 1, "driver": "optimize",
+               "molecule": {"symbols": ["O", "H", "H"] + ["Ar"] * 12,
+                            "geometry": np.vstack([water, shell]).ravel().tolist()},
+               "model": {"method": "hf", "basis": "sto-3g"},
+               "keywords": {"optimizer": {"core_atoms": "1 2 3", "alg_geom_maxiter": 40}}}
+    json_out = optking.run_qcschema(json_in)
+    assert json_out['success']
+    assert np.max(np.abs(json_out['return_result']['gradient'])) < 3.0e-4
@@ -18,3 +18,37 @@ def test_lj_energy(R, ref):
 
     if not pytest.approx(ref) == energy:
         raise ValueError("test_lj_energy for R=%.2f did not match reference (comp = %12.10f, ref = %12.10f)." % (R, energy, ref))
+
+
+def test_lj_gradient():
+    positions = np.array([[0.0, 0.0, 0.0], [0.0, 0.3, 2.1], [1.9, 0.2, -0.4], [-1.0, 2.0, 1.0]])
+    E, gradient = optking.lj_functions.calc_energy_and_gradient(positions, 3.0, 4.0)
+
+    disp = 1.0e-6
+    for a in range(4):
+        for xyz in range(3):
+            plus, minus = positions.copy(), positions.copy()
+            plus[a, xyz] += disp
+            minus[a, xyz] -= disp
+            fd = (optking.lj_functions.calc_energy_and_gradient(plus, 3.0, 4.0, do_gradient=False)
+                  - optking.lj_functions.calc_energy_and_gradient(minus, 3.0, 4.0, do_gradient=False))
+            assert np.isclose(gradient[a, xyz], fd / (2 * disp), rtol=1.0e-5, atol=1.0e-8)
+
+
+def test_lj_distance():
+    # with squared=False, r is the distance
+    positions = np.array([[0.0, 0.0, 0.0], [0.0, 0.3, 2.1], [1.9, 0.2, -0.4], [-1.0, 2.0, 1.0]])
+    r = np.linalg.norm(positions[1:] - positions[0], axis=1)
+    E, gradient = optking.lj_functions.calc_energy_and_gradient(positions, 2.0, 0.1, atoms=[0],
+                                                                squared=False)
+    assert np.isclose(E, np.sum(0.4 * ((2.0 / r)**12 - (2.0 / r)**6)))
+
+    disp = 1.0e-6
+    for a in range(4):
+        for xyz in range(3):
+            plus, minus = positions.copy(), positions.copy()
+            plus[a, xyz] += disp
+            minus[a, xyz] -= disp
+            fd = (optking.lj_functions.calc_energy_and_gradient(plus, 2.0, 0.1, False, [0], False)
+                  - optking.lj_functions.calc_energy_and_gradient(minus, 2.0, 0.1, False, [0], False))
+            assert np.isclose(gradient[a, xyz], fd / (2 * disp), rtol=1.0e-5, atol=1.0e-8)
@@ -0,0 +1,91 @@
+"""
+Tests finding the lowest mode from gradient differences, on a quadratic surface
+in the internal coordinates of HOOH with a negative torsional force constant
+"""
+import concurrent.futures
+import importlib
+
+import numpy as np
+import pytest
+
+from optking import lowestMode
+from optking import optparams as op
+
+# R(1,2), R(2,3), R(3,4), B(1,2,3), B(2,3,4), D(1,2,3,4)
+k = np.array([0.5, 0.4, 0.5, 0.15, 0.15, -0.01])
+
+
+@pytest.fixture
+def params():
+    names = ['mode_block', 'mode_tol', 'mode_max_iter', 'mode_fd_step']
+    saved = [getattr(op.Params, name) for name in names]
+    yield op.Params
+    for name, value in zip(names, saved):
+        setattr(op.Params, name, value)
+
+
+@pytest.mark.parametrize('block', [1, 2])
+def test_lowest_mode(params, hooh_molsys, block):
+    params.mode_block = block
+    params.mode_tol = 1.0e-5
+    params.mode_fd_step = 1.0e-4
+    oMolsys = hooh_molsys
+    q0 = oMolsys.qValues() + [0.1, -0.05, 0.02, 0.05, 0.0, 0.1]
+
+    calls = []
+
+    def gradients(geoms):
+        calls.append(len(geoms))
+        return [np.dot(oMolsys.Bmat(x).T, k * (oMolsys.qValues(x) - q0)) for x in geoms]
+
+    gX = gradients([oMolsys.geom])[0]
+    H0 = oMolsys.hessianGuess('SCHLEGEL')
+    H, v, curvature, nGradients = lowestMode.lowestMode(oMolsys, gX, H0, gradients)
+    assert curvature == pytest.approx(k[5], abs=1.0e-4)
+    assert abs(v[5]) == pytest.approx(1.0, abs=1.0e-3)
+    assert np.linalg.eigvalsh(H)[0] == pytest.approx(k[5], abs=1.0e-4)
+    assert nGradients == sum(calls[1:]) and max(calls[1:]) <= block
+
+
+def test_update_hessian_in_subspace():
+    rng = np.random.RandomState(3)
+    H = rng.normal(size=(8, 8))
+    H += H.T
+    H_true = rng.normal(size=(8, 8))
+    H_true += H_true.T
+    V = np.linalg.qr(rng.normal(size=(8, 3)))[0]
+    H_new = lowestMode.updateHessianInSubspace(H, V, np.dot(H_true, V))
+    assert np.allclose(H_new, H_new.T)
+    assert np.allclose(np.dot(H_new, V), np.dot(H_true, V))
+    # unchanged in the complement of V
+    Q = np.identity(8) - np.dot(V, V.T)
+    assert np.allclose(np.dot(Q, np.dot(H_new, Q)), np.dot(Q, np.dot(H, Q)))
+
+
+def test_mode_hessian_pool(params, hooh_molsys, monkeypatch):
+    # all the blocks are computed by one pool of mode_block processes
+    optimize = importlib.import_module('optking.optimize')
+    pools = []
+
+    class Pool(concurrent.futures.ThreadPoolExecutor):
+        def __init__(self, max_workers):
+            pools.append(max_workers)
+            super(Pool, self).__init__(max_workers)
+
+    params.mode_block = 2
+    params.mode_tol = 1.0e-5
+    params.mode_fd_step = 1.0e-4
+    oMolsys = hooh_molsys
+    q0 = oMolsys.qValues() + [0.1, -0.05, 0.02, 0.05, 0.0, 0.1]
+    geoms = []
+
+    def gradient(geom, o_json):
+        geoms.append(geom)
+        return np.dot(oMolsys.Bmat(geom).T, k * (oMolsys.qValues(geom) - q0))
+
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', Pool)
+    monkeypatch.setattr(optimize, '_cartesianGradient', gradient)
+    gX = gradient(oMolsys.geom, None)
+    H = optimize.get_mode_hessian(oMolsys, None, gX, oMolsys.hessianGuess('SCHLEGEL'))
+    assert np.linalg.eigvalsh(H)[0] == pytest.approx(k[5], abs=1.0e-4)
+    assert pools == [2] and len(geoms) > 3
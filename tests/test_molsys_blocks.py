@@ -0,0 +1,103 @@
+"""
+Tests the fragment-blocked linear algebra of the molecular system
+"""
+import optking
+import pytest
+import numpy as np
+
+from optking import frag, molsys, intcosMisc
+from optking import optparams as op
+from optking.linearAlgebra import symmMatInv
+
+water = np.array([[0.0, 0.0, 0.2], [0.0, 1.5, -0.9], [0.0, -1.4, -0.95]])
+
+
+def two_fragments(hooh):
+    frags = [frag.Frag([8, 1, 1], water.copy(), [15.995, 1.008, 1.008]),
+             frag.Frag([1, 8, 8, 1], hooh + [9.0, 0.0, 0.0], [1.008, 15.995, 15.995, 1.008])]
+    oMolsys = molsys.Molsys(frags)
+    oMolsys.addIntcosFromConnectivity()
+    return oMolsys
+
+
+@pytest.mark.parametrize("threads", [1, 2])
+def test_block_forces_and_projection(hooh, threads):
+    saved = op.Params.frag_threads
+    op.Params.frag_threads = threads
+    try:
+        oMolsys = two_fragments(hooh)
+        gX = np.random.RandomState(7).uniform(-0.05, 0.05, 3 * oMolsys.Natom)
+
+        # reference: dense B for the whole system, with fragment atom offsets
+        B = np.zeros((len(oMolsys.intcos), 3 * oMolsys.Natom))
+        for iF, F in enumerate(oMolsys._fragments):
+            B[oMolsys.frag_intco_slice(iF), oMolsys.frag_cart_slice(iF)] = \
+                intcosMisc.Bmat(F.intcos, F.geom)
+        assert np.allclose(oMolsys.Bmat(), B)
+
+        G = np.dot(B, B.T)
+        fq_ref = -np.dot(symmMatInv(G, redundant=True), np.dot(B, gX))
+        fq = oMolsys.qForces(gX)
+        assert np.allclose(fq, fq_ref)
+
+        P = np.dot(G, symmMatInv(G, redundant=True))
+        H = np.eye(len(fq))
+        oMolsys.projectRedundanciesAndConstraints(fq, H)
+        assert np.allclose(fq, np.dot(P, fq_ref))
+        assert np.allclose(H, np.dot(P, P))
+    finally:
+        op.Params.frag_threads = saved
+
+
+def test_fragment_local_coordinates(hooh):
+    oMolsys = two_fragments(hooh)
+    q = oMolsys.qValues()
+    assert np.allclose(q, oMolsys.qValues(oMolsys.geom))
+    assert np.allclose(q[oMolsys.frag_intco_slice(1)],
+                       intcosMisc.qValues(oMolsys._fragments[1].intcos, hooh))
+
+
+def test_cache_per_geometry(monkeypatch, hooh):
+    oMolsys = two_fragments(hooh)
+    gX = np.random.RandomState(7).uniform(-0.05, 0.05, 3 * oMolsys.Natom)
+    calls = []
+    Bmat = intcosMisc.Bmat
+    monkeypatch.setattr(intcosMisc, 'Bmat', lambda *args: calls.append(1) or Bmat(*args))
+
+    fq = oMolsys.qForces(gX)
+    oMolsys.projectRedundanciesAndConstraints(fq, np.eye(len(fq)))
+    G = oMolsys.Gmat()
+    assert np.allclose(np.dot(G, np.dot(oMolsys.Ginv(), G)), G)
+    assert len(calls) == oMolsys.Nfragments
+
+    # cached arrays are not handed out
+    B = oMolsys.Bmat()
+    B[:] = 0.0
+    assert np.any(oMolsys.Bmat())
+
+    # a displacement in place is a new geometry
+    version = oMolsys.version
+    oMolsys._fragments[1].geom[0] += [0.0, 0.1, 0.0]
+    assert not np.allclose(oMolsys.qForces(gX), fq)
+    assert len(calls) == 2 * oMolsys.Nfragments
+    oMolsys.geom = oMolsys.geom
+    assert oMolsys.version > version
+
+    # other geometries are not cached
+    x = oMolsys.geom + 0.01
+    assert np.allclose(oMolsys.Bmat(x), two_fragments(hooh).Bmat(x))
+    assert np.allclose(oMolsys.qValues(x), two_fragments(hooh).qValues(x))
+
+
+def test_cache_cleared_with_coordinates(hooh):
+    oMolsys = two_fragments(hooh)
+    Nintco = len(oMolsys.qValues())
+    oMolsys.addCartesianIntcos()
+    assert len(oMolsys.qValues()) == len(oMolsys.intcos) > Nintco
+
+    oMolsys = two_fragments(hooh)
+    oMolsys._fragments[0].intcos[0].frozen = True
+    oMolsys.clearCache()
+    fq = oMolsys.qForces(np.ones(3 * oMolsys.Natom))
+    oMolsys.projectRedundanciesAndConstraints(fq, np.eye(len(fq)))
+    assert fq[0] == pytest.approx(0.0)
@@ -0,0 +1,100 @@
+"""
+Tests the local optimization service with a model potential in place of psi4
+"""
+import json
+import time
+import urllib.request
+
+import numpy as np
+import pytest
+
+from optking import service
+
+water = {"schema_name": "qcschema_input", "schema_version": 1, "driver": "optimize",
+         "molecule": {"symbols": ["O", "H", "H"],
+                      "geometry": [0.0, 0.0, 0.2, 0.0, 1.5, -0.9, 0.0, -1.4, -0.95]},
+         "model": {"method": "hf", "basis": "sto-3g"}, "keywords": {}}
+
+
+def model_calculation(delay, new_geom, o_json, driver='gradient'):
+    # harmonic O-H bonds of 1.8 bohr and an H-O-H angle of 104.5 degrees
+    time.sleep(delay)
+    x = np.asarray(new_geom, float).reshape(-1, 3)
+
+    def energy(x):
+        u, v = x[1] - x[0], x[2] - x[0]
+        ru, rv = np.linalg.norm(u), np.linalg.norm(v)
+        theta = np.arccos(np.dot(u, v) / (ru * rv))
+        return 0.25 * ((ru - 1.8) ** 2 + (rv - 1.8) ** 2) + 0.08 * (theta - np.radians(104.5)) ** 2
+
+    g = np.zeros(x.size)
+    for i in range(x.size):
+        step = np.zeros(x.size)
+        step[i] = 1.0e-5
+        g[i] = (energy(x + step.reshape(-1, 3)) - energy(x - step.reshape(-1, 3))) / 2.0e-5
+    return {'schema_name': 'qcschema_output', 'return_result': g.tolist(),
+            'properties': {'return_energy': energy(x), 'nuclear_repulsion_energy': 9.0}}
+
+
+def install_model(delay):
+    from functools import partial
+    from optking import psi4methods
+    psi4methods.psi4_calculation = partial(model_calculation, delay)
+
+
+def test_service_http(tmpdir):
+    with service.OptimizationService(workers=2, warm_modules=(), initializer=install_model,
+                                     initargs=(0.0,), workdir=str(tmpdir)) as server:
+        port = server.serve()
+        url = 'http://127.0.0.1:%d' % port
+
+        def call(method, path, body=None):
+            data = None if body is None else json.dumps(body).encode('utf-8')
+            with urllib.request.urlopen(urllib.request.Request(url + path, data, method=method)) as r:
+                return r.read().decode('utf-8')
+
+        ids = [json.loads(call('POST', '/jobs', water))['id'] for _ in range(3)]
+        for job_id in ids:
+            events = [json.loads(line) for line in call('GET', '/jobs/%s/events' % job_id).split('\n')
+                      if line]
+            kinds = [e['event'] for e in events]
+            assert kinds[:2] == ['queued', 'started'] and kinds[-1] == 'finished'
+            assert 'calculation' in kinds
+            job = json.loads(call('GET', '/jobs/%s' % job_id))
+            assert job['result']['success']
+            assert job['result']['properties']['return_energy'] < 1.0e-6
+        assert json.loads(call('GET', '/status')) == {'workers': 2, 'queued': 0, 'running': 0}
+
+
+def test_service_cancel(tmpdir):
+    with service.OptimizationService(workers=1, warm_modules=(), initializer=install_model,
+                                     initargs=(0.3,), workdir=str(tmpdir)) as server:
+        running = server.submit(water)
+        queued = server.submit(water)
+        for event in server.events(running):
+            if event['event'] == 'calculation':
+                break
+        assert server.cancel(queued) and server.cancel(running)
+        assert server.result(running) is None and server.job(running).status == 'cancelled'
+        assert server.job(queued).status == 'cancelled'
+        assert 'started' not in [e['event'] for e in server.events(queued)]
+
+        # the worker is replaced
+        assert server.result(server.submit(water))['success']
+
+
+@pytest.mark.parametrize('options', [{'hessian_free_mode': True, 'mode_block': 2},
+                                     {'opt_type': 'IRC', 'irc_direction': 'BOTH', 'irc_points': 3,
+                                      'hessian_free_mode': True}])
+def test_service_in_turn(tmpdir, options):
+    # the branches of the IRC and the gradients of the lowest mode are computed
+    # in turn in the daemonic worker
+    with service.OptimizationService(workers=1, warm_modules=(), initializer=install_model,
+                                     initargs=(0.0,), workdir=str(tmpdir)) as server:
+        result = server.result(server.submit(dict(water, keywords={'optimizer': options})),
+                               timeout=300)
+    assert result['success'], result.get('error')
+    if options.get('opt_type') == 'IRC':
+        assert len(result['properties']['IRC']) > 1
+    else:
+        assert result['properties']['return_energy'] < 1.0e-6
@@ -0,0 +1,169 @@
+"""
+Tests point group detection, symmetrization, and the totally symmetric projector
+of the internal coordinates
+"""
+import pytest
+import numpy as np
+import qcelemental as qcel
+
+from optking import frag, molsys
+from optking.symmetry import PointGroup
+
+rng = np.random.RandomState(11)
+ring = 2 * np.pi * np.arange(6) / 6
+tri = 2 * np.pi * np.arange(3) / 3
+
+molecules = {
+    'C2v': ([8, 1, 1], [[0, 0, 0.2], [0, 1.5, -0.9], [0, -1.5, -0.9]]),
+    'C3v': ([7, 1, 1, 1], [[0, 0, 0.2]] + [[1.8 * np.cos(a), 1.8 * np.sin(a), -0.5] for a in tri]),
+    'Td': ([6, 1, 1, 1, 1], [[0, 0, 0], [1.2, 1.2, 1.2], [-1.2, -1.2, 1.2], [-1.2, 1.2, -1.2],
+                             [1.2, -1.2, -1.2]]),
+    'D6h': ([6] * 6 + [1] * 6, [[2.6 * np.cos(a), 2.6 * np.sin(a), 0] for a in ring]
+            + [[4.7 * np.cos(a), 4.7 * np.sin(a), 0] for a in ring]),
+    'Oh': ([16] + [9] * 6, [[0, 0, 0], [3, 0, 0], [-3, 0, 0], [0, 3, 0], [0, -3, 0], [0, 0, 3],
+                            [0, 0, -3]]),
+    'D3d': ([6, 6] + [1] * 6, [[0, 0, 1.45], [0, 0, -1.45]]
+            + [[1.9 * np.cos(a), 1.9 * np.sin(a), 2.2] for a in tri]
+            + [[1.9 * np.cos(a + np.pi / 3), 1.9 * np.sin(a + np.pi / 3), -2.2] for a in tri]),
+    'D2d': ([6, 6, 6, 1, 1, 1, 1], [[0, 0, 0], [0, 0, 2.5], [0, 0, -2.5], [0, 1.75, 3.5],
+                                    [0, -1.75, 3.5], [1.75, 0, -3.5], [-1.75, 0, -3.5]]),
+    'D*h': ([6, 8, 8], [[0, 0, 0], [0, 0, 2.2], [0, 0, -2.2]]),
+    'C2': ([1, 8, 8, 1], [[1.7, 1.6, 0.8], [0, 1.35, -0.1], [0, -1.35, -0.1], [-1.7, -1.6, 0.8]]),
+    'C1': ([6, 1, 9, 17], [[0, 0, 0], [1.2, 1.2, 1.2], [-1.2, -1.2, 1.2], [-1.2, 1.2, -1.2]]),
+}
+
+
+def oriented(label):
+    Z, x = molecules[label]
+    R, _ = np.linalg.qr(rng.uniform(-1, 1, (3, 3)))
+    return Z, np.dot(x, R.T) + [0.3, -1.0, 0.5]
+
+
+@pytest.mark.parametrize("label", list(molecules))
+def test_point_group(label):
+    Z, x = oriented(label)
+    masses = [qcel.periodictable.to_mass(z) for z in Z]
+    assert PointGroup.fromGeometry(x, Z, masses).label == label
+
+    # within the tolerance, a distorted geometry has the same point group
+    x_noisy = x + 1.0e-4 * rng.normal(size=x.shape)
+    pg = PointGroup.fromGeometry(x_noisy, Z, masses)
+    assert pg.label == label
+    x_sym = pg.symmetrizeGeom(x_noisy)
+    assert np.max(np.abs(x_sym - x_noisy)) < 1.0e-3
+    assert PointGroup.fromGeometry(x_sym, Z, masses, tol=1.0e-8).label == label
+
+    S = pg.cartesianProjector()
+    assert np.allclose(np.dot(S, S), S) and np.allclose(S, S.T)
+    v = rng.normal(size=3 * len(Z))
+    assert np.allclose(pg.symmetrizeVector(v), np.dot(S, v))
+
+
+def test_internal_symmetry_projector():
+    Z, x = oriented('C3v')
+    masses = [qcel.periodictable.to_mass(z) for z in Z]
+    oMolsys = molsys.Molsys([frag.Frag(Z, x + 1.0e-4 * rng.normal(size=x.shape), masses)])
+    oMolsys.addIntcosFromConnectivity()
+    oMolsys.detectPointGroup()
+    assert oMolsys.pointGroup.label == 'C3v'
+
+    # 3 N-H stretches and 3 H-N-H bends: 2 of the 6 degrees of freedom are symmetric
+    S = oMolsys.symmetryProjector()
+    P = np.dot(oMolsys.Gmat(), oMolsys.Ginv())
+    assert np.allclose(np.dot(S, S), S) and np.allclose(np.dot(S, P), np.dot(P, S))
+    assert np.isclose(np.trace(S), 2)
+
+    stretch = np.array([1.0, 1.0, 1.0, 0.0, 0.0, 0.0]) * 0.01
+    assert oMolsys.isDqSymmetric(stretch, 0.05)
+    assert not oMolsys.isDqSymmetric(stretch * [1, -1, 0, 0, 0, 0], 0.05)
+
+    fq, H = rng.normal(size=6), np.identity(6)
+    oMolsys.projectRedundanciesAndConstraints(fq, H)
+    assert oMolsys.isDqSymmetric(fq, 1.0e-8)
+    assert np.allclose(fq[:3], fq[0]) and np.allclose(fq[3:], fq[3])
+
+
+def hooh_model(new_geom, o_json, driver='gradient'):
+    # harmonic bonds and bends of HOOH, with a twofold torsional barrier
+    def energy(x):
+        r = [np.linalg.norm(x[i + 1] - x[i]) for i in range(3)]
+        bends = [np.arccos(np.dot(x[i] - x[i + 1], x[i + 2] - x[i + 1])
+                           / (np.linalg.norm(x[i] - x[i + 1]) * np.linalg.norm(x[i + 2] - x[i + 1])))
+                 for i in range(2)]
+        n1, n2 = np.cross(x[1] - x[0], x[2] - x[1]), np.cross(x[2] - x[1], x[3] - x[2])
+        phi = np.arccos(np.dot(n1, n2) / (np.linalg.norm(n1) * np.linalg.norm(n2)))
+        return 0.25 * ((r[0] - 1.83)**2 + (r[1] - 2.75)**2 + (r[2] - 1.83)**2) \
+            + 0.08 * sum((b - np.radians(100.0))**2 for b in bends) + 0.002 * (1.0 + np.cos(2.0 * phi))
+
+    x = np.asarray(new_geom, float).reshape(-1, 3)
+    steps = 1.0e-5 * np.eye(x.size)
+    gradient = np.array([energy(x + d.reshape(-1, 3)) - energy(x - d.reshape(-1, 3))
+                         for d in steps]) / 2.0e-5
+    return {'schema_name': 'qcschema_output', 'return_result': gradient.tolist(),
+            'properties': {'return_energy': energy(x), 'nuclear_repulsion_energy': 30.0}}
+
+
+@pytest.mark.parametrize("options, r12", [({"frozen_distance": "1 2"}, None),
+                                          ({"fixed_distance": "1 2 1.0"}, 1.0 / qcel.constants.bohr2angstroms)])
+def test_constrained_symmetric_optimization(monkeypatch, options, r12):
+    # a constraint on one O-H bond of C2 HOOH does not move the other one
+    import optking
+    from optking import psi4methods
+    from optking import optparams as op
+
+    # the optimization deletes the options, which the other tests use
+    monkeypatch.setattr(op, 'Params', op.Params)
+    monkeypatch.setattr(psi4methods, 'psi4_calculation', hooh_model)
+    x = np.array(molecules['C2'][1], float)
+    json_in = {"schema_name": "qcschema_input", "schema_version": 1, "driver": "optimize",
+               "molecule": {"symbols": ["H", "O", "O", "H"], "geometry": x.ravel().tolist()},
+               "model": {"method": "hf", "basis": "sto-3g"}, "keywords": {"optimizer": options}}
+    json_out = optking.run_qcschema(json_in)
+    assert json_out['success']
+    geom = np.array(json_out['molecule']['geometry']).reshape(-1, 3)
+    r12 = np.linalg.norm(x[1] - x[0]) if r12 is None else r12
+    assert np.isclose(np.linalg.norm(geom[1] - geom[0]), r12, atol=1.0e-4)
+    assert np.isclose(np.linalg.norm(geom[3] - geom[2]), 1.83, atol=1.0e-3)
+
+
+@pytest.fixture
+def params(monkeypatch):
+    from optking import optparams as op
+    monkeypatch.setattr(op, 'Params', op.OptParams({}))
+    return op.Params
+
+
+def test_constrained_subgroup(params):
+    Z, x = molecules['C2']
+    oMolsys = molsys.Molsys([frag.Frag(Z, np.array(x, float), [1.008, 15.995, 15.995, 1.008])])
+    oMolsys.addIntcosFromConnectivity()
+    intcos = {str(intco).strip(' *'): intco for intco in oMolsys.intcos}
+
+    # C2 exchanges the two O-H bonds, and keeps the torsion
+    intcos['D(1,2,3,4)'].frozen = True
+    oMolsys.detectPointGroup()
+    assert oMolsys.pointGroup.label == 'C2'
+    intcos['R(1,2)'].frozen = True
+    oMolsys.restrictPointGroup()
+    assert oMolsys.pointGroup.label == 'C1'
+
+    # the group is dropped once the geometry is no longer symmetric
+    intcos['R(1,2)'].frozen = False
+    oMolsys.detectPointGroup()
+    oMolsys.checkPointGroup()
+    assert oMolsys.pointGroup is not None
+    oMolsys.geom = oMolsys.geom + [[0.0, 0.0, 0.01], [0, 0, 0], [0, 0, 0], [0, 0, 0]]
+    oMolsys.checkPointGroup()
+    assert oMolsys.pointGroup is None
+
+
+def test_core_atoms_subgroup(params):
+    # inversion exchanges the core water with the environment water
+    water = np.array([[0.3, 0.2, 2.6], [0.3, 1.6, 3.7], [0.4, -1.4, 3.5]])
+    x = np.vstack([water, -water])
+    oMolsys = molsys.Molsys([frag.Frag([8, 1, 1] * 2, x, [15.995, 1.008, 1.008] * 2)])
+    oMolsys.detectPointGroup()
+    assert oMolsys.pointGroup.label == 'Ci'
+    params.core_atoms = [1, 2, 3]
+    oMolsys.detectPointGroup()
+    assert oMolsys.pointGroup.label == 'C1'
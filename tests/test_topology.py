@@ -0,0 +1,62 @@
+"""
+Tests saving the coordinates of a molecular system as a topology template and
+loading them for another geometry
+"""
+import numpy as np
+
+from optking import frag, molsys, topology
+
+water = np.array([[0.0, 0.0, 0.2], [0.0, 1.5, -0.9], [0.0, -1.4, -0.95]])
+# a water dimer, with the atoms of the two molecules interleaved
+dimer_Z = [8, 8, 1, 1, 1, 1]
+dimer_order = [0, 3, 1, 2, 4, 5]
+dimer_geom = np.vstack([water, water + [0.5, 0.4, 5.6]])[dimer_order]
+
+
+def water_dimer(geom):
+    return molsys.Molsys([frag.Frag(dimer_Z, geom.copy(), [15.995 if z == 8 else 1.008
+                                                        for z in dimer_Z])])
+
+
+def intcoStrings(oMolsys):
+    return [str(intco) for intco in oMolsys.intcos]
+
+
+def test_template_round_trip(tmpdir):
+    oMolsys = water_dimer(dimer_geom)
+    oMolsys.splitFragmentsByConnectivity()
+    oMolsys.addIntcosFromConnectivity()
+    oMolsys.addDimerFrags()
+    assert oMolsys.Nfragments == 2 and len(oMolsys.dimers) == 1
+    filename = str(tmpdir.join('dimer.json'))
+    topology.writeTemplate(filename, topology.exportTemplate(oMolsys, dimer_geom))
+
+    # another geometry in the input order takes the same fragments and coordinates
+    geom = dimer_geom + 0.05 * np.random.RandomState(7).normal(size=dimer_geom.shape)
+    oNew = water_dimer(geom)
+    assert topology.applyTemplate(oNew, topology.readTemplate(filename))
+    assert intcoStrings(oNew) == intcoStrings(oMolsys)
+    assert np.allclose(oNew.dimers[0].A_weights, oMolsys.dimers[0].A_weights)
+    assert np.allclose(oNew.geom, geom[[0, 2, 3, 1, 4, 5]])
+
+
+def test_template_validity():
+    oMolsys = water_dimer(dimer_geom)
+    oMolsys.splitFragmentsByConnectivity()
+    oMolsys.addIntcosFromConnectivity()
+    template = topology.exportTemplate(oMolsys, dimer_geom)
+
+    # a broken O-H bond
+    geom = dimer_geom.copy()
+    geom[2] += [0.0, 3.0, 0.0]
+    oNew = water_dimer(geom)
+    assert not topology.applyTemplate(oNew, template)
+    assert oNew.Nfragments == 1 and not oNew.intcos
+
+    # a linear water
+    geom = dimer_geom.copy()
+    geom[[0, 2, 3]] = [[0.0, 0.0, 0.0], [0.0, 1.8, 0.0], [0.0, -1.8, 0.0]]
+    assert not topology.applyTemplate(water_dimer(geom), template)
+
+    template['Z'][0] = 7
+    assert not topology.applyTemplate(water_dimer(dimer_geom), template)